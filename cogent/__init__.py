@@ -35,6 +35,7 @@ version_info = tuple([int(v) for v in version.split(".") if v.isdigit()])
 
 from cogent.util.table import Table as _Table
 from cogent.parse.table import load_delimited, autogen_reader
+from cogent.parse.compressed import open_compressed, strip_compressed_suffix
 from cogent.core.tree import TreeBuilder, TreeError
 from cogent.parse.tree_xml import parse_string as tree_xml_parse_string
 from cogent.parse.newick import parse_string as newick_parse_string
@@ -159,8 +160,9 @@ def LoadTable(filename=None, sep=',', reader=None, header=None, rows=None,
     """
     # 
     if filename is not None and not (reader or static_column_types):
-        if filename[filename.rfind(".")+1:] == 'pickle':
-            f = file(filename, 'U')
+        name = strip_compressed_suffix(filename)
+        if name[name.rfind(".")+1:] == 'pickle':
+            f = open_compressed(filename, 'U')
             loaded_table = cPickle.load(f)
             f.close()
             return _Table(**loaded_table)
@@ -170,7 +172,7 @@ def LoadTable(filename=None, sep=',', reader=None, header=None, rows=None,
                                     delimiter = sep, limit=limit, **kwargs)
         title = title or loaded_title
     elif filename and (reader or static_column_types):
-        f = file(filename, "r")
+        f = open_compressed(filename, "r")
         if not reader:
             reader = autogen_reader(f, sep, limit=limit,
                         with_title=kwargs.get('with_title', False))
@@ -204,8 +206,11 @@ def LoadTree(filename=None, treestring=None, tip_names=None, format=None, \
 
     if filename:
         assert not (treestring or tip_names)
-        treestring = open(filename).read()
-        if format is None and filename.endswith('.xml'):
+        f = open_compressed(filename)
+        treestring = f.read()
+        f.close()
+        if format is None and strip_compressed_suffix(filename).endswith(
+                '.xml'):
             format = "xml"
     if treestring:
         assert not tip_names
@@ -8,7 +8,8 @@ from numpy import array, zeros, dot as matrixmultiply, ones, identity, take,\
     asarray, uint8 as UInt8, add, sqrt
 from random import choice
 from cogent.util.array import hamming_distance
-from cogent.core.profile import Profile, CharMeaningProfile
+from cogent.core.profile import Profile, CharMeaningProfile,\
+    ProfileAccumulator
 from cogent.core.moltype import DNA, RNA, PROTEIN
 from cogent.core.alignment import Alignment
 
@@ -326,18 +327,13 @@ def AlnToProfile(aln, alphabet=None, char_order=None, split_degenerates=False,\
     if weights is None:
         weights = dict.fromkeys(aln.keys(),1/len(aln))
     
-    char_meaning = CharMeaningProfile(alphabet, char_order,\
+    items = aln.items()
+    seqs = [v for k,v in items]
+    accumulator = ProfileAccumulator(len(seqs[0]), alphabet, char_order,\
         split_degenerates)
-
-    profiles = []
-    for k,v in aln.items():
-        idxs = array(str(v).upper(), 'c').view(UInt8)
-        profiles.append(char_meaning.Data[idxs] * weights[k])
-    s = reduce(add,profiles)
-    
-    result = Profile(s,alphabet, char_order)
     try:
-        result.normalizePositions()
+        accumulator.add(seqs, [weights[k] for k,v in items])
+        result = accumulator.toProfile()
     except Exception, e:
         raise ValueError,e
         #"Probably one of the rows in your profile adds up to zero,\n "+\
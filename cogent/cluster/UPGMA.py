@@ -10,7 +10,8 @@ inputs_from_dict2D function.
 Both return a PhyloNode object of the UPGMA cluster
 """
 
-from numpy import array, ravel, argmin, take, sum, average, ma, diag
+from numpy import array, ravel, argmin, take, sum, average, ma, diag, \
+    arange, fill_diagonal, flatnonzero, inf
 from cogent.core.tree import PhyloNode
 from cogent.util.dict2d import Dict2D
 
@@ -131,6 +132,35 @@ def condense_node_order(matrix, smallest_index, node_order):
     node_order[index2] = None
     return node_order
 
+def row_minima(matrix):
+    """returns the smallest value in each row of matrix and its column"""
+    columns = matrix.argmin(axis=1)
+    return matrix[arange(len(matrix)), columns], columns
+
+def update_row_minima(matrix, row_mins, row_columns, smallest_index):
+    """updates row_mins and row_columns in place after condense_matrix
+
+    Only the rows whose smallest value was in one of the two condensed
+    columns, and the row of the new node, are searched again; for the other
+    rows the new column can only become their smallest value. Ties go to
+    the lowest column, as with find_smallest_index. The condensed away row
+    gets an infinite minimum so it is never chosen again.
+    """
+    first_index, second_index = smallest_index
+    new_column = matrix[:, first_index]
+    stale = (row_columns == first_index) | (row_columns == second_index)
+    better = (new_column < row_mins) | ((new_column == row_mins) & \
+            (first_index < row_columns))
+    better &= ~stale
+    row_mins[better] = new_column[better]
+    row_columns[better] = first_index
+    stale[first_index] = True
+    stale[second_index] = False
+    rows = flatnonzero(stale)
+    if len(rows):
+        row_mins[rows], row_columns[rows] = row_minima(matrix[rows])
+    row_mins[second_index] = inf
+
 def UPGMA_cluster(matrix, node_order, large_number):
     """cluster with UPGMA
     
@@ -138,6 +168,10 @@ def UPGMA_cluster(matrix, node_order, large_number):
     node_order is a list of PhyloNode objects corresponding to the matrix.
     large_number will be assigned to the matrix during the process and
     should be much larger than any value already in the matrix.
+
+    The smallest value of each row is cached and only the rows affected by
+    a join are searched again, so finding the closest pair takes O(n) time
+    per join instead of a scan of the whole matrix.
     
     WARNING: Changes matrix in-place.
     WARNING: Expects matrix to already have diagonals assigned to large_number
@@ -145,16 +179,16 @@ def UPGMA_cluster(matrix, node_order, large_number):
     """
     num_entries = len(node_order)
     tree = None
+    fill_diagonal(matrix, large_number)
+    row_mins, row_columns = row_minima(matrix)
     for i in range(num_entries - 1):
-        smallest_index = find_smallest_index(matrix)
-        index1, index2 = smallest_index
-        #if smallest_index is on the diagonal set the diagonal to large_number
-        if index1 == index2:
-            matrix[diag([True]*len(matrix))] = large_number
-            smallest_index = find_smallest_index(matrix)
+        first_index = argmin(row_mins)
+        smallest_index = (first_index, row_columns[first_index])
         row_order = condense_node_order(matrix, smallest_index, \
                 node_order)
         matrix = condense_matrix(matrix, smallest_index, large_number)
+        matrix[first_index, first_index] = large_number
+        update_row_minima(matrix, row_mins, row_columns, smallest_index)
         tree = node_order[smallest_index[0]]
     return tree
 
@@ -70,6 +70,13 @@ where U_ij is the i'th component of the jth eigenvector of A (see
 below) and g_j is the j'th eigenvalue of A.  The index j only runs
 from 1 to k in order to make a k dimensional embedding.
 
+Since the coordinates of an object only depend on its distances to the
+seeds, landmark_mds computes them a block of objects at a time, from
+seed-by-block distances given by a function or read from a (memory
+mapped) matrix, in parallel, and writes them to a (memory mapped)
+output, so that neither the full nor the seed distance matrix is ever
+held in memory.
+
 ===================== SCMDS =====================
 
 The is a Python/Numpy implementation of SCMDS:
@@ -90,10 +97,14 @@ solutions are then joined using an affine mapping approach.
 from numpy import sign, floor, sqrt, power, mean, array
 from numpy import matrix, ones, dot, argsort, diag, eye
 from numpy import zeros, concatenate, ndarray, kron, argwhere
+from numpy import arange, asarray, newaxis, triu
 from numpy.linalg import eig, eigh, qr
 from random import sample
+from itertools import izip
 import time
 
+from cogent.util import parallel
+
 
 __author__ = "Adreas Wilm"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -575,9 +586,8 @@ def calc_matrix_a(matrix_e):
         raise ValueError, "matrix_e should be quadratic"
     nseeds = matrix_e.shape[0]
 
-    row_center = zeros(nseeds)
-    for i in range(nseeds):
-        row_center[i] = power(matrix_e[i, :], 2).sum()/nseeds
+    squares = power(matrix_e, 2)
+    row_center = squares.sum(axis=1)/nseeds
 
     # E should be symmetric, i.e. column and row means are identical.
     # Why is that not mentioned in the papers? To be on the safe side
@@ -588,27 +598,15 @@ def calc_matrix_a(matrix_e):
     # or simply:
     col_center = row_center
 
-    grand_center = power(matrix_e, 2).sum()/power(nseeds, 2)
+    grand_center = squares.sum()/power(nseeds, 2)
 
-    # E is symmetric and so is A, which is why we don't need to loop
-    # over the whole thing
-    #
-    # FIXME: Optimize
-    #
-    result = zeros((nseeds, nseeds))
-    for i in range(nseeds):
-        for j in range(i, nseeds):
-            # avoid pow(x,2). it's slow
-            eij_sq = matrix_e[i, j] * matrix_e[i, j]
-            result[i, j] = -0.50 * (
-                eij_sq -
-                col_center[j] -
-                row_center[i] +
-                grand_center)
-            if i != j:
-                result[j, i] = result[i, j]
-            
-    return result
+    result = -0.50 * (squares -
+        col_center[newaxis, :] -
+        row_center[:, newaxis] +
+        grand_center)
+    
+    # E is symmetric and so is A: use the upper triangle for both halves
+    return triu(result) + triu(result, 1).transpose()
 
 
 
@@ -732,23 +730,10 @@ def nystrom(seed_distmat, dim):
 
     #print("INFO: Eigendecomposing A")
     t0 = time.clock()
-    # eigh: eigen decomposition for symmetric matrices
-    # returns: w, v
-    # w : ndarray, shape (M,)
-    #     The eigenvalues, not necessarily ordered.
-    # v : ndarray, or matrix object if a is, shape (M, M)
-    #     The column v[:, i] is the normalized eigenvector corresponding
-    #     to the eigenvalue w[i].
-    # alternative is svd: [U, S, V] = numpy.linalg.svd(matrix_a)
-    (eigval_a, eigvec_a) = eigh(matrix_a)
+    (eigval_a, eigvec_a) = _sorted_eigh(matrix_a)
     if PRINT_TIMINGS:
         print("TIMING(%s): Eigendecomposition of A took %f CPU secs" % 
               (__name__, time.clock() - t0))    
-    # Sort descending
-    ind = argsort(eigval_a)
-    ind = ind[::-1]
-    eigval_a = eigval_a[ind]
-    eigvec_a = eigvec_a[:, ind]
 
    
     #print("INFO: Estimating MDS coords")
@@ -757,34 +742,10 @@ def nystrom(seed_distmat, dim):
     # Preventing negative eigenvalues by using abs value. Other option
     # is to set negative values to zero. Fabian recommends using
     # absolute values (as in SVD)
-    sqrt_eigval_a = sqrt(abs(eigval_a))
-    for i in xrange(nfull):
-        for j in xrange(dim):
-            if i+1 <= nseeds:
-                val = sqrt_eigval_a[j] * eigvec_a[i, j]
-            else:
-                # - original, unoptimised code-block
-                # numerator = 0.0
-                # for p in xrange(nseeds):
-                #     numerator += matrix_b[p, i-nseeds] * eigvec_a[p, j]
-                # val = numerator / sqrt_eigval_a[j]
-                #
-                # - optimisation attempt: actually slower
-                # numerator = sum(matrix_b[p, i-nseeds] * eigvec_a[p, j] 
-                #                 for p in xrange(nseeds))
-                #
-                # - slightly optimised version: twice as fast on a seedmat of
-                #   size 750 x 3000
-                #a_mb = array([matrix_b[p, i-nseeds] for p in xrange(nseeds)])
-                #a_eva = array([eigvec_a[p, j] for p in xrange(nseeds)])
-                #val = (a_mb*a_eva).sum() / sqrt_eigval_a[j]
-                #
-                # - optmisation suggested by daniel:
-                # 100fold increase on a seedmat of size 750 x 3000
-                numerator = (matrix_b[:nseeds, i-nseeds] * eigvec_a[:nseeds, j]).sum()
-                val = numerator / sqrt_eigval_a[j]
-
-            result[i, j] = val
+    sqrt_eigval_a = sqrt(abs(eigval_a[:dim]))
+    result[:nseeds] = sqrt_eigval_a * eigvec_a[:, :dim]
+    result[nseeds:] = dot(matrix_b.transpose(), eigvec_a[:, :dim]) / \
+        sqrt_eigval_a
 
     if PRINT_TIMINGS:
         print("TIMING(%s): Actual MDS approximation took %f CPU secs" % 
@@ -793,6 +754,113 @@ def nystrom(seed_distmat, dim):
     return result
 
 
+
+def _sorted_eigh(matrix_a):
+    """Returns eigenvalues and eigenvectors of matrix_a, largest first"""
+    # eigh: eigen decomposition for symmetric matrices
+    # returns: w, v
+    # w : ndarray, shape (M,)
+    #     The eigenvalues, not necessarily ordered.
+    # v : ndarray, or matrix object if a is, shape (M, M)
+    #     The column v[:, i] is the normalized eigenvector corresponding
+    #     to the eigenvalue w[i].
+    # alternative is svd: [U, S, V] = numpy.linalg.svd(matrix_a)
+    (eigval_a, eigvec_a) = eigh(matrix_a)
+    # Sort descending
+    ind = argsort(eigval_a)
+    ind = ind[::-1]
+    return eigval_a[ind], eigvec_a[:, ind]
+
+
+
+def _array_distances(distmat):
+    """Returns a block distance function reading from the array distmat"""
+    def get_distances(rows, cols):
+        return asarray(distmat[rows[:, newaxis], cols])
+    return get_distances
+
+
+
+def landmark_mds(num_objects, num_seeds, dim, dist_func, block_size=1024,
+                 out=None, permute_order=True):
+    """Computes an approximate MDS mapping of num_objects objects from
+    the distances between num_seeds seed (landmark) objects and all
+    objects, as nystrom does, without ever holding the seed distance
+    matrix, let alone the full one.
+
+    Distances are requested for block_size objects at a time, and the
+    coordinates of each block are computed independently, by a pool of
+    processes if cogent.util.parallel is set up for multiprocessing.
+    
+    Arguments:
+    - `num_objects`:
+       total number of objects to compute mapping for.
+    - `num_seeds`:
+       number of seeds objects. high means more exact solution, but the
+       slower
+    - `dim`:
+       dimensionality of MDS mapping
+    - `dist_func`:
+       callable f(rows, cols) returning the len(rows) x len(cols)
+       array of distances between the objects with the indices in the
+       arrays rows and cols (index range 0..num_objects-1), or a 2D
+       array, e.g. a numpy.memmap of the full distance matrix, to read
+       them from
+    - `block_size`:
+       number of objects per block
+    - `out`:
+       num_objects x dim array, e.g. a numpy.memmap, the coordinates
+       are written to as the blocks are done. A new array by default.
+    - `permute_order`:
+       pick seeds at random, otherwise the first num_seeds objects
+
+    Return:
+    out, holding the coordinates of the objects in their original order
+    """
+
+    if not num_seeds < num_objects:
+        raise ValueError, \
+            "number of seeds must be smaller than number of objects"
+    if not dim <= num_seeds:
+        raise ValueError, \
+            "number of seeds must be >= requested dim"
+    if not callable(dist_func):
+        dist_func = _array_distances(dist_func)
+
+    if permute_order:
+        seeds = sorted(sample(xrange(num_objects), num_seeds))
+    else:
+        seeds = range(num_seeds)
+    seeds = array(seeds)
+
+    matrix_e = asarray(dist_func(seeds, seeds), float)
+    (eigval_a, eigvec_a) = _sorted_eigh(calc_matrix_a(matrix_e))
+    sqrt_eigval_a = sqrt(abs(eigval_a[:dim]))
+    projection = eigvec_a[:, :dim] / sqrt_eigval_a
+    # see calc_matrix_b
+    row_center_e = power(matrix_e, 2).sum(axis=1)/num_seeds
+
+    if out is None:
+        out = zeros((num_objects, dim))
+    elif out.shape != (num_objects, dim):
+        raise ValueError, \
+            "out should have shape %s" % str((num_objects, dim))
+
+    blocks = [(start, min(start+block_size, num_objects))
+              for start in range(0, num_objects, block_size)]
+    def calc_block(block):
+        (start, end) = block
+        matrix_f = asarray(dist_func(seeds, arange(start, end)), float)
+        matrix_b = -0.5 * (matrix_f**2 - row_center_e[:, newaxis])
+        return dot(matrix_b.transpose(), projection)
+
+    for (start, end), coords in izip(blocks,
+            parallel.imap(calc_block, blocks)):
+        out[start:end] = coords
+    out[seeds] = sqrt_eigval_a * eigvec_a[:, :dim]
+    return out
+
+
 """
 =================
 
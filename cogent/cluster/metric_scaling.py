@@ -19,8 +19,10 @@ results as they are just a different reflection. R's cmdscale documentation
 also confirms the possibility of obtaining different signs between different R
 platforms. Please feel free to send questions to jai.rideout@gmail.com.
 """
-from numpy import shape, add, sum, sqrt, argsort, transpose, newaxis
-from numpy.linalg import eigh
+from numpy import shape, add, sum, sqrt, argsort, transpose, newaxis, \
+    dot, empty, zeros
+from numpy.linalg import eigh, qr
+from numpy.random import RandomState
 from cogent.util.dict2d import Dict2D
 from cogent.util.table import Table
 from cogent.cluster.UPGMA import inputs_from_dict2D
@@ -58,14 +60,27 @@ def PCoA(pairwise_distances):
     point_matrix, eigvals = principal_coordinates_analysis(matrix_a)
     return output_pca(point_matrix, eigvals, items_in_matrix)
 
-def principal_coordinates_analysis(distance_matrix):
+def principal_coordinates_analysis(distance_matrix, num_axes=None,
+        out=None, block_size=1024, seed=None):
     """Takes a distance matrix and returns principal coordinate results
 
     point_matrix: each row is an axis and the columns are points within the axis
     eigvals: correspond to the rows and indicate the amount of the variation
         that that the axis in that row accounts for
     NOT NECESSARILY SORTED
+
+    If num_axes is given, only the num_axes axes with the largest eigenvalues
+    are computed, by a randomized eigensolver (see run_eig), and they are
+    returned sorted from largest to smallest eigenvalue. The centred matrix
+    is then written to out, which may be the distance_matrix itself (e.g. a
+    numpy.memmap opened in r+ mode) to centre in place, and is read a block
+    of block_size rows at a time. seed seeds the random starting vectors.
     """
+    if num_axes is not None:
+        F_matrix = center_distance_matrix(distance_matrix, out, block_size)
+        eigvals, eigvecs = run_eig(F_matrix, num_axes, block_size=block_size,
+            seed=seed)
+        return get_principal_coordinates(eigvals, eigvecs), eigvals
     E_matrix = make_E_matrix(distance_matrix)
     F_matrix = make_F_matrix(E_matrix)
     eigvals, eigvecs = run_eig(F_matrix)
@@ -113,8 +128,78 @@ def make_F_matrix(E_matrix):
     #                column_means[j] + matrix_mean
     return E_matrix
 
-def run_eig(F_matrix):
-    """takes an F-matrix and returns eigenvalues and eigenvectors"""
+def center_distance_matrix(dist_matrix, out=None, block_size=1024):
+    """takes a distance matrix and returns its F matrix, a block at a time
+
+    Same as make_F_matrix(make_E_matrix(dist_matrix)) for a symmetric
+    dist_matrix, but only block_size rows are in memory at once besides out,
+    where the result is written. out may be dist_matrix itself to centre in
+    place, or a numpy.memmap; by default a new array is allocated.
+    """
+    num_rows = len(dist_matrix)
+    if out is None:
+        out = empty((num_rows, num_rows))
+    row_means = zeros(num_rows)
+    for start in range(0, num_rows, block_size):
+        end = start + block_size
+        block = dist_matrix[start:end]
+        E_block = (block * block) / -2.0
+        row_means[start:end] = E_block.mean(axis=1)
+        out[start:end] = E_block
+    matrix_mean = row_means.mean()
+    #the matrix is symmetric, so the column means are the row means
+    col_adjust = row_means - matrix_mean
+    for start in range(0, num_rows, block_size):
+        end = start + block_size
+        out[start:end] -= row_means[start:end, newaxis] + col_adjust
+    return out
+
+def _blocked_dot(matrix, vectors, block_size=1024):
+    """returns dot(matrix, vectors), reading block_size rows of matrix at once"""
+    result = empty((len(matrix), vectors.shape[1]))
+    for start in range(0, len(matrix), block_size):
+        result[start:start+block_size] = dot(matrix[start:start+block_size],
+            vectors)
+    return result
+
+def randomized_eigh(matrix, num_axes, oversamples=10, num_iters=4,
+        block_size=1024, seed=None):
+    """returns the num_axes largest eigenvalues and eigenvectors of matrix
+
+    matrix: symmetric matrix, e.g. a numpy.memmap, which is only used in
+        products with a few vectors, block_size rows at a time.
+    oversamples: number of extra random vectors improving the accuracy.
+    num_iters: number of subspace (power) iterations; more are needed if the
+        eigenvalues decay slowly.
+
+    Uses the randomized subspace iteration of Halko, Martinsson and Tropp
+    (2011, SIAM Review 53:217-288), which finds the eigenvalues of largest
+    magnitude, and keeps those that are largest. Eigenvalues are returned
+    from largest to smallest, eigenvectors as the columns of an array, as
+    from eigh.
+    """
+    num_rows = len(matrix)
+    num_vectors = min(num_rows, num_axes + oversamples)
+    random = RandomState(seed)
+    basis = qr(_blocked_dot(matrix, random.normal(size=(num_rows,
+        num_vectors)), block_size))[0]
+    for i in range(num_iters):
+        basis = qr(_blocked_dot(matrix, basis, block_size))[0]
+    projected = dot(basis.T, _blocked_dot(matrix, basis, block_size))
+    eigvals, small_eigvecs = eigh((projected + projected.T) / 2)
+    order = argsort(eigvals)[::-1][:num_axes]
+    return eigvals[order], dot(basis, small_eigvecs[:, order])
+
+def run_eig(F_matrix, num_axes=None, **kwargs):
+    """takes an F-matrix and returns eigenvalues and eigenvectors
+
+    If num_axes is given, only the num_axes largest eigenvalues and their
+    eigenvectors are computed by randomized_eigh, to which any other keyword
+    arguments are passed.
+    """
+    if num_axes is not None:
+        eigvals, eigvecs = randomized_eigh(F_matrix, num_axes, **kwargs)
+        return eigvals, eigvecs.transpose()
 
     #use eig to get vector of eigenvalues and matrix of eigenvectors
     #these are already normalized such that
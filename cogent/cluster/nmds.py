@@ -4,15 +4,20 @@
 see, for example: Jan de Leeuw 2004 (monotone regression), 
 Rencher 2002: Methods of multivariate analysis, and the original work: 
 Kruskal 1964: Nonmetric multidimensional scaling
+
+The distances, dhats and stress gradient are computed as vectors over the
+n*(n-1)/2 point pairs, in the order of the input dissimilarities, so a fit
+needs no Python loops over points or pairs.
 """
 from __future__ import division
 from numpy import array, multiply, sum, zeros, size, shape, diag, dot, mean,\
-    sqrt, transpose, trace, argsort, newaxis, finfo, all
-from numpy.random import seed, normal as random_gauss
+    sqrt, transpose, trace, argsort, newaxis, finfo, all, asarray, ones, \
+    add, bincount, concatenate, flatnonzero, repeat, triu_indices, errstate
+from numpy.random import seed, randint, normal as random_gauss
 from numpy.linalg import norm, svd
-from operator import itemgetter
 import cogent.maths.scipy_optimize as optimize
 from cogent.cluster.metric_scaling import principal_coordinates_analysis
+from cogent.util import parallel
 
 __author__ = "Justin Kuczynski"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -157,19 +162,21 @@ class NMDS(object):
         # normalize the scaling, which should not change the stress
         self._rescale()
     
+    @property
+    def order(self):
+        """The [i, j] point pairs in order of increasing dissimilarity"""
+        return [[i, j] for (i, j) in zip(self._pairs_i.tolist(),
+            self._pairs_j.tolist())]
+
     @property
     def dhats(self):
         """The dhats in order."""
-        # Probably not required, but here in case needed for backward
-        # compatibility.  self._dhats is the full 2D array
-        return [self._dhats[i,j] for (i,j) in self.order]
+        return list(self._dhats)
         
     @property
     def dists(self):
         """The dists in order"""
-        # Probably not required, but here in case needed for backward
-        # compatibility.  self._dists is the full 2D array
-        return [self._dists[i,j] for (i,j) in self.order]
+        return list(self._dists)
 
     def getPoints(self):
         """Returns (ordered in a list) the n points in k space 
@@ -202,49 +209,33 @@ class NMDS(object):
         return result
     
     def _calc_dissim_order(self, dissim_mtx, point_range):
-        """calculates the order of the dissim_mtx entries, puts in self.order
+        """calculates the order of the dissim_mtx entries
         
-        First creates a list of dissim elements with structure [i, j, value],
-        then sorts that by value and strips the value subelemnt.
-        i and j correspond to the row and column of the input dissim matrix 
+        Sets self._pairs_i and self._pairs_j, the row and column indices
+        (i < j) of the upper triangle of the input dissim matrix sorted by
+        value. Ties keep the row by row order of the upper triangle.
         """
-        
-        dissim_list = []
-        for i in point_range:
-            for j in point_range:
-                if j > i:
-                    dissim_list.append([i, j, dissim_mtx[i,j]])
-        dissim_list.sort(key = itemgetter(2))
-        for elem in dissim_list:
-            elem.pop()
-        self.order = dissim_list
+        pairs_i, pairs_j = triu_indices(len(point_range), 1)
+        dissims = asarray(dissim_mtx, float)[pairs_i, pairs_j]
+        order = argsort(dissims, kind='mergesort')
+        self._pairs_i = pairs_i[order]
+        self._pairs_j = pairs_j[order]
 
     def _get_initial_pts(self, dimension, pt_range):
         """Generates points randomly with a gaussian distribution (sigma = 1)
         """
-        
-        # nested list comprehension.  Too dense for good readability?
-        points = [[random_gauss(0., 1) for axis in range(dimension)] \
-            for pt_idx in pt_range]
-        return array(points, 'd')
+        return random_gauss(0., 1., (len(pt_range), dimension))
 
     def _calc_distances(self):
-        """Update distances between the points"""
-        diffv = self.points[newaxis, :, :] - self.points[:, newaxis, :]
-        squared_dists = (diffv**2).sum(axis=-1)
-        self._dists = sqrt(squared_dists)
-        self._squared_dist_sums = squared_dists.sum(axis=-1)
+        """Update distances between the point pairs, in dissimilarity order"""
+        self._diffs = self.points[self._pairs_i] - self.points[self._pairs_j]
+        self._dists = sqrt((self._diffs**2).sum(axis=-1))
              
     def _update_dhats(self):
         """Update dhats based on distances"""
-        new_dhats = self._dists.copy()
-        ordered_dhats = [new_dhats[i,j] for (i,j) in self.order]
-        ordered_dhats = self._do_monotone_regression(ordered_dhats)
-        for ((i,j),d) in zip(self.order, ordered_dhats):
-            new_dhats[i,j] = new_dhats[j, i] = d
-        self._dhats = new_dhats
+        self._dhats = self._do_monotone_regression(self._dists)
         
-    def _do_monotone_regression(self, dhats):
+    def _do_monotone_regression(self, dhats, max_passes=50):
         """Performs a monotone regression on dhats, returning the result
         
         Assuming the input dhats are the values of the pairwise point 
@@ -255,55 +246,49 @@ class NMDS(object):
         if an element is smaller than its preceeding one, the two are averaged
         and grouped together in a block.  The process is repeated until
         the blocks are monotonic, that is block i <= block i+1.
+
+        Each pass pools every run of non-increasing blocks at once with
+        numpy. Pools that need many passes (a chain of blocks each
+        absorbing the next) are finished, after max_passes, by pooling the
+        remaining blocks one at a time.
         """
+        totals = array(dhats, float)
+        sizes = ones(len(totals), int)
+        for i in range(max_passes):
+            means = totals / sizes
+            violators = means[:-1] >= means[1:]
+            if not violators.any():
+                return repeat(means, sizes)
+            starts = flatnonzero(concatenate([[True], ~violators]))
+            totals = add.reduceat(totals, starts)
+            sizes = add.reduceat(sizes, starts)
         
         blocklist = []
-        for top_dhat in dhats:
-            top_total = top_dhat
-            top_size = 1
+        for top_total, top_size in zip(totals.tolist(), sizes.tolist()):
+            top_dhat = top_total / top_size
             while blocklist and top_dhat <= blocklist[-1][0]:
                 (dhat, total, size) = blocklist.pop()
                 top_total += total
                 top_size += size
                 top_dhat = top_total / top_size
             blocklist.append((top_dhat, top_total, top_size))
-        result_dhats = []
-        for (val, total, size) in blocklist:
-            result_dhats.extend([val]*size)
-        return result_dhats
+        means, totals, sizes = zip(*blocklist)
+        return repeat(means, sizes)
         
     def _calc_stress(self):
         """calculates the stress, or badness of fit between the distances and dhats
         Caches some intermediate values for gradient calculations.
         """
-        diffs = (self._dists - self._dhats)
-        diffs **= 2
-        self._squared_diff_sums = diffs.sum(axis=-1)
-        self._total_squared_diff = self._squared_diff_sums.sum() / 2
-        self._total_squared_dist = self._squared_dist_sums.sum() / 2
+        self._residuals = self._dists - self._dhats
+        self._total_squared_diff = (self._residuals**2).sum()
+        self._total_squared_dist = (self._dists**2).sum()
         self.stress = sqrt(self._total_squared_diff/self._total_squared_dist)
-        
-    def _nudged_stress(self, v, d, epsilon):
-        """Calculates the stress with point v moved epsilon in the dth dimension
-        """
-        delta_epsilon = zeros([self.dimension], float)
-        delta_epsilon[d] = epsilon
-        moved_point = self.points[v] + delta_epsilon
-        squared_dists = ((moved_point - self.points)**2).sum(axis=-1)
-        squared_dists[v] = 0.0
-        delta_squared_dist = squared_dists.sum() - self._squared_dist_sums[v]
-        diffs = sqrt(squared_dists) - self._dhats[v]
-        diffs **= 2
-        delta_squared_diff = diffs.sum() - self._squared_diff_sums[v]
-        return sqrt(
-            (self._total_squared_diff + delta_squared_diff) /
-            (self._total_squared_dist + delta_squared_dist))
 
     def _rescale(self):
         """ assumes centered, rescales to mean ot-origin dist of 1
         """
     
-        factor = array([norm(vec) for vec in self.points]).mean()
+        factor = sqrt((self.points**2).sum(axis=-1)).mean()
         self.points = self.points/factor
 
     def _move_points(self):
@@ -362,15 +347,13 @@ class NMDS(object):
         of steepest descent.  The default parameters are only shown to work on
         a few simple cases, and aren't optimized.
         
-        The gradient is calculated discretely, not via formula.  Each variable
-        (there are n points * k dimensions of variables), is adjusted, 
-        the stress measured, and the variable returned to its prior value.
-        
         If a local minimum is larger than step_size, the algorithm cannot 
         escape.
+        
+        The gradient is that of _calc_stress_gradients.
         """
         num_rows, num_cols = shape(self.points)
-        avg_point_dist = sum([norm(point) for point in self.points])/num_rows
+        avg_point_dist = sqrt((self.points**2).sum(axis=-1)).mean()
         step_size = avg_point_dist*rel_step_size
 
             
@@ -378,24 +361,14 @@ class NMDS(object):
             
             # initial values
             prestep_stress = self.stress.copy()
-            gradient = zeros((num_rows, num_cols))
-            
-            # get gradient
-            for i in range(num_rows):
-                for j in range(num_cols):
-                    self.points[i,j] += step_size
-                    self._calc_distances()
-                    self._calc_stress()
-                    delta_stress = self.stress - prestep_stress
-                    gradient[i,j] = delta_stress/step_size
-                    self.points[i,j] -= step_size
-            
+            gradient = self._calc_stress_gradients(self.points.ravel())
             grad_mag = norm(gradient)
+            if not grad_mag:
+                break
             
             # step in the direction of the negative gradient
-            for i in range(num_rows):
-                for j in range(num_cols):
-                    self.points[i,j] -= step_size*gradient[i,j]/grad_mag
+            self.points = self.points - \
+                (step_size*gradient/grad_mag).reshape(num_rows, num_cols)
             self._calc_distances()
             self._calc_stress()
             newstress = self.stress.copy()
@@ -424,15 +397,31 @@ class NMDS(object):
         return self.stress
     
     def _calc_stress_gradients(self, pts):
-        """Approx first derivatives of stress at pts, for optimisers"""
-        epsilon = sqrt(finfo(float).eps)
-        f0 = self._recalc_stress_from_pts(pts)
-        grad = zeros(pts.shape, float)
-        for k in range(len(pts)):
-            (point, dim) = divmod(k, self.dimension)
-            f1 = self._nudged_stress(point, dim, epsilon)
-            grad[k] = (f1 - f0)/epsilon
-        return grad
+        """First derivatives of stress at pts, dhats fixed, for optimisers
+        
+        With stress S = sqrt(D/T), D the sum of squared (dist - dhat) and T
+        the sum of squared dists, moving point i changes the dist of each
+        pair (i, j) by (x_i - x_j)/dist, so the gradient at x_i is the sum
+        over its pairs of ((dist - dhat)/(dist*T) - D/T**2)/S * (x_i - x_j).
+        Coincident points contribute only through T.
+        """
+        stress = self._recalc_stress_from_pts(pts)
+        num_points, dimension = self.points.shape
+        if not stress:
+            return zeros(pts.shape, float)
+        with errstate(divide='ignore', invalid='ignore'):
+            weights = self._residuals / self._dists
+        weights[self._dists == 0] = 0.0
+        weights /= self._total_squared_dist
+        weights -= self._total_squared_diff / self._total_squared_dist**2
+        weights /= stress
+        pair_grads = self._diffs * weights[:, newaxis]
+        grad = zeros((num_points, dimension), float)
+        for dim in range(dimension):
+            grad[:, dim] = bincount(self._pairs_i, pair_grads[:, dim],
+                num_points) - bincount(self._pairs_j, pair_grads[:, dim],
+                num_points)
+        return grad.ravel()
 
 
 def metaNMDS(iters, *args, **kwargs):
@@ -441,14 +430,25 @@ def metaNMDS(iters, *args, **kwargs):
     returns NMDS object with lowest stress
     args, kwargs is passed to NMDS(), but must not have initial_pts
     must supply distance matrix
+
+    The random starts are spread over the CPUs of the current parallel
+    context. Random start k is seeded with (rand_seed, k), rand_seed
+    being drawn from numpy's global random state if not given, so the
+    result does not depend on the number of CPUs.
     """
+    rand_seed = kwargs.pop('rand_seed', None)
+    if rand_seed is None:
+        rand_seed = randint(2**31)
     results = []
     kwargs['initial_pts'] = "pcoa"
     res1 = NMDS(*args,**kwargs)
     results.append(res1)
     kwargs['initial_pts'] = "random"
-    for i in range(iters):
-        results.append(NMDS(*args, **kwargs))
+
+    def random_start(index):
+        return NMDS(rand_seed=[rand_seed, index], *args, **kwargs)
+
+    results.extend(parallel.imap(random_start, range(iters)))
     stresses = [nmds.getStress() for nmds in results]
     bestidx = stresses.index(min(stresses))
     return results[bestidx]
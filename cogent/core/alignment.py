@@ -29,7 +29,7 @@ import cogent   #will use to get at cogent.parse.fasta.MinimalFastaParser,
 from cogent.format.alignment import save_to_filename
 from cogent.core.info import Info as InfoClass
 from cogent.core.sequence import frac_same, ModelSequence
-from cogent.core.location import LostSpan, Span
+from cogent.core.location import LostSpan, Span, ArrayMap
 from cogent.maths.stats.util import Freqs
 from cogent.format.fasta import fasta_from_alignment
 from cogent.format.phylip import phylip_from_alignment
@@ -1569,7 +1569,13 @@ class Aligned(object):
         #assert map is self.parent_map or ... ?
         #print 'REMAP', self.map, self
         #print 'ONTO', map, map.inverse()
-        result = Aligned(map[self.map.inverse()].inverse(), self.data)
+        try:
+            # array form avoids building intermediate Span objects
+            new_map = ArrayMap.fromMap(map)[
+                    ArrayMap.fromMap(self.map).inverse()].inverse().toMap()
+        except ValueError:
+            new_map = map[self.map.inverse()].inverse()
+        result = Aligned(new_map, self.data)
         #print 'GIVES', result.map, result
         #print
         return result
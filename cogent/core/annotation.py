@@ -1,4 +1,5 @@
 from location import as_map, Map
+from bisect import bisect_left
 import numpy
 
 __author__ = "Peter Maxwell and Gavin Huttley"
@@ -10,9 +11,141 @@ __maintainer__ = "Gavin Huttley"
 __email__ = "gavin.huttley@anu.edu.au"
 __status__ = "Production"
 
+def _changes(name):
+    method = getattr(list, name)
+    def changed(self, *args, **kw):
+        self.version += 1
+        return method(self, *args, **kw)
+    changed.__name__ = name
+    return changed
+
+class _AnnotationList(list):
+    """A list which counts changes made to it, so that an _AnnotationIndex
+    can tell when items have been replaced or removed in place."""
+    version = 0
+    
+    __setitem__ = _changes('__setitem__')
+    __delitem__ = _changes('__delitem__')
+    __setslice__ = _changes('__setslice__')
+    __delslice__ = _changes('__delslice__')
+    __iadd__ = _changes('__iadd__')
+    __imul__ = _changes('__imul__')
+    append = _changes('append')
+    extend = _changes('extend')
+    insert = _changes('insert')
+    pop = _changes('pop')
+    remove = _changes('remove')
+    reverse = _changes('reverse')
+    sort = _changes('sort')
+    
+
+class _AnnotationIndex(object):
+    """Interval and type index over the annotations list of an _Annotatable.
+    
+    Annotations are held in centred interval trees so that those
+    overlapping a region are found in O(log n + k). Annotations attached
+    after the index was built are collected in a short pending list, which
+    becomes a tree of its own once full. Trees of similar size are merged,
+    so there are never more than O(log n) of them to search.
+    Query results are always returned in annotations list order.
+    """
+    
+    # longest pending list before it is made into a tree
+    _max_pending = 8
+    
+    def __init__(self, annotations):
+        self.annotations = annotations
+        self.size = 0
+        self.by_type = {}
+        self.trees = []
+        self.pending = []
+        self.unbounded = []
+        self.add(annotations)
+        self._flush()
+    
+    def add(self, annots):
+        for annot in annots:
+            entry = (self.size, annot)
+            self.size += 1
+            self.by_type.setdefault(annot.type, []).append(annot)
+            if not annot.map.useful:
+                continue
+            elif annot.map.Start < annot.map.End:
+                self.pending.append(entry)
+            else:
+                self.unbounded.append(entry)
+        if len(self.pending) > self._max_pending:
+            self._flush()
+        self.version = getattr(self.annotations, 'version', None)
+    
+    def isCurrent(self, annotations):
+        return annotations is self.annotations and \
+                len(annotations) == self.size and \
+                getattr(annotations, 'version', None) == self.version
+    
+    def _flush(self):
+        """make the pending entries into a tree, merging it with any
+        trees which are not larger"""
+        entries = self.pending
+        self.pending = []
+        while self.trees and len(self.trees[-1][0]) <= len(entries):
+            entries = self.trees.pop()[0] + entries
+        if entries:
+            self.trees.append((entries, self._build(entries)))
+    
+    def _build(self, entries):
+        if not entries:
+            return None
+        starts = [annot.map.Start for (posn, annot) in entries]
+        starts.sort()
+        centre = starts[len(starts) // 2]
+        left, here, right = [], [], []
+        for (posn, annot) in entries:
+            if annot.map.End <= centre:
+                left.append((posn, annot))
+            elif annot.map.Start > centre:
+                right.append((posn, annot))
+            else:
+                here.append((posn, annot))
+        by_start = [(a.map.Start, p, a) for (p, a) in here]
+        by_start.sort()
+        by_end = [(-a.map.End, p, a) for (p, a) in here]
+        by_end.sort()
+        return (centre, by_start, by_end, self._build(left),
+                self._build(right))
+    
+    def overlapping(self, start, end):
+        """annotations with a useful map that overlaps start:end"""
+        found = [(p, a) for (p, a) in self.pending + self.unbounded
+                if a.map.Start < end and a.map.End > start]
+        stack = [tree for (entries, tree) in self.trees]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            (centre, by_start, by_end, left, right) = node
+            if end <= centre:
+                for (s, p, a) in by_start[:bisect_left(by_start, (end,))]:
+                    found.append((p, a))
+                stack.append(left)
+            elif start > centre:
+                for (e, p, a) in by_end[:bisect_left(by_end, (-start,))]:
+                    found.append((p, a))
+                stack.append(right)
+            else:
+                found.extend([(p, a) for (s, p, a) in by_start])
+                stack.extend([left, right])
+        found.sort()
+        return [annot for (posn, annot) in found]
+    
+
 class _Annotatable(object):
     # default
     annotations = ()
+    _annotation_index = None
+    
+    # lists with fewer annotations than this are searched directly
+    _min_indexed = 16
     
     # Subclasses should provide __init__, getOwnTracks, and a _mapped for use by
     # __getitem__
@@ -27,14 +160,11 @@ class _Annotatable(object):
             #    print "Annotations dropped because %s" % detail
             #    return []
             if slicemap.useful:
-                for annot in self.annotations:
-                    if not annot.map.useful:
-                        continue
-                    if annot.map.Start < slicemap.End and \
-                            annot.map.End > slicemap.Start:
-                        annot = annot.remappedTo(new, newmap)
-                        if annot.map.useful:
-                            result.append(annot)
+                for annot in self.getAnnotationsOverlapping(slicemap.Start,
+                        slicemap.End):
+                    annot = annot.remappedTo(new, newmap)
+                    if annot.map.useful:
+                        result.append(annot)
         return result
     
     def _shiftedAnnotations(self, new, shift):
@@ -98,8 +228,13 @@ class _Annotatable(object):
             if annot.attached:
                 raise ValueError("already attached")
         if self.annotations is self.__class__.annotations:
-            self.annotations = []
+            self.annotations = _AnnotationList()
+        index = self._annotation_index
+        if index is not None and not index.isCurrent(self.annotations):
+            index = self._annotation_index = None
         self.annotations.extend(annots)
+        if index is not None:
+            index.add(annots)
         for annot in annots:
             annot.attached = True
     
@@ -111,13 +246,50 @@ class _Annotatable(object):
             if annot.attached:
                 self.annotations.remove(annot)
                 annot.attached = False
+        self._annotation_index = None
+    
+    def _getAnnotationIndex(self):
+        """the _AnnotationIndex for self.annotations, or None if the list
+        is too short to be worth indexing"""
+        if len(self.annotations) < self._min_indexed:
+            return None
+        index = self._annotation_index
+        if index is None or not index.isCurrent(self.annotations):
+            if not isinstance(self.annotations, _AnnotationList):
+                self.annotations = _AnnotationList(self.annotations)
+            index = self._annotation_index = _AnnotationIndex(
+                    self.annotations)
+        return index
+    
+    def getAnnotationsOverlapping(self, start, end, within=False):
+        """returns annotations whose span overlaps start:end.
+        
+        Arguments:
+            - start, end: region in the coordinates of self.
+            - within: if True, only annotations lying entirely inside the
+              region are returned."""
+        index = self._getAnnotationIndex()
+        if index is None:
+            result = [annot for annot in self.annotations if annot.map.useful
+                    and annot.map.Start < end and annot.map.End > start]
+        else:
+            result = index.overlapping(start, end)
+        if within:
+            result = [annot for annot in result
+                    if annot.map.Start >= start and annot.map.End <= end]
+        return result
     
     def addFeature(self, type, Name, spans):
         return self.addAnnotation(Feature, type, Name, spans)
     
     def getAnnotationsMatching(self, annotation_type, Name=None):
         result = []
-        for annotation in self.annotations:
+        index = self._getAnnotationIndex()
+        if index is None:
+            annotations = self.annotations
+        else:
+            annotations = index.by_type.get(annotation_type, [])
+        for annotation in annotations:
             if annotation_type == annotation.type and (
                     Name is None or Name == annotation.Name):
                 result.append(annotation)
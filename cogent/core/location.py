@@ -44,6 +44,7 @@ from string import strip
 
 from bisect import bisect_right, bisect_left
 import copy
+import numpy
 
 __author__ = "Rob Knight"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -687,6 +688,163 @@ class Map(object):
         return coords
     
 
+class ArrayMap(object):
+    """A Map held as parallel integer arrays rather than Span objects.
+    
+    Segment i covers positions offsets[i]:offsets[i]+lengths[i] of the map
+    and, unless it is a gap (starts[i] == -1), positions
+    starts[i]:starts[i]+lengths[i] of the parent. Only forward spans without
+    values or tidy ends can be represented, which covers the maps of gapped
+    alignment sequences. Slicing, composition and inversion are vectorised
+    so that no per-span objects are created until toMap is called.
+    """
+    
+    def __init__(self, starts, lengths, parent_length):
+        starts = numpy.asarray(starts, int)
+        lengths = numpy.asarray(lengths, int)
+        keep = lengths > 0
+        starts, lengths = starts[keep], lengths[keep]
+        if len(lengths) > 1:
+            # merge neighbouring gaps, and spans contiguous on the parent
+            prev_starts, prev_lengths = starts[:-1], lengths[:-1]
+            joined = numpy.where(prev_starts < 0, starts[1:] < 0,
+                    prev_starts + prev_lengths == starts[1:])
+            first = numpy.concatenate([[True], ~joined])
+            groups = numpy.cumsum(first) - 1
+            lengths = numpy.bincount(groups, lengths).astype(int)
+            starts = starts[first]
+        self.starts = starts
+        self.lengths = lengths
+        self.offsets = numpy.cumsum(lengths) - lengths
+        self.length = int(lengths.sum())
+        self.parent_length = parent_length
+        present = starts >= 0
+        self.useful = bool(present.any())
+        self.complete = bool(present.all())
+        if self.useful:
+            self.Start = int(starts[present].min())
+            self.End = int((starts + lengths)[present].max())
+    
+    @classmethod
+    def fromMap(cls, map):
+        """An ArrayMap equivalent to map, raises ValueError if map has
+        spans that can't be represented."""
+        starts = []
+        lengths = []
+        for span in map.spans:
+            if span.lost:
+                if span.value is not None:
+                    raise ValueError("Can't represent %s" % repr(span))
+                starts.append(-1)
+            else:
+                if span.Reverse or span.value is not None or \
+                        span.tidy_start or span.tidy_end or span.Start < 0:
+                    raise ValueError("Can't represent %s" % repr(span))
+                starts.append(span.Start)
+            lengths.append(span.length)
+        return cls(starts, lengths, map.parent_length)
+    
+    def toMap(self):
+        spans = []
+        for (start, length) in zip(self.starts.tolist(),
+                self.lengths.tolist()):
+            if start < 0:
+                spans.append(LostSpan(length))
+            else:
+                spans.append(Span(start, start+length))
+        return Map(spans=spans, parent_length=self.parent_length)
+    
+    def __len__(self):
+        return self.length
+    
+    def __repr__(self):
+        spans = ['%s:%s' % (s, s+l) if s >= 0 else '-%s-' % l
+                for (s, l) in zip(self.starts.tolist(), self.lengths.tolist())]
+        return '[%s]/%s' % (', '.join(spans), self.parent_length)
+    
+    def _pieces(self, lo, hi):
+        """The (starts, lengths) of the pieces of self covering each of the
+        regions lo[i]:hi[i] of the map, concatenated in order, and the number
+        of pieces in each region."""
+        first = numpy.searchsorted(self.offsets, lo, 'right') - 1
+        last = numpy.searchsorted(self.offsets, hi, 'left') - 1
+        counts = numpy.where(hi > lo, last - first + 1, 0)
+        region = numpy.repeat(numpy.arange(len(lo)), counts)
+        within = numpy.arange(counts.sum()) - numpy.repeat(
+                numpy.cumsum(counts) - counts, counts)
+        segment = first[region] + within
+        seg_lo = self.offsets[segment]
+        piece_lo = numpy.maximum(lo[region], seg_lo)
+        piece_hi = numpy.minimum(hi[region], seg_lo + self.lengths[segment])
+        starts = self.starts[segment]
+        starts = numpy.where(starts < 0, -1, starts + piece_lo - seg_lo)
+        return starts, piece_hi - piece_lo, counts
+    
+    def __getitem__(self, index):
+        """A slice of self, or the composition of self with an ArrayMap (or
+        Map) of positions on self, as an ArrayMap on the same parent"""
+        if isinstance(index, Map):
+            index = ArrayMap.fromMap(index)
+        if not isinstance(index, ArrayMap):
+            (lo, hi, step) = _norm_slice(index, self.length)
+            assert (step or 1) == 1, index
+            index = ArrayMap([lo], [hi-lo], self.length)
+        gap = index.starts < 0
+        lo = numpy.where(gap, 0, index.starts)
+        hi = numpy.where(gap, 0, index.starts + index.lengths)
+        if len(hi) and hi.max() > self.length:
+            raise ValueError("Region outside map of length %s" % self.length)
+        (starts, lengths, counts) = self._pieces(lo, hi)
+        # a gap in index stays a gap, in its place amongst the pieces
+        ends = numpy.cumsum(numpy.where(gap, 1, counts))
+        gap_slot = numpy.zeros(ends[-1] if len(ends) else 0, bool)
+        gap_slot[ends[gap] - 1] = True
+        all_starts = numpy.empty(len(gap_slot), int)
+        all_lengths = numpy.empty(len(gap_slot), int)
+        all_starts[~gap_slot] = starts
+        all_lengths[~gap_slot] = lengths
+        all_starts[gap_slot] = -1
+        all_lengths[gap_slot] = index.lengths[gap]
+        return ArrayMap(all_starts, all_lengths, self.parent_length)
+    
+    def inverse(self):
+        """The ArrayMap of the parent onto self, raises ValueError if the
+        map has overlapping spans"""
+        present = self.starts >= 0
+        order = numpy.argsort(self.starts[present], kind='mergesort')
+        lo = self.starts[present][order]
+        lengths = self.lengths[present][order]
+        offsets = self.offsets[present][order]
+        hi = lo + lengths
+        if len(lo) and (lo[1:] < hi[:-1]).any():
+            raise ValueError("Uninvertable. Overlapping spans")
+        if len(lo) and hi[-1] > self.parent_length:
+            raise ValueError("Span beyond parent length")
+        gaps = lo - numpy.concatenate([[0], hi[:-1]])
+        tail = self.parent_length - (hi[-1] if len(hi) else 0)
+        starts = numpy.empty(2 * len(lo) + 1, int)
+        starts[0:-1:2] = -1
+        starts[1::2] = offsets
+        starts[-1] = -1
+        new_lengths = numpy.empty(len(starts), int)
+        new_lengths[0:-1:2] = gaps
+        new_lengths[1::2] = lengths
+        new_lengths[-1] = tail
+        return ArrayMap(starts, new_lengths, self.length)
+    
+    def gaps(self):
+        """(start, end) positions on self of the gaps, as an array"""
+        gap = self.starts < 0
+        return numpy.transpose([self.offsets[gap],
+                self.offsets[gap] + self.lengths[gap]])
+    
+    def getCoordinates(self):
+        """returns span coordinates as [(start, end), ...]"""
+        present = self.starts >= 0
+        starts = self.starts[present]
+        return zip(starts.tolist(), (starts+self.lengths[present]).tolist())
+    
+
 class SpansOnly(ConstrainedList):
     """List that converts elements to Spans on addition."""
     Mask = FunctionWrapper(Span)
@@ -11,7 +11,7 @@ from string import maketrans, translate
 from numpy import array, sum, transpose, reshape, ones, zeros,\
     take, float64, ravel, nonzero, log, put, concatenate, argmax, cumsum,\
     sort, argsort, searchsorted, logical_and, asarray, uint8, add, subtract,\
-    multiply, divide, newaxis, alltrue, max, all, isfinite
+    multiply, divide, newaxis, alltrue, max, all, isfinite, dot
 #from numpy.oldnumeric import sum
 from numpy.random import random
 from cogent.util.array import euclidean_distance, row_degeneracy,\
@@ -391,17 +391,23 @@ class Profile(object):
 
         This function doesn't do any input validation. That is done in 'score'
         See method 'score' for more information.
+
+        The loop runs over the positions of the profile, not over the
+        windows of the sequence, so each step is a single take over the
+        whole sequence.
         """
         data = self.Data
         pl = len(data) #profile length (number of positions)
-        sl = len(seq_indices)
-
-        r = range(pl) #fixed range
-        result = []
-        for starting_pos in range(offset, len(seq_indices)-pl+1):
-            slice = seq_indices[starting_pos:starting_pos+pl]
-            result.append(sum(array([data[i] for i in zip(r,slice)]), axis=0))
-        return array(result)
+        seq_indices = asarray(seq_indices)
+        num_windows = len(seq_indices) - pl + 1 - offset
+        if num_windows < 0:
+            num_windows = 0
+
+        result = zeros(num_windows, data.dtype)
+        for i in range(pl):
+            start = offset + i
+            result += take(data[i], seq_indices[start:start+num_windows])
+        return result
     
     def _score_profile(self, profile, offset=0):
         """Returns score of the profile against the input_profile.
@@ -415,12 +421,35 @@ class Profile(object):
         data = self.Data
         self_l = len(data) #profile length
         other_l = len(profile.Data) #other profile length
-        result = []
-        for start in range(offset,other_l-self_l+1):
-            stop = start + self_l
-            slice = profile.Data[start:stop,:]
-            result.append(sum(self.Data*slice))
-        return array(result)
+        num_windows = other_l - self_l + 1 - offset
+        if num_windows < 0:
+            num_windows = 0
+        #products[j,i] is the score of row i of self against row j of other
+        products = dot(profile.Data, transpose(data))
+        result = zeros(num_windows, products.dtype)
+        for i in range(self_l):
+            start = offset + i
+            result += products[start:start+num_windows, i]
+        return result
+
+    def _seq_to_indices(self, seq):
+        """Returns array of indices of the characters of seq in the CharOrder
+
+        Raises a ProfileError if the sequence contains characters that are
+        not in the CharOrder.
+        """
+        if hasattr(self, '_translation_table'):
+            seq_indices = numpy.frombuffer(translate(str(seq),\
+                self._translation_table), uint8)
+        else:   #need to figure out where each item is in the charorder
+            idx = self.CharOrder.index
+            seq_indices = array(map(idx, seq))
+        #raise error if some sequence characters are not in the CharOrder
+        if (seq_indices >= len(self.CharOrder)).any():
+            raise ProfileError,\
+            "Sequence contains characters that are not in the "+\
+            "CharOrder"
+        return seq_indices
 
     def score(self, input_data, offset=0):
         """Returns a score of the profile against input_data (Profile or Seq).
@@ -503,19 +532,48 @@ class Profile(object):
             return self._score_profile(input_data, offset)
         else:
             #translate seq to indices
-            if hasattr(self, '_translation_table'):
-                seq_indices = array(map(ord,translate(str(input_data),\
-                    self._translation_table)))
-            else:   #need to figure out where each item is in the charorder
-                idx = self.CharOrder.index
-                seq_indices = array(map(idx, input_data))
-            #raise error if some sequence characters are not in the CharOrder
-            if (seq_indices > len(self.CharOrder)).any():
-                raise ProfileError,\
-                "Sequence contains characters that are not in the "+\
-                "CharOrder"
+            seq_indices = self._seq_to_indices(input_data)
             #now the profile is scored against the list of indices   
             return self._score_indices(seq_indices,offset)
+
+    def scoreSequences(self, seqs, offset=0):
+        """Returns list of score arrays of the profile against each seq
+
+        seqs: list of Sequence objects (or strings)
+        offset: starting index for searching in each sequence
+
+        The result for each sequence is the same as what 'score' returns
+        for it, but all sequences are translated and joined first, so the
+        windows of the whole batch are scored in one pass. Windows that
+        span the border between two sequences are dropped.
+        """
+        data = self.Data
+        pl = len(data) #profile length
+        if not data.any():
+            raise ProfileError,"Can't score an empty profile"
+
+        all_indices = []
+        for seq in seqs:
+            to_score_length = len(seq)
+            if to_score_length < pl:
+                raise ProfileError,\
+                "Sequence to score should be at least %s "%(pl)+\
+                "characters long, but is %s."%(to_score_length)
+            if not offset <= (to_score_length - pl):
+                raise ProfileError, "Offset must be <= %s, but is %s"\
+                %((to_score_length-pl), offset)
+            all_indices.append(self._seq_to_indices(seq))
+        if not all_indices:
+            return []
+
+        scores = self._score_indices(concatenate(all_indices))
+        result = []
+        start = 0
+        for seq_indices in all_indices:
+            stop = start + len(seq_indices)
+            result.append(scores[start+offset:stop-pl+1])
+            start = stop
+        return result
      
     def rowUncertainty(self):
         """Returns the uncertainty (Shannon's entropy) for each row in profile
@@ -757,3 +815,84 @@ def CharMeaningProfile(alphabet, char_order=None, split_degenerates=False):
         result[ord(c)] = array(c*lc, 'c') == char_order           
     return Profile(Data=result,Alphabet=alphabet,CharOrder=char_order)
 
+
+class ProfileAccumulator(object):
+    """Builds a Profile from equal length sequences added in batches
+
+    Only a position x ascii-character table of weighted counts is kept,
+    so memory use does not depend on the number of sequences added. The
+    meaning of each character (see CharMeaningProfile) is applied once,
+    when the Profile is made.
+    """
+
+    def __init__(self, length, alphabet, char_order=None,\
+        split_degenerates=False):
+        """Initialize ProfileAccumulator
+
+        length: length of the sequences that will be added
+        alphabet: Alphabet object (should have 'Degenerates' if 
+            split_degenerates is set to True)
+        char_order: order of the characters in the profile. Default is
+            list(alphabet)
+        split_degenerates: whether the counts for the degenerate symbols
+            should be divided over the non-degenerate symbols they code for
+        """
+        if not char_order:
+            char_order = list(alphabet)
+        self.Length = length
+        self.Alphabet = alphabet
+        self.CharOrder = char_order
+        self.CharMeaning = CharMeaningProfile(alphabet, char_order,\
+            split_degenerates)
+        self.Counts = zeros([length, 256], float64)
+        self.NumSeqs = 0
+        self.TotalWeight = 0
+
+    def add(self, seqs, weights=None):
+        """Adds a batch of sequences to the counts
+
+        seqs: list of Sequence objects (or strings), all of self.Length
+        weights: list of weights, one for each sequence. Default is a
+            weight of one for each sequence.
+
+        Characters are counted case-insensitively.
+        """
+        seqs = [str(s).upper() for s in seqs]
+        if not seqs:
+            return
+        length = self.Length
+        for s in seqs:
+            if len(s) != length:
+                raise ProfileError,\
+                "Sequence length %s doesn't match profile length %s"\
+                %(len(s), length)
+        if weights is None:
+            weights = ones(len(seqs), float64)
+        else:
+            weights = asarray(weights, float64)
+            if len(weights) != len(seqs):
+                raise ProfileError,\
+                "Got %s weights for %s sequences"%(len(weights), len(seqs))
+        codes = numpy.frombuffer(''.join(seqs), uint8).reshape(\
+            (len(seqs), length))
+        #flat index of (position, character) for each character in the batch
+        flat = (codes + numpy.arange(length)[newaxis,:]*256).ravel()
+        seq_weights = numpy.repeat(weights, length)
+        self.Counts += numpy.bincount(flat, seq_weights,\
+            minlength=length*256).reshape((length, 256))
+        self.NumSeqs += len(seqs)
+        self.TotalWeight += weights.sum()
+
+    def toProfile(self, normalize=True):
+        """Returns Profile of the sequences added so far
+
+        normalize: whether the positions of the profile should be normalized
+            to one (raises ProfileError when a position contains only 
+            characters that are ignored)
+        """
+        meaning = self.CharMeaning.Data
+        data = dot(self.Counts[:,:len(meaning)], meaning)
+        result = Profile(data, self.Alphabet, self.CharOrder)
+        if normalize:
+            result.normalizePositions()
+        return result
@@ -835,65 +835,55 @@ class TreeNode(object):
         and its descendents. This method is a modification of an implementation
         by Zongzhi Liu
         """
-        result = ['(']
-        nodes_stack = [[self, len(self.Children)]]
-        node_count = 1
+        return ''.join(self._newickPieces(with_distances, semicolon,
+                escape_name))
 
-        while nodes_stack:
-            node_count += 1
-            #check the top node, any children left unvisited?
-            top = nodes_stack[-1]
-            top_node, num_unvisited_children = top
-            if num_unvisited_children: #has any child unvisited
-                top[1] -= 1  #decrease the #of children unvisited
-                next_child = top_node.Children[-num_unvisited_children] # - for order
-                #pre-visit
-                if next_child.Children:
-                    result.append('(')
-                nodes_stack.append([next_child, len(next_child.Children)])
-            else:  #no unvisited children
-                nodes_stack.pop()
-                #post-visit
-                if top_node.Children:
-                    result[-1] = ')'
+    def writeNewick(self, outfile, with_distances=False, semicolon=True,
+            escape_name=True):
+        """Write the newick string for this tree to an open file.
 
-                if top_node.NameLoaded:
-                    if top_node.Name is None:
-                        name = ''
-                    else:
-                        name = str(top_node.Name)
-                        if escape_name and not (name.startswith("'") and \
-                                                name.endswith("'")):
-                            if re.search("""[]['"(),:;_]""", name):
-                                name = "'%s'" % name.replace("'", "''")
-                            else:
-                                name = name.replace(' ','_')
-                    result.append(name)
-                
-                if isinstance(self, PhyloNode):
-                    if with_distances and top_node.Length is not None:
-                        #result.append(":%s" % top_node.Length)
-                        result[-1] = "%s:%s" % (result[-1], top_node.Length)
+        Arguments are as for getNewick. The string is written as it is
+        generated, so it is never held in memory as a whole.
+        """
+        outfile.writelines(self._newickPieces(with_distances, semicolon,
+                escape_name))
 
-                result.append(',')
+    def _newickPieces(self, with_distances, semicolon, escape_name):
+        """Generates the newick string for this tree a piece at a time.
 
-        len_result = len(result)
-        if len_result == 2:  # single node no name
-            if semicolon:
-                return ";"
-            else:
-                return ''
-        elif len_result == 3: # single node with name
-            if semicolon:
-                return "%s;" % result[1]
-            else:
-                return result[1]
-        else:
-            if semicolon:
-                result[-1] = ';'
-            else:
-                result.pop(-1)
-            return ''.join(result)
+        Iterative, so safe for deep trees.
+        """
+        show_lengths = with_distances and isinstance(self, PhyloNode)
+        nodes_stack = [[self, 0]]
+        while nodes_stack:
+            top = nodes_stack[-1]
+            top_node, child_index = top
+            if child_index < len(top_node.Children):
+                #pre-visit next child
+                if child_index:
+                    yield ','
+                else:
+                    yield '('
+                top[1] += 1
+                nodes_stack.append([top_node.Children[child_index], 0])
+                continue
+            #post-visit
+            nodes_stack.pop()
+            if top_node.Children:
+                yield ')'
+            if top_node.NameLoaded and top_node.Name is not None:
+                name = str(top_node.Name)
+                if escape_name and not (name.startswith("'") and \
+                                        name.endswith("'")):
+                    if re.search("""[]['"(),:;_]""", name):
+                        name = "'%s'" % name.replace("'", "''")
+                    else:
+                        name = name.replace(' ','_')
+                yield name
+            if show_lengths and top_node.Length is not None:
+                yield ":%s" % top_node.Length
+        if semicolon:
+            yield ';'
     
     def removeNode(self, target):
         """Removes node by identity instead of value.
@@ -1310,12 +1300,11 @@ class TreeNode(object):
         else:
             xml = filename.lower().endswith('xml')
         
+        outf = open(filename, "w")
         if xml:
-            data = self.getXML()
+            outf.writelines(self.getXML())
         else:
-            data = self.getNewick(with_distances=with_distances)
-        outf = open(filename, "w")
-        outf.writelines(data)
+            self.writeNewick(outf, with_distances=with_distances)
         outf.close()
 
     def getNodeNames(self, includeself=True, tipsonly=False):
@@ -1499,6 +1488,63 @@ class TreeNode(object):
                 i.__leaf_set = leaf_set
         return frozenset(sets)
                 
+    def postorderMasks(self, tip_index, include_self=True):
+        """Returns iterator of (node, mask) pairs in postorder.
+
+        mask is an integer bitset with bit tip_index[name] set for every tip
+        descending from node. Names missing from tip_index are added to it,
+        so a single dict can be shared to encode many trees consistently.
+        """
+        masks = {}
+        for node in self.traverse(self_before=False, self_after=True):
+            if node.Children:
+                mask = 0L
+                for child in node.Children:
+                    mask |= masks.pop(id(child))
+            else:
+                if node.Name not in tip_index:
+                    tip_index[node.Name] = len(tip_index)
+                mask = 1L << tip_index[node.Name]
+            masks[id(node)] = mask
+            if include_self or node is not self:
+                yield node, mask
+
+    def subsetMasks(self, tip_index=None):
+        """Returns subsets (see subsets) encoded as integer bitsets.
+
+        tip_index is a dict of tip name -> bit position, extended with any
+        names not already present. Sharing it between trees allows subsets
+        to be compared with integer rather than frozenset operations.
+        """
+        if tip_index is None:
+            tip_index = {}
+        return frozenset([mask for node, mask in
+            self.postorderMasks(tip_index, include_self=False)
+            if mask & (mask - 1)])
+
+    def splitMasks(self, tip_index=None):
+        """Returns the non-trivial bipartitions of self as integer bitsets.
+
+        Each edge splits the tips in two; the split is represented by the
+        side that excludes the tip with the lowest bit in tip_index, so the
+        result does not depend on where the tree is rooted. The symmetric
+        difference of two such sets gives the Robinson-Foulds distance.
+        """
+        if tip_index is None:
+            tip_index = {}
+        pairs = list(self.postorderMasks(tip_index))
+        full = pairs[-1][1]
+        reference = full & -full
+        num_tips = bin(full).count('1')
+        splits = set()
+        for node, mask in pairs[:-1]:
+            if mask & reference:
+                mask = full ^ mask
+            size = bin(mask).count('1')
+            if 1 < size < num_tips - 1:
+                splits.add(mask)
+        return frozenset(splits)
+
     def compareBySubsets(self, other, exclude_absent_taxa=False):
         """Returns fraction of overlapping subsets where self and other differ.
             
@@ -1508,13 +1554,17 @@ class TreeNode(object):
         mismatches: if you don't want this behavior, strip out the non-matching
         tips first.
         """
-        self_sets, other_sets = self.subsets(), other.subsets()
+        tip_index = {}
+        self_sets = self.subsetMasks(tip_index)
+        other_sets = other.subsetMasks(tip_index)
         if exclude_absent_taxa:
-            in_both = self.subset() & other.subset()
+            in_both = 0L
+            for name in self.subset() & other.subset():
+                in_both |= 1L << tip_index[name]
             self_sets = [i & in_both for i in self_sets]
-            self_sets = frozenset([i for i in self_sets if len(i) > 1])
+            self_sets = frozenset([i for i in self_sets if i & (i - 1)])
             other_sets = [i & in_both for i in other_sets]
-            other_sets = frozenset([i for i in other_sets if len(i) > 1])
+            other_sets = frozenset([i for i in other_sets if i & (i - 1)])
         total_subsets = len(self_sets) + len(other_sets)
         intersection_length = len(self_sets & other_sets)
         if not total_subsets:   #no common subsets after filtering, so max dist
@@ -1787,11 +1837,16 @@ class PhyloNode(TreeNode):
     
     def sameTopology(self, other):
         """Tests whether two trees have the same topology."""
-        tip_names = self.getTipNames()
-        root_at = tip_names[0]
-        me = self.rootedWithTip(root_at).sorted(tip_names)
-        them = other.rootedWithTip(root_at).sorted(tip_names)
-        return self is other or me.sameShape(them)
+        if self is other:
+            return True
+        tip_index = {}
+        me = self.splitMasks(tip_index)
+        num_tips = len(tip_index)
+        them = other.splitMasks(tip_index)
+        if len(tip_index) != num_tips or \
+                len(other.getTipNames()) != len(self.getTipNames()):
+            return False
+        return me == them
     
     def unrooted(self):
         """A tree with at least 3 children at the root.
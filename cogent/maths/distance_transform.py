@@ -19,6 +19,15 @@ docstring for specifics):
     * functions prefaced with "binary" consider only presense/absense in
     input data (qualitative rather than quantitative)
 
+BLOCKED COMPUTATION
+The distance functions compute their results in tiles of rows with
+pairwise_blocked, which can also return condensed (upper triangle) or
+float32 results, fill a preallocated or memory-mapped result, use a pool of
+threads, and read sparse input a block of rows at a time. dist_blocked does
+the same for a metric given by name (see BLOCK_KERNELS and TABLE_KERNELS).
+A new metric needs only a block kernel, f(x, y) returning the distances
+between the rows of the dense row blocks x and y.
+
 TRANSFORM FUNCTIONS
 * For transform functions, very little error checking exists.  0/0 evals
 in transform fomulas will throw errors, and negative data will return 
@@ -62,7 +71,11 @@ from numpy import (array, zeros, logical_and, logical_or, logical_xor, where,
 # ValueError: The truth value of an array with more than one element is 
 # ambiguous. Use a.any() or a.all()
 
+from numpy import (dot, empty, errstate, fill_diagonal, flatnonzero,
+    newaxis, finfo, sort, searchsorted, minimum, maximum)
 from numpy.linalg import norm
+from cogent.util.array import condensed_offsets
+from cogent.util.misc import map_threads
 
 __author__ = "Justin Kuczynski"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -196,20 +209,7 @@ def dist_bray_curtis(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i,:]
-        for j in range(i):
-            r2 = datamtx[j,:]
-            abs_v = float(sum(abs(r1 - r2)))
-            v = sum(r1 + r2)
-            cur_d = 0.0 
-            if v > 0:
-                cur_d = abs_v/v
-
-            dists[i][j] = dists[j][i] = cur_d
-    return dists
+    return pairwise_blocked(datamtx, _bray_curtis_block)
 
 dist_bray_curtis_faith = dist_bray_curtis
 
@@ -250,22 +250,7 @@ def dist_bray_curtis_magurran(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return numpy.zeros((0,0),'d')
-
-    dists = numpy.zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i,:]
-        r1sum = r1.sum()
-        for j in range(i):
-            r2 = datamtx[j,:]
-            r2sum = r2.sum()
-            minvals = numpy.min([r1,r2],axis=0)
-
-            if (r1sum + r2sum) == 0:
-                dists[i][j] = dists[j][i] = 0.0
-            else:
-                dissim = 1 - ( (2*minvals.sum()) / (r1sum + r2sum) )
-                dists[i][j] = dists[j][i] = dissim
-    return dists
+    return pairwise_blocked(datamtx, _bray_curtis_magurran_block)
 
 def dist_canberra(datamtx, strict=True):
     """returns a row-row canberra dist matrix
@@ -303,23 +288,9 @@ def dist_canberra(datamtx, strict=True):
         except ValueError:
             return zeros((0,0),'d')
 
-    oldstate = seterr(invalid='ignore',divide='ignore')
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i]
-        for j in range(i):
-            r2 = datamtx[j]
-            dist = 0.0
-            net = abs( r1 - r2 ) / (r1 + r2)
-
-            net = nan_to_num(net)
-            num_nonzeros = nonzero(net)[0].size
-            dists[i,j] = dists[j,i] = nan_to_num(net.sum()/num_nonzeros)
-            
-    seterr(**oldstate)
-    return dists
+    return pairwise_blocked(datamtx, _canberra_block)
 
 def dist_chisq(datamtx, strict=True):
     """returns a row-row chisq dist matrix
@@ -360,29 +331,7 @@ def dist_chisq(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    sqrt_grand_sum = sqrt(sum(datamtx))
-    rowsums, colsums = sum(datamtx, axis=1), sum(datamtx, axis=0)
-    if not colsums.all():
-        for i in range(len(colsums)):
-            if colsums[i] == 0.0:
-                colsums[i] = 1.0
-    for i in range(numrows):
-        r1 = datamtx[i]
-        r1sum = rowsums[i]
-        for j in range(i):
-            r2 = datamtx[j]
-            r2sum = rowsums[j]
-            if r1sum == 0.0 or r2sum == 0.0:
-                if r1sum == 0.0 and r2sum == 0.0:
-                    dist = 0.0
-                else: dist = 1.0
-            else:
-                dist = sqrt_grand_sum *\
-                    sqrt(sum( multiply((1./colsums) ,
-                    square(r1/r1sum - r2/r2sum)) ))
-            dists[i,j] = dists[j,i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _chisq_kernel(datamtx))
 
 def dist_chord(datamtx, strict=True):
     """returns a row-row chord dist matrix
@@ -417,22 +366,7 @@ def dist_chord(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i] # cache here
-        r1norm = norm(r1)
-        for j in range(i):
-            r2 = datamtx[j]
-            r2norm = norm(r2)
-            if r1norm == 0.0 or r2norm == 0.0:
-                if r1norm == 0.0 and r2norm == 0.0:
-                    dist = 0.0
-                else: dist = 1.0
-            else:
-                dist = norm(r1/r1norm - r2/r2norm)
-            dists[i,j] = dists[j,i] = dist
-
-    return dists
+    return pairwise_blocked(datamtx, _chord_block)
 
 def dist_euclidean(datamtx, strict=True):
     """returns a row by row euclidean dist matrix
@@ -464,14 +398,9 @@ def dist_euclidean(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for r in range(numrows):
-        for c in range(r):
-            dist = norm(datamtx[r] - datamtx[c])
-            if isnan(dist):
-                raise RuntimeError('ERROR: overflow when computing euclidean distance')
-            dists[r,c] = dists[c,r] = dist
-
+    dists = pairwise_blocked(datamtx, _euclidean_block)
+    if isnan(dists).any():
+        raise RuntimeError('ERROR: overflow when computing euclidean distance')
     return dists
 
 def dist_gower(datamtx, strict=True):
@@ -510,21 +439,7 @@ def dist_gower(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    coldiffs = datamtx.max(axis=0) - datamtx.min(axis=0)
-    for i in range(numcols):
-        if coldiffs[i] == 0.0:
-            coldiffs[i] = 1.0 # numerator will be zero anyway
-
-    for i in range(numrows):
-        r1 = datamtx[i]
-        for j in range(i):
-            r2 = datamtx[j]
-            rowdiff = r2 - r1
-            dist = sum(abs(r1 - r2) / coldiffs)
-            dists[i,j] = dists[j,i] = dist
-
-    return dists
+    return pairwise_blocked(datamtx, _gower_kernel(datamtx))
 
 def dist_hellinger(datamtx, strict=True):
     """returns a row-row hellinger dist matrix
@@ -558,22 +473,7 @@ def dist_hellinger(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i]
-        r1sum = sum(r1)
-        for j in range(i):
-            r2 = datamtx[j]
-            r2sum = sum(r2)
-            if r1sum == 0.0 or r2sum == 0.0:
-                if r1sum == 0.0 and r2sum == 0.0:
-                    dist = 0.0
-                else: dist = 1.0
-            else:
-                dist = norm(sqrt(r1/r1sum) - sqrt(r2/r2sum))
-            dists[i,j] = dists[j,i] = dist
-
-    return dists
+    return pairwise_blocked(datamtx, _hellinger_block)
 
 def dist_kulczynski(datamtx, strict=True):
     """ calculates the kulczynski distances between rows of a matrix
@@ -611,25 +511,7 @@ def dist_kulczynski(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    rowsums = datamtx.sum(axis=1)
-    # rowsum: the sum of elements in a row
-    # cache to avoid recalculating for each pair
-    for i in range(numrows):
-        irowsum = rowsums[i]
-        r1 = datamtx[i]
-        for j in range(i):
-            r2 = datamtx[j]
-            jrowsum = rowsums[j]
-            rowminsum = float(sum(where(r1<r2, r1,r2)))
-            if (irowsum == 0.0 and jrowsum == 0.0):
-                cur_d = 0.0 # => two rows of zeros
-            elif (irowsum == 0.0 or jrowsum == 0.0):
-                cur_d = 1.0 # one row zeros, one not all zeros
-            else:
-                cur_d = 1.0 - (((rowminsum/irowsum) + (rowminsum/jrowsum))/2.0)
-            dists[i][j] = dists[j][i] = cur_d
-    return dists
+    return pairwise_blocked(datamtx, _kulczynski_block)
 
 def dist_manhattan(datamtx, strict=True):
     """ returns manhattan (city block) distance between rows
@@ -662,13 +544,7 @@ def dist_manhattan(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i] # cache here
-        for j in range(i):
-            dists[i,j] = dists[j,i] = sum(abs(r1 - datamtx[j]))
-            
-    return dists
+    return pairwise_blocked(datamtx, _manhattan_block)
 
 def dist_abund_jaccard(datamtx, strict=True):
     """Calculate abundance-based Jaccard distance between rows
@@ -712,34 +588,7 @@ def dist_abund_jaccard(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    
-    rowsums = datamtx.sum(axis=1, dtype='float')
-
-    for i in range(numrows):
-        row1 = datamtx[i]
-        N1 = rowsums[i]
-
-        for j in range(i):
-            row2 = datamtx[j]
-            N2 = rowsums[j]
-
-            if N1 == 0.0 and N2 == 0.0:
-                similarity = 1.0
-            elif N1 == 0.0 or N2 == 0.0:
-                similarity = 0.0
-            else:
-                shared = logical_and(row1, row2)
-                u = sum(row1[shared]) / N1
-                v = sum(row2[shared]) / N2
-                # Verified by graphical inspection
-                if u == 0.0 and v == 0.0:
-                    similarity = 0.0
-                else:
-                    similarity = (u * v) / (u + v - (u * v))
-
-            dists[i][j] = dists[j][i] = 1 - similarity
-    return dists
+    return pairwise_blocked(datamtx, _abund_jaccard_block)
 
 def dist_morisita_horn(datamtx, strict=True):
     """ returns morisita-horn distance between rows
@@ -777,34 +626,7 @@ def dist_morisita_horn(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    
-    rowsums = datamtx.sum(axis=1, dtype='float')
-    row_ds = (datamtx**2).sum(axis=1, dtype='float') # these are d_a, etc
-    
-    for i in range(numrows):
-        if row_ds[i] !=0.:
-            row_ds[i] = row_ds[i] / rowsums[i]**2
-    # this leaves row_ds zero if actually 0/0
-    for i in range(numrows):
-        row1 = datamtx[i]
-        N1 = rowsums[i]
-        d1 = row_ds[i]
-        for j in range(i):
-            row2 = datamtx[j]
-            N2 = rowsums[j]
-            d2 = row_ds[j]
-            if N2 == 0.0 and N1==0.0:
-                dist = 0.0
-            elif N2 == 0.0 or N1==0.0:
-                dist = 1.0
-            else:
-            # d's zero only if N's zero, and we already checked for that
-                similarity = 2*sum(row1*row2)
-                similarity = similarity / ( (d1 + d2) * N1 * N2 )
-                dist = 1 - similarity
-            dists[i][j] = dists[j][i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _morisita_horn_block)
 
 def dist_pearson(datamtx, strict=True):
     """ Calculates pearson distance (1-r) between rows
@@ -847,36 +669,7 @@ def dist_pearson(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-
-    rowmeans =  mean(datamtx, axis=1)
-    rowstds =  std(datamtx, axis=1)
-
-    dists = zeros((numrows,numrows),'d')
-    n = float(numrows)
-
-    for i in range(numrows):
-        r1 = datamtx[i,:]
-        r1m = rowmeans[i]
-        r1dev = r1 - r1m
-        for j in range(i):
-            r2 = datamtx[j,:]
-            r2m = rowmeans[j]
-            r2dev = r2 - r2m
-            top = sum(r1dev*r2dev)
-            sum1 = sum(r1dev**2)
-            sum2 = sum(r2dev**2)
-
-            if (sum1 == 0.0 and sum2 == 0.0):
-                r = 1.0
-            elif (sum1 == 0.0 or sum2 == 0.0):
-                r = 0.0
-            else:
-                bottom = sqrt(sum1 * sum2)
-                r = top/bottom
-                
-            dists[i][j] = dists[j][i] = 1.0 - r
-            
-    return dists
+    return pairwise_blocked(datamtx, _pearson_block)
 
 def dist_soergel(datamtx, strict=True):
     """ Calculate soergel distance between rows of a matrix
@@ -913,19 +706,7 @@ def dist_soergel(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i,:]
-        for j in range(i):
-            r2 = datamtx[j,:]
-            top = float(sum(abs(r1 - r2)))
-            bot = float(sum(where(r1>r2, r1,r2)))
-            if bot <= 0.0:
-                cur_d = 0.0
-            else:
-                cur_d = top/bot
-            dists[i][j] = dists[j][i] = cur_d
-    return dists
+    return pairwise_blocked(datamtx, _soergel_block)
 
 def dist_spearman_approx(datamtx, strict=True):
     """ Calculate spearman rank distance (1-r) using an approximation formula
@@ -965,23 +746,7 @@ def dist_spearman_approx(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    
-    if numcols < 2:
-        return dists # formula fails for < 2 elements per row
-    
-    for i in range(numrows):
-        r1 = datamtx[i,:]
-        rank1 = _rankdata(r1)
-        for j in range(i):
-            r2 = datamtx[j,:]
-            rank2 = _rankdata(r2)
-            rankdiff = rank1 - rank2
-            dsqsum = sum((rankdiff)**2)
-            dist = 6*dsqsum / float(numcols*(numcols**2-1))
-            
-            dists[i][j] = dists[j][i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _spearman_approx_block)
 
 def dist_specprof(datamtx, strict=True):
     """returns a row-row species profile distance matrix
@@ -1015,22 +780,7 @@ def dist_specprof(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    for i in range(numrows):
-        r1 = datamtx[i]
-        r1sum = sum(r1)
-        for j in range(i):
-            r2 = datamtx[j]
-            r2sum = sum(r2)
-            if r1sum == 0.0 or r2sum == 0.0:
-                if r1sum == 0.0 and r2sum == 0.0:
-                    dist = 0.0
-                else: dist = 1.0
-            else:
-                dist = norm((r1/r1sum) - (r2/r2sum))
-            dists[i,j] = dists[j,i] = dist
-
-    return dists
+    return pairwise_blocked(datamtx, _specprof_block)
 
 def binary_dist_otu_gain(otumtx):
     """ Calculates number of new OTUs observed in sample A wrt sample B
@@ -1040,17 +790,10 @@ def binary_dist_otu_gain(otumtx):
         each other sample.
     
     """
-    result = []
-    for i in otumtx:
-        row = []
-        for j in otumtx:
-            gain = 0
-            for i_val, j_val in zip(i, j):
-                if i_val > 0 and j_val == 0:
-                    gain += 1
-            row.append(gain)
-        result.append(row)
-    return array(result)
+    otumtx = asarray(otumtx)
+    observed = (otumtx > 0).astype(int)
+    absent = (otumtx == 0).astype(int)
+    return dot(observed, absent.T)
 
 def binary_dist_chisq(datamtx, strict=True):
     """Calculates binary chi-square dist between rows, returns dist matrix.
@@ -1116,19 +859,7 @@ def binary_dist_sorensen_dice(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    rowsums = datamtx.sum(axis=1)
-    
-    for i in range(numrows):
-        row1 = datamtx[i]
-        for j in range(i):
-            row2 = datamtx[j]
-            bottom = float(rowsums[i] + rowsums[j])
-            cur_d = 0.0
-            if bottom:
-                cur_d = 1-(2*logical_and(row1,row2).sum()/bottom)
-            dists[i][j] = dists[j][i] = cur_d
-    return dists
+    return pairwise_blocked(datamtx, _binary_sorensen_dice_block)
 
 def binary_dist_euclidean(datamtx, strict=True):
     """Calculates binary euclidean distance between rows, returns dist matrix.
@@ -1183,19 +914,7 @@ def binary_dist_hamming(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    rowsums = datamtx.sum(axis=1)
-    
-    for i in range(numrows):
-        first = datamtx[i]
-        a = rowsums[i]
-        for j in range(i):
-            second = datamtx[j]
-            b = rowsums[j]
-            c = float(logical_and(first, second).sum())
-            dist = a + b - (2.0*c)
-            dists[i][j] = dists[j][i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _binary_hamming_block)
     
 def binary_dist_jaccard(datamtx, strict=True):
     """Calculates jaccard distance between rows, returns distance matrix.
@@ -1241,22 +960,7 @@ def binary_dist_jaccard(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    
-    rowsums = datamtx.sum(axis=1)
-    for i in range(numrows):
-        first = datamtx[i]
-        a = rowsums[i]
-        for j in range(i):
-            second = datamtx[j]
-            b = rowsums[j]
-            c = float(logical_and(first, second).sum())
-            if a==0.0 and b==0.0:
-                dist = 0.0
-            else:
-                dist = 1.0 - (c/(a+b-c))
-            dists[i][j] = dists[j][i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _binary_jaccard_block)
 
 def binary_dist_lennon(datamtx, strict=True):
     """Calculates lennon distance between rows, returns distance matrix.
@@ -1302,24 +1006,7 @@ def binary_dist_lennon(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    
-    rowsums = datamtx.sum(axis=1)
-    for i in range(numrows):
-        first = datamtx[i]
-        a = rowsums[i]
-        for j in range(i):
-            second = datamtx[j]
-            b = rowsums[j]
-            c = float(logical_and(first, second).sum())
-            if a==0.0 and b==0.0:
-                dist = 0.0
-            elif c==0.0:
-                dist = 1.0
-            else:
-                dist = 1.0 - (c/(c + min([a-c,b-c])))
-            dists[i][j] = dists[j][i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _binary_lennon_block)
 
 def binary_dist_ochiai(datamtx, strict=True):
     """Calculates ochiai distance btw rows, returning distance matrix.
@@ -1365,24 +1052,7 @@ def binary_dist_ochiai(datamtx, strict=True):
 
     if numrows == 0 or numcols == 0:
         return zeros((0,0),'d')
-    dists = zeros((numrows,numrows),'d')
-    rowsums = datamtx.sum(axis=1)
-    
-    for i in range(numrows):
-        first = datamtx[i]
-        a = rowsums[i]
-        for j in range(i):
-            second = datamtx[j]
-            b = rowsums[j]
-            c = float(logical_and(first, second).sum())
-            if a==0.0 and b==0.0:
-                dist = 0.0
-            elif a==0.0 or b==0.0:
-                dist = 1.0
-            else:
-                dist = 1.0 - (c/sqrt(a*b))
-            dists[i][j] = dists[j][i] = dist
-    return dists
+    return pairwise_blocked(datamtx, _binary_ochiai_block)
     
 def binary_dist_pearson(datamtx, strict=True):
     """Calculates binary pearson distance between rows, returns distance matrix
@@ -1395,6 +1065,385 @@ def binary_dist_pearson(datamtx, strict=True):
     return dist_pearson(datamtx, strict=True)
 
 
+# Blocked pairwise engine
+#
+# The dist_* functions above compute their distances through
+# pairwise_blocked: the rows of the data are cut into blocks and a block
+# kernel computes the distances between all rows of two blocks with array
+# operations. Only the tiles of the upper triangle are computed, each is
+# written straight into the (square or condensed) result, and tiles can be
+# computed by a pool of threads (see cogent.util.misc.map_threads). A new
+# metric needs only a block kernel: a function of two dense row blocks x and
+# y returning the len(x) by len(y) array of distances between their rows.
+
+MAX_CELLS = 2**16
+
+def _row_block(datamtx, start, end, dtype='d'):
+    """Returns rows start to end of datamtx as a dense array of dtype.
+
+    datamtx may be a numpy array or matrix, a memory-mapped array or a
+    sparse matrix in CSR format (anything whose row slices have toarray).
+    """
+    block = datamtx[start:end]
+    if hasattr(block, 'toarray'):
+        block = block.toarray()
+    return asarray(block, dtype)
+
+def _row_blocks(datamtx, block_size=256, dtype='d'):
+    """Yields successive dense blocks of block_size rows of datamtx"""
+    for start in range(0, datamtx.shape[0], block_size):
+        yield _row_block(datamtx, start, start + block_size, dtype)
+
+def pairwise_blocked(datamtx, kernel, block_size=256, dtype='d',
+        condensed=False, num_threads=None, out=None):
+    """Returns the distances between all rows of datamtx, computed in tiles.
+
+    datamtx: 2D array of samples (rows) by species (cols). May be a numpy
+        matrix, a memory-mapped array or a scipy sparse matrix; only
+        block_size rows at a time are made dense.
+    kernel: f(x, y) returning the array of distances between the rows of the
+        dense row blocks x and y. numpy divide and invalid warnings are
+        ignored while it runs, so 0/0 can be fixed up afterwards.
+    block_size: the number of rows in a block. The temporaries of a tile are
+        a small multiple of block_size**2 values.
+    dtype: type of the blocks and of the result, e.g. 'f' to halve memory.
+    condensed: if True, returns the upper triangle as a vector of length
+        n*(n-1)/2, ordered (0,1), (0,2) ... (1,2) ..., instead of the
+        symmetric n x n matrix.
+    num_threads: number of threads computing tiles (default: number of cpus).
+    out: optional preallocated result (e.g. a numpy.memmap) of the right
+        shape that is filled in and returned.
+    """
+    if hasattr(datamtx, 'tocsr'):
+        datamtx = datamtx.tocsr()
+    numrows = datamtx.shape[0]
+    if condensed:
+        size = (numrows * (numrows - 1) // 2,)
+    else:
+        size = (numrows, numrows)
+    if out is None:
+        out = zeros(size, dtype)
+    elif out.shape != size:
+        raise ValueError("out has shape %s, expected %s" % (out.shape, size))
+    offsets = condensed_offsets(numrows)
+    starts = range(0, numrows, block_size)
+    tiles = [(first, second) for first in starts for second in starts
+        if second >= first]
+
+    def calc_tile(tile):
+        first, second = tile
+        x = _row_block(datamtx, first, first + block_size, dtype)
+        if first == second:
+            y = x
+        else:
+            y = _row_block(datamtx, second, second + block_size, dtype)
+        with errstate(divide='ignore', invalid='ignore'):
+            dists = kernel(x, y)
+        if condensed:
+            end = second + len(y)
+            for i in range(first, minimum(first + len(x), end - 1)):
+                j = max(i + 1, second)
+                start = offsets[i] + j - i - 1
+                out[start:start + end - j] = dists[i - first, j - second:]
+        else:
+            if first == second:
+                fill_diagonal(dists, 0)
+            out[first:first + len(x), second:second + len(y)] = dists
+            out[second:second + len(y), first:first + len(x)] = dists.T
+
+    map_threads(calc_tile, tiles, num_threads)
+    return out
+
+def _pairwise_sums(f, x, y, num_sums=1, max_cells=MAX_CELLS):
+    """Returns num_sums arrays of sums over the columns of f(x_i, y_j).
+
+    f is called with x and y chunks of shape (len(x), 1, k) and (1, len(y), k)
+    and returns a sequence of num_sums arrays of the broadcast shape. Columns
+    that are zero in both x and y are skipped, so f(0, 0) must be 0; chunks
+    hold at most max_cells values.
+    """
+    used = flatnonzero(x.any(0) | y.any(0))
+    result = [zeros((len(x), len(y)), x.dtype) for i in range(num_sums)]
+    step = max(1, max_cells // max(1, len(x) * len(y)))
+    for start in range(0, len(used), step):
+        cols = used[start:start + step]
+        parts = f(x[:, cols][:, newaxis, :], y[:, cols][newaxis, :, :])
+        for total, part in zip(result, parts):
+            total += part.sum(axis=2)
+    return result
+
+def _manhattan_block(x, y):
+    """manhattan distances between the rows of x and y"""
+    return _pairwise_sums(lambda a, b: [abs(a - b)], x, y)[0]
+
+def _sq_euclidean_block(x, y):
+    """squared euclidean distances between the rows of x and y
+
+    Uses |x|^2 + |y|^2 - 2x.y, recomputing directly the pairs whose distance
+    is too small relative to the norms for that to be accurate (e.g.
+    identical rows).
+    """
+    xx = (x * x).sum(axis=1)[:, newaxis]
+    yy = (y * y).sum(axis=1)[newaxis, :]
+    norms = xx + yy
+    result = norms - 2 * dot(x, y.T)
+    close = result <= sqrt(finfo(result.dtype).eps) * norms
+    if close.any():
+        rows, cols = nonzero(close)
+        result[rows, cols] = square(x[rows] - y[cols]).sum(axis=1)
+    return result
+
+def _euclidean_block(x, y):
+    """euclidean distances between the rows of x and y"""
+    return sqrt(_sq_euclidean_block(x, y))
+
+def _fix_empty_rows(dists, x_empty, y_empty):
+    """Sets distances between two empty rows to 0, one empty row to 1"""
+    x_empty = x_empty[:, newaxis]
+    dists[x_empty & y_empty] = 0.0
+    dists[x_empty ^ y_empty] = 1.0
+    return dists
+
+def _scaled_euclidean_block(x, y, scale):
+    """euclidean distances of rows scaled by scale(rows), empty rows fixed"""
+    x_sums, y_sums = x.sum(axis=1), y.sum(axis=1)
+    dists = _euclidean_block(scale(x, x_sums), scale(y, y_sums))
+    return _fix_empty_rows(dists, x_sums == 0, y_sums == 0)
+
+def _bray_curtis_block(x, y):
+    """bray curtis distances between the rows of x and y"""
+    sums = x.sum(axis=1)[:, newaxis] + y.sum(axis=1)
+    return where(sums > 0, _manhattan_block(x, y) / sums, 0.0)
+
+def _bray_curtis_magurran_block(x, y):
+    """bray curtis (magurran) distances between the rows of x and y"""
+    sums = x.sum(axis=1)[:, newaxis] + y.sum(axis=1)
+    #2*sum(min(a_i, b_i)) = sum(a_i + b_i) - sum(abs(a_i - b_i))
+    return where(sums == 0, 0.0, _manhattan_block(x, y) / sums)
+
+def _canberra_terms(a, b):
+    """canberra terms of a and b, and whether they are nonzero"""
+    terms = nan_to_num(abs(a - b) / (a + b))
+    return [terms, terms != 0]
+
+def _canberra_block(x, y):
+    """canberra distances between the rows of x and y"""
+    total, count = _pairwise_sums(_canberra_terms, x, y, 2)
+    return nan_to_num(total / count)
+
+def _chord_block(x, y):
+    """chord distances between the rows of x and y"""
+    x_norms = sqrt((x * x).sum(axis=1))
+    y_norms = sqrt((y * y).sum(axis=1))
+    dists = _euclidean_block(x / x_norms[:, newaxis], y / y_norms[:, newaxis])
+    return _fix_empty_rows(dists, x_norms == 0, y_norms == 0)
+
+def _hellinger_block(x, y):
+    """hellinger distances between the rows of x and y"""
+    return _scaled_euclidean_block(x, y,
+        lambda rows, sums: sqrt(rows / sums[:, newaxis]))
+
+def _specprof_block(x, y):
+    """species profile distances between the rows of x and y"""
+    return _scaled_euclidean_block(x, y,
+        lambda rows, sums: rows / sums[:, newaxis])
+
+def _kulczynski_block(x, y):
+    """kulczynski distances between the rows of x and y"""
+    x_sums = x.sum(axis=1)[:, newaxis]
+    y_sums = y.sum(axis=1)[newaxis, :]
+    min_sums = (x_sums + y_sums - _manhattan_block(x, y)) / 2.0
+    dists = 1.0 - (min_sums / x_sums + min_sums / y_sums) / 2.0
+    return _fix_empty_rows(dists, x_sums[:, 0] == 0, y_sums[0] == 0)
+
+def _abund_jaccard_block(x, y):
+    """abundance based jaccard distances between the rows of x and y"""
+    x_sums = x.sum(axis=1)[:, newaxis]
+    y_sums = y.sum(axis=1)[newaxis, :]
+    #relative abundances in each row of the species present in the other
+    u = dot(x, (y != 0).T.astype(x.dtype)) / x_sums
+    v = dot((x != 0).astype(y.dtype), y.T) / y_sums
+    dists = where((u == 0) & (v == 0), 1.0, 1.0 - u * v / (u + v - u * v))
+    return _fix_empty_rows(dists, x_sums[:, 0] == 0, y_sums[0] == 0)
+
+def _morisita_horn_block(x, y):
+    """morisita-horn distances between the rows of x and y"""
+    x_sums, y_sums = x.sum(axis=1), y.sum(axis=1)
+    x_ds = nan_to_num((x * x).sum(axis=1) / x_sums**2)
+    y_ds = nan_to_num((y * y).sum(axis=1) / y_sums**2)
+    dists = 1 - 2 * dot(x, y.T) / ((x_ds[:, newaxis] + y_ds) *
+        x_sums[:, newaxis] * y_sums)
+    return _fix_empty_rows(dists, x_sums == 0, y_sums == 0)
+
+def _pearson_block(x, y):
+    """pearson distances (1 - r) between the rows of x and y"""
+    x_devs = x - x.mean(axis=1)[:, newaxis]
+    y_devs = y - y.mean(axis=1)[:, newaxis]
+    x_sq, y_sq = (x_devs**2).sum(axis=1), (y_devs**2).sum(axis=1)
+    r = dot(x_devs, y_devs.T) / sqrt(x_sq[:, newaxis] * y_sq)
+    #flat rows have r 1 with each other and 0 with other rows
+    return _fix_empty_rows(1.0 - r, x_sq == 0, y_sq == 0)
+
+def _soergel_block(x, y):
+    """soergel distances between the rows of x and y"""
+    differences = _manhattan_block(x, y)
+    #sum(max(a_i, b_i)) = (sum(a_i + b_i) + sum(abs(a_i - b_i))) / 2
+    max_sums = (x.sum(axis=1)[:, newaxis] + y.sum(axis=1) + differences) / 2
+    return where(max_sums <= 0, 0.0, differences / max_sums)
+
+def _rank_rows(x):
+    """Returns the ranks within each row of x, ties averaged as _rankdata"""
+    result = empty(x.shape, x.dtype)
+    for i, row in enumerate(x):
+        ordered = sort(row)
+        result[i] = (searchsorted(ordered, row, 'left') +
+            searchsorted(ordered, row, 'right') + 1) / 2.0
+    return result
+
+def _spearman_approx_block(x, y):
+    """approximate spearman rank distances between the rows of x and y"""
+    numcols = x.shape[1]
+    if numcols < 2:
+        return zeros((len(x), len(y)), x.dtype)
+    return 6 * _sq_euclidean_block(_rank_rows(x), _rank_rows(y)) / \
+        float(numcols * (numcols**2 - 1))
+
+def _binary_counts(x, y):
+    """Returns species in each row of x, of y, and shared by each pair"""
+    x, y = (x != 0).astype(x.dtype), (y != 0).astype(y.dtype)
+    return x.sum(axis=1)[:, newaxis], y.sum(axis=1)[newaxis, :], dot(x, y.T)
+
+def _binary_hamming_block(x, y):
+    """hamming distances between the rows of x and y"""
+    a, b, c = _binary_counts(x, y)
+    return a + b - 2 * c
+
+def _binary_jaccard_block(x, y):
+    """jaccard distances between the rows of x and y"""
+    a, b, c = _binary_counts(x, y)
+    return where((a == 0) & (b == 0), 0.0, 1.0 - c / (a + b - c))
+
+def _binary_lennon_block(x, y):
+    """lennon distances between the rows of x and y"""
+    a, b, c = _binary_counts(x, y)
+    dists = where(c == 0, 1.0, 1.0 - c / (c + minimum(a - c, b - c)))
+    return where((a == 0) & (b == 0), 0.0, dists)
+
+def _binary_ochiai_block(x, y):
+    """ochiai distances between the rows of x and y"""
+    a, b, c = _binary_counts(x, y)
+    dists = 1.0 - c / sqrt(a * b)
+    return _fix_empty_rows(dists, a[:, 0] == 0, b[0] == 0)
+
+def _binary_sorensen_dice_block(x, y):
+    """sorensen-dice distances between the rows of x and y"""
+    a, b, c = _binary_counts(x, y)
+    return where(a + b == 0, 0.0, 1.0 - 2 * c / (a + b))
+
+def _binary(kernel):
+    """Returns a block kernel applying kernel to presence/absence data"""
+    def binary_kernel(x, y):
+        return kernel((x != 0).astype(x.dtype), (y != 0).astype(y.dtype))
+    return binary_kernel
+
+def _gower_kernel(datamtx, block_size=256):
+    """Returns a gower block kernel for the column ranges of datamtx"""
+    col_min = col_max = None
+    for block in _row_blocks(datamtx, block_size):
+        if col_min is None:
+            col_min, col_max = block.min(axis=0), block.max(axis=0)
+        else:
+            col_min = minimum(col_min, block.min(axis=0))
+            col_max = maximum(col_max, block.max(axis=0))
+    col_diffs = col_max - col_min
+    col_diffs[col_diffs == 0] = 1.0 # numerator will be zero anyway
+    def gower_kernel(x, y):
+        return _manhattan_block(x / col_diffs.astype(x.dtype),
+            y / col_diffs.astype(y.dtype))
+    return gower_kernel
+
+def _chisq_kernel(datamtx, block_size=256, binary=False):
+    """Returns a chi square block kernel for the column sums of datamtx"""
+    col_sums = 0
+    for block in _row_blocks(datamtx, block_size):
+        if binary:
+            block = (block != 0).astype(float)
+        col_sums = col_sums + block.sum(axis=0)
+    sqrt_grand_sum = sqrt(sum(col_sums))
+    col_sums = where(col_sums == 0, 1.0, col_sums)
+    col_weights = sqrt_grand_sum / sqrt(col_sums)
+    def chisq_kernel(x, y):
+        if binary:
+            x, y = (x != 0).astype(x.dtype), (y != 0).astype(y.dtype)
+        return _scaled_euclidean_block(x, y,
+            lambda rows, sums: rows / sums[:, newaxis] * col_weights)
+    return chisq_kernel
+
+BLOCK_KERNELS = {
+    'abund_jaccard': _abund_jaccard_block,
+    'bray_curtis': _bray_curtis_block,
+    'bray_curtis_faith': _bray_curtis_block,
+    'bray_curtis_magurran': _bray_curtis_magurran_block,
+    'canberra': _canberra_block,
+    'chord': _chord_block,
+    'euclidean': _euclidean_block,
+    'hellinger': _hellinger_block,
+    'kulczynski': _kulczynski_block,
+    'manhattan': _manhattan_block,
+    'morisita_horn': _morisita_horn_block,
+    'pearson': _pearson_block,
+    'soergel': _soergel_block,
+    'spearman_approx': _spearman_approx_block,
+    'specprof': _specprof_block,
+    'binary_chord': _binary(_chord_block),
+    'binary_euclidean': _binary(_euclidean_block),
+    'binary_hamming': _binary_hamming_block,
+    'binary_jaccard': _binary_jaccard_block,
+    'binary_lennon': _binary_lennon_block,
+    'binary_ochiai': _binary_ochiai_block,
+    'binary_pearson': _binary(_pearson_block),
+    'binary_sorensen_dice': _binary_sorensen_dice_block,
+    }
+
+# kernels of metrics that depend on the whole table, built by f(datamtx)
+TABLE_KERNELS = {
+    'chisq': _chisq_kernel,
+    'gower': _gower_kernel,
+    'binary_chisq': lambda datamtx, block_size=256: _chisq_kernel(datamtx,
+        block_size, binary=True),
+    }
+
+def make_block_kernel(metric, datamtx=None, block_size=256):
+    """Returns the block kernel of metric, a key of BLOCK_KERNELS or
+    TABLE_KERNELS; the latter need the whole datamtx.
+    """
+    if metric in TABLE_KERNELS:
+        if datamtx is None:
+            raise ValueError("metric %s needs the data matrix" % metric)
+        if hasattr(datamtx, 'tocsr'):
+            datamtx = datamtx.tocsr()
+        return TABLE_KERNELS[metric](datamtx, block_size)
+    try:
+        return BLOCK_KERNELS[metric]
+    except KeyError:
+        raise ValueError("no block kernel for metric %s" % metric)
+
+def dist_blocked(datamtx, metric='bray_curtis', block_size=256, dtype='d',
+        condensed=False, num_threads=None, out=None):
+    """Returns the metric distances between all rows of datamtx.
+
+    metric: name of a metric in BLOCK_KERNELS or TABLE_KERNELS, or a block
+        kernel f(x, y) (see pairwise_blocked).
+    The other arguments are those of pairwise_blocked. Results are the same
+    as those of the corresponding dist_* functions, but no checks are made
+    on the input, which may be sparse.
+    """
+    if isinstance(metric, basestring):
+        metric = make_block_kernel(metric, datamtx, block_size)
+    return pairwise_blocked(datamtx, metric, block_size, dtype, condensed,
+        num_threads, out)
+
+
 if __name__ == "__main__":
     """ just a test run"""
     matrix1 = array(    [   [10,8,4,1],
@@ -774,10 +774,14 @@ def fmin_bfgs(f, x0, fprime=None, args=(), gtol=1e-5, norm=Inf,
         if isinf(rhok): # this is patch for numpy
             rhok = 1000.0
             print "Divide-by-zero encountered: rhok assumed large"
-        A1 = I - sk[:,numpy.newaxis] * yk[numpy.newaxis,:] * rhok
-        A2 = I - yk[:,numpy.newaxis] * sk[numpy.newaxis,:] * rhok
-        Hk = numpy.dot(A1,numpy.dot(Hk,A2)) + rhok * sk[:,numpy.newaxis] \
-                 * sk[numpy.newaxis,:]
+        # (I - rhok*sk*yk') Hk (I - rhok*yk*sk') + rhok*sk*sk', expanded
+        # into rank one updates so that it takes O(N**2), not O(N**3)
+        Hkyk = numpy.dot(Hk, yk)
+        ykHk = numpy.dot(yk, Hk)
+        Hk = Hk - rhok * (sk[:,numpy.newaxis] * ykHk[numpy.newaxis,:] + \
+                Hkyk[:,numpy.newaxis] * sk[numpy.newaxis,:]) + \
+                (rhok * rhok * numpy.dot(yk, Hkyk) + rhok) * \
+                sk[:,numpy.newaxis] * sk[numpy.newaxis,:]
 
     if disp or full_output:
         fval = old_fval
@@ -1,9 +1,21 @@
 #!/usr/bin/env python
-from numpy import concatenate, repeat, array, zeros, histogram, arange, uint, zeros
-from numpy.random import permutation, randint, sample, multinomial
+from numpy import concatenate, repeat, array, zeros, histogram, arange, uint, \
+    zeros, asarray, empty, minimum, bincount, log, errstate, nan, newaxis
+from numpy.random import permutation, randint, sample, multinomial, \
+    RandomState
+import numpy.random
 from random import Random, _ceil, _log
+from cogent.util import parallel
 
-"""Given array of objects (counts or indices), perform rarefaction analyses."""
+"""Given array of objects (counts or indices), perform rarefaction analyses.
+
+subsample_table and batch_rarefaction rarefy a whole samples by OTUs table
+at once. A sample of size n from the counts of a group of OTUs is split
+between the two halves of the group by one hypergeometric (or, sampling
+with replacement, binomial) draw, so halving the groups from all OTUs down
+to single OTUs samples every row of the table with log2(#OTUs) vectorised
+draws and no loop over the individual observations.
+"""
 
 __author__ = "Sandra Smit"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -89,13 +101,7 @@ def subsample(counts, n):
     """
     if counts.sum() <= n:
         return counts
-    nz = counts.nonzero()[0]
-    unpacked = concatenate([repeat(array(i,), counts[i]) for i in nz])
-    permuted = permutation(unpacked)[:n]
-    result = zeros(len(counts))
-    for p in permuted:
-        result[p] += 1
-    return result
+    return subsample_table(asarray(counts)[newaxis], n)[0].astype(float)
 
 def subsample_freq_dist_nonzero(counts, n, dtype=uint):
     """Subsamples new vector from vector of orig items.
@@ -206,10 +212,7 @@ def rarefaction(data, start=0, stop=None, stride=1, histogram_f=None, \
         stride = 1  #avoid zero or None as stride
     max_val=indices.max() 
     if histogram_f is None:
-        if stride < 100:
-            histogram_f = naive_histogram
-        else:
-            histogram_f = wrap_numpy_histogram(max_val)
+        histogram_f = lambda vals, max_val: bincount(vals, minlength=max_val+1)
     permuted = permutation_f(indices)
     result = zeros(max_val+1, dtype=int)
     while start < stop:
@@ -218,3 +221,183 @@ def rarefaction(data, start=0, stop=None, stride=1, histogram_f=None, \
         yield result
         start += stride
 
+def _group_totals(table):
+    """Returns the totals of the OTU groups that subsample_table splits.
+
+    Element k of the result is an array holding, for each row of table, the
+    totals of the 2**k groups of OTUs at depth k of a binary tree over the
+    columns (padded to a power of two), so the first holds the row totals
+    and the last the counts.
+    """
+    num_rows, num_cols = table.shape
+    width = 1
+    while width < num_cols:
+        width *= 2
+    totals = zeros((num_rows, width), int)
+    totals[:, :num_cols] = table
+    levels = [totals]
+    while totals.shape[1] > 1:
+        totals = totals[:, ::2] + totals[:, 1::2]
+        levels.append(totals)
+    return levels[::-1]
+
+def _split_draws(random, good, bad, num, replace):
+    """Returns how many of num draws from good + bad items are good"""
+    result = zeros(num.shape, int)
+    todo = (num > 0) & (good > 0)
+    if replace:
+        result[todo] = random.binomial(num[todo],
+            good[todo] / (good[todo] + bad[todo]).astype(float))
+    else:
+        all_good = todo & (bad == 0)
+        result[all_good] = num[all_good]
+        everything = todo & (num == good + bad)
+        result[everything] = good[everything]
+        todo &= (bad > 0) & (num < good + bad)
+        result[todo] = random.hypergeometric(good[todo], bad[todo],
+            num[todo])
+    return result
+
+def subsample_table(table, n, replace=False, random_state=None, rows=None):
+    """Subsamples each row of a samples by OTUs table of counts to n items.
+
+    table: 2D array of counts, one row per sample
+    n: the number of items to sample from each row, or an array of one
+        number per row
+    replace: whether to sample with replacement (multinomial) rather than
+        without (hypergeometric)
+    random_state: numpy RandomState to draw from (default numpy.random)
+    rows: sample the table rows with these indices, which may repeat, to
+        rarefy many copies of the same sample at once (default all rows)
+
+    Returns an int array with a row for each of rows. As with subsample,
+    rows with n or fewer items are returned unchanged.
+    """
+    if random_state is None:
+        random_state = numpy.random
+    table = asarray(table)
+    levels = _group_totals(table)
+    if rows is not None:
+        levels = [totals[rows] for totals in levels]
+    row_totals = levels[0][:, 0]
+    draws = minimum(n, row_totals)[:, newaxis]
+    for totals in levels[1:]:
+        good = totals[:, ::2]
+        left = _split_draws(random_state, good, totals[:, 1::2], draws,
+            replace)
+        split = empty(totals.shape, int)
+        split[:, ::2] = left
+        split[:, 1::2] = draws - left
+        draws = split
+    result = draws[:, :table.shape[1]]
+    if replace:
+        unchanged = row_totals <= n
+        result[unchanged] = levels[-1][unchanged, :table.shape[1]]
+    return result
+
+def _table_metrics():
+    """Returns dict of alpha diversity functions to row by row versions.
+
+    alpha_diversity imports this module, so it is imported here.
+    """
+    from cogent.maths.stats import alpha_diversity as alpha
+
+    def freqs(table):
+        return table / table.sum(axis=1).astype(float)[:, newaxis]
+
+    def dominance(table):
+        f = freqs(table)
+        return (f*f).sum(axis=1)
+
+    def shannon(table):
+        f = freqs(table)
+        with errstate(divide='ignore', invalid='ignore'):
+            logs = log(f)
+        logs[f == 0] = 0
+        return -(f*logs).sum(axis=1)/log(2)
+
+    def chao1(table):
+        observed = (table != 0).sum(axis=1)
+        singles = (table == 1).sum(axis=1)
+        doubles = (table == 2).sum(axis=1)
+        return observed + singles*(singles-1) / (2.0*(doubles+1))
+
+    return {alpha.observed_species: lambda table: (table != 0).sum(axis=1),
+        alpha.singles: lambda table: (table == 1).sum(axis=1),
+        alpha.doubles: lambda table: (table == 2).sum(axis=1),
+        alpha.dominance: dominance,
+        alpha.simpson: lambda table: 1 - dominance(table),
+        alpha.shannon: shannon,
+        alpha.chao1: chao1,
+        alpha.berger_parker_d: lambda table:
+            table.max(axis=1) / table.sum(axis=1).astype(float)}
+
+def batch_rarefaction(table, depths, num_iters=10, metrics=None,
+    replace=False, batch_size=10, seed=None):
+    """Returns alpha diversity of a table rarefied many times to each depth.
+
+    table: 2D array of counts, one row per sample
+    depths: the numbers of items to subsample each sample to
+    num_iters: the number of subsamples at each depth
+    metrics: functions of a vector of counts giving alpha diversity, such
+        as those in cogent.maths.stats.alpha_diversity (default
+        observed_species). observed_species, singles, doubles, dominance,
+        simpson, shannon, chao1 and berger_parker_d, with their default
+        arguments, are computed for all rows of a rarefied table at once;
+        other functions are applied to each row.
+    replace: whether to subsample with replacement
+    batch_size: the number of iterations rarefied together
+    seed: the iterations of depth k in batch b are drawn from a
+        RandomState seeded with (seed, k, b), and the batches are spread
+        over the CPUs of the current parallel context. If seed is None it
+        is drawn from numpy.random. The results depend on seed, but not on
+        the number of CPUs.
+
+    Returns a dict from metric function names to arrays of shape
+    (len(depths), num_iters, number of samples). Samples with fewer items
+    than a depth are not rarefied to it and their values are nan.
+    """
+    table = asarray(table)
+    if metrics is None:
+        from cogent.maths.stats.alpha_diversity import observed_species
+        metrics = [observed_species]
+    if seed is None:
+        seed = randint(2**31)
+    table_metrics = _table_metrics()
+    row_totals = table.sum(axis=1)
+    num_samples = len(table)
+    sizes = [min(batch_size, num_iters - start) for start in
+        range(0, num_iters, batch_size)]
+    tasks = [(depth_index, batch_index) for depth_index in
+        range(len(depths)) for batch_index in range(len(sizes))]
+
+    def calc_batch(task):
+        depth_index, batch_index = task
+        depth = depths[depth_index]
+        size = sizes[batch_index]
+        random_state = RandomState([seed, depth_index, batch_index])
+        samples = (row_totals >= depth).nonzero()[0]
+        rows = repeat(samples[newaxis], size, axis=0).ravel()
+        rarefied = subsample_table(table, depth, replace, random_state, rows)
+        results = []
+        for metric in metrics:
+            if metric in table_metrics:
+                values = table_metrics[metric](rarefied)
+            else:
+                values = array([metric(row) for row in rarefied])
+            result = empty((size, num_samples), float)
+            result.fill(nan)
+            result[:, samples] = values.reshape(size, len(samples))
+            results.append(result)
+        return results
+
+    shape = (len(depths), num_iters, num_samples)
+    result = dict((metric.__name__, empty(shape, float)) for metric in
+        metrics)
+    for (depth_index, batch_index), batch in zip(tasks,
+            parallel.imap(calc_batch, tasks)):
+        start = sum(sizes[:batch_index])
+        for metric, values in zip(metrics, batch):
+            result[metric.__name__][depth_index,
+                start:start+len(values)] = values
+    return result
@@ -3,8 +3,11 @@
 
 from numpy import (logical_and, logical_or, sum, take, nonzero, repeat, 
     array, concatenate, zeros, put, transpose, flatnonzero, newaxis,
-    logical_xor, logical_not)
+    logical_xor, logical_not, dot, tensordot, errstate, fill_diagonal,
+    asarray, ones, arange, diff, cumsum, bincount, lexsort, unique, union1d,
+    searchsorted, tril)
 from numpy.random import permutation
+from cogent.util.misc import map_threads
 from cogent.core.tree import PhyloNode
 
 __author__ = "Rob Knight and Micah Hamady"
@@ -282,6 +285,40 @@ def fitch_descendants(bound_indices, counter=FitchCounter):
     traverse_reduce(bound_indices, f.__call__)
     return f.Changes
 
+class FitchCounterBatch(object):
+    """Returns parsimony results for several copies of the states at once.
+
+    The columns of the array are num_copies consecutive groups of envs, e.g.
+    from permute_selected_rows_batch, and Changes counts the changes of each
+    group separately. Each group gets the same result as FitchCounter.
+    """
+    def __init__(self, num_copies):
+        """Returns new FitchCounterBatch, with Changes = 0 for each copy."""
+        self.Changes = zeros(num_copies, int)
+
+    def __call__(self, a, ignored):
+        """Returns intersection(a), or, if empty, union(a), for each copy."""
+        states = a.reshape(a.shape[0], len(self.Changes), -1) != 0
+        nonempty = states.any(2)
+        has_states = nonempty.any(0)
+        #children without states don't take part in the intersection
+        result = logical_or(states, logical_not(nonempty)[:,:,newaxis]).all(0)
+        result &= has_states[:,newaxis]
+        changed = has_states & logical_not(result.any(1))
+        result[changed] = states[:,changed].any(0)
+        self.Changes += changed
+        return result.ravel()
+
+def fitch_descendants_batch(bound_indices, num_copies):
+    """Sets internal nodes to Fitch assignments, returns changes per copy.
+
+    As fitch_descendants with FitchCounter, for an array holding num_copies
+    groups of env columns side by side.
+    """
+    f = FitchCounterBatch(num_copies)
+    traverse_reduce(bound_indices, f.__call__)
+    return f.Changes
+
 def tip_distances(a, bound_indices, tip_indices):
     """Sets each tip to its distance from the root."""
     for i, s in bound_indices:
@@ -304,6 +341,22 @@ def permute_selected_rows(rows, orig, new, permutation_f=permutation):
     for r, s in zip(rows, shuffled):
         new[s] = orig[r]
 
+def permute_selected_rows_batch(rows, orig, permutations):
+    """Returns copies of orig with the selected rows in permuted orders.
+
+    The result has the columns of one copy of orig for each permutation, side
+    by side: copy k is zero except that, as in permute_selected_rows, 
+    orig[rows[i]] is moved to rows[permutations[k][i]]. Propagating the 
+    result through the tree then handles all the permutations in one pass.
+    """
+    rows = asarray(rows)
+    num_copies = len(permutations)
+    result = zeros((orig.shape[0], num_copies, orig.shape[1]), orig.dtype)
+    if num_copies:
+        targets = take(rows, asarray(permutations))
+        result[targets, arange(num_copies)[:,newaxis]] = orig[rows]
+    return result.reshape(orig.shape[0], num_copies*orig.shape[1])
+
 def prep_items_for_jackknife(col):
     """Takes column of a, returns vector with multicopy states unpacked.
     
@@ -463,6 +516,22 @@ def unifrac_one_sample(one_sample_idx, branch_lengths, m, metric=unifrac):
         j in range(num_cols)],'float')
     return result
 
+def env_unique_fraction_batch(branch_lengths, m, num_copies):
+    """Calculates env_unique_fraction for each copy of the envs in m.
+
+    m holds num_copies groups of env columns side by side, e.g. from 
+    permute_selected_rows_batch. Returns unique branch lengths and unique
+    fractions as num_copies x envs arrays.
+    """
+    total_bl = branch_lengths.sum()
+    if total_bl <= 0:
+        raise ValueError, "total branch length in tree must be > 0"
+    m = m.reshape(m.shape[0], num_copies, -1)
+    col_sum = m.sum(2)
+    sing = (m == col_sum[:,:,newaxis]) & (m != 0)
+    env_bl_sums = tensordot(branch_lengths, sing, axes=(0,0))
+    return env_bl_sums, env_bl_sums/total_bl
+
 def env_unique_fraction(branch_lengths, m):
     """ Calculates unique branch length for each env. 
 
@@ -617,3 +686,530 @@ def weighted_unifrac_vector(branch_lengths, m, tip_indices, bl_correct=False,
             rest_col, i_sum, rest_sum)
         result.append(curr)
     return array(result)
+
+def _sample_blocks(num_cols, block_size):
+    """Returns list of (start, end) column ranges of at most block_size."""
+    block_size = max(int(block_size), 1)
+    return [(start, min(start+block_size, num_cols)) for start in \
+        range(0, num_cols, block_size)]
+
+def _unifrac_block(shared, first_pd, second_pd, total):
+    """unifrac from shared branch length and PD of each column in a block"""
+    return 1 - shared/(first_pd + second_pd - shared)
+
+def _unnormalized_unifrac_block(shared, first_pd, second_pd, total):
+    """unnormalized_unifrac from shared branch length and PD of each column"""
+    return (first_pd + second_pd - 2*shared)/total
+
+def _G_block(shared, first_pd, second_pd, total):
+    """G from shared branch length and PD of each column in a block"""
+    return (first_pd - shared)/(first_pd + second_pd - shared)
+
+def _unnormalized_G_block(shared, first_pd, second_pd, total):
+    """unnormalized_G from shared branch length and PD of each column"""
+    return (first_pd - shared)/total
+
+#metrics that unifrac_matrix_blocked computes from matrix products
+BLOCK_METRICS = {unifrac:_unifrac_block,
+    unnormalized_unifrac:_unnormalized_unifrac_block,
+    G:_G_block,
+    unnormalized_G:_unnormalized_G_block,
+}
+
+def _block_rows(m, nonzero_bl, first, second):
+    """Returns rows of m that can contribute to a pair of column blocks.
+
+    nonzero_bl is True for the rows with nonzero branch length. For 
+    SparseColumns only those of these rows that are nonzero in either block
+    are returned.
+    """
+    if isinstance(m, SparseColumns):
+        rows = union1d(m.rowsUsed(*first), m.rowsUsed(*second))
+        return rows[nonzero_bl[rows]]
+    return flatnonzero(nonzero_bl)
+
+def _index_mask(indices, length):
+    """Returns boolean array of length that is True at indices."""
+    result = zeros(length, bool)
+    result[indices] = True
+    return result
+
+def _column_block(m, start, end, rows):
+    """Returns dense array of the given rows of columns start to end of m."""
+    if isinstance(m, SparseColumns):
+        return m.toarray(start, end, rows)
+    return take(m[:,start:end], rows, axis=0)
+
+class UnifracBlockKernel(object):
+    """Computes an unweighted metric between two blocks of columns of m.
+
+    m is the (nodes x envs) array after bool_descendants, or SparseColumns
+    after bool_descendants_sparse. The branch length shared by each pair of
+    columns is (m_i.T * branch_lengths) . m_j on the boolean states, from 
+    which the union, xor, etc. needed by the metric follow. Only the rows
+    with nonzero branch length, and for SparseColumns only the rows used by
+    the two blocks, are made dense.
+    """
+    def __init__(self, branch_lengths, m, metric=unifrac):
+        """Returns new UnifracBlockKernel; metric must be in BLOCK_METRICS."""
+        try:
+            self.BlockMetric = BLOCK_METRICS[metric]
+        except KeyError:
+            raise ValueError, "No block kernel for metric %s" % metric
+        self.m = m
+        #branches of zero length can't contribute to any sum
+        self.NonzeroBl = branch_lengths != 0
+        self.BranchLengths = branch_lengths.astype(float)
+        if isinstance(m, SparseColumns):
+            self.PDs = m.columnSums(self.BranchLengths, as_bool=True)
+        else:
+            keep = flatnonzero(self.NonzeroBl)
+            self.PDs = dot(take(self.BranchLengths, keep), 
+                take(m, keep, axis=0) != 0)
+        self.Total = self.BranchLengths.sum()
+
+    def __call__(self, first, second):
+        """Returns metric for columns first[0]:first[1] vs second[0]:second[1]
+        """
+        (i_start, i_end), (j_start, j_end) = first, second
+        m = self.m
+        rows = _block_rows(m, self.NonzeroBl, first, second)
+        first = _column_block(m, i_start, i_end, rows) != 0
+        second = _column_block(m, j_start, j_end, rows) != 0
+        bl = take(self.BranchLengths, rows)
+        shared = dot((first*bl[:,newaxis]).T, second.astype(float))
+        with errstate(divide='ignore', invalid='ignore'):
+            return self.BlockMetric(shared, self.PDs[i_start:i_end,newaxis],
+                self.PDs[newaxis,j_start:j_end], self.Total)
+
+
+class WeightedUnifracBlockKernel(object):
+    """Computes weighted UniFrac between two blocks of columns of m.
+
+    m is the (nodes x envs) array after sum_descendants, or SparseColumns
+    after sum_descendants_sparse. The branch length weighted L1 distance 
+    between the relative abundances of the two blocks is computed as one 
+    array operation, over at most max_cells (rows x columns x columns) 
+    temporary cells at a time.
+    """
+    def __init__(self, branch_lengths, m, tip_indices, bl_correct=False,
+        tip_distances=None, max_cells=2**18):
+        """Returns new WeightedUnifracBlockKernel.
+
+        Parameters as for weighted_unifrac_matrix with the default unifrac_f.
+        """
+        self.m = m
+        self.NonzeroBl = branch_lengths != 0
+        self.BranchLengths = branch_lengths.astype(float)
+        self.MaxCells = max_cells
+        if isinstance(m, SparseColumns):
+            is_tip = _index_mask(tip_indices, m.shape[0]).astype(float)
+            self.Sums = m.columnSums(is_tip)
+            if bl_correct:
+                corrections = m.columnSums(tip_distances.ravel())
+        else:
+            self.Sums = take(m, tip_indices, axis=0).sum(0).astype(float)
+            if bl_correct:
+                corrections = (tip_distances.ravel()[:,newaxis]*m).sum(0)
+        self.Corrections = None
+        if bl_correct:
+            with errstate(divide='ignore', invalid='ignore'):
+                self.Corrections = corrections/self.Sums
+
+    def __call__(self, first, second):
+        """Returns weighted UniFrac for columns first[0]:first[1] against
+        columns second[0]:second[1].
+        """
+        (i_start, i_end), (j_start, j_end) = first, second
+        m, sums = self.m, self.Sums
+        rows = _block_rows(m, self.NonzeroBl, first, second)
+        bl = take(self.BranchLengths, rows)
+        with errstate(divide='ignore', invalid='ignore'):
+            first = _column_block(m, i_start, i_end, rows)/ \
+                sums[i_start:i_end]
+            second = _column_block(m, j_start, j_end, rows)/ \
+                sums[j_start:j_end]
+        first, second = first[:,:,newaxis], second[:,newaxis,:]
+        num_rows = max(self.MaxCells // first.shape[1] // second.shape[2], 1)
+        result = zeros((i_end-i_start, j_end-j_start), float)
+        for start in range(0, len(bl), num_rows):
+            end = start + num_rows
+            diffs = abs(first[start:end] - second[start:end])
+            result += tensordot(bl[start:end], diffs, axes=(0,0))
+        if self.Corrections is not None:
+            with errstate(divide='ignore', invalid='ignore'):
+                result /= self.Corrections[i_start:i_end,newaxis] + \
+                    self.Corrections[newaxis,j_start:j_end]
+        return result
+
+
+def _blocked_matrix(kernel, num_cols, block_size, is_symmetric, num_threads):
+    """Returns num_cols x num_cols matrix from kernel applied to blocks."""
+    result = zeros((num_cols,num_cols), float)
+    blocks = _sample_blocks(num_cols, block_size)
+    if is_symmetric:
+        tasks = [(i, j) for i in blocks for j in blocks if j[0] <= i[0]]
+    else:
+        tasks = [(i, j) for i in blocks for j in blocks]
+
+    def calc_block(task):
+        (i_start, i_end), (j_start, j_end) = task
+        curr = kernel(*task)
+        if is_symmetric and i_start == j_start:
+            #like unifrac_matrix, keep metric(i,j) for i > j and mirror it
+            curr = tril(curr, -1)
+            curr = curr + curr.T
+        result[i_start:i_end, j_start:j_end] = curr
+        if is_symmetric:
+            result[j_start:j_end, i_start:i_end] = curr.T
+
+    map_threads(calc_block, tasks, num_threads)
+    if is_symmetric:
+        #the pairwise functions don't calculate the diagonal
+        fill_diagonal(result, 0)
+    return result
+
+def unifrac_matrix_blocked(branch_lengths, m, metric=unifrac, 
+    is_symmetric=True, block_size=256, num_threads=None):
+    """Calculates unifrac(i,j) for all i,j in m using matrix products.
+
+    Parameters and result as for unifrac_matrix, but metric must be one of
+    BLOCK_METRICS, and m may be SparseColumns. Blocks of block_size columns 
+    are compared at a time by UnifracBlockKernel, spread over num_threads
+    threads (default: the number of cpus).
+    """
+    kernel = UnifracBlockKernel(branch_lengths, m, metric)
+    return _blocked_matrix(kernel, m.shape[-1], block_size, is_symmetric,
+        num_threads)
+
+def weighted_unifrac_matrix_blocked(branch_lengths, m, tip_indices, 
+    bl_correct=False, tip_distances=None, block_size=64, num_threads=None,
+    max_cells=2**18):
+    """Calculates weighted_unifrac(i,j) for all i,j in m, blockwise.
+
+    Parameters and result as for weighted_unifrac_matrix with the default
+    unifrac_f, but m may be SparseColumns. Blocks of block_size columns are
+    compared at a time by WeightedUnifracBlockKernel, spread over 
+    num_threads threads (default: the number of cpus).
+    """
+    kernel = WeightedUnifracBlockKernel(branch_lengths, m, tip_indices,
+        bl_correct, tip_distances, max_cells)
+    return _blocked_matrix(kernel, m.shape[-1], block_size, True, 
+        num_threads)
+
+class SparseColumns(object):
+    """Mostly zero 2D array stored by column, as in the CSC format.
+
+    The nonzero rows of column i are Indices[IndPtr[i]:IndPtr[i+1]], in 
+    increasing order, and their values are in the same slice of Data, so
+    memory scales with the number of nonzero entries rather than with 
+    rows x columns. Used in place of the dense (nodes x envs) count array
+    when the envs are given as SparseEnvCounts.
+    """
+    def __init__(self, indptr, indices, data, num_rows):
+        """Returns new SparseColumns from CSC arrays and the number of rows."""
+        self.IndPtr = asarray(indptr)
+        self.Indices = asarray(indices)
+        self.Data = asarray(data)
+        self.shape = (num_rows, len(self.IndPtr) - 1)
+
+    @classmethod
+    def fromTriples(cls, rows, cols, values, shape):
+        """Returns SparseColumns from parallel arrays of row, col and value.
+
+        Zero values are dropped; each (row, col) should occur only once.
+        """
+        rows, cols, values = asarray(rows, int), asarray(cols, int), \
+            asarray(values)
+        nonzero_values = values != 0
+        rows, cols, values = rows[nonzero_values], cols[nonzero_values], \
+            values[nonzero_values]
+        order = lexsort((rows, cols))
+        indptr = concatenate(([0], cumsum(bincount(cols, \
+            minlength=shape[1]))))
+        return cls(indptr, rows[order], values[order], shape[0])
+
+    @classmethod
+    def fromMatrix(cls, matrix):
+        """Returns SparseColumns from a scipy.sparse matrix or dense array.
+
+        Any object with a tocsc method, e.g. a scipy CSR or CSC matrix, is
+        converted through CSC without making it dense.
+        """
+        if hasattr(matrix, 'tocsc'):
+            csc = matrix.tocsc()
+            csc.sum_duplicates()
+            num_cols = csc.shape[1]
+            cols = repeat(arange(num_cols), diff(csc.indptr))
+            return cls.fromTriples(csc.indices, cols, csc.data, csc.shape)
+        matrix = asarray(matrix)
+        cols, rows = nonzero(matrix.T)
+        return cls.fromTriples(rows, cols, matrix[rows, cols], matrix.shape)
+
+    def columnIds(self):
+        """Returns the column of each entry of Indices and Data."""
+        return repeat(arange(self.shape[1]), diff(self.IndPtr))
+
+    def rowsUsed(self, start=0, end=None):
+        """Returns sorted rows that are nonzero in any of columns start:end"""
+        if end is None:
+            end = self.shape[1]
+        return unique(self.Indices[self.IndPtr[start]:self.IndPtr[end]])
+
+    def columnSums(self, weights, as_bool=False):
+        """Returns sum of weights * column for each column.
+
+        If as_bool is True, the nonzero entries count as 1.
+        """
+        values = asarray(weights, float)[self.Indices]
+        if not as_bool:
+            values = values * self.Data
+        return bincount(self.columnIds(), values, minlength=self.shape[1])
+
+    def take(self, cols):
+        """Returns SparseColumns of the columns cols, in that order."""
+        pieces = [arange(self.IndPtr[c], self.IndPtr[c+1]) for c in cols]
+        lengths = [len(p) for p in pieces]
+        if pieces:
+            positions = concatenate(pieces)
+        else:
+            positions = zeros(0, int)
+        return self.__class__(concatenate(([0], cumsum(lengths))), 
+            self.Indices[positions], self.Data[positions], self.shape[0])
+
+    def toarray(self, start=0, end=None, rows=None):
+        """Returns dense array of columns start:end, all rows or sorted rows.
+        """
+        if end is None:
+            end = self.shape[1]
+        if rows is None:
+            rows = arange(self.shape[0])
+        result = zeros((len(rows), end-start), self.Data.dtype)
+        lo, hi = self.IndPtr[start], self.IndPtr[end]
+        indices = self.Indices[lo:hi]
+        cols = repeat(arange(end-start), diff(self.IndPtr[start:end+1]))
+        positions = searchsorted(rows, indices)
+        found = positions < len(rows)
+        found[found] = take(rows, positions[found]) == indices[found]
+        result[positions[found], cols[found]] = self.Data[lo:hi][found]
+        return result
+
+
+class SparseEnvCounts(object):
+    """Taxon by env abundance matrix usable in place of the count_envs dict.
+
+    fast_unifrac, fast_unifrac_permutations and PD_whole_tree keep the 
+    abundances in SparseColumns throughout when given a SparseEnvCounts, so
+    memory scales with the number of nonzero counts.
+    """
+    def __init__(self, matrix, taxon_names, env_names):
+        """Returns new SparseEnvCounts.
+
+        matrix: taxa x envs counts, as a scipy.sparse matrix (CSR, CSC or 
+            any other format with a tocsc method) or a dense array.
+        taxon_names, env_names: labels of the rows and the columns of matrix.
+        """
+        self.Counts = SparseColumns.fromMatrix(matrix)
+        self.TaxonNames = list(taxon_names)
+        self.EnvNames = list(env_names)
+        if self.Counts.shape != (len(self.TaxonNames), len(self.EnvNames)):
+            raise ValueError, "matrix shape %s doesn't match names" % \
+                str(self.Counts.shape)
+        self._keys = [self.TaxonNames[i] for i in self.Counts.rowsUsed()]
+        self._key_set = set(self._keys)
+        self._name_to_row = {}
+        for row, name in enumerate(self.TaxonNames):
+            self._name_to_row.setdefault(name, row)
+        #the entries of each row, so lookups don't scan all the counts
+        self._row_entries = self.Counts.Indices.argsort(kind='mergesort')
+        self._row_starts = searchsorted(
+            self.Counts.Indices[self._row_entries],
+            arange(len(self.TaxonNames) + 1))
+        self._entry_columns = self.Counts.columnIds()
+
+    def keys(self):
+        """Returns names of the taxa that have counts in some env."""
+        return list(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, name):
+        return name in self._key_set
+
+    def __getitem__(self, name):
+        """Returns {env:count} for taxon name, as in the count_envs dict."""
+        try:
+            row = self._name_to_row[name]
+        except KeyError:
+            raise KeyError, name
+        entries = self._row_entries[self._row_starts[row]:
+            self._row_starts[row+1]]
+        cols = self._entry_columns[entries]
+        result = dict([(self.EnvNames[c], v) for c, v in \
+            zip(cols, self.Counts.Data[entries])])
+        if not result:
+            raise KeyError, name
+        return result
+
+
+def index_envs_sparse(env_counts, tree_index):
+    """Returns SparseColumns of taxon x env counts, as index_envs.
+
+    env_counts is SparseEnvCounts or the output of count_envs(lines).
+    Taxa that aren't in tree_index are skipped. Returns (SparseColumns, 
+    unique_envs, env_to_index, node_to_index) with the envs sorted.
+    """
+    num_nodes = len(tree_index)
+    node_to_index = {}
+    for i, node in tree_index.items():
+        if node.Name is not None:
+            node_to_index[node.Name] = i
+    if isinstance(env_counts, SparseEnvCounts):
+        counts = env_counts.Counts
+        row_to_node = array([node_to_index.get(name, -1) for name in \
+            env_counts.TaxonNames] or [-1])
+        nodes = row_to_node[counts.Indices]
+        in_tree = nodes >= 0
+        nodes, cols, values = nodes[in_tree], counts.columnIds()[in_tree], \
+            counts.Data[in_tree]
+        env_names = env_counts.EnvNames
+    else:
+        env_names, num_envs = get_unique_envs(env_counts)
+        env_to_index = dict([(e, i) for i, e in enumerate(env_names)])
+        nodes, cols, values = [], [], []
+        for name, counts in env_counts.items():
+            if name not in node_to_index:
+                continue
+            for env, count in counts.items():
+                nodes.append(node_to_index[name])
+                cols.append(env_to_index[env])
+                values.append(count)
+        nodes, cols, values = array(nodes, int), array(cols, int), \
+            array(values)
+    #keep only envs with counts in the tree, in sorted order
+    used = unique(cols[values != 0])
+    unique_envs = sorted([env_names[i] for i in used])
+    env_to_index = dict([(e, i) for i, e in enumerate(unique_envs)])
+    new_cols = zeros(len(env_names), int)
+    for i in used:
+        new_cols[i] = env_to_index[env_names[i]]
+    result = SparseColumns.fromTriples(nodes, new_cols[cols], values, 
+        (num_nodes, len(unique_envs)))
+    return result, unique_envs, env_to_index, node_to_index
+
+def parent_indices(t):
+    """Returns array of the _leaf_index of the parent of each node in t.
+
+    Takes as input tree t with _leaf_index set, e.g. by index_tree. The root
+    has parent -1.
+    """
+    nodes = list(t.traverse(self_before=True, self_after=False))
+    result = -ones(len(nodes), int)
+    for n in nodes:
+        if n is not t:
+            result[n._leaf_index] = n.Parent._leaf_index
+    return result
+
+def _propagate_sparse(columns, parents, add):
+    """Propagates each column of SparseColumns from the tips to the root.
+
+    If add is True the values of each node are the sums of its descendants,
+    otherwise each node that has any descendant with a value is True.
+    """
+    num_rows, num_cols = columns.shape
+    totals = zeros(num_rows, float)
+    seen = zeros(num_rows, bool)
+    indptr, all_indices, all_data = [0], [], []
+    for c in range(num_cols):
+        lo, hi = columns.IndPtr[c], columns.IndPtr[c+1]
+        nodes, values = columns.Indices[lo:hi], columns.Data[lo:hi]
+        visited = []
+        while len(nodes):
+            if add:
+                #nodes are unique at each level, so += is safe
+                totals[nodes] += values
+                visited.append(nodes[~seen[nodes]])
+                seen[visited[-1]] = True
+                parent = parents[nodes]
+                has_parent = parent >= 0
+                nodes, inverse = unique(parent[has_parent], 
+                    return_inverse=True)
+                values = bincount(inverse, values[has_parent])
+            else:
+                #no need to go further up from nodes already set
+                nodes = nodes[~seen[nodes]]
+                seen[nodes] = True
+                visited.append(nodes)
+                nodes = unique(parents[nodes])
+                nodes = nodes[nodes >= 0]
+        if visited:
+            nodes = unique(concatenate(visited))
+        else:
+            nodes = zeros(0, int)
+        all_indices.append(nodes)
+        if add:
+            all_data.append(totals[nodes].astype(columns.Data.dtype))
+            totals[nodes] = 0
+        else:
+            all_data.append(ones(len(nodes), bool))
+        seen[nodes] = False
+        indptr.append(indptr[-1] + len(nodes))
+    if num_cols:
+        all_indices, all_data = concatenate(all_indices), \
+            concatenate(all_data)
+    return SparseColumns(indptr, all_indices, all_data, num_rows)
+
+def bool_descendants_sparse(columns, parents):
+    """Returns SparseColumns that are True where any descendant is nonzero.
+
+    Sparse counterpart of bool_descendants: parents is from parent_indices.
+    Each column only visits the ancestors of its own nonzero nodes.
+    """
+    return _propagate_sparse(columns, parents, add=False)
+
+def sum_descendants_sparse(columns, parents):
+    """Returns SparseColumns in which each node has the sum of descendants.
+
+    Sparse counterpart of sum_descendants: parents is from parent_indices.
+    """
+    return _propagate_sparse(columns, parents, add=True)
+
+def unifrac_vector_sparse(branch_lengths, m):
+    """Calculates unifrac(i, others) for each column i of SparseColumns m.
+
+    As unifrac_vector for m from bool_descendants_sparse.
+    """
+    coverage = bincount(m.Indices, minlength=m.shape[0])
+    union = branch_lengths[coverage > 0].sum()
+    shared = m.columnSums(branch_lengths * (coverage > 1), as_bool=True)
+    return 1 - shared/union
+
+def weighted_unifrac_vector_sparse(branch_lengths, m, tip_indices, 
+    bl_correct=False, tip_distances=None):
+    """Calculates weighted_unifrac(i,rest) for each column i of m.
+
+    As weighted_unifrac_vector with the default unifrac_f for SparseColumns
+    m from sum_descendants_sparse. Each column only touches its own nonzero
+    nodes: the rest of the tree enters through the totals over all columns.
+    """
+    totals = bincount(m.Indices, m.Data, minlength=m.shape[0])
+    sums = m.columnSums(_index_mask(tip_indices, m.shape[0]))
+    rest_sums = sums.sum() - sums
+    col_ids = m.columnIds()
+    values = m.Data / sums[col_ids]
+    rest_values = (totals[m.Indices] - m.Data) / rest_sums[col_ids]
+    in_col = bincount(col_ids, branch_lengths[m.Indices] * \
+        abs(values - rest_values), minlength=m.shape[1])
+    #outside its own nodes a column is 0 and the rest has all the counts
+    out_col = (dot(branch_lengths, totals) - \
+        m.columnSums(branch_lengths * totals, as_bool=True)) / rest_sums
+    result = in_col + out_col
+    if bl_correct:
+        tip_distances = tip_distances.ravel()
+        own = m.columnSums(tip_distances)
+        result /= own/sums + (dot(tip_distances, totals) - own)/rest_sums
+    return result
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 """Fast implementation of UniFrac for use with very large datasets"""
 
+import os
 from random import shuffle
-from numpy import ones, ma, where
-from numpy.random import permutation
+from numpy import ones, ma, where, triu_indices, searchsorted, memmap
+from numpy.random import permutation, RandomState
 from cogent.maths.unifrac.fast_tree import *
 # not imported by import *
 from cogent.maths.unifrac.fast_tree import _weighted_unifrac, _branch_correct 
@@ -12,6 +13,8 @@ from cogent.cluster.metric_scaling import *
 from cogent.core.tree import PhyloNode, TreeError
 from cogent.cluster.UPGMA import UPGMA_cluster
 from cogent.phylo.nj import nj
+from cogent.util import parallel
+from cogent.util.array import condensed_offsets
 from StringIO import StringIO
 
 __author__ = "Rob Knight and Micah Hamady"
@@ -168,8 +171,12 @@ def fast_p_test_file(tree_in, envs_in, num_iters=1000, verbose=False,
 
     return result
 
-def _fast_unifrac_setup(t, envs, make_subtree=True):
-    """Setup shared by fast_unifrac and by significance tests."""
+def _fast_unifrac_setup(t, envs, make_subtree=True, sparse=False):
+    """Setup shared by fast_unifrac and by significance tests.
+    
+    envs may be SparseEnvCounts, in which case the count array is 
+    SparseColumns if sparse is True, and is made dense otherwise.
+    """
     if make_subtree:
         t2 = t.copy()
         wanted = set(envs.keys())
@@ -183,20 +190,62 @@ def _fast_unifrac_setup(t, envs, make_subtree=True):
 
     #index tree
     node_index, nodes = index_tree(t)
-    #get good nodes, defined as those that are in the env file.
-    good_nodes=dict([(i.Name,envs[i.Name]) for i in t.tips() if i.Name in envs])
-    envs = good_nodes
-    count_array, unique_envs, env_to_index, node_to_index = index_envs(envs, node_index)
+    if isinstance(envs, SparseEnvCounts):
+        #taxa that aren't tips of the tree are skipped while indexing
+        count_array, unique_envs, env_to_index, node_to_index = \
+            index_envs_sparse(envs, node_index)
+        if not sparse:
+            count_array = count_array.toarray()
+    else:
+        #get good nodes, defined as those that are in the env file.
+        good_nodes=dict([(i.Name,envs[i.Name]) for i in t.tips() if i.Name in envs])
+        envs = good_nodes
+        count_array, unique_envs, env_to_index, node_to_index = index_envs(envs, node_index)
     env_names = sorted(unique_envs)
     #Note: envs get sorted at the step above
     branch_lengths = get_branch_lengths(node_index)
-    if not envs:
+    if not unique_envs:
         raise ValueError, "No valid samples/environments found. Check whether tree tips match otus/taxa present in samples/environments"
     return envs, count_array, unique_envs, env_to_index, node_to_index, env_names, branch_lengths, nodes, t
 
-def fast_unifrac_whole_tree(t, envs, num_iters, permutation_f=permutation):
-    """Performs UniFrac permutations on whole tree """
-    sim_ufracs = []
+def _batched_permutations(calc_batch, num_iters, num_items, 
+    permutation_f=permutation, batch_size=100, seed=None):
+    """Returns list of the results of calc_batch for num_iters permutations.
+
+    calc_batch(permutations) is called with batches of up to batch_size 
+    permutations of range(num_items) and must return one result for each.
+    If seed is None the permutations are made in order by permutation_f
+    and the batches are computed in this process. Otherwise batch k uses its
+    own RandomState seeded by (seed, k), and the batches are spread over the
+    CPUs of the current parallel context, with results that depend on seed
+    but not on the number of CPUs.
+    """
+    sizes = [min(batch_size, num_iters - start) for start in \
+        range(0, num_iters, batch_size)]
+    result = []
+    if seed is None:
+        for size in sizes:
+            result.extend(calc_batch([permutation_f(num_items) for i in \
+                range(size)]))
+        return result
+
+    def calc_seeded_batch(task):
+        batch_index, size = task
+        random = RandomState([seed, batch_index])
+        return calc_batch([random.permutation(num_items) for i in \
+            range(size)])
+
+    for batch in parallel.imap(calc_seeded_batch, list(enumerate(sizes))):
+        result.extend(batch)
+    return result
+
+def fast_unifrac_whole_tree(t, envs, num_iters, permutation_f=permutation,
+    batch_size=100, seed=None):
+    """Performs UniFrac permutations on whole tree 
+    
+    The permuted tips of batch_size iterations are propagated through the 
+    tree together; see _batched_permutations for permutation_f and seed.
+    """
     envs, count_array, unique_envs, env_to_index, node_to_index, env_names, \
         branch_lengths, nodes, t = _fast_unifrac_setup(t, envs)
     
@@ -208,13 +257,17 @@ def fast_unifrac_whole_tree(t, envs, num_iters, permutation_f=permutation):
     real_bl_sums, real_bl_ufracs = env_unique_fraction(branch_lengths, 
         count_array)
     tip_indices = [n._leaf_index for n in t.tips()]
-    for i in range(num_iters):
-        permute_selected_rows(tip_indices, orig_count_array, count_array, 
-            permutation_f)
-        bool_descendants(bound_indices)
-        cur_bl_sums, cur_bl_ufracs = env_unique_fraction(branch_lengths, 
-            count_array)
-        sim_ufracs.append(cur_bl_ufracs)
+
+    def calc_batch(permutations):
+        batch = permute_selected_rows_batch(tip_indices, orig_count_array,
+            permutations)
+        bool_descendants(bind_to_array(nodes, batch))
+        cur_bl_sums, cur_bl_ufracs = env_unique_fraction_batch(
+            branch_lengths, batch, len(permutations))
+        return list(cur_bl_ufracs)
+
+    sim_ufracs = _batched_permutations(calc_batch, num_iters, 
+        len(tip_indices), permutation_f, batch_size, seed)
     return real_bl_ufracs, sim_ufracs 
 
 def PD_whole_tree(t, envs):
@@ -224,7 +277,11 @@ def PD_whole_tree(t, envs):
     want to calculate a related metric.
     """
     envs, count_array, unique_envs, env_to_index, node_to_index, env_names, \
-        branch_lengths, nodes, t = _fast_unifrac_setup(t, envs)
+        branch_lengths, nodes, t = _fast_unifrac_setup(t, envs, sparse=True)
+    if isinstance(count_array, SparseColumns):
+        count_array = bool_descendants_sparse(count_array, parent_indices(t))
+        return unique_envs, count_array.columnSums(branch_lengths, 
+            as_bool=True)
     count_array = count_array.astype(bool)
     bound_indices = bind_to_array(nodes, count_array)
     #initialize result
@@ -248,20 +305,25 @@ def PD_generic_whole_tree(t, envs, metric=PD):
     return unique_envs, result
 
 def fast_unifrac_permutations(t, envs, weighted, num_iters, first_env, 
-    second_env, permutation_f=permutation, unifrac_f=_weighted_unifrac):
+    second_env, permutation_f=permutation, unifrac_f=_weighted_unifrac,
+    batch_size=100, seed=None):
     """Performs UniFrac permutations between specified pair of environments.
     
     NOTE: this function just gives you the result of the permutations, need to 
     compare to real values from doing a single unifrac.
+
+    The permuted tips of batch_size iterations are propagated through the 
+    tree together and their distances computed as arrays; see 
+    _batched_permutations for permutation_f and seed.
     """
-    result = []
-    envs, count_array, unique_envs, env_to_index, node_to_index, env_names, branch_lengths, nodes, t = _fast_unifrac_setup(t, envs)
+    envs, count_array, unique_envs, env_to_index, node_to_index, env_names, branch_lengths, nodes, t = _fast_unifrac_setup(t, envs, sparse=True)
 
     first_index,second_index = env_to_index[first_env], env_to_index[second_env]
-    count_array = count_array[:,[first_index,second_index]] #ditch rest of array
-    bound_indices = bind_to_array(nodes, count_array)
+    if isinstance(count_array, SparseColumns):
+        count_array = count_array.take([first_index,second_index]).toarray()
+    else:
+        count_array = count_array[:,[first_index,second_index]] #ditch rest of array
     orig_count_array = count_array.copy()
-    first_col, second_col = count_array[:,0], count_array[:,1]
     tip_indices = [n._leaf_index for n in t.tips()]
 
     #figure out whether doing weighted or unweighted analysis: for weighted,
@@ -276,40 +338,51 @@ def fast_unifrac_permutations(t, envs, weighted, num_iters, first_env,
         else:
             bl_correct = False
         first_sum, second_sum = [sum(take(count_array[:,i], tip_indices)) for i in range(2)]
-        for i in range(num_iters):
-            permute_selected_rows(tip_indices, orig_count_array, count_array, permutation_f)
-            sum_descendants(bound_indices)
+
+    def calc_batch(permutations):
+        batch = permute_selected_rows_batch(tip_indices, orig_count_array,
+            permutations)
+        bound_indices = bind_to_array(nodes, batch)
+        firsts, seconds = batch[:,0::2], batch[:,1::2]
+        if not weighted:
+            bool_descendants(bound_indices)
+            firsts, seconds = firsts != 0, seconds != 0
+            return 1 - dot(branch_lengths, firsts & seconds) / \
+                dot(branch_lengths, firsts | seconds)
+        sum_descendants(bound_indices)
+        if unifrac_f is _weighted_unifrac:
+            firsts = firsts / float(first_sum)
+            seconds = seconds / float(second_sum)
+            result = dot(branch_lengths, abs(firsts - seconds))
+            if bl_correct:
+                result /= dot(tip_ds.ravel(), firsts + seconds)
+            return result
+        result = []
+        for first_col, second_col in zip(firsts.T, seconds.T):
             curr = unifrac_f(branch_lengths, first_col, second_col, first_sum, second_sum)
             if bl_correct:
                 curr /= _branch_correct(tip_ds, first_col, second_col, first_sum, second_sum)
             result.append(curr)
-    else:
-        for i in range(num_iters):
-            permute_selected_rows(tip_indices, orig_count_array, count_array, permutation_f)
+        return result
 
-            # commenting out these (??)
-            #first = count_array.copy()
-            #permute_selected_rows(tip_indices, orig_count_array, count_array, permutation_f)
-            #second = count_array.copy()
-
-            bool_descendants(bound_indices)
-            curr = unifrac(branch_lengths, first_col, second_col)
-            result.append(curr)
-    return result
+    return list(_batched_permutations(calc_batch, num_iters, 
+        len(tip_indices), permutation_f, batch_size, seed))
 
 def fast_p_test(t, envs, num_iters, first_env=None, second_env=None, 
-    permutation_f=permutation):
+    permutation_f=permutation, batch_size=100, seed=None):
     """Performs Andy Martin's p test between specified pair of environments.
 
     t: tree 
     envs: envs 
     first_env: name of first env, or None if doing whole tree
     second_env: name of second env, or None if doing whole tree
+    batch_size: number of iterations whose Fitch parsimony is computed in one
+        pass through the tree
+    seed: see _batched_permutations
 
     NOTE: this function just gives you the result of the permutations, need to 
     compare to real Fitch parsimony values. Sleazy way to get the real values 
     is to set num_iters to 1, permutation_f to identity."""
-    result = []
     envs, count_array, unique_envs, env_to_index, node_to_index, env_names, branch_lengths, nodes, t = _fast_unifrac_setup(t, envs)
 
     # check if doing pairwise
@@ -320,16 +393,17 @@ def fast_p_test(t, envs, num_iters, first_env=None, second_env=None,
     elif not (first_env is None and second_env is None):
         raise ValueError, "Both envs must either have a value or be None."
 
-    bound_indices = bind_to_array(nodes, count_array)
     orig_count_array = count_array.copy()
     tip_indices = [n._leaf_index for n in t.tips()]
-    for i in range(num_iters):
-        count_array *= 0
-        permute_selected_rows(tip_indices, orig_count_array, count_array, 
-            permutation_f=permutation_f)
-        curr = fitch_descendants(bound_indices)
-        result.append(curr)
-    return result
+
+    def calc_batch(permutations):
+        batch = permute_selected_rows_batch(tip_indices, orig_count_array,
+            permutations)
+        return list(fitch_descendants_batch(bind_to_array(nodes, batch),
+            len(permutations)))
+
+    return _batched_permutations(calc_batch, num_iters, len(tip_indices),
+        permutation_f, batch_size, seed)
 
 def shared_branch_length(t, envs, env_count=1):
     """Returns the shared branch length env_count combinations of envs
@@ -418,11 +492,14 @@ def shared_branch_length_to_root(t, envs):
     return result
 
 def fast_unifrac(t, envs, weighted=False, metric=unifrac, is_symmetric=True, 
-    modes=UNIFRAC_DEFAULT_MODES, weighted_unifrac_f=_weighted_unifrac,make_subtree=True):
+    modes=UNIFRAC_DEFAULT_MODES, weighted_unifrac_f=_weighted_unifrac,make_subtree=True,
+    num_threads=None):
     """ Run fast unifrac.
     
     t: phylogenetic tree relating the sequences.  pycogent phylonode object
-    envs: dict of {sequence:{env:count}} showing environmental abundance.
+    envs: dict of {sequence:{env:count}} showing environmental abundance,
+        or SparseEnvCounts wrapping a sparse sequence x env count matrix, in
+        which case the counts stay sparse throughout.
     weighted: if True, performs the weighted UniFrac procedure.
     metric: distance metric to use.  currently you must use unifrac only
         if weighted=True.
@@ -433,6 +510,10 @@ def fast_unifrac(t, envs, weighted=False, metric=unifrac, is_symmetric=True,
     is_symmetric: if the desired distance matrix is symmetric 
         (dist(sampleA, sampleB) == dist(sampleB, sampleA)), then set this True
         to prevent calculating the same number twice
+    num_threads: number of threads for computing the distance matrix
+        (default: the number of cpus). The matrix is computed from blocked
+        matrix products for the metrics in BLOCK_METRICS and for the default
+        weighted_unifrac_f, and pair by pair otherwise.
 
     using default modes, returns a dictionary with the following (key:value) pairs:
 
@@ -463,8 +544,12 @@ def fast_unifrac(t, envs, weighted=False, metric=unifrac, is_symmetric=True,
     if not modes or modes - UNIFRAC_VALID_MODES:
         raise ValueError, "Invalid run modes: %s, valid: %s" % (str(modes),str(UNIFRAC_VALID_MODES))
 
-    envs, count_array, unique_envs, env_to_index, node_to_index, env_names, branch_lengths, nodes, t = _fast_unifrac_setup(t, envs, make_subtree)
-    bound_indices = bind_to_array(nodes, count_array)
+    envs, count_array, unique_envs, env_to_index, node_to_index, env_names, branch_lengths, nodes, t = _fast_unifrac_setup(t, envs, make_subtree, sparse=True)
+    sparse = isinstance(count_array, SparseColumns)
+    if sparse:
+        parents = parent_indices(t)
+    else:
+        bound_indices = bind_to_array(nodes, count_array)
     #initialize result
     result = {}
     
@@ -473,7 +558,12 @@ def fast_unifrac(t, envs, weighted=False, metric=unifrac, is_symmetric=True,
     #doing unweighted analysis.
     if weighted:
         tip_indices = [n._leaf_index for n in t.tips()]
-        sum_descendants(bound_indices)
+        if sparse:
+            count_array = sum_descendants_sparse(count_array, parents)
+            if weighted_unifrac_f is not _weighted_unifrac:
+                count_array = count_array.toarray()
+        else:
+            sum_descendants(bound_indices)
         tip_ds = branch_lengths.copy()[:,newaxis]
         bindings = bind_to_parent_array(t, tip_ds)
         tip_distances(tip_ds, bindings, tip_indices)
@@ -481,21 +571,45 @@ def fast_unifrac(t, envs, weighted=False, metric=unifrac, is_symmetric=True,
             bl_correct = True
         else:
             bl_correct = False
-        u = weighted_unifrac_matrix(branch_lengths, count_array, tip_indices, \
-            bl_correct=bl_correct, tip_distances=tip_ds, \
-            unifrac_f=weighted_unifrac_f)
+        if weighted_unifrac_f is _weighted_unifrac:
+            u = weighted_unifrac_matrix_blocked(branch_lengths, count_array,
+                tip_indices, bl_correct=bl_correct, tip_distances=tip_ds,
+                num_threads=num_threads)
+        else:
+            u = weighted_unifrac_matrix(branch_lengths, count_array, 
+                tip_indices, bl_correct=bl_correct, tip_distances=tip_ds, 
+                unifrac_f=weighted_unifrac_f)
         #figure out if we need the vector
         if UNIFRAC_DIST_VECTOR in modes:
-            result[UNIFRAC_DIST_VECTOR] = (weighted_unifrac_vector(
-                branch_lengths, count_array, tip_indices, 
-                bl_correct=bl_correct, tip_distances=tip_ds, 
-                unifrac_f=weighted_unifrac_f), env_names)
+            if isinstance(count_array, SparseColumns):
+                vector = weighted_unifrac_vector_sparse(branch_lengths, 
+                    count_array, tip_indices, bl_correct=bl_correct, 
+                    tip_distances=tip_ds)
+            else:
+                vector = weighted_unifrac_vector(branch_lengths, count_array,
+                    tip_indices, bl_correct=bl_correct, tip_distances=tip_ds,
+                    unifrac_f=weighted_unifrac_f)
+            result[UNIFRAC_DIST_VECTOR] = (vector, env_names)
     else:
-        bool_descendants(bound_indices)
-        u = unifrac_matrix(branch_lengths, count_array, metric=metric, is_symmetric=is_symmetric)
+        if sparse:
+            count_array = bool_descendants_sparse(count_array, parents)
+            if metric not in BLOCK_METRICS:
+                count_array = count_array.toarray()
+        else:
+            bool_descendants(bound_indices)
+        if metric in BLOCK_METRICS:
+            u = unifrac_matrix_blocked(branch_lengths, count_array, 
+                metric=metric, is_symmetric=is_symmetric, 
+                num_threads=num_threads)
+        else:
+            u = unifrac_matrix(branch_lengths, count_array, metric=metric, 
+                is_symmetric=is_symmetric)
         if UNIFRAC_DIST_VECTOR in modes:
-            result[UNIFRAC_DIST_VECTOR] = (unifrac_vector(branch_lengths, 
-                count_array), env_names)
+            if isinstance(count_array, SparseColumns):
+                vector = unifrac_vector_sparse(branch_lengths, count_array)
+            else:
+                vector = unifrac_vector(branch_lengths, count_array)
+            result[UNIFRAC_DIST_VECTOR] = (vector, env_names)
     
     #check if we have to do the matrix calculations, which are expensive
     if modes - set([UNIFRAC_DIST_VECTOR]):
@@ -550,6 +664,142 @@ def fast_unifrac_one_sample(one_sample_name, t, envs, weighted=False,
 
     return (u, env_names)
         
+def condensed_to_matrix(condensed, num_envs):
+    """Returns the symmetric num_envs x num_envs matrix of condensed."""
+    result = zeros((num_envs, num_envs), float)
+    result[triu_indices(num_envs, 1)] = condensed
+    return result + result.T
+
+def unifrac_stripes(num_envs, stripe_size):
+    """Returns list of (first, last) rows of stripes of a condensed matrix.
+
+    Each stripe is a run of whole rows with at most stripe_size distances,
+    unless a single row is longer, so that stripes near the end of the 
+    matrix have more rows than those at the start.
+    """
+    offsets = condensed_offsets(num_envs)
+    result = []
+    start = 0
+    while start < num_envs - 1:
+        end = searchsorted(offsets, offsets[start] + stripe_size, 'right') - 1
+        end = min(max(end, start + 1), num_envs - 1)
+        result.append((start, end))
+        start = end
+    return result
+
+def _read_stripe_log(log_filename, header):
+    """Returns set of stripes done according to the log, if header matches"""
+    if not os.path.exists(log_filename):
+        return None
+    lines = open(log_filename, 'U').read().split('\n')
+    if lines[0] != header:
+        return None
+    #the last line is incomplete if the log was interrupted while writing
+    return set([int(line) for line in lines[1:-1]])
+
+def fast_unifrac_striped(t, envs, filename, weighted=False, metric=unifrac,
+    stripe_size=2**22, block_size=64, make_subtree=True):
+    """Computes the condensed UniFrac matrix into the file filename.
+
+    t, envs, weighted, make_subtree: as for fast_unifrac. envs may be 
+        SparseEnvCounts.
+    metric: a symmetric metric in BLOCK_METRICS, used unless weighted.
+    stripe_size: maximum number of distances in each stripe.
+    block_size: number of envs compared at a time.
+
+    The condensed matrix (see condensed_offsets) is a memory-mapped array of
+    doubles in filename. It is computed in stripes of whole rows, which are
+    spread over the CPUs of the current parallel context, and each stripe is
+    written to the file as soon as it is done. Completed stripes are logged
+    in filename + '.stripes', so that an interrupted run called again with 
+    the same arguments only computes the missing stripes. Under MPI only
+    rank 0 creates the file and writes the log.
+
+    Returns the condensed matrix, opened read only, and the env names.
+    """
+    envs, count_array, unique_envs, env_to_index, node_to_index, env_names, \
+        branch_lengths, nodes, t = _fast_unifrac_setup(t, envs, make_subtree,
+        sparse=True)
+    num_envs = len(env_names)
+    if num_envs < 2:
+        raise ValueError, "Need at least two envs for a distance matrix"
+    if isinstance(count_array, SparseColumns):
+        parents = parent_indices(t)
+    else:
+        bound_indices = bind_to_array(nodes, count_array)
+    if weighted:
+        tip_indices = [n._leaf_index for n in t.tips()]
+        if isinstance(count_array, SparseColumns):
+            count_array = sum_descendants_sparse(count_array, parents)
+        else:
+            sum_descendants(bound_indices)
+        tip_ds = branch_lengths.copy()[:,newaxis]
+        bindings = bind_to_parent_array(t, tip_ds)
+        tip_distances(tip_ds, bindings, tip_indices)
+        kernel = WeightedUnifracBlockKernel(branch_lengths, count_array,
+            tip_indices, bl_correct=(weighted == 'correct'),
+            tip_distances=tip_ds)
+        metric_name = 'weighted_%s' % weighted
+    else:
+        if isinstance(count_array, SparseColumns):
+            count_array = bool_descendants_sparse(count_array, parents)
+        else:
+            bool_descendants(bound_indices)
+        kernel = UnifracBlockKernel(branch_lengths, count_array, metric)
+        metric_name = metric.__name__
+
+    num_pairs = num_envs * (num_envs - 1) // 2
+    offsets = condensed_offsets(num_envs)
+    stripes = unifrac_stripes(num_envs, stripe_size)
+    log_filename = filename + '.stripes'
+    header = '\t'.join(['#%s' % metric_name, str(stripe_size)] + env_names)
+    comm = parallel.getCommunicator()
+    is_writer = comm.Get_rank() == 0
+    if is_writer:
+        done = _read_stripe_log(log_filename, header)
+        if done is None or not os.path.exists(filename) or \
+            os.path.getsize(filename) != num_pairs * 8:
+            done = set()
+            memmap(filename, float, 'w+', shape=(num_pairs,)).flush()
+            log = open(log_filename, 'w')
+            log.write(header + '\n')
+            log.close()
+    else:
+        done = None
+    #the other ranks wait until the file exists and agree on what is done
+    done = comm.bcast(done, 0)
+    comm.Barrier()
+
+    def calc_stripe(stripe):
+        index, (first, last) = stripe
+        result = memmap(filename, float, 'r+', shape=(num_pairs,))
+        for start in range(first, last, block_size):
+            end = min(start + block_size, last)
+            rows = zeros((end - start, num_envs - start), float)
+            for col in range(start, num_envs, block_size):
+                col_end = min(col + block_size, num_envs)
+                rows[:,col-start:col_end-start] = kernel((start, end), 
+                    (col, col_end))
+            for i in range(start, end):
+                result[offsets[i]:offsets[i]+num_envs-i-1] = \
+                    rows[i-start, i-start+1:]
+        result.flush()
+        del result
+        return index
+
+    todo = [(i, s) for i, s in enumerate(stripes) if i not in done]
+    if is_writer:
+        log = open(log_filename, 'a')
+    try:
+        for index in parallel.imap(calc_stripe, todo):
+            if is_writer:
+                log.write('%s\n' % index)
+                log.flush()
+    finally:
+        if is_writer:
+            log.close()
+    return memmap(filename, float, 'r', shape=(num_pairs,)), env_names
+
 def unifrac_tasks_from_matrix(u, env_names, modes=UNIFRAC_DEFAULT_MODES):
     """Returns the UniFrac matrix, PCoA, and/or cluster from the matrix."""
     result = {}
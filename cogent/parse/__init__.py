@@ -9,6 +9,7 @@ __all__ = ['aaindex',
            'clustal',
            'cmfinder',
            'column',
+           'compressed',
            'comrna',
            'consan',
            'contrafold',
@@ -19,6 +20,7 @@ __all__ = ['aaindex',
            'dialign',
            'dynalign',
            'ebi',
+           'faidx',
            'fasta',
            'fastq',
            'foldalign',
@@ -11,9 +11,12 @@ __email__ = 'kylebittinger@gmail.com'
 __status__ = 'Prototype'
 
 from cStringIO import StringIO
+import mmap
 import string
 import struct
 
+import numpy
+
 # Sections were inspired by, but not derived from, several other implementations:
 # * BioPython (biopython.org)
 # * sff_extract (www.melogen.upv.es/sff_extract)
@@ -372,6 +375,210 @@ def parse_binary_sff(sff_file, native_flowgram_values=False):
     return header, get_reads()
 
 
+def _padded_length(n, unit=8):
+    """Return n rounded up to the next multiple of unit."""
+    return ((n + unit - 1) // unit) * unit
+
+
+def parse_read_arrays(sff_file, number_of_flows=400):
+    """Parse a single read from a binary SFF file into NumPy arrays.
+
+    Keys are as for parse_read, but flowgram_values (native integer
+    values), flow_index_per_base and quality_scores are big-endian
+    decoded arrays rather than tuples.
+
+    As a side effect, sets the position of the file object to the end
+    of the Read Data section.
+    """
+    read = parse_read_header(sff_file)
+    number_of_bases = read['number_of_bases']
+    flow_size = 2 * number_of_flows
+    buff = sff_file.read(flow_size + 3 * number_of_bases)
+    read['flowgram_values'] = numpy.frombuffer(
+        buff, '>u2', number_of_flows).astype(numpy.uint16)
+    bases_start = flow_size + number_of_bases
+    read['flow_index_per_base'] = numpy.frombuffer(
+        buff[flow_size:bases_start], numpy.uint8)
+    read['Bases'] = buff[bases_start:bases_start + number_of_bases]
+    read['quality_scores'] = numpy.frombuffer(
+        buff[bases_start + number_of_bases:], numpy.uint8)
+    seek_pad(sff_file)
+    return read
+
+
+def _file_bytes(sff_file):
+    """Return the contents of a file as a uint8 array, mapped if possible."""
+    try:
+        data = mmap.mmap(sff_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        sff_file.seek(0)
+        data = sff_file.read()
+    return numpy.frombuffer(data, numpy.uint8)
+
+
+def parse_binary_sff_arrays(sff_file, native_flowgram_values=False):
+    """Parse a binary SFF file into a header and a dict of arrays.
+
+    The read headers are unpacked, and the flowgram, flow index, base and
+    quality sections of each read are copied into arrays holding all
+    reads. The resulting dict has:
+
+    - 'Name' and 'Bases': lists with one string per read
+    - one integer array per read header field (e.g. 'clip_qual_left')
+    - 'flowgram_values': reads x flows array, divided by 100 unless
+      native_flowgram_values is True
+    - 'flow_index_per_base', 'quality_scores': uint8 arrays of all
+      reads joined, where read i spans base_offsets[i]:base_offsets[i+1]
+    - 'base_offsets': integer array of length number of reads + 1
+    - 'read_offset': the file offset of each read, as in the index
+
+    The file is memory mapped where possible.
+    """
+    header = parse_common_header(sff_file)
+    validate_common_header(header)
+    number_of_flows = header['number_of_flows_per_read']
+    number_of_reads = header['number_of_reads']
+    flow_size = 2 * number_of_flows
+    data = _file_bytes(sff_file)
+    buff = data.data if hasattr(data, 'data') else data
+
+    header_values = []
+    names = []
+    read_offsets = []
+    position = header['header_length']
+    unpack_header = super(NamedStruct, read_header_struct).unpack_from
+    for i in range(number_of_reads):
+        # Skip the index section
+        if position == header['index_offset']:
+            position += header['index_length']
+        values = unpack_header(buff, position)
+        header_length, name_length, number_of_bases = values[:3]
+        name_start = position + read_header_struct.size
+        names.append(data[name_start:name_start + name_length].tostring())
+        header_values.append(values)
+        read_offsets.append(position)
+        position += header_length + \
+            _padded_length(flow_size + 3 * number_of_bases)
+
+    reads = {'Name': names}
+    header_values = numpy.array(header_values, int).reshape(
+        (number_of_reads, len(read_header_fields)))
+    for i, field in enumerate(read_header_fields):
+        reads[field] = header_values[:, i]
+    read_offsets = numpy.array(read_offsets, int)
+    reads['read_offset'] = read_offsets
+    data_offsets = read_offsets + reads['read_header_length']
+
+    number_of_bases = reads['number_of_bases']
+    base_offsets = numpy.zeros(number_of_reads + 1, int)
+    numpy.cumsum(number_of_bases, out=base_offsets[1:])
+    reads['base_offsets'] = base_offsets
+
+    # copy the sections of one read at a time, so that no index arrays
+    # larger than the file are needed
+    flows = numpy.empty((number_of_reads, number_of_flows), '>u2')
+    flow_index = numpy.empty(base_offsets[-1], numpy.uint8)
+    qualities = numpy.empty(base_offsets[-1], numpy.uint8)
+    bases = []
+    for i, (start, base_start, n) in enumerate(zip(data_offsets.tolist(),
+            base_offsets.tolist(), number_of_bases.tolist())):
+        flows[i] = data[start:start + flow_size].view('>u2')
+        start += flow_size
+        flow_index[base_start:base_start + n] = data[start:start + n]
+        bases.append(data[start + n:start + 2 * n].tostring())
+        qualities[base_start:base_start + n] = data[start + 2 * n:start + 3 * n]
+    flows = flows.astype(numpy.uint16)
+    if native_flowgram_values:
+        reads['flowgram_values'] = flows
+    else:
+        reads['flowgram_values'] = flows * 0.01
+    reads['flow_index_per_base'] = flow_index
+    reads['Bases'] = bases
+    reads['quality_scores'] = qualities
+    return header, reads
+
+
+def read_from_arrays(reads, i):
+    """Return read i of the arrays from parse_binary_sff_arrays as a dict.
+
+    Keys are as for parse_read; sections are array slices.
+    """
+    read = dict((field, int(reads[field][i])) for field in read_header_fields)
+    start, end = reads['base_offsets'][i], reads['base_offsets'][i+1]
+    read['Name'] = reads['Name'][i]
+    read['Bases'] = reads['Bases'][i]
+    read['flowgram_values'] = reads['flowgram_values'][i]
+    read['flow_index_per_base'] = reads['flow_index_per_base'][start:end]
+    read['quality_scores'] = reads['quality_scores'][start:end]
+    return read
+
+
+def _parse_roche_index_entries(buff, number_of_reads):
+    """Return (name, offset) pairs from the read entries of a Roche index.
+
+    Each entry is the read name, a null byte, the offset as four base 255
+    digits and a 0xFF terminator.
+    """
+    entries = []
+    for entry in buff.split('\xff')[:number_of_reads]:
+        if len(entry) < 6 or entry[-5] != '\x00':
+            raise UnsupportedSffError('Malformed read index entry.')
+        offset = 0
+        for digit in entry[-4:]:
+            offset = offset * 255 + ord(digit)
+        entries.append((entry[:-5], offset))
+    return entries
+
+
+def parse_sff_index(sff_file, header):
+    """Return a dict mapping read names to read offsets in an SFF file.
+
+    The Roche manifest (.mft) and sorted (.srt) index sections are
+    read if present; otherwise the read headers are scanned.
+
+    As a side effect, changes the position of the file object.
+    """
+    index_offset = header['index_offset']
+    index_length = header['index_length']
+    if index_length:
+        sff_file.seek(index_offset)
+        magic = sff_file.read(8)
+        if magic == '.mft1.00':
+            xml_size, data_size = struct.unpack('>II', sff_file.read(8))
+            sff_file.seek(xml_size, 1)
+            entries = sff_file.read(data_size)
+        elif magic == '.srt1.00':
+            sff_file.seek(4, 1)
+            entries = sff_file.read(index_length - 12)
+        else:
+            entries = None
+        if entries is not None:
+            return dict(_parse_roche_index_entries(
+                entries, header['number_of_reads']))
+
+    index = {}
+    number_of_flows = header['number_of_flows_per_read']
+    position = header['header_length']
+    for i in range(header['number_of_reads']):
+        if position == index_offset:
+            position += index_length
+        sff_file.seek(position)
+        read_header = parse_read_header(sff_file)
+        index[read_header['Name']] = position
+        position += read_header['read_header_length'] + _padded_length(
+            2 * number_of_flows + 3 * read_header['number_of_bases'])
+    return index
+
+
+def parse_read_by_name(sff_file, header, index, name):
+    """Return the read called name as parsed by parse_read_arrays.
+
+    index is a dict of read names to offsets, as from parse_sff_index.
+    """
+    sff_file.seek(index[name])
+    return parse_read_arrays(sff_file, header['number_of_flows_per_read'])
+
+
 def write_binary_sff(sff_file, header, reads):
     """Write a binary SFF file, using provided header and read dicts.
     """
@@ -5,6 +5,8 @@ from cogent.parse.record_finder import LabeledRecordFinder, \
     DelimitedRecordFinder, never_ignore
 from cogent.parse.record import RecordError
 from string import strip, upper
+from itertools import islice
+import numpy
 
 __author__ = "Micah Hamady"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -468,6 +470,323 @@ class BlastResult(dict):
     
     #raise error if both field and f passed, uses same dict as filterByField
 
+# the columns of -outfmt 6 and 7 (and -m 8, 9) tabular output
+BLAST_TABULAR_FIELDS = [BlastResult.QUERY_ID, BlastResult.SUBJECT_ID,
+    BlastResult.PERCENT_IDENTITY, BlastResult.ALIGNMENT_LENGTH,
+    BlastResult.MISMATCHES, BlastResult.GAP_OPENINGS, BlastResult.QUERY_START,
+    BlastResult.QUERY_END, BlastResult.SUBJECT_START, BlastResult.SUBJECT_END,
+    BlastResult.E_VALUE, BlastResult.BIT_SCORE]
+
+# BLAST+ names for fields in '# Fields:' lines
+blast_field_aliases = {'GAP OPENS': BlastResult.GAP_OPENINGS,
+    'EVALUE': BlastResult.E_VALUE}
+
+blast_column_types = {
+    BlastResult.QUERY_ID: 'label',
+    BlastResult.SUBJECT_ID: 'label',
+    BlastResult.PERCENT_IDENTITY: float,
+    BlastResult.ALIGNMENT_LENGTH: int,
+    BlastResult.MISMATCHES: int,
+    BlastResult.GAP_OPENINGS: int,
+    BlastResult.QUERY_START: int,
+    BlastResult.QUERY_END: int,
+    BlastResult.SUBJECT_START: int,
+    BlastResult.SUBJECT_END: int,
+    BlastResult.E_VALUE: float,
+    BlastResult.BIT_SCORE: float,
+    }
+
+class BlastHitColumns(object):
+    """BLAST hits held as one NumPy array per field.
+    
+    Numeric fields are int or float arrays. Label fields (the query and
+    subject ids) are int32 arrays of codes into Labels[field], so repeated
+    ids are stored once. Use getColumn for the ids themselves.
+    
+    Unlike BlastResult, there is no nesting by query: the hits of a query
+    are found by group-by operations on the arrays.
+    """
+    # which way is better for each field, e.g. want small e-values
+    FieldComparisonOperators = {
+        BlastResult.PERCENT_IDENTITY: numpy.greater,
+        BlastResult.ALIGNMENT_LENGTH: numpy.greater,
+        BlastResult.MISMATCHES: numpy.less,
+        BlastResult.E_VALUE: numpy.less,
+        BlastResult.BIT_SCORE: numpy.greater,
+        }
+    
+    def __init__(self, columns, labels=None, fields=None):
+        """Initialize self.
+        
+        columns: dict of {field: array}, all of the same length
+        labels: dict of {field: array of labels} for the coded fields
+        fields: the order of the fields (default is sorted)
+        """
+        self.Columns = columns
+        self.Labels = labels or {}
+        self.Fields = fields or sorted(columns)
+        lengths = set([len(c) for c in columns.values()])
+        if len(lengths) > 1:
+            raise ValueError("Columns differ in length")
+    
+    def __len__(self):
+        if not self.Columns:
+            return 0
+        return len(self.Columns[self.Fields[0]])
+    
+    def _field(self, field):
+        """Returns field name in the case used in self.Fields"""
+        if field in self.Columns:
+            return field
+        upper_field = field.upper()
+        if upper_field in self.Columns:
+            return upper_field
+        raise KeyError("No field %s" % field)
+    
+    def getColumn(self, field):
+        """Returns array of the values of field, with labels decoded"""
+        field = self._field(field)
+        column = self.Columns[field]
+        if field in self.Labels:
+            return self.Labels[field][column]
+        return column
+    
+    __getitem__ = getColumn
+    
+    def take(self, indices):
+        """Returns BlastHitColumns of the hits at indices (or a bool mask)"""
+        columns = dict([(field, column[indices]) for field, column in
+            self.Columns.items()])
+        return self.__class__(columns, self.Labels, self.Fields)
+    
+    def filterByField(self, field='E-value', threshold=0.001):
+        """Returns hits where field is better than threshold.
+        
+        Uses FieldComparisonOperators to figure out which direction to compare.
+        """
+        field = self._field(field)
+        if field not in self.FieldComparisonOperators:
+            raise ValueError, "Invalid field: %s. You must specify one of: %s" \
+                              % (field, str(self.FieldComparisonOperators))
+        better = self.FieldComparisonOperators[field]
+        return self.take(better(self.Columns[field], threshold))
+    
+    def filterByIteration(self, iteration=-1):
+        """Returns hits from the given PSI-BLAST iteration of each query.
+        
+        Negative indices count backwards from the last iteration of each
+        query. Hits without an ITERATION field are from iteration 1.
+        """
+        if BlastResult.ITERATION not in self.Columns:
+            if iteration in (1, -1):
+                return self
+            return self.take(numpy.zeros(len(self), bool))
+        iterations = self.Columns[BlastResult.ITERATION]
+        if iteration > 0 or not len(self):
+            return self.take(iterations == iteration)
+        order = numpy.argsort(self.Columns[BlastResult.QUERY_ID],
+            kind='mergesort')
+        starts = self._groupStarts(order)
+        last = numpy.maximum.reduceat(iterations[order], starts[:-1])
+        wanted = numpy.empty(len(self), int)
+        wanted[order] = numpy.repeat(last + iteration + 1, numpy.diff(starts))
+        return self.take(iterations == wanted)
+    
+    def _queryOrder(self, field):
+        """Returns hit indices sorted by query, and best field value first"""
+        values = self.Columns[field]
+        if self.FieldComparisonOperators[field] is numpy.greater:
+            values = -values
+        # stable, so ties stay in file order
+        return numpy.lexsort((values, self.Columns[BlastResult.QUERY_ID]))
+    
+    def _groupStarts(self, order):
+        """Returns start of each query's run of hits in order, and the end"""
+        queries = self.Columns[BlastResult.QUERY_ID][order]
+        starts = numpy.flatnonzero(queries[1:] != queries[:-1]) + 1
+        return numpy.concatenate(([0], starts, [len(queries)])).astype(int)
+    
+    def bestHitsByQuery(self, n=1, field='BIT SCORE', return_self=False):
+        """Returns the n best hits of each query, grouped by query.
+        
+        return_self: if False, hits of queries to themselves are skipped.
+        
+        Uses FieldComparisonOperators to figure out which direction to compare.
+        """
+        field = self._field(field)
+        if field not in self.FieldComparisonOperators:
+            raise ValueError, "Invalid field: %s. You must specify one of: %s" \
+                              % (field, str(self.FieldComparisonOperators))
+        hits = self
+        if not return_self:
+            hits = self.take(self.getColumn(BlastResult.QUERY_ID) !=
+                self.getColumn(BlastResult.SUBJECT_ID))
+        if not len(hits):
+            return hits
+        order = hits._queryOrder(field)
+        starts = hits._groupStarts(order)
+        # rank of each sorted hit within its query
+        sizes = numpy.diff(starts)
+        ranks = numpy.arange(len(order)) - numpy.repeat(starts[:-1], sizes)
+        return hits.take(order[ranks < n])
+    
+    def iterHitsByQuery(self):
+        """Yields (query id, BlastHitColumns of its hits) in file order"""
+        if not len(self):
+            return
+        queries = self.Columns[BlastResult.QUERY_ID]
+        order = numpy.argsort(queries, kind='mergesort')
+        starts = self._groupStarts(order)
+        first_hits = order[starts[:-1]]
+        labels = self.Labels[BlastResult.QUERY_ID]
+        for i in numpy.argsort(first_hits):
+            yield labels[queries[first_hits[i]]], \
+                self.take(order[starts[i]:starts[i+1]])
+    
+    def toTable(self, **kwargs):
+        """Returns a cogent.util.table.Table of the hits.
+        
+        kwargs are passed to the Table constructor.
+        """
+        from cogent.util.table import Table
+        columns = [self.getColumn(field).tolist() for field in self.Fields]
+        return Table(header=self.Fields, rows=zip(*columns), **kwargs)
+    
+    @classmethod
+    def fromLists(cls, columns, fields, column_types=blast_column_types):
+        """Returns BlastHitColumns from dict of {field: list of strings}.
+        
+        column_types gives the type of each field: int, float or 'label'.
+        Fields not in column_types are treated as labels.
+        """
+        arrays = {}
+        labels = {}
+        for field in fields:
+            values = columns[field]
+            kind = column_types.get(field, 'label')
+            if kind == 'label':
+                codes, labels[field] = _code_labels(values)
+                arrays[field] = codes
+            else:
+                arrays[field] = _to_numbers(values, kind, field)
+        return cls(arrays, labels, fields)
+    
+    @classmethod
+    def concatenate(cls, parts):
+        """Returns BlastHitColumns of the hits of parts, in order.
+        
+        Label codes are remapped to a shared set of labels.
+        """
+        if not parts:
+            return cls({})
+        fields = parts[0].Fields
+        arrays = {}
+        labels = {}
+        for field in fields:
+            if field not in parts[0].Labels:
+                arrays[field] = numpy.concatenate([p.Columns[field]
+                    for p in parts])
+                continue
+            all_labels = numpy.concatenate([p.Labels[field] for p in parts])
+            labels[field], inverse = _unique_in_order(all_labels)
+            codes = []
+            offset = 0
+            for p in parts:
+                n = len(p.Labels[field])
+                codes.append(inverse[offset:offset + n][p.Columns[field]])
+                offset += n
+            arrays[field] = numpy.concatenate(codes).astype(numpy.int32)
+        return cls(arrays, labels, fields)
+
+def _unique_in_order(values):
+    """Returns unique values in order of first occurrence, and codes"""
+    uniques, first, inverse = numpy.unique(values, return_index=True,
+        return_inverse=True)
+    order = numpy.argsort(first)
+    # renumber codes so they follow the order of first occurrence
+    recode = numpy.empty(len(order), numpy.int32)
+    recode[order] = numpy.arange(len(order))
+    return uniques[order], recode[inverse]
+
+def _code_labels(values):
+    """Returns int32 codes of values and array of the distinct labels"""
+    if not len(values):
+        return numpy.zeros(0, numpy.int32), numpy.zeros(0, str)
+    labels, codes = _unique_in_order(numpy.array(values, dtype=str))
+    return codes, labels
+
+def _to_numbers(values, kind, field):
+    """Returns array of type kind from strings, parsed in one call"""
+    result = numpy.fromstring(' '.join(values), dtype=kind, sep=' ')
+    if len(result) != len(values):
+        raise RecordError("Bad number in field %s" % field)
+    return result
+
+def _blast_fields(line):
+    """Returns field names from a '# Fields:' comment line"""
+    label, value = make_label(line)
+    fields = [f.strip().upper() for f in value.split(',')]
+    return [blast_field_aliases.get(f, f) for f in fields]
+
+def ColumnarBlastParser(lines, chunk_size=100000, fields=None):
+    """Returns BlastHitColumns of the hits in BLAST tabular output.
+    
+    lines: lines of -outfmt 6 or 7 (or legacy -m 8 or 9) output
+    chunk_size: number of lines converted to arrays at a time, so that
+        only chunk_size hits are ever held as strings.
+    fields: names of the columns. Default is the '# Fields:' line of
+        -outfmt 7 output if present, otherwise BLAST_TABULAR_FIELDS.
+    """
+    lines = iter(lines)
+    parts = []
+    iterations = []
+    iteration = None
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            break
+        rows = []
+        row_iterations = []
+        for line in chunk:
+            if line.startswith('#'):
+                if line.startswith('# Iteration:'):
+                    iteration = make_label(line)[1]
+                elif fields is None and line.startswith('# Fields:'):
+                    fields = _blast_fields(line)
+                continue
+            line = line.rstrip('\r\n')
+            if line:
+                rows.append(line.split('\t'))
+                row_iterations.append(iteration or 1)
+        if not rows:
+            continue
+        if fields is None:
+            fields = BLAST_TABULAR_FIELDS
+        if len(set(map(len, rows))) != 1 or len(rows[0]) != len(fields):
+            raise RecordError("Expected %s tab separated fields per hit" %
+                len(fields))
+        columns = dict(zip(fields, zip(*rows)))
+        parts.append(BlastHitColumns.fromLists(columns, fields))
+        iterations.append(numpy.array(row_iterations, numpy.int32))
+    if not parts:
+        fields = fields or BLAST_TABULAR_FIELDS
+        result = BlastHitColumns.fromLists(dict([(f, []) for f in fields]),
+            fields)
+    elif len(parts) == 1:
+        result = parts[0]
+    else:
+        result = BlastHitColumns.concatenate(parts)
+    # PSI-BLAST output, or legacy output that numbers its iterations
+    if iteration is not None:
+        if iterations:
+            iterations = numpy.concatenate(iterations)
+        else:
+            iterations = numpy.array([], numpy.int32)
+        result.Columns[BlastResult.ITERATION] = iterations
+        result.Fields = [BlastResult.ITERATION] + result.Fields
+    return result
+
+
 fastacmd_taxonomy_splitter = DelimitedRecordFinder(delimiter='', \
     ignore=never_ignore)
 fasta_field_map = { 'NCBI sequence id':'seq_id',
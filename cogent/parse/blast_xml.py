@@ -28,7 +28,11 @@ Possible improvements:
 - consider high speed parser for standard output
 """
 
-from cogent.parse.blast import BlastResult
+from cStringIO import StringIO
+from xml.etree.cElementTree import iterparse
+
+from cogent.parse.blast import BlastResult, BlastHitColumns, \
+    BLAST_TABULAR_FIELDS, blast_column_types
 
 # field names used to parse tags and create dict.
 HIT_XML_FIELDNAMES = ['QUERY ID','SUBJECT_ID','HIT_DEF','HIT_ACCESSION',\
@@ -230,3 +234,110 @@ class BlastXMLResult(BlastResult):
             self[query_id].append(hits)
         
 
+
+
+# columns of ColumnarBlastXmlParser, after those of tabular output
+XML_EXTRA_FIELDS = [BlastXMLResult.HIT_DEF, BlastXMLResult.HIT_ACCESSION,
+    BlastXMLResult.HIT_LENGTH, BlastXMLResult.SCORE, BlastXMLResult.POSITIVE]
+
+xml_column_types = blast_column_types.copy()
+xml_column_types.update({BlastXMLResult.HIT_LENGTH: int,
+    BlastXMLResult.SCORE: float, BlastXMLResult.POSITIVE: int})
+
+# tags whose text is needed, and the columns they give
+_xml_value_tags = {'Iteration_query-def': None, 'BlastOutput_query-def': None,
+    'Hit_id': BlastResult.SUBJECT_ID, 'Hit_def': BlastXMLResult.HIT_DEF,
+    'Hit_accession': BlastXMLResult.HIT_ACCESSION,
+    'Hit_len': BlastXMLResult.HIT_LENGTH,
+    'Hsp_identity': None, 'Hsp_gaps': None,
+    'Hsp_align-len': BlastResult.ALIGNMENT_LENGTH,
+    'Hsp_query-from': BlastResult.QUERY_START,
+    'Hsp_query-to': BlastResult.QUERY_END,
+    'Hsp_hit-from': BlastResult.SUBJECT_START,
+    'Hsp_hit-to': BlastResult.SUBJECT_END,
+    'Hsp_evalue': BlastResult.E_VALUE,
+    'Hsp_bit-score': BlastResult.BIT_SCORE,
+    'Hsp_score': BlastXMLResult.SCORE,
+    'Hsp_positive': BlastXMLResult.POSITIVE}
+
+def _hsp_row(values, query_id):
+    """Returns dict of column value strings for an Hsp from its tag values"""
+    row = {BlastResult.QUERY_ID: query_id}
+    for tag, field in _xml_value_tags.items():
+        if field is not None:
+            row[field] = values.get(tag) or '0'
+    align_len = int(row[BlastResult.ALIGNMENT_LENGTH])
+    identity = int(values.get('Hsp_identity') or 0)
+    gaps = int(values.get('Hsp_gaps') or 0)
+    row[BlastResult.PERCENT_IDENTITY] = repr(100.0*identity/(align_len or 1))
+    row[BlastResult.MISMATCHES] = str(align_len - identity - gaps)
+    row[BlastResult.GAP_OPENINGS] = str(gaps)
+    return row
+
+def _clear_values(values, prefix):
+    """Removes the tag values whose tags start with prefix"""
+    for tag in [t for t in values if t.startswith(prefix)]:
+        del values[tag]
+
+def ColumnarBlastXmlParser(data, chunk_size=100000):
+    """Returns BlastHitColumns of the HSPs in BLAST XML output.
+    
+    data: open file or lines of -outfmt 5 (or legacy -m 7) output
+    chunk_size: number of HSPs converted to arrays at a time
+    
+    The XML is read incrementally, so only chunk_size HSPs are ever held
+    as strings. The columns are those of tabular output plus
+    XML_EXTRA_FIELDS; the alignment strings are not kept. As in tabular
+    output, % identity and mismatches are computed from Hsp_identity,
+    Hsp_gaps and Hsp_align-len, and gap openings is Hsp_gaps. The query id
+    is the first word of the query definition, or its number if there is
+    none.
+    """
+    if not hasattr(data, 'read'):
+        data = StringIO(''.join(data))
+    fields = BLAST_TABULAR_FIELDS + XML_EXTRA_FIELDS
+    parts = []
+    rows = []
+    values = {}
+    query_number = 0
+    query_id = None
+    for event, elem in iterparse(data, events=('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == 'Iteration':
+                query_number += 1
+                values.pop('Iteration_query-def', None)
+                query_id = None
+            continue
+        if tag in _xml_value_tags:
+            values[tag] = elem.text
+        elif tag == 'Hsp':
+            if query_id is None:
+                query_def = values.get('Iteration_query-def') or \
+                    values.get('BlastOutput_query-def')
+                if query_def and query_def.split():
+                    query_id = query_def.split()[0]
+                else:
+                    query_id = str(query_number or 1)
+            rows.append(_hsp_row(values, query_id))
+            #optional tags must not carry over to the next Hsp or Hit
+            _clear_values(values, 'Hsp_')
+            elem.clear()
+            if len(rows) >= chunk_size:
+                parts.append(_rows_to_columns(rows, fields))
+                rows = []
+        elif tag == 'Hit':
+            _clear_values(values, 'Hit_')
+            elem.clear()
+        elif tag == 'Iteration':
+            elem.clear()
+    if rows or not parts:
+        parts.append(_rows_to_columns(rows, fields))
+    if len(parts) == 1:
+        return parts[0]
+    return BlastHitColumns.concatenate(parts)
+
+def _rows_to_columns(rows, fields):
+    """Returns BlastHitColumns from list of dicts of field values"""
+    columns = dict([(f, [row[f] for row in rows]) for f in fields])
+    return BlastHitColumns.fromLists(columns, fields, xml_column_types)
@@ -17,7 +17,8 @@ the aligned sequence will be:
 """
 
 import re
-from cogent.core.location import LostSpan, Span, Map, _LostSpan
+import numpy
+from cogent.core.location import LostSpan, Span, Map, _LostSpan, ArrayMap
 from cogent import DNA, LoadSeqs
 
 __author__ = "Hua Ying"
@@ -47,23 +48,19 @@ def map_to_cigar(map):
             cigar += str(num_chars)+char
     return cigar
 
+def cigar_to_array_map(cigar_text):
+    """convert cigar string into an ArrayMap"""
+    assert 'I' not in cigar_text
+    parts = pattern.findall(cigar_text)
+    lengths = numpy.array([int(n or 1) for (n, c) in parts], int)
+    matched = numpy.array([c == 'M' for (n, c) in parts], bool)
+    starts = numpy.cumsum(numpy.where(matched, lengths, 0)) - lengths
+    starts[~matched] = -1
+    return ArrayMap(starts, lengths, int(lengths[matched].sum()))
+
 def cigar_to_map(cigar_text):
     """convert cigar string into Map"""
-    assert 'I' not in cigar_text
-    spans, posn = [], 0
-    for n, c in pattern.findall(cigar_text):
-        if n:
-            n = int(n)
-        else:
-            n = 1
-            
-        if c == 'M':
-            spans.append(Span(posn, posn+n))
-            posn += n
-        else:
-            spans.append(LostSpan(n))
-    map = Map(spans = spans, parent_length = posn)
-    return map
+    return cigar_to_array_map(cigar_text).toMap()
 
 def aligned_from_cigar(cigar_text, seq, moltype=DNA):
     """returns an Aligned sequence from a cigar string, sequence and moltype"""
@@ -73,49 +70,25 @@ def aligned_from_cigar(cigar_text, seq, moltype=DNA):
     aligned_seq = seq.gappedByMap(map)
     return aligned_seq
 
-def _slice_by_aln(map, left, right):
-    slicemap = map[left:right]
-    if hasattr(slicemap, 'Start'):
-        location = [slicemap.Start, slicemap.End]
-    else:
-        location = []
-    return slicemap, location
-
-def _slice_by_seq(map, start, end):
-    re_map = map.inverse()
-    slicemap = re_map[start:end]
-    aln_start, aln_end = slicemap.Start, slicemap.End
-    new_map = map[aln_start:aln_end]
-    return new_map, [aln_start, aln_end]
-
-def _remap(map):
-    start = map.Start
-    if start == 0:
-        new_map = map
-        new_map.parent_length = map.End
-    else:
-        spans = []
-        for span in map.spans:
-            if span.lost:
-                spans.append(span)
-            else:
-                span.Start = span.Start - start
-                span.End = span.End - start
-                length = span.End
-                spans.append(span)
-        new_map = Map(spans = spans, parent_length = length)
-    return new_map
-
 def slice_cigar(cigar_text, start, end, by_align=True):
     """slices a cigar string as an alignment"""
-    map = cigar_to_map(cigar_text)
+    map = cigar_to_array_map(cigar_text)
     if by_align:
-        new_map, location = _slice_by_aln(map, start, end)
+        new_map = map[start:end]
+        if new_map.useful:
+            location = [new_map.Start, new_map.End]
+        else:
+            location = []
     else:
-        new_map, location = _slice_by_seq(map, start, end)
-    if hasattr(new_map, 'Start'):
-        new_map = _remap(new_map)
-    return new_map, location
+        slicemap = map.inverse()[start:end]
+        location = [slicemap.Start, slicemap.End]
+        new_map = map[slicemap.Start:slicemap.End]
+    if new_map.useful:
+        # relocate onto the sliced sequence
+        starts = numpy.where(new_map.starts < 0, -1,
+                new_map.starts - new_map.Start)
+        new_map = ArrayMap(starts, new_map.lengths, new_map.End-new_map.Start)
+    return new_map.toMap(), location
 
 def CigarParser(seqs, cigars, sliced = False, ref_seqname = None, start = None, end = None, moltype=DNA):
     """return an alignment from raw sequences and cigar strings
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""Reading of gzip, bzip2 and BGZF compressed files.
+
+The compression of a file is detected from its first bytes, not its name.
+open_compressed returns a streaming file object for any of the formats.
+BgzfReader gives random access to BGZF files (the blocked gzip format
+written by bgzip and used for BAM), both by uncompressed offset, so that
+indexes of the uncompressed data like .fai work unchanged, and by the
+virtual offsets used in BAM style indexes.
+"""
+import os
+import bz2
+import zlib
+import struct
+from bisect import bisect_right
+from gzip import GzipFile
+
+__author__ = "Gavin Huttley"
+__copyright__ = "Copyright 2007-2012, The Cogent Project"
+__credits__ = ["Gavin Huttley"]
+__license__ = "GPL"
+__version__ = "1.5.3-dev"
+__maintainer__ = "Gavin Huttley"
+__email__ = "gavin.huttley@anu.edu.au"
+__status__ = "Development"
+
+GZIP_MAGIC = '\x1f\x8b'
+BZ2_MAGIC = 'BZh'
+COMPRESSED_SUFFIXES = ('.gz', '.bgz', '.bz2')
+
+def _is_bgzf_header(header):
+    """Checks if header starts a gzip member with the BGZF extra field"""
+    return len(header) >= 18 and header.startswith(GZIP_MAGIC) and \
+            ord(header[3]) & 4 and header[12:14] == 'BC' and \
+            struct.unpack('<H', header[14:16])[0] == 2
+
+def compression_type(filename):
+    """Returns 'bgzf', 'gzip', 'bz2' or None for an uncompressed file"""
+    f = open(filename, 'rb')
+    header = f.read(18)
+    f.close()
+    if _is_bgzf_header(header):
+        return 'bgzf'
+    elif header.startswith(GZIP_MAGIC):
+        return 'gzip'
+    elif header.startswith(BZ2_MAGIC):
+        return 'bz2'
+    return None
+
+def strip_compressed_suffix(filename):
+    """Returns filename without a trailing .gz, .bgz or .bz2"""
+    for suffix in COMPRESSED_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+def open_compressed(filename, mode='U'):
+    """Returns an open file object for reading filename, decompressing it
+    while it is read if it is gzip, BGZF or bzip2 compressed.
+
+    mode: the mode for uncompressed files (default universal newlines).
+    """
+    kind = compression_type(filename)
+    if kind in ('gzip', 'bgzf'):
+        return GzipFile(filename, 'rb')
+    elif kind == 'bz2':
+        return bz2.BZ2File(filename, 'rU' if 'U' in mode else 'r')
+    return open(filename, mode)
+
+
+class BgzfReader(object):
+    """Read only, seekable file object for a BGZF compressed file.
+
+    seek, tell and read work in uncompressed offsets; seekVirtual and
+    tellVirtual in virtual offsets, (block start << 16) | offset in block.
+    Only the blocks that are read are decompressed. The table of block
+    offsets is built from the block headers when the file is opened.
+    """
+    def __init__(self, filename):
+        self.Filename = filename
+        self._file = open(filename, 'rb')
+        self._block_starts, self._data_starts = self._blockTable()
+        self._cached_block = None
+        self._cached_data = ''
+        self._offset = 0
+
+    def _blockTable(self):
+        """Returns compressed and uncompressed start offsets of the blocks"""
+        block_starts, data_starts = [0], [0]
+        f = self._file
+        size = os.fstat(f.fileno()).st_size
+        block_start = data_start = 0
+        while block_start < size:
+            f.seek(block_start)
+            header = f.read(18)
+            if not _is_bgzf_header(header):
+                raise IOError('Not a BGZF block at offset %s of %s'
+                        % (block_start, self.Filename))
+            block_size = struct.unpack('<H', header[16:18])[0] + 1
+            f.seek(block_start + block_size - 4)
+            data_size = struct.unpack('<I', f.read(4))[0]
+            block_start += block_size
+            data_start += data_size
+            block_starts.append(block_start)
+            data_starts.append(data_start)
+        #the last entries mark the ends of the file and of the data
+        self.Size = data_starts[-1]
+        return block_starts, data_starts
+
+    def _blockData(self, block):
+        """Returns the decompressed data of the block with index block"""
+        if block != self._cached_block:
+            start = self._block_starts[block]
+            self._file.seek(start)
+            raw = self._file.read(self._block_starts[block+1] - start)
+            extra_length = struct.unpack('<H', raw[10:12])[0]
+            self._cached_data = zlib.decompress(raw[12+extra_length:-8],
+                    -zlib.MAX_WBITS)
+            self._cached_block = block
+        return self._cached_data
+
+    def _blockAt(self, offset):
+        """Returns index of the block holding uncompressed offset"""
+        return bisect_right(self._data_starts, offset) - 1
+
+    def readAt(self, offset, size):
+        """Returns size bytes of uncompressed data starting at offset"""
+        pieces = []
+        end = min(offset + size, self.Size)
+        while offset < end:
+            block = self._blockAt(offset)
+            data = self._blockData(block)
+            start = offset - self._data_starts[block]
+            piece = data[start:start + end - offset]
+            if not piece:
+                break
+            pieces.append(piece)
+            offset += len(piece)
+        return ''.join(pieces)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.Size - self._offset
+        data = self.readAt(self._offset, size)
+        self._offset += len(data)
+        return data
+
+    def readline(self):
+        pieces = []
+        while self._offset < self.Size:
+            block = self._blockAt(self._offset)
+            data = self._blockData(block)
+            start = self._offset - self._data_starts[block]
+            end = data.find('\n', start)
+            if end == -1:
+                pieces.append(data[start:])
+                self._offset = self._data_starts[block+1]
+            else:
+                pieces.append(data[start:end+1])
+                self._offset += end + 1 - start
+                break
+        return ''.join(pieces)
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def seek(self, offset, whence=0):
+        """Moves to an uncompressed offset, whence as for file.seek"""
+        if whence == 1:
+            offset += self._offset
+        elif whence == 2:
+            offset += self.Size
+        self._offset = max(offset, 0)
+
+    def tell(self):
+        """Returns the current uncompressed offset"""
+        return self._offset
+
+    def seekVirtual(self, virtual_offset):
+        """Moves to a virtual offset: (block start << 16) | offset in block"""
+        block_start, within = virtual_offset >> 16, virtual_offset & 0xFFFF
+        block = bisect_right(self._block_starts, block_start) - 1
+        if self._block_starts[block] != block_start:
+            raise ValueError('No BGZF block starts at %s' % block_start)
+        self._offset = self._data_starts[block] + within
+
+    def tellVirtual(self):
+        """Returns the current position as a virtual offset"""
+        block = self._blockAt(self._offset)
+        within = self._offset - self._data_starts[block]
+        return (self._block_starts[block] << 16) | within
+
+    def close(self):
+        self._file.close()
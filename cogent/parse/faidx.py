@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""Random access to FASTA and FASTQ files through .fai style indexes.
+
+The index files are compatible with those written by samtools faidx. Each
+line has the tab separated fields
+
+    name  length  offset  linebases  linewidth  [qualoffset]
+
+where offset is the byte offset of the first base of the sequence,
+linebases and linewidth are the number of bases and of bytes (bases plus
+line terminator) on each full line, and qualoffset (FASTQ only) is the byte
+offset of the first quality character.
+"""
+import os
+import mmap
+
+from cogent.parse.record import RecordError
+from cogent.parse.compressed import compression_type, BgzfReader
+from cogent.core.alignment import SequenceCollection
+
+__author__ = "Gavin Huttley"
+__copyright__ = "Copyright 2007-2012, The Cogent Project"
+__credits__ = ["Gavin Huttley"]
+__license__ = "GPL"
+__version__ = "1.5.3-dev"
+__maintainer__ = "Gavin Huttley"
+__email__ = "gavin.huttley@anu.edu.au"
+__status__ = "Development"
+
+def _label_to_name(line):
+    """Returns the name in a label line: the first word after the marker"""
+    fields = line[1:].split(None, 1)
+    if not fields:
+        raise RecordError("Found label line without name: %r" % line)
+    return fields[0]
+
+def fasta_index_records(infile):
+    """Yields (name, length, offset, linebases, linewidth) for each record.
+
+    infile: FASTA file opened in binary mode (offsets are counted in bytes).
+
+    Raises RecordError if sequence lines occur before the first label, or
+    if the lines of a record (other than its last line) differ in length.
+    """
+    name = None
+    offset = 0
+    for line in infile:
+        if line.startswith('>'):
+            if name is not None:
+                yield (name, length, seq_offset, linebases or 0,
+                        linewidth or 0)
+            name = _label_to_name(line)
+            seq_offset = offset + len(line)
+            length = 0
+            linebases = linewidth = None
+            ended = False
+        elif name is None:
+            if line.strip():
+                raise RecordError("Found sequence before first label")
+        else:
+            bases = len(line.rstrip('\r\n'))
+            if not bases:
+                ended = True
+            elif ended:
+                raise RecordError("Different line length in sequence %s"
+                        % name)
+            elif linebases is None:
+                linebases, linewidth = bases, len(line)
+            elif bases > linebases:
+                raise RecordError("Different line length in sequence %s"
+                        % name)
+            elif bases < linebases or len(line) != linewidth:
+                #the last line of a record may be shorter
+                ended = True
+            length += bases
+        offset += len(line)
+    if name is not None:
+        yield (name, length, seq_offset, linebases or 0, linewidth or 0)
+
+def fastq_index_records(infile):
+    """Yields (name, length, offset, linebases, linewidth, qualoffset).
+
+    infile: FASTQ file with four lines per record, opened in binary mode.
+
+    Raises RecordError on records that don't have the label, sequence,
+    separator and quality lines, or whose quality and sequence lengths
+    differ.
+    """
+    offset = 0
+    lines = iter(infile)
+    for label in lines:
+        if not label.strip():
+            offset += len(label)
+            continue
+        if not label.startswith('@'):
+            raise RecordError("FASTQ label should start with '@': %r" % label)
+        name = _label_to_name(label)
+        try:
+            seq = lines.next()
+            sep = lines.next()
+            qual = lines.next()
+        except StopIteration:
+            raise RecordError("Incomplete FASTQ record %s" % name)
+        if not sep.startswith('+'):
+            raise RecordError("FASTQ separator should start with '+': %r"
+                    % sep)
+        length = len(seq.rstrip('\r\n'))
+        if len(qual.rstrip('\r\n')) != length:
+            raise RecordError("Quality and sequence lengths differ in %s"
+                    % name)
+        seq_offset = offset + len(label)
+        qual_offset = seq_offset + len(seq) + len(sep)
+        yield (name, length, seq_offset, length, len(seq), qual_offset)
+        offset = qual_offset + len(qual)
+
+def parse_fai(lines):
+    """Yields index records, as tuples of name and ints, from .fai lines"""
+    for line in lines:
+        fields = line.rstrip('\r\n').split('\t')
+        if not fields[0]:
+            continue
+        if len(fields) not in (5, 6):
+            raise RecordError("Index lines should have 5 or 6 fields: %r"
+                    % line)
+        yield tuple([fields[0]] + map(int, fields[1:]))
+
+def write_fai(records, outfile):
+    """Writes index records to outfile, one tab separated line each"""
+    for record in records:
+        outfile.write('\t'.join(map(str, record)) + '\n')
+
+
+class IndexedFasta(object):
+    """Dict-like read only view of an indexed FASTA file.
+
+    Sequences are read from the file only when asked for: getSeq and
+    slices of the items seek to the byte offsets of the requested region.
+    The file is memory mapped where possible.
+    """
+    _index_records = staticmethod(fasta_index_records)
+
+    def __init__(self, filename, index_filename=None, MolType=None,
+            write_index=True):
+        """Initialize IndexedFasta
+
+        filename: name of the FASTA file
+        index_filename: name of the index file. Default is filename + '.fai'
+        MolType: if given, sequences are returned as MolType sequences,
+            otherwise as strings
+        write_index: whether an index that had to be built should be saved
+            to index_filename
+
+        The index is read from index_filename if that exists, otherwise it
+        is built by a scan of the file. The file may be BGZF compressed (as
+        written by bgzip), in which case offsets refer to the uncompressed
+        data and only the blocks holding a requested region are read.
+        """
+        if index_filename is None:
+            index_filename = filename + '.fai'
+        self.Filename = filename
+        self.IndexFilename = index_filename
+        self.MolType = MolType
+        self.Compression = compression_type(filename)
+        if self.Compression not in (None, 'bgzf'):
+            raise ValueError("%s is %s compressed, random access needs "
+                    "BGZF compression" % (filename, self.Compression))
+
+        if os.path.exists(index_filename):
+            index_file = open(index_filename, 'U')
+            records = list(parse_fai(index_file))
+            index_file.close()
+        else:
+            seq_file = self._openData()
+            records = list(self._index_records(seq_file))
+            seq_file.close()
+            if write_index:
+                try:
+                    index_file = open(index_filename, 'w')
+                except IOError:
+                    pass
+                else:
+                    write_fai(records, index_file)
+                    index_file.close()
+
+        self.Names = []
+        self._index = {}
+        for record in records:
+            name = record[0]
+            if name in self._index:
+                raise RecordError("Duplicate sequence name %s" % name)
+            self.Names.append(name)
+            self._index[name] = record[1:]
+
+        self._file = self._openData()
+        self._data = None
+        if self.Compression is None:
+            try:
+                self._data = mmap.mmap(self._file.fileno(), 0,
+                        access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                #empty files and some file systems can't be mapped
+                pass
+
+    def _openData(self):
+        """Returns a seekable file object for the uncompressed data"""
+        if self.Compression == 'bgzf':
+            return BgzfReader(self.Filename)
+        return open(self.Filename, 'rb')
+
+    def close(self):
+        """Closes the underlying file"""
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
+
+    def _read(self, offset, num_bytes):
+        """Returns num_bytes of the file starting at offset"""
+        if self._data is not None:
+            return self._data[offset:offset+num_bytes]
+        self._file.seek(offset)
+        return self._file.read(num_bytes)
+
+    def _fetch(self, offset, linebases, linewidth, start, end):
+        """Returns characters start to end of the lines starting at offset"""
+        if end <= start or not linebases:
+            return ''
+        first = offset + (start // linebases) * linewidth + start % linebases
+        last = end - 1
+        last = offset + (last // linebases) * linewidth + last % linebases
+        return self._read(first, last + 1 - first).translate(None, '\r\n')
+
+    def _region(self, name, start, end):
+        """Returns index record of name and the normalized start and end"""
+        try:
+            record = self._index[name]
+        except KeyError:
+            raise KeyError("Sequence %s not in index" % name)
+        start, end, step = slice(start, end).indices(record[0])
+        return record, start, end
+
+    def getSeqLength(self, name):
+        """Returns the length of the sequence called name"""
+        try:
+            return self._index[name][0]
+        except KeyError:
+            raise KeyError("Sequence %s not in index" % name)
+
+    def getSeq(self, name, start=None, end=None):
+        """Returns the sequence called name, or its region from start to end
+
+        start and end are interpreted like slice bounds, so they may be
+        negative or None. Only the bytes of the region are read.
+        """
+        seq = self._seq_string(name, start, end)
+        if self.MolType is not None:
+            seq = self.MolType.makeSequence(seq, Name=name)
+        return seq
+
+    def keys(self):
+        return list(self.Names)
+
+    def __iter__(self):
+        return iter(self.Names)
+
+    def __len__(self):
+        return len(self.Names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __getitem__(self, name):
+        """Returns an IndexedSeq for name, which reads slices on demand"""
+        if name not in self._index:
+            raise KeyError("Sequence %s not in index" % name)
+        return IndexedSeq(self, name)
+
+    def iterSeqs(self, names=None):
+        """Yields (name, seq) for names (default all) in file order"""
+        if names is None:
+            names = self.Names
+        for name in names:
+            yield name, self.getSeq(name)
+
+    def toSequenceCollection(self, names=None, MolType=None):
+        """Returns a SequenceCollection of the named (default all) seqs"""
+        if MolType is None:
+            MolType = self.MolType
+        if names is None:
+            names = self.Names
+        data = [(name, self._seq_string(name)) for name in names]
+        return SequenceCollection(data, Names=list(names), MolType=MolType)
+
+    def _seq_string(self, name, start=None, end=None):
+        """Returns the region from start to end of name as a string"""
+        record, start, end = self._region(name, start, end)
+        return self._fetch(record[1], record[2], record[3], start, end)
+
+
+class IndexedFastq(IndexedFasta):
+    """Dict-like read only view of an indexed FASTQ file.
+
+    Adds getQual to the IndexedFasta interface. Records must have their
+    sequence and quality on single lines.
+    """
+    _index_records = staticmethod(fastq_index_records)
+
+    def getQual(self, name, start=None, end=None):
+        """Returns the quality string of name, or its region start to end"""
+        record, start, end = self._region(name, start, end)
+        if len(record) < 5:
+            raise RecordError("Index has no quality offsets")
+        length, offset, linebases, linewidth, qual_offset = record
+        return self._fetch(qual_offset, linebases, linewidth, start, end)
+
+
+class IndexedSeq(object):
+    """A sequence in an indexed file that is read when sliced"""
+
+    def __init__(self, source, name):
+        self.Source = source
+        self.Name = name
+
+    def __len__(self):
+        return self.Source.getSeqLength(self.Name)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step in (None, 1):
+                seq = self.Source._seq_string(self.Name, index.start,
+                        index.stop)
+            else:
+                seq = self.Source._seq_string(self.Name)[index]
+        else:
+            length = len(self)
+            if index < 0:
+                index += length
+            if not 0 <= index < length:
+                raise IndexError(index)
+            seq = self.Source._seq_string(self.Name, index, index + 1)
+        return seq
+
+    def __str__(self):
+        return self.Source._seq_string(self.Name)
+
+    def __repr__(self):
+        return '%s(%r, length=%s)' % (self.__class__.__name__, self.Name,
+                len(self))
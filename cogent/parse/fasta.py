@@ -39,13 +39,84 @@ def is_blank(x):
 
 FastaFinder = LabeledRecordFinder(is_fasta_label, ignore=is_blank_or_comment)
 
+FASTA_BLOCK_SIZE = 1 << 20
+
+#characters that make the lines of a record body differ from their stripped
+#versions, or that might start an ignored comment line
+_fasta_body_specials = ' \t\r\x0b\x0c#'
+
+def _fasta_segments(infile, block_size):
+    """Yields the text of infile split just before each line starting '>'"""
+    pieces = []
+    carry = ''
+    while True:
+        block = infile.read(block_size)
+        if not block:
+            break
+        text = carry + block
+        carry = ''
+        pos = 0
+        while True:
+            i = text.find('\n>', pos)
+            if i == -1:
+                break
+            pieces.append(text[pos:i+1])
+            yield ''.join(pieces)
+            pieces = []
+            pos = i + 1
+        #a newline at the end of the block may precede a label in the next one
+        if text.endswith('\n'):
+            pieces.append(text[pos:-1])
+            carry = '\n'
+        else:
+            pieces.append(text[pos:])
+    pieces.append(carry)
+    last = ''.join(pieces)
+    if last:
+        yield last
+
+def FastaBlockFinder(infile, block_size=FASTA_BLOCK_SIZE):
+    """Returns the same records as FastaFinder, reading infile in blocks.
+
+    infile must be a file-like object with a read method. Records are found
+    by searching each block for newlines followed by '>', and the sequence
+    lines of a record are joined by deleting the newlines, so for ordinary
+    records no list of lines is built. The last item of each record is
+    the whole sequence rather than its last line. Records containing
+    whitespace inside lines or comment lines are handed to FastaFinder.
+    """
+    for segment in _fasta_segments(infile, block_size):
+        if segment.startswith('>'):
+            end_label = segment.find('\n')
+            if end_label == -1:
+                label_line, body = segment, ''
+            else:
+                label_line, body = segment[:end_label], segment[end_label+1:]
+            for c in _fasta_body_specials:
+                if c in body:
+                    break
+            else:
+                seq = body.replace('\n', '')
+                if seq:
+                    yield [label_line.strip(), seq]
+                else:
+                    yield [label_line.strip()]
+                continue
+        for rec in FastaFinder(segment.split('\n')):
+            yield rec
+
 def MinimalFastaParser(infile, strict=True, \
     label_to_name=str, finder=FastaFinder, \
     is_label=None, label_characters='>'):
     """Yields successive sequences from infile as (label, seq) tuples.
 
     If strict is True (default), raises RecordError when label or seq missing.
+
+    File-like objects read with the default finder go through
+    FastaBlockFinder.
     """
+    if finder is FastaFinder and hasattr(infile, 'read'):
+        finder = FastaBlockFinder
     
     for rec in finder(infile):
         #first line must be a label line
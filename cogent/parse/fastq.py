@@ -7,14 +7,23 @@ __maintainer__ = "Gavin Huttley"
 __email__ = "Gavin.Huttley@anu.edu.au"
 __status__ = "Development"
 
+from itertools import islice
+
+import numpy
+
+from cogent.parse.record import RecordError
+from cogent.parse.compressed import open_compressed
+from cogent.util import parallel
+
 def MinimalFastqParser(data, strict=True):
     """yields name, seq, qual from fastq file
 
     Arguments:
         - strict: checks the quality and sequence labels are the same
     """
-    if type(data) == str:
-        data = open(data)
+    opened = type(data) == str
+    if opened:
+        data = open_compressed(data)
 
     # fastq format is very simple, defined by blocks of 4 lines
     line_num = -1
@@ -40,6 +49,93 @@ def MinimalFastqParser(data, strict=True):
             yield record[0][1:], record[1], record[3]
         
     
-    if type(data) == file:
+    if opened or type(data) == file:
         data.close()
 
+
+def _parse_fastq_chunk(text, strict=True, phred_offset=33):
+    """Returns labels, seqs, quals, lengths for the records in text
+
+    quals is a 2D uint8 array of Phred scores with a row per read, padded
+    with zeros past the end of each read; lengths gives the read lengths.
+    """
+    lines = text.splitlines()
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if len(lines) % 4:
+        raise RecordError('Incomplete FASTQ record: %s' % lines[-1])
+    labels = lines[0::4]
+    seqs = lines[1::4]
+    separators = lines[2::4]
+    quals = lines[3::4]
+
+    lengths = numpy.array(map(len, seqs), int)
+    qual_lengths = numpy.array(map(len, quals), int)
+    if (lengths != qual_lengths).any():
+        i = (lengths != qual_lengths).nonzero()[0][0]
+        raise RecordError('Quality and sequence lengths differ: %s'
+                % labels[i])
+    for label, sep in zip(labels, separators):
+        if label[:1] != '@' or sep[:1] != '+':
+            raise RecordError('Invalid format: %s -- %s' % (label, sep))
+        if strict and len(sep) > 1 and sep[1:] != label[1:]:
+            raise RecordError('Invalid format: %s -- %s'
+                    % (label[1:], sep[1:]))
+
+    scores = numpy.frombuffer(''.join(quals), numpy.uint8).copy()
+    if (scores < phred_offset).any():
+        raise RecordError('Quality characters below the Phred offset %s'
+                % phred_offset)
+    scores -= phred_offset
+    max_length = lengths.max() if len(lengths) else 0
+    result = numpy.zeros((len(seqs), max_length), numpy.uint8)
+    result[numpy.arange(max_length) < lengths[:, numpy.newaxis]] = scores
+    return [l[1:] for l in labels], seqs, result, lengths
+
+def FastqBatchParser(data, batch_size=10000, strict=True, phred_offset=33):
+    """yields labels, seqs, quals, lengths for batches of reads
+
+    Arguments:
+        - data: fastq file name or open file. Records must have four lines.
+        - batch_size: number of reads per batch (the last may have fewer)
+        - strict: checks the quality and sequence labels are the same
+          (a quality label line of just '+' is accepted)
+        - phred_offset: value of the character for a Phred score of zero
+
+    quals is a uint8 array of Phred scores with a row per read, padded with
+    zeros past the end of each read, and lengths gives the read lengths.
+    Batches are parsed by the CPUs of the current parallel context.
+    """
+    opened = type(data) == str
+    if opened:
+        data = open_compressed(data)
+    parse = lambda text: _parse_fastq_chunk(text, strict, phred_offset)
+    # batches are handed out in rounds, so memory use is bounded
+    round_size = parallel.getContext().size
+    if round_size > 1:
+        round_size *= 8
+    while True:
+        chunks = []
+        for i in range(round_size):
+            lines = list(islice(data, 4 * batch_size))
+            if not lines:
+                break
+            chunks.append(''.join(lines))
+        if not chunks:
+            break
+        for labels, seqs, quals, lengths in parallel.imap(parse, chunks):
+            if labels:
+                yield labels, seqs, quals, lengths
+    
+    if opened:
+        data.close()
+
+def FastqParser(data, strict=True, phred_offset=33, batch_size=10000):
+    """yields name, seq, qual from fastq file with qual as Phred scores
+
+    Arguments are as for FastqBatchParser. qual is a uint8 array.
+    """
+    for labels, seqs, quals, lengths in FastqBatchParser(data, batch_size,
+            strict, phred_offset):
+        for i in range(len(labels)):
+            yield labels[i], seqs[i], quals[i, :lengths[i]]
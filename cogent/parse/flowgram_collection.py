@@ -12,12 +12,16 @@ __Status__ = "Development"
 from copy import copy
 from types import GeneratorType
 
+import numpy
 from numpy import transpose
 from numpy.random import multinomial
 
 from cogent.util.unit_test import FakeRandom
 from cogent.core.sequence import Sequence
-from cogent.parse.flowgram_parser import parse_sff
+from cogent.parse.flowgram_parser import parse_sff, split_summary, \
+    get_header_info
+from cogent.parse.binary_sff import read_from_arrays, format_read, \
+    format_common_header
 from cogent.parse.flowgram import Flowgram
 from cogent.core.alignment import SequenceCollection
 
@@ -84,6 +88,63 @@ def flows_from_sff(flows):
     flows, head = parse_sff(flows)
     return flows_from_generic(flows)
 
+class BinarySffFlows(object):
+    """Read only list of flowgram strings of binary SFF read arrays.
+
+    reads is a dict as returned by parse_binary_sff_arrays. Each flowgram
+    string is formatted from the array of flowgram values when indexed.
+    """
+    def __init__(self, reads):
+        self.Reads = reads
+        values = reads['flowgram_values']
+        if values.dtype.kind in 'iu':
+            values = values * 0.01
+        self._values = values
+
+    def __len__(self):
+        return len(self._values)
+
+    def __getitem__(self, i):
+        return ' '.join(['%.2f' % v for v in self._values[i]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class BinarySffInfo(BinarySffFlows):
+    """Read only list of header_info dicts of binary SFF read arrays.
+
+    The dicts have the keys that parse_sff gives for the text format.
+    """
+    def __init__(self, reads):
+        self.Reads = reads
+        values = reads['flowgram_values']
+        if values.dtype.kind == 'f':
+            values = numpy.round(values * 100).astype(int)
+        self._values = values
+
+    def __getitem__(self, i):
+        read = read_from_arrays(self.Reads, i)
+        read['flowgram_values'] = self._values[i]
+        lines = [l for l in format_read(read).splitlines() if l.strip()]
+        info = split_summary(lines)
+        del info['Flowgram']
+        return info
+
+
+def flows_from_binary_sff(reads):
+    """FlowgramCollection from the read arrays of parse_binary_sff_arrays.
+
+    Flowgram strings and header info are formatted from the arrays when
+    they are first used, not up front.
+    """
+    return BinarySffFlows(reads), list(reads['Name']), BinarySffInfo(reads)
+
+def binary_sff_header_info(header):
+    """Returns FlowgramCollection header_info for a binary SFF header"""
+    return get_header_info(format_common_header(header).splitlines())
+
 def flows_from_generic(flows):
     """SequenceCollection from generic seq x pos data: seq of seqs of chars.
     
@@ -117,6 +178,7 @@ class FlowgramCollection(object):
     InputHandlers = {   'array': flows_from_array,
                         'dict': flows_from_dict,
                         'sff' :flows_from_sff,
+                        'binary_sff': flows_from_binary_sff,
                         'empty': flows_from_empty,
                         'kv_pairs':flows_from_kv_pairs,
                         'flowcoll':flows_from_flowCollection,
@@ -190,11 +252,28 @@ class FlowgramCollection(object):
             per_flow_names = name_order
 
         self.flow_str= flows  
-        self.flows = [Flowgram(f,n,keyseq,floworder, i)\
-                      for f,n, i in zip(flows,self.Names,info)]
-
-        #create NamedFlows dict for fast lookups
-        self.NamedFlows = self._make_named_flows(self.Names, self.flows)
+        #Flowgram objects are only built when first needed
+        self._flow_args = (info, keyseq, floworder)
+        self._flows = None
+        self._named_flows = None
+
+    def _get_flows(self):
+        """Returns the list of Flowgram objects, building it if needed"""
+        if self._flows is None:
+            info, keyseq, floworder = self._flow_args
+            self._flows = [Flowgram(f,n,keyseq,floworder, i)\
+                      for f,n, i in zip(self.flow_str,self.Names,info)]
+        return self._flows
+
+    flows = property(_get_flows)
+
+    def _get_named_flows(self):
+        """Returns NamedFlows dict for fast lookups, building it if needed"""
+        if self._named_flows is None:
+            self._named_flows = self._make_named_flows(self.Names, self.flows)
+        return self._named_flows
+
+    NamedFlows = property(_get_named_flows)
                 
 
     def _strip_duplicates(self, names, flows, info):
@@ -289,6 +368,8 @@ class FlowgramCollection(object):
         """
         
         if isinstance(data, dict):
+            if 'flowgram_values' in data and 'base_offsets' in data:
+                return 'binary_sff'
             return 'dict'
         if isinstance(data, str):
             return 'sff'
@@ -325,7 +406,7 @@ class FlowgramCollection(object):
 
     def __len__(self):
         """returns the number of flowgrams in the collection"""
-        return len(self.flows)
+        return len(self.Names)
 
     def __iter__(self):
         """iterates over the flows in the collection"""
@@ -4,6 +4,7 @@ from cogent.parse.record_finder import DelimitedRecordFinder, \
     LabeledRecordFinder
 from cogent.core.genetic_code import GeneticCodes
 from string import maketrans, strip, rstrip
+from itertools import islice
 from cogent.core.moltype import PROTEIN, DNA, ASCII
 from cogent.core.annotation import Feature
 from cogent.core.info import Info
@@ -431,13 +432,21 @@ class LocationList(list):
         return ''.join(result)
     
 
-def parse_feature_table(lines):
-    """Simple parser for feature table. Assumes starts with FEATURES line."""
+def parse_feature_table(lines, feature_types=None):
+    """Simple parser for feature table. Assumes starts with FEATURES line.
+    
+    feature_types: if given, only features of these types are parsed; the
+    locations and qualifiers of other features are never parsed.
+    """
     if not lines:
         return []
     if lines[0].startswith('FEATURES'):
         lines = lines[1:]
-    return [parse_feature(f) for f in indent_splitter(lines)]
+    features = indent_splitter(lines)
+    if feature_types is not None:
+        features = [f for f in features \
+            if f[0].split(None, 1)[0] in feature_types]
+    return [parse_feature(f) for f in features]
 
 reference_label_marker = ' ' * 11
 reference_field_finder = LabeledRecordFinder(lambda x: \
@@ -493,23 +502,163 @@ handlers = {
     '?': lambda lines, curr: None
 }
 
+def feature_table_handlers(feature_types, handlers=handlers):
+    """Returns copy of handlers parsing only features of feature_types."""
+    def selective_feature_table_adaptor(lines, curr):
+        if 'features' not in curr:
+            curr['features'] = []
+        curr['features'].extend(parse_feature_table(lines, feature_types))
+    result = handlers.copy()
+    result['FEATURES'] = selective_feature_table_adaptor
+    return result
+
+def _parse_fields(lines, curr, handlers, default_handler):
+    """Updates curr with the data from each field of lines."""
+    for field in indent_splitter(lines):
+        first_word = field[0].split(None, 1)[0]
+        handler = handlers.get(first_word, default_handler)
+        handler(field, curr)
+
+def _parse_record(lines, handlers=handlers, default_handler=generic_adaptor):
+    """Returns dict of the fields of a GenBank record, or None if bad."""
+    curr = {}
+    try:
+        _parse_fields(lines, curr, handlers, default_handler)
+    except:
+        return None
+    return curr
+
 def MinimalGenbankParser(lines, handlers=handlers,\
-    default_handler=generic_adaptor):
+    default_handler=generic_adaptor, feature_types=None, lazy=False):
+    """Yields a dict for each GenBank record in lines.
+    
+    Records that can't be parsed are skipped.
+    
+    Arguments:
+        - feature_types: if given, only features of these types are parsed
+        - lazy: if True, yields GenbankRecord objects, which only parse the
+          header, features or sequence when they are first accessed (and
+          raise any parsing errors then).
+    """
+    if feature_types is not None:
+        handlers = feature_table_handlers(feature_types, handlers)
     for rec in GbFinder(lines):
-        curr = {}
-        bad_record = False
-        for field in indent_splitter(rec):
-            first_word = field[0].split(None, 1)[0]
-            handler = handlers.get(first_word, default_handler)
+        if lazy:
+            yield GenbankRecord(rec, handlers, default_handler)
+            continue
+        curr = _parse_record(rec, handlers, default_handler)
+        if curr is not None:
+            yield curr
 
-            try:
-                handler(field, curr)
-            except:
-                bad_record = True
-                break
+_locus_keys = dict.fromkeys([f for f in locus_fields if f is not None])
 
-        if not bad_record:
-            yield curr
+def _record_section(key):
+    """Returns the section of a GenBank record that has key."""
+    if key in _locus_keys:
+        return 'locus'
+    elif key in ('features', 'sequence'):
+        return key
+    return 'header'
+
+class GenbankRecord(object):
+    """A GenBank record that is parsed as it is used.
+    
+    Behaves like the dicts yielded by MinimalGenbankParser. The record is
+    split into its LOCUS line, header fields, feature table and sequence,
+    and each of these is only parsed when one of its keys is first looked
+    up, so e.g. scanning records for their features never parses their
+    sequences.
+    """
+    def __init__(self, lines, handlers=handlers, \
+            default_handler=generic_adaptor):
+        self._handlers = handlers
+        self._default_handler = default_handler
+        self._sections = {'locus':[], 'header':[], 'features':[],
+            'sequence':[]}
+        section = self._sections['header']
+        for line in lines:
+            if line[:1] and not line[0].isspace():
+                if line.startswith('LOCUS'):
+                    section = self._sections['locus']
+                elif line.startswith('FEATURES'):
+                    section = self._sections['features']
+                elif line.startswith('ORIGIN'):
+                    section = self._sections['sequence']
+                else:
+                    section = self._sections['header']
+            section.append(line)
+        self._data = {}
+        self._sequence_defaults = (None, None, None)
+    
+    def _load(self, section):
+        """Parses section, if it has not already been parsed."""
+        lines = self._sections[section]
+        if lines is None:
+            return
+        _parse_fields(lines, self._data, self._handlers, \
+            self._default_handler)
+        self._sections[section] = None
+    
+    def _loadAll(self):
+        for section in self._sections:
+            self._load(section)
+    
+    def __getitem__(self, key):
+        self._load(_record_section(key))
+        return self._data[key]
+    
+    def __contains__(self, key):
+        self._load(_record_section(key))
+        return key in self._data
+    
+    def get(self, key, default=None):
+        if key in self:
+            return self._data[key]
+        return default
+    
+    def keys(self):
+        self._loadAll()
+        return self._data.keys()
+    
+    def items(self):
+        self._loadAll()
+        return self._data.items()
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __len__(self):
+        return len(self.keys())
+    
+    def hasSequence(self):
+        """Returns whether the record has sequence data.
+        
+        The sequence is not parsed if the record has no ORIGIN section.
+        """
+        if self._sections['sequence'] == []:
+            return False
+        return 'sequence' in self
+    
+    def setSequenceDefaults(self, info_excludes=None, moltype=None, \
+            add_annotation=None):
+        """Sets the arguments toSequence uses when it isn't given them"""
+        self._sequence_defaults = (info_excludes, moltype, add_annotation)
+    
+    def toSequence(self, info_excludes=None, moltype=None, \
+            add_annotation=None):
+        """Returns the annotated sequence, as made by RichGenbankParser.
+        
+        Arguments that are None default to those of setSequenceDefaults.
+        Returns None for records without sequence data (e.g. contigs).
+        """
+        defaults = self._sequence_defaults
+        if info_excludes is None:
+            info_excludes = defaults[0]
+        if moltype is None:
+            moltype = defaults[1]
+        if add_annotation is None:
+            add_annotation = defaults[2]
+        return rich_sequence(self, info_excludes, moltype, add_annotation)
 
 def parse_location_segment(location_segment):
     """Parses a location segment into its component pieces.
@@ -566,8 +715,87 @@ def extract_nt_prot_seqs(rec, wanted=wanted_types):
         print 'ct:', GeneticCodes[f.get('transl_table', '1')[0]].translate(seq)
         print 's :', seq
 
+def rich_sequence(rec, info_excludes=None, moltype=None, \
+        add_annotation=None):
+    """Returns annotated sequence from a parsed GenBank record.
+    
+    Arguments are as for RichGenbankParser. Returns None if the record
+    has no sequence data.
+    """
+    info_excludes = info_excludes or []
+    moltype = moltype or ASCII
+    if 'sequence' not in rec:
+        return None
+    info = Info()
+    # populate the Info object, excluding the sequence
+    for label, value in rec.items():
+        if label in info_excludes:
+            continue
+        info[label] = value
+    
+    if rec.get('mol_type') == 'protein':  # which it doesn't for genbank
+        moltype = PROTEIN
+    elif rec.get('mol_type') == 'DNA':
+        moltype = DNA
+    
+    seq = moltype.makeSequence(rec['sequence'].upper(), Info=info,
+                                Name=rec['locus'])
+    
+    for feature in rec.get('features', []):
+        spans = []
+        reversed = None
+        if feature['location'] == None or feature['type'] in ['source', \
+                                                            'organism']:
+            continue
+        for location in feature['location']:
+            (lo, hi) = (location.first() - 1, location.last())
+            if location.Strand == -1:
+                (lo, hi) = (hi, lo)
+                assert reversed is not False
+                reversed = True
+            else:
+                assert reversed is not True
+                reversed = False
+            # ensure we don't put in a span that starts beyond the sequence
+            if lo > len(seq):
+                continue
+            # or that's longer than the sequence
+            hi = [hi, len(seq)][hi > len(seq)]
+            spans.append((lo, hi))
+        
+        if add_annotation:
+            add_annotation(seq, feature, spans)
+        else:
+            for id_field in ['gene', 'note', 'product', 'clone']:
+                if id_field in feature:
+                    name = feature[id_field]
+                    if not isinstance(name, basestring):
+                        name = ' '.join(name)
+                    break
+            else:
+                name = None
+            seq.addAnnotation(Feature, feature['type'], name, spans)
+    return seq
+
+def _rich_records(recs, info_excludes, moltype, skip_contigs, add_annotation):
+    """Returns list of (locus, seq) for parsed GenBank records."""
+    result = []
+    for rec in recs:
+        seq = rich_sequence(rec, info_excludes, moltype, add_annotation)
+        if seq is not None:
+            result.append((rec['locus'], seq))
+        elif not skip_contigs:
+            if 'contig' in rec:
+                result.append((rec['locus'], rec['contig']))
+            elif 'WGS' in rec:
+                result.append((rec['locus'], rec['WGS']))
+            else:
+                result.append((rec['locus'], None))
+    return result
+
 def RichGenbankParser(handle, info_excludes=None, moltype=None,
-    skip_contigs=False, add_annotation=None):
+    skip_contigs=False, add_annotation=None, feature_types=None, lazy=False,
+    records_per_task=100):
     """Returns annotated sequences from GenBank formatted file.
     
     Arguments:
@@ -577,72 +805,57 @@ def RichGenbankParser(handle, info_excludes=None, moltype=None,
           a genomic contig.
         - add_annotation: a callback function to create an new annotation from a
           GenBank feature. Function is called with the sequence, a feature dict
-          and the feature spans."""
-    info_excludes = info_excludes or []
-    moltype = moltype or ASCII
-    for rec in MinimalGenbankParser(handle):
-        info = Info()
-        # populate the Info object, excluding the sequence
-        for label, value in rec.items():
-            if label in info_excludes:
-                continue
-            info[label] = value
-        
-        if rec['mol_type'] == 'protein':  # which it doesn't for genbank
-            moltype = PROTEIN
-        elif rec['mol_type'] == 'DNA':
-            moltype = DNA
-        
-        try:
-            seq = moltype.makeSequence(rec['sequence'].upper(), Info=info,
-                                        Name=rec['locus'])
-        except KeyError:
-            if not skip_contigs:
-                if 'contig' in rec:
-                    yield rec['locus'], rec['contig']
-                elif 'WGS' in rec:
-                    yield rec['locus'], rec['WGS']
-                else:
-                    yield rec['locus'], None
-            continue
-        
-        for feature in rec['features']:
-            spans = []
-            reversed = None
-            if feature['location'] == None or feature['type'] in ['source', \
-                                                                'organism']:
+          and the feature spans.
+        - feature_types: if given, only features of these types, e.g.
+          ['CDS'], are parsed and annotated.
+        - lazy: if True, yields (locus, GenbankRecord) pairs instead. The
+          records parse their header, features and sequence only when they
+          are accessed; GenbankRecord.toSequence makes the annotated sequence,
+          using info_excludes, moltype and add_annotation. With skip_contigs,
+          records without sequence data are skipped.
+        - records_per_task: number of records handed to each CPU at a time
+          when the current parallel context has more than one CPU.
+    
+    Records are parsed by the CPUs of the current parallel context."""
+    if lazy:
+        for rec in MinimalGenbankParser(handle, feature_types=feature_types,
+                lazy=True):
+            if skip_contigs and not rec.hasSequence():
                 continue
-            for location in feature['location']:
-                (lo, hi) = (location.first() - 1, location.last())
-                if location.Strand == -1:
-                    (lo, hi) = (hi, lo)
-                    assert reversed is not False
-                    reversed = True
-                else:
-                    assert reversed is not True
-                    reversed = False
-                # ensure we don't put in a span that starts beyond the sequence
-                if lo > len(seq):
-                    continue
-                # or that's longer than the sequence
-                hi = [hi, len(seq)][hi > len(seq)]
-                spans.append((lo, hi))
-            
-            if add_annotation:
-                add_annotation(seq, feature, spans)
-            else:
-                for id_field in ['gene', 'note', 'product', 'clone']:
-                    if id_field in feature:
-                        name = feature[id_field]
-                        if not isinstance(name, basestring):
-                            name = ' '.join(name)
-                        break
-                else:
-                    name = None
-                seq.addAnnotation(Feature, feature['type'], name, spans)
-        
-        yield (rec['locus'], seq)
-        
+            rec.setSequenceDefaults(info_excludes, moltype, add_annotation)
+            yield rec['locus'], rec
+        return
+    
+    handlers_ = handlers
+    if feature_types is not None:
+        handlers_ = feature_table_handlers(feature_types)
+    def parse(recs):
+        recs = [_parse_record(rec, handlers_) for rec in recs]
+        return _rich_records([rec for rec in recs if rec is not None],
+            info_excludes, moltype, skip_contigs, add_annotation)
+    
+    # imported here, as importing parallel warns if mpi4py is missing
+    from cogent.util import parallel
+    # records are handed out in rounds, so memory use is bounded
+    round_size = parallel.getContext().size
+    if round_size > 1:
+        round_size *= 8
+    else:
+        records_per_task = 1
+    records = GbFinder(handle)
+    while True:
+        tasks = []
+        for i in range(round_size):
+            recs = list(islice(records, records_per_task))
+            if not recs:
+                break
+            tasks.append(recs)
+        if not tasks:
+            break
+        for results in parallel.imap(parse, tasks):
+            for result in results:
+                yield result
+
 def parse(*args):
     return RichGenbankParser(*args).next()[1]
 
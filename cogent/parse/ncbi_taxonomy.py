@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 """Extracts data from NCBI nodes.dmp and names.dmp files.
+
+The dumps can also be compiled once into a binary cache of parent, rank and
+name arrays (see compile_ncbi_taxonomy), which NcbiTaxonomyFromCache maps
+into memory without parsing.
 """
+import mmap
+import struct
 from cogent.core.tree import TreeNode
 from string import strip
+from numpy import array, zeros, empty, arange, argsort, searchsorted, where, \
+    frombuffer, concatenate, cumsum, int32, int64, uint8
 
 __author__ = "Jason Carnes"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -253,3 +261,383 @@ def NcbiTaxonomyFromFiles(nodes_file, names_file, strict=False):
     taxa = NcbiTaxonLookup(NcbiTaxonParser(nodes_file))
     names = NcbiNameLookup(NcbiNameParser(names_file))
     return NcbiTaxonomy(taxa, names, strict)
+
+
+CACHE_MAGIC = 'NCBITAX\x01'
+_cache_header = struct.Struct('<8sqqq')
+
+def _cache_sections(num_taxa, names_size, ranks_size):
+    """Returns (name, dtype, count, offset) of the arrays in a cache file.
+    
+    Each array starts at a multiple of 8 bytes after the header.
+    """
+    layout = [('TaxonIds', int32, num_taxa), ('Parents', int32, num_taxa),
+        ('Depths', int32, num_taxa), ('Ranks', uint8, num_taxa),
+        ('NameStarts', int64, num_taxa + 1), ('NameOrder', int32, num_taxa),
+        ('ChildOrder', int32, num_taxa), ('ChildStarts', int32, num_taxa + 1),
+        ('Names', uint8, names_size), ('RankNames', uint8, ranks_size)]
+    result = []
+    offset = _cache_header.size
+    for name, dtype, count in layout:
+        result.append((name, dtype, count, offset))
+        size = count * array([], dtype).itemsize
+        offset += size + (-size % 8)
+    return result
+
+def _taxonomy_arrays(nodes_file, names_file, strict=False):
+    """Returns dict of the cache arrays from nodes and names lines."""
+    taxon_ids, parent_ids, rank_names = [], [], []
+    for line in nodes_file:
+        fields = line.split('|', 3)
+        if len(fields) < 3:
+            continue
+        taxon_ids.append(int(fields[0]))
+        parent_ids.append(int(fields[1]))
+        rank_names.append(fields[2].strip())
+    taxon_ids = array(taxon_ids, int32)
+    parent_ids = array(parent_ids, int32)
+    order = argsort(taxon_ids, kind='mergesort')
+    taxon_ids = taxon_ids[order]
+    parent_ids = parent_ids[order]
+    num_taxa = len(taxon_ids)
+
+    #parents are stored as indices, roots and deadbeats get -1
+    parents = searchsorted(taxon_ids, parent_ids).astype(int32)
+    found = parents < num_taxa
+    found[found] = taxon_ids[parents[found]] == parent_ids[found]
+    if strict and not found.all():
+        raise MissingParentError, \
+            "Node %s has parent %s, which isn't in taxa." % \
+            (taxon_ids[~found][0], parent_ids[~found][0])
+    parents[~found | (parent_ids == taxon_ids)] = -1
+
+    #depths by pointer jumping: each round doubles the distance covered
+    depths = (parents >= 0).astype(int32)
+    current = parents.copy()
+    for step in xrange(64):
+        up = (current >= 0).nonzero()[0]
+        if not len(up):
+            break
+        jump = current[up]
+        depths[up] += depths[jump]
+        current[up] = current[jump]
+    else:
+        raise ValueError('Taxonomy parents contain a cycle')
+
+    rank_list = sorted(set(rank_names))
+    rank_codes = dict([(r, i) for i, r in enumerate(rank_list)])
+    ranks = array([rank_codes[r] for r in rank_names], uint8)[order]
+
+    names = {}
+    for line in names_file:
+        fields = line.split('|')
+        if len(fields) > 3 and fields[3].strip() == 'scientific name':
+            names[int(fields[0])] = fields[1].strip()
+    names = [names.get(t_id, 'Unknown') for t_id in taxon_ids.tolist()]
+    name_starts = concatenate([[0], cumsum([len(n) for n in names])])
+
+    child_order = argsort(parents, kind='mergesort').astype(int32)
+    child_starts = searchsorted(parents[child_order],
+        arange(num_taxa + 1)).astype(int32)
+    return {'TaxonIds': taxon_ids, 'Parents': parents, 'Depths': depths,
+        'Ranks': ranks, 'NameStarts': name_starts.astype(int64),
+        'NameOrder': argsort(array(names, object), kind='mergesort'
+            ).astype(int32),
+        'ChildOrder': child_order, 'ChildStarts': child_starts,
+        'Names': ''.join(names), 'RankNames': '\n'.join(rank_list)}
+
+def compile_ncbi_taxonomy(nodes_file, names_file, filename, strict=False):
+    """Writes a binary taxonomy cache from nodes.dmp and names.dmp lines.
+
+    The cache holds, in taxon id order, the parent, depth, rank and
+    scientific name of each taxon, plus the orders by name and by parent
+    used for lookups. NcbiTaxonomyFromCache reads it.
+
+    strict, if True, raises MissingParentError on finding taxa whose parents
+    don't exist. Otherwise they are stored as roots.
+    """
+    arrays = _taxonomy_arrays(nodes_file, names_file, strict)
+    sections = _cache_sections(len(arrays['TaxonIds']),
+        len(arrays['Names']), len(arrays['RankNames']))
+    outfile = open(filename, 'wb')
+    outfile.write(_cache_header.pack(CACHE_MAGIC, len(arrays['TaxonIds']),
+        len(arrays['Names']), len(arrays['RankNames'])))
+    for name, dtype, count, offset in sections:
+        outfile.write('\0' * (offset - outfile.tell()))
+        data = arrays[name]
+        if not isinstance(data, str):
+            data = data.astype(dtype).tostring()
+        outfile.write(data)
+    outfile.close()
+
+class MappedNcbiTaxonomy(object):
+    """Taxonomy backed by the arrays of a memory mapped taxonomy cache.
+
+    Properties:
+        TaxonIds    sorted taxon ids
+        Parents     index of the parent of each taxon, -1 for roots
+        Depths      number of ancestors of each taxon
+        Ranks       code of the rank of each taxon, see RankNames
+        RankNames   list of the rank names
+
+    Nodes are made when they are asked for, by id or by name as with
+    NcbiTaxonomy. getLineage, lastCommonAncestor and lastCommonAncestors
+    work on the arrays and return taxon ids.
+    """
+    def __init__(self, filename):
+        """Maps the cache written by compile_ncbi_taxonomy into memory."""
+        infile = open(filename, 'rb')
+        try:
+            self._data = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            self._data = infile.read()
+        infile.close()
+        magic, num_taxa, names_size, ranks_size = _cache_header.unpack(
+            self._data[:_cache_header.size])
+        if magic != CACHE_MAGIC:
+            raise ValueError('%s is not a taxonomy cache' % filename)
+        for name, dtype, count, offset in _cache_sections(num_taxa,
+                names_size, ranks_size):
+            setattr(self, name, frombuffer(self._data, dtype, count, offset))
+            if name == 'Names':
+                self._names_offset = offset
+        self.RankNames = self.RankNames.tostring().split('\n')
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self.TaxonIds)
+
+    def __contains__(self, taxon_id):
+        try:
+            self.getIndex(taxon_id)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, item):
+        """If item is int, returns taxon by id: otherwise, searches by name.
+        
+        Returns the relevant MappedNcbiTaxonNode.
+        Will raise KeyError if not present.
+        """
+        try:
+            index = self.getIndex(int(item))
+        except ValueError:
+            index = self._nameIndex(item)
+        return self._node(index)
+
+    def _node(self, index):
+        """Returns the node of the taxon at index, made on first use"""
+        try:
+            return self._nodes[index]
+        except KeyError:
+            node = self._nodes[index] = MappedNcbiTaxonNode(self, index)
+            return node
+
+    def getIndex(self, taxon_id):
+        """Returns the index of taxon_id in the arrays"""
+        index = searchsorted(self.TaxonIds, taxon_id)
+        if index == len(self.TaxonIds) or self.TaxonIds[index] != taxon_id:
+            raise KeyError(taxon_id)
+        return int(index)
+
+    def getIndices(self, taxon_ids):
+        """Returns the indices of a sequence of taxon ids in the arrays"""
+        taxon_ids = array(taxon_ids, int32)
+        indices = searchsorted(self.TaxonIds, taxon_ids)
+        found = indices < len(self.TaxonIds)
+        found[found] = self.TaxonIds[indices[found]] == taxon_ids[found]
+        if not found.all():
+            raise KeyError(taxon_ids[~found][0])
+        return indices
+
+    def _name(self, index):
+        """Returns the scientific name of the taxon at index"""
+        offset = self._names_offset
+        return self._data[offset + self.NameStarts[index]:
+            offset + self.NameStarts[index + 1]]
+
+    def _nameIndex(self, name):
+        """Returns the index of a taxon with scientific name"""
+        lo, hi = 0, len(self.NameOrder)
+        order = self.NameOrder
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(order[mid]) < name:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(order) and self._name(order[lo]) == name:
+            return int(order[lo])
+        raise KeyError(name)
+
+    def getName(self, taxon_id):
+        """Returns the scientific name of taxon_id"""
+        return self._name(self.getIndex(taxon_id))
+
+    def getRank(self, taxon_id):
+        """Returns the rank of taxon_id"""
+        return self.RankNames[self.Ranks[self.getIndex(taxon_id)]]
+
+    def getLineage(self, taxon_id):
+        """Returns array of taxon ids from taxon_id back to its root"""
+        index = self.getIndex(taxon_id)
+        lineage = empty(self.Depths[index] + 1, int32)
+        for i in xrange(len(lineage)):
+            lineage[i] = index
+            index = self.Parents[index]
+        return self.TaxonIds[lineage]
+
+    def _commonAncestors(self, first, second):
+        """Returns indices of the last common ancestors of pairs of indices"""
+        first, second = first.copy(), second.copy()
+        depths = self.Depths
+        parents = self.Parents
+        while True:
+            differ = (first != second) & (first >= 0) & (second >= 0)
+            if not differ.any():
+                break
+            first_deeper = differ & (depths[first] >= depths[second])
+            second_deeper = differ & (depths[second] >= depths[first])
+            first[first_deeper] = parents[first[first_deeper]]
+            second[second_deeper] = parents[second[second_deeper]]
+        #taxa in different trees have no common ancestor
+        return where(first == second, first, -1)
+
+    def lastCommonAncestors(self, first_ids, second_ids):
+        """Returns array of last common ancestors of pairs of taxon ids.
+
+        Pairs without a common ancestor get -1.
+        """
+        result = self._commonAncestors(self.getIndices(first_ids),
+            self.getIndices(second_ids))
+        return where(result >= 0, self.TaxonIds[result], -1)
+
+    def lastCommonAncestor(self, taxon_ids):
+        """Returns last common ancestor of taxon ids, or None"""
+        indices = self.getIndices(taxon_ids)
+        while len(indices) > 1:
+            half = len(indices) // 2
+            common = self._commonAncestors(indices[:half],
+                indices[half:2 * half])
+            if (common < 0).any():
+                return None
+            indices = concatenate([common, indices[2 * half:]])
+        if not len(indices):
+            return None
+        return int(self.TaxonIds[indices[0]])
+
+    def getRankedAncestors(self, taxon_ids, rank):
+        """Returns array of the ancestors (or selves) of taxon ids at rank.
+
+        Taxa without an ancestor at rank get -1.
+        """
+        indices = self.getIndices(taxon_ids)
+        if rank not in self.RankNames:
+            return zeros(len(indices), int32) - 1
+        code = self.RankNames.index(rank)
+        searching = indices >= 0
+        while True:
+            searching &= (indices >= 0)
+            searching[searching] = self.Ranks[indices[searching]] != code
+            if not searching.any():
+                break
+            indices[searching] = self.Parents[indices[searching]]
+        return where(indices >= 0, self.TaxonIds[indices], -1)
+
+
+class MappedNcbiTaxonNode(object):
+    """Node of a MappedNcbiTaxonomy, reading its data from the arrays.
+
+    Provides the NcbiTaxonNode properties and tree navigation.
+    """
+    def __init__(self, taxonomy, index):
+        self.Taxonomy = taxonomy
+        self.Index = index
+
+    def __repr__(self):
+        return '%s(%s, %r)' % (self.__class__.__name__, self.TaxonId,
+            self.Name)
+
+    def _get_taxon_id(self):
+        return int(self.Taxonomy.TaxonIds[self.Index])
+    TaxonId = property(_get_taxon_id)
+
+    def _get_parent_id(self):
+        parent = self.Taxonomy.Parents[self.Index]
+        if parent < 0:
+            return self.TaxonId
+        return int(self.Taxonomy.TaxonIds[parent])
+    ParentId = property(_get_parent_id)
+
+    def _get_rank(self):
+        return self.Taxonomy.RankNames[self.Taxonomy.Ranks[self.Index]]
+    Rank = property(_get_rank)
+
+    def _get_rank_id(self):
+        return RanksToNumbers.get(self.Rank, None)
+    RankId = property(_get_rank_id)
+
+    def _get_name(self):
+        return self.Taxonomy._name(self.Index)
+    Name = property(_get_name)
+
+    def _get_parent(self):
+        parent = self.Taxonomy.Parents[self.Index]
+        if parent < 0:
+            return None
+        return self.Taxonomy._node(int(parent))
+    Parent = property(_get_parent)
+
+    def _get_children(self):
+        tx = self.Taxonomy
+        children = tx.ChildOrder[tx.ChildStarts[self.Index]:
+            tx.ChildStarts[self.Index + 1]]
+        return [tx._node(int(child)) for child in children]
+    Children = property(_get_children)
+
+    def __iter__(self):
+        return iter(self.Children)
+
+    def __len__(self):
+        tx = self.Taxonomy
+        return int(tx.ChildStarts[self.Index + 1] - tx.ChildStarts[self.Index])
+
+    def __getitem__(self, i):
+        return self.Children[i]
+
+    def ancestors(self):
+        """Returns all ancestors back to the root."""
+        lineage = self.Taxonomy.getLineage(self.TaxonId)[1:]
+        tx = self.Taxonomy
+        return [tx._node(index) for index in tx.getIndices(lineage).tolist()]
+
+    def siblings(self):
+        """Returns all nodes that are children of the same parent as self."""
+        parent = self.Parent
+        if parent is None:
+            return []
+        return [node for node in parent.Children if node is not self]
+
+    def lastCommonAncestor(self, other):
+        """Finds last common ancestor of self and other, or None."""
+        common = self.Taxonomy.lastCommonAncestor([self.TaxonId,
+            other.TaxonId])
+        if common is None:
+            return None
+        return self.Taxonomy[common]
+
+    def getRankedDescendants(self, rank):
+        """Returns all descendants of self with specified rank as flat list."""
+        result = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.Rank == rank:
+                result.append(node)
+            stack.extend(reversed(node.Children))
+        return result
+
+def NcbiTaxonomyFromCache(filename):
+    """Returns new MappedNcbiTaxonomy from a compile_ncbi_taxonomy file."""
+    return MappedNcbiTaxonomy(filename)
@@ -16,6 +16,7 @@ also:
 
 from cogent.parse.record import FileFormatError
 import re
+from itertools import chain
 EOT = None
 
 __author__ = "Peter Maxwell"
@@ -44,7 +45,12 @@ class _Tokeniser(object):
     """
     
     def __init__(self, text, strict_labels=False, underscore_unmunge=True):
-        self.text = text
+        if isinstance(text, basestring):
+            self.lines = [text]
+        else:
+            self.lines = text
+        self.text = ''
+        self.text_line = 0
         self.posn = None
         self.strict_unquoted_labels = strict_labels
         self.underscore_unmunge = underscore_unmunge
@@ -55,7 +61,7 @@ class _Tokeniser(object):
         else:
             msg = 'At '
         (line, column) = self.posn
-        sample = self.text.split('\n')[line][:column]
+        sample = self.text.split('\n')[line-self.text_line][:column]
         if column > 30:
             sample = "..." + sample[-20:]
         if line > 0:
@@ -64,6 +70,20 @@ class _Tokeniser(object):
             msg += 'char %s "%s"' % (column, sample)
         return TreeParseError(msg + '. ' + detail)
                             
+    def _splitLines(self):
+        # text is split one chunk (line of a file) at a time so that only
+        # the current line is held, never the whole file
+        line = 0
+        for text in self.lines:
+            self.text = text
+            self.text_line = line
+            for token in re.split(
+                    """([\\t ]+|\\n|''|""|[]['"(),:;])""", text):
+                if token == '\n':
+                    line += 1
+                yield token
+        yield EOT
+    
     def tokens(self):
         closing_quote_token = None
         column = 0
@@ -71,7 +91,7 @@ class _Tokeniser(object):
         text = None
         closing_quote_token = None
         in_comment = False
-        for token in re.split("""([\\t ]+|\\n|''|""|[]['"(),:;])""", self.text)+[EOT]:
+        for token in self._splitLines():
             label_complete = False
             token_consumed = True
             self.token = token
@@ -143,13 +163,37 @@ def parse_string(text, constructor, **kw):
     if "(" not in text and ";" not in text and text.strip():
          # otherwise "filename" is a valid (if small) tree
         raise TreeParseError('Not a Newick tree: "%s"' % text[:10])
+    tokeniser = _Tokeniser(text, **kw)
+    return _parse_tokens(tokeniser, tokeniser.tokens(), constructor)
+
+def parse_trees(lines, constructor, **kw):
+    """Yields successive trees from Newick-format lines, eg: an open file.
+    
+    Each tree must be terminated by a ';'. Trees are built one at a time as
+    the lines are consumed, so a file of many trees (eg: MCMC samples) can
+    be processed without reading it all into memory.
+    
+    Calls constructor(children, name, attributes); see parse_string for
+    the keyword arguments. The same constructor is used for every tree, so
+    a stateful one such as TreeBuilder().createEdge will rename tips that
+    recur between trees.
+    """
+    tokeniser = _Tokeniser(lines, **kw)
+    tokens = tokeniser.tokens()
+    for token in tokens:
+        if token is EOT:
+            break
+        yield _parse_tokens(tokeniser, chain([token], tokens), constructor)
+
+def _parse_tokens(tokeniser, tokens, constructor):
+    """Returns the tree built from tokens, consuming them up to the first
+    ';' outside of any subtree."""
     sentinals = [';', EOT]
     stack = []
     nodes = []
     children = name = expected_attribute = None
     attributes = {}
-    tokeniser = _Tokeniser(text, **kw)
-    for token in tokeniser.tokens():
+    for token in tokens:
         if expected_attribute is not None:
             (attr_name, attr_cast) = expected_attribute
             try:
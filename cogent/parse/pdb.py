@@ -2,7 +2,8 @@
 """PDB parser class and parsing utility functions."""
 
 from re import compile
-from numpy import array, linalg
+from numpy import array, linalg, dtype, zeros, where, fromstring, \
+                  frombuffer, hstack, int32, float64, char
 
 from cogent.data.protein_properties import AA_NAMES
 from cogent.core.entity import StructureBuilder, ConstructionWarning, ConstructionError
@@ -24,6 +25,18 @@ match_trailer = compile('^CONECT')      # end of coordinates
 PDB_COORDS_STRING = "%s%5i %-4s%c%3s %c%4i%c   %8.3f%8.3f%8.3f%6.2f%6.2f      %4s%2s\n"
 PDB_TER_STRING = "%s%5i %-4s%c%3s %c%4i%c\n"
 
+# one record of an atom array, the fields are those of ``pdb2dict`` and the
+# number of the model the atom belongs to.
+PDB_ATOM_DTYPE = dtype([('model', int32), ('at_type', 'S6'),
+                        ('ser_num', int32), ('at_name', 'S4'), ('at_id', 'S4'),
+                        ('alt_loc', 'S1'), ('res_name', 'S5'),
+                        ('chain_id', 'S1'), ('res_id', int32),
+                        ('res_ic', 'S1'), ('h_flag', 'S1'),
+                        ('coords', float64, (3,)), ('occupancy', float64),
+                        ('bfactor', float64), ('seg_id', 'S4'),
+                        ('element', 'S2')])
+PDB_LINE_WIDTH = 80
+
 def dict2pdb(d):
     """Transform an atom dictionary into a valid PDB line."""
     (x, y, z) = d['coords']
@@ -240,13 +253,132 @@ def parse_coords(builder, coords, forgive=1):
 
     return builder.getStructure()
 
+def _char_columns(chars, start, end):
+    """Returns columns start to end of a 2D character array as strings."""
+    columns = chars[:, start:end].copy()
+    return columns.view('S%s' % (end - start)).ravel()
+
+def _number_columns(chars, start, end, type_):
+    """Returns columns start to end of a 2D character array as numbers."""
+    # a blank column separates the fields of consecutive lines
+    columns = hstack([chars[:, start:end], zeros((len(chars), 1), 'S1')])
+    columns[columns == ''] = ' '
+    numbers = fromstring(columns.tostring(), type_, sep=' ')
+    if len(numbers) != len(chars):
+        raise ValueError('Columns %s-%s do not hold one number per line' % \
+                         (start + 1, end))
+    return numbers
+
+def parse_coords_array(coords):
+    """Parse coordinate lines into an array of ``PDB_ATOM_DTYPE`` records.
+
+    The fields of all ATOM and HETATM lines are read column by column, models
+    are numbered as in ``parse_coords``. Raises a ``ValueError`` if a numeric
+    field can not be read."""
+    lines = []
+    models = []
+    current_model_id = 0
+    model_open = False
+    for line in coords:
+        record_type = line[0:6]
+        if record_type == 'ATOM  ' or record_type == 'HETATM':
+            if not model_open:
+                current_model_id += 1
+                model_open = True
+            lines.append(line.rstrip('\r\n')[:PDB_LINE_WIDTH].ljust(\
+                                                    PDB_LINE_WIDTH, '\0'))
+            models.append(current_model_id - 1)
+        elif record_type == 'MODEL ':
+            current_model_id += 1
+            model_open = True
+        elif record_type == 'ENDMDL':
+            model_open = False
+
+    atoms = zeros(len(lines), dtype=PDB_ATOM_DTYPE)
+    if not lines:
+        return atoms
+    chars = frombuffer(''.join(lines), 'S1').reshape((len(lines), \
+                                                      PDB_LINE_WIDTH))
+    atoms['model'] = models
+    for name, start, end in (('at_type', 0, 6), ('at_name', 12, 16),
+                             ('alt_loc', 16, 17), ('chain_id', 21, 22),
+                             ('res_ic', 26, 27), ('seg_id', 72, 76),
+                             ('element', 76, 78)):
+        atoms[name] = _char_columns(chars, start, end)
+    for name, start, end, type_ in (('ser_num', 6, 11, int32),
+                                    ('res_id', 22, 26, int32),
+                                    ('occupancy', 54, 60, float64),
+                                    ('bfactor', 60, 66, float64)):
+        atoms[name] = _number_columns(chars, start, end, type_)
+    for axis, start in enumerate((30, 38, 46)):
+        atoms['coords'][:, axis] = _number_columns(chars, start, start + 8, \
+                                                   float64)
+    atoms['at_id'] = char.strip(atoms['at_name'])
+    # hetatms get the het flag, SeMet are not ligands
+    res_name = _char_columns(chars, 17, 20)
+    het = (atoms['at_type'] == 'HETATM') & (res_name != 'MSE') & \
+          (res_name != 'SEL')
+    atoms['h_flag'] = where(het, 'H', ' ')
+    atoms['res_name'] = where(het, char.add('H_', res_name), res_name)
+    return atoms
+
+def build_structure(builder, atoms, forgive=1):
+    """Add the atoms of an array of ``PDB_ATOM_DTYPE`` records to the
+    structure of a builder, as ``parse_coords`` does for coordinate lines."""
+    current_model_id = None
+    current_chain_id = None
+    current_seg_id = None
+    current_res_long_id = None
+    current_res_name = None
+
+    for (model_id, at_type, ser_num, at_name, at_id, alt_loc, res_name, \
+         chain_id, res_id, res_ic, h_flag, coords, occupancy, bfactor, \
+         seg_id, element) in atoms.tolist():
+        new_chain = False
+        if current_model_id != model_id:
+            current_model_id = model_id
+            builder.initModel(model_id)
+            current_chain_id = None
+
+        if current_seg_id != seg_id:
+            current_seg_id = seg_id
+            builder.initSeg(current_seg_id)
+
+        if current_chain_id != chain_id:
+            current_chain_id = chain_id
+            new_chain = True
+            try:
+                builder.initChain(current_chain_id)
+            except ConstructionWarning:
+                if not forgive:
+                    raise ConstructionError
+
+        res_long_id = (res_name, res_id, res_ic)
+        if current_res_name != res_name or \
+           current_res_long_id != res_long_id or new_chain:
+            current_res_long_id = res_long_id
+            current_res_name = res_name
+            try:
+                builder.initResidue(res_long_id, h_flag)
+            except ConstructionWarning:
+                if not forgive:
+                    raise ConstructionError
+        try:
+            builder.initAtom((at_id, alt_loc), at_name, ser_num, \
+                             array(coords), occupancy, bfactor, element)
+        except ConstructionError:
+            if not forgive > 1:
+                raise ConstructionError
+
+    return builder.getStructure()
+
 def parse_trailer(trailer):
     return {}
 
-def PDBParser(open_file, structure_id=None, forgive=2):
-    """Parse a PDB file and return a Structure object."""
+def _parse_sections(open_file):
+    """Split a PDB file into its header, coordinates and trailer lines and
+    parse the header and the trailer."""
     file_ = open_file.readlines()
-    builder = StructureBuilder()
 
     c_offset = get_coords_offset(file_)
     t_offset = get_trailer_offset(file_)
@@ -257,18 +389,107 @@ def PDBParser(open_file, structure_id=None, forgive=2):
 
     parsed_header = parse_header(raw_header)
     parsed_trailer = parse_trailer(raw_trailer)
-    structure_id = (structure_id or parsed_header.get('id'))
-    builder.initStructure(structure_id)
-    structure = parse_coords(builder, raw_coords, forgive)
 
     # only X-ray structures will contain crystallographic data
     if parsed_header.get('expdta') == 'X-RAY':
         symetry_info = get_symmetry(raw_header)
         parsed_header.update(symetry_info)
 
+    return raw_header, raw_coords, raw_trailer, parsed_header, parsed_trailer
+
+def PDBParser(open_file, structure_id=None, forgive=2):
+    """Parse a PDB file and return a Structure object."""
+    raw_header, raw_coords, raw_trailer, parsed_header, parsed_trailer = \
+                                                    _parse_sections(open_file)
+    builder = StructureBuilder()
+    structure_id = (structure_id or parsed_header.get('id'))
+    builder.initStructure(structure_id)
+    structure = parse_coords(builder, raw_coords, forgive)
+
     structure.header = parsed_header
     structure.trailer = parsed_trailer
     structure.raw_header = raw_header
     structure.raw_trailer = raw_trailer
 
     return structure
+
+def PDBArrayParser(open_file, structure_id=None, forgive=2):
+    """Parse a PDB file and return a ``PDBArrays`` object. The atoms are read
+    into a structured array, the Structure object is only built on demand."""
+    raw_header, raw_coords, raw_trailer, parsed_header, parsed_trailer = \
+                                                    _parse_sections(open_file)
+    structure_id = (structure_id or parsed_header.get('id'))
+    arrays = PDBArrays(parse_coords_array(raw_coords), structure_id, forgive)
+    arrays.header = parsed_header
+    arrays.trailer = parsed_trailer
+    arrays.raw_header = raw_header
+    arrays.raw_trailer = raw_trailer
+    return arrays
+
+
+class PDBArrays(object):
+    """The atoms of a PDB file as an array of ``PDB_ATOM_DTYPE`` records.
+
+    Columns of the ``atoms`` array are available as ``coords``, ``bfactors``
+    etc. The ``Structure`` entity is built from the array by ``getStructure``
+    the first time it is needed. Per-atom results of calculations on the
+    array are kept in the ``xtra`` dictionary."""
+
+    def __init__(self, atoms, structure_id=None, forgive=2):
+        self.atoms = atoms
+        self.id = structure_id
+        self.forgive = forgive
+        self.header = {}
+        self.trailer = {}
+        self.raw_header = []
+        self.raw_trailer = []
+        self.xtra = {}
+        self._structure = None
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __repr__(self):
+        return "<PDBArrays %s, %s atoms>" % (self.id, len(self.atoms))
+
+    coords = property(lambda self: self.atoms['coords'])
+    bfactors = property(lambda self: self.atoms['bfactor'])
+    occupancies = property(lambda self: self.atoms['occupancy'])
+
+    def getModelIds(self):
+        """Return the sorted ids of the models."""
+        return sorted(set(self.atoms['model'].tolist()))
+
+    def getModel(self, model_id=0):
+        """Return the array of atoms of a model."""
+        return self.atoms[self.atoms['model'] == model_id]
+
+    def getFull_ids(self, atoms=None):
+        """Return the full ids of the atoms of the array (or of ``atoms``),
+        which are the full ids of the corresponding ``Atom`` entities."""
+        if atoms is None:
+            atoms = self.atoms
+        res_long_ids = zip(atoms['res_name'].tolist(), \
+                           atoms['res_id'].tolist(), atoms['res_ic'].tolist())
+        at_long_ids = zip(atoms['at_id'].tolist(), atoms['alt_loc'].tolist())
+        return [(self.id, model_id, chain_id, res_long_id, at_long_id) for \
+                (model_id, chain_id, res_long_id, at_long_id) in \
+                zip(atoms['model'].tolist(), atoms['chain_id'].tolist(), \
+                    res_long_ids, at_long_ids)]
+
+    def isBuilt(self):
+        """Return ``True`` if the ``Structure`` entity has been built."""
+        return self._structure is not None
+
+    def getStructure(self):
+        """Return the ``Structure`` entity, it is built on the first call."""
+        if self._structure is None:
+            builder = StructureBuilder()
+            builder.initStructure(self.id)
+            structure = build_structure(builder, self.atoms, self.forgive)
+            structure.header = self.header
+            structure.trailer = self.trailer
+            structure.raw_header = self.raw_header
+            structure.raw_trailer = self.raw_trailer
+            self._structure = structure
+        return self._structure
@@ -6,6 +6,7 @@ import xml.dom.minidom
 from cogent.parse import fasta, phylip, paml, clustal, genbank
 from cogent.parse import gbseq, tinyseq, macsim, gcg
 from cogent.parse.record import FileFormatError
+from cogent.parse.compressed import open_compressed, strip_compressed_suffix
 
 __author__ = "Cath Lawrence"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -25,7 +26,7 @@ def FromFilenameParser(filename, format=None, **kw):
             - format: the multiple sequence file format
     """
     format = format_from_filename(filename, format)
-    f = open(filename, 'U')
+    f = open_compressed(filename, 'U')
     return FromFileParser(f, format, **kw)
 
 def FromFileParser(f, format, dialign_recode=False, **kw):
@@ -56,10 +57,11 @@ def FromFileParser(f, format, dialign_recode=False, **kw):
         yield (name, seq)
 
 def format_from_filename(filename, format=None):
-    """Detects format based on filename."""
+    """Detects format based on filename, ignoring compression suffixes."""
     if format:
         return format
     else:
+        filename = strip_compressed_suffix(filename)
         return filename[filename.rfind('.')+1:]
 
 PARSERS  = {
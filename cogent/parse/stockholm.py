@@ -11,8 +11,11 @@ from cogent.core.moltype import BYTES
 from cogent.core.info import Info
 from cogent.struct.rna2d import WussStructure
 from cogent.util.transform import trans_all,keep_chars
-from cogent.core.alignment import Alignment, DataError, SequenceCollection
+from cogent.core.alignment import Alignment, DataError, SequenceCollection, \
+    DenseAlignment
 from collections import defaultdict
+from itertools import chain
+from numpy import frombuffer, zeros, uint8, int32
 
 __author__ = "Jeremy Widmann"
 __copyright__ = "Copyright 2007-2008, The Cogent Project"
@@ -433,3 +436,160 @@ def _process_seq(seq, strict):
     if seq is not real_seq:
         real_seq.Name = seq.Name
         real_seq.Info = seq.Info
+
+
+def _dense_alignment(names, seqs, MolType):
+    """Returns DenseAlignment of equal length seqs, built as one char array.
+
+    Letters are upper cased unless MolType is BYTES, as Alignment does.
+    Raises RecordError on characters that are not in the alphabet.
+    """
+    try:
+        alphabet = MolType.Alphabets.DegenGapped
+    except AttributeError:
+        alphabet = MolType.Alphabet
+    chars = frombuffer(''.join(seqs), uint8).copy().reshape((len(seqs), -1))
+    if MolType is not BYTES:
+        lower = (chars >= ord('a')) & (chars <= ord('z'))
+        chars[lower] -= ord('a') - ord('A')
+    table = zeros(256, int32) - 1
+    for index, char in enumerate(alphabet):
+        if len(char) == 1:
+            table[ord(char)] = index
+    indices = table[chars]
+    if (indices < 0).any():
+        raise RecordError, "Characters %s not in alphabet" % \
+            ''.join(sorted(set(chars[indices < 0].tostring())))
+    return DenseAlignment(indices.T.astype(alphabet.ArrayType),
+        Names=list(names), MolType=MolType, Alphabet=alphabet)
+
+def _stockholm_alignment(names, seq_parts, gf, gc, gs, gr, ss_cons, MolType,
+    dense, info_constructor_dict, struct_constructor, strict):
+    """Returns the alignment of one record of StreamingStockholmParser"""
+    if not names:
+        raise RecordError, 'Found record with missing element(s): sequences'
+    seqs = [''.join(seq_parts[name]).replace('.', '-') for name in names]
+    if len(set(map(len, seqs))) > 1:
+        raise RecordError, 'Sequences in record have different lengths'
+    if dense:
+        alignment = _dense_alignment(names, seqs, MolType)
+    else:
+        alignment = Alignment(zip(names, seqs), MolType=MolType)
+    info = {}
+    if gf is not None:
+        info['GF'] = info_constructor_dict['GF'](gf, strict=strict)
+    if gs is not None:
+        info['GS'] = info_constructor_dict['GS'](gs, strict=strict)
+    if gc is not None:
+        info['GC'] = dict([(_gc_field_names.get(feature, feature),
+            ''.join(parts)) for feature, parts in gc.items()])
+    if gr is not None:
+        info['GR'] = dict([(_gr_field_names.get(feature, feature),
+            dict([(name, ''.join(parts)) for name, parts in by_seq.items()]))
+            for feature, by_seq in gr.items()])
+    info['Struct'] = struct_constructor(''.join(ss_cons))
+    alignment.Info.update(info)
+    return alignment
+
+def StreamingStockholmParser(lines, MolType=BYTES, dense=False,
+    annotations=('GF', 'GC', 'GS', 'GR'), info_constructor_dict=AllToInfo,
+    struct_constructor=WussStructure, strict=True):
+    """Yields successive Stockholm records as alignments, one at a time.
+
+    Only the record being read is held in memory, so full database files
+    such as Rfam.full or Pfam-A.full can be parsed family by family. The
+    parts of each sequence in interleaved blocks are collected in lists and
+    joined once; '.' gaps become '-'.
+
+    MolType: MolType of the alignments, default BYTES (no conversion).
+    dense: if True, yields DenseAlignment objects (built from one character
+        array) instead of Alignment objects.
+    annotations: the kinds of annotation to keep, any of 'GF', 'GC', 'GS'
+        and 'GR'. Lines of other kinds are skipped without being parsed and
+        their key is left out of the alignment Info.
+    info_constructor_dict: constructors of the 'GF' and 'GS' Info entries.
+    struct_constructor: constructor of Info['Struct'], the consensus
+        structure from the '#=GC SS_cons' lines, which are always read.
+
+    The Info of each alignment has the same entries as from StockholmParser.
+    If strict, raises RecordError on malformed lines or records, otherwise
+    skips them.
+    """
+    keep = frozenset(annotations)
+    gf, gc, gs, gr = [None] * 4
+    names, seq_parts, ss_cons = [], {}, []
+    started = False
+    #a None line after the last one ends a record that lacks its '//'
+    for line in chain(lines, [None]):
+        if line is None:
+            if started and strict:
+                raise RecordError, "Found additional data after records"
+            line = '//'
+        if line.startswith('//'):
+            if started:
+                try:
+                    alignment = _stockholm_alignment(names, seq_parts, gf, gc,
+                        gs, gr, ss_cons, MolType, dense,
+                        info_constructor_dict, struct_constructor, strict)
+                except (RecordError, DataError, ValueError, KeyError,
+                        IndexError), e:
+                    if strict:
+                        raise RecordError, str(e)
+                else:
+                    yield alignment
+            started = False
+            continue
+        if not started:
+            if is_empty_or_html(line) or (line.startswith('#') and
+                    not line.startswith('#=')):
+                continue
+            started = True
+            gf = [] if 'GF' in keep else None
+            gs = [] if 'GS' in keep else None
+            gc = defaultdict(list) if 'GC' in keep else None
+            gr = defaultdict(lambda: defaultdict(list)) if 'GR' in keep \
+                else None
+            names, seq_parts, ss_cons = [], {}, []
+        if line.startswith('#='):
+            kind = line[2:4]
+            if kind == 'GC':
+                fields = line.split(None, 2)
+                if len(fields) != 3:
+                    if strict:
+                        raise RecordError, "Failed to extract feature and " +\
+                            "content information from line %s" % line
+                    continue
+                content = fields[2].strip()
+                if fields[1] == 'SS_cons':
+                    ss_cons.append(content)
+                if gc is not None:
+                    gc[fields[1]].append(content)
+            elif kind not in keep:
+                continue
+            elif kind == 'GR':
+                fields = line.split(None, 3)
+                if len(fields) != 4:
+                    if strict:
+                        raise RecordError, "Failed to extract feature and " +\
+                            "content information from line %s" % line
+                    continue
+                gr[fields[2]][fields[1]].append(fields[3].strip())
+            elif kind == 'GF':
+                gf.append(line.strip())
+            elif kind == 'GS':
+                gs.append(line.strip())
+        elif line.startswith('#') or is_empty_or_html(line):
+            continue
+        else:
+            fields = line.split()
+            if len(fields) != 2:
+                if strict:
+                    raise RecordError, "Failed to parse sequence line %s" % \
+                        line
+                continue
+            name, seq = fields
+            if name not in seq_parts:
+                names.append(name)
+                seq_parts[name] = [seq]
+            else:
+                seq_parts[name].append(seq)
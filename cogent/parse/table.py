@@ -2,7 +2,7 @@
 
 import cPickle, csv
 from record_finder import is_empty
-from gzip import GzipFile
+from cogent.parse.compressed import open_compressed
 
 __author__ = "Gavin Huttley"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -132,10 +132,7 @@ def load_delimited(filename, header = True, delimiter = ',',
     if limit is not None:
         limit += 1 # don't count header line
     
-    if filename.endswith('gz'):
-        f = GzipFile(filename, 'rb')
-    else:
-        f = file(filename, "U")
+    f = open_compressed(filename)
     
     reader = csv.reader(f, dialect = 'excel', delimiter = delimiter)
     rows = []
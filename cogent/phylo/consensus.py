@@ -32,15 +32,15 @@ def majorityRule(trees, strict=False):
     return weightedMajorityRule(trees, strict, "count")
 
 def weightedMajorityRule(weighted_trees, strict=False, attr="support"):
+    # clades are counted as integer bitsets over a shared tip index so the
+    # frequency table stays small for large numbers of trees
+    tip_index = {}
     cladecounts = {}
     edgelengths = {}
     total = 0
     for (weight, tree) in weighted_trees:
         total += weight
-        edges = tree.getEdgeVector()
-        for edge in edges:
-            tips = edge.getTipNames(includeself=True)
-            tips = frozenset(tips)
+        for (edge, tips) in tree.postorderMasks(tip_index):
             if tips not in cladecounts:
                 cladecounts[tips] = 0
             cladecounts[tips] += weight
@@ -61,19 +61,26 @@ def weightedMajorityRule(weighted_trees, strict=False, attr="support"):
                 break
     
     # Remove conflicts
-    accepted_clades = set()
+    accepted_masks = []
     counts = {}
-    for (count, clade) in cladecounts:
-        for accepted_clade in accepted_clades:
-            if clade.intersection(accepted_clade) and not (
-                    clade.issubset(accepted_clade) or
-                    clade.issuperset(accepted_clade)):
-                        break
+    lengths = {}
+    tip_names = [None] * len(tip_index)
+    for (name, index) in tip_index.items():
+        tip_names[index] = name
+    for (count, mask) in cladecounts:
+        for accepted_mask in accepted_masks:
+            common = mask & accepted_mask
+            if common and common != mask and common != accepted_mask:
+                break
         else:
-            accepted_clades.add(clade)
+            accepted_masks.append(mask)
+            clade = frozenset([name for (index, name) in enumerate(tip_names)
+                    if mask >> index & 1])
             counts[clade] = count
-            weighted_length = edgelengths[clade]
-            edgelengths[clade] = weighted_length and weighted_length / total
+            weighted_length = edgelengths[mask]
+            lengths[clade] = weighted_length and weighted_length / total
+    accepted_clades = counts.keys()
+    edgelengths = lengths
     
     nodes = {}
     queue = []
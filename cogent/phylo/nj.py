@@ -269,13 +269,158 @@ def gnj(dists, keep=None, dkeep=0, ui=None):
     return ScoredTreeCollection(result)
 
 
+class SortedRows(object):
+    """The distances of each node to the others, sorted, for RapidNJ style
+    bounds on the best join of each node (Simonsen, Mailund & Pedersen 2008).
+
+    Nodes are referred to by an id, which is never reused: a join gives the
+    new node a new id, so entries for the joined nodes left in other rows go
+    stale and are recognised by having no slot. The distance between two
+    live nodes never changes, so the entries that are not stale stay
+    sorted. Rows are padded with infinite distances.
+    """
+
+    def __init__(self, d, slot_ids, live_slots):
+        """Sorts the rows of the live slots of d"""
+        width = len(live_slots) - 1
+        self.Ids = numpy.empty([len(d), width], int)
+        self.Dists = numpy.empty([len(d), width], d.dtype)
+        for slot in live_slots:
+            self.setRow(slot, d[slot], slot_ids, live_slots)
+
+    def setRow(self, slot, dists, slot_ids, live_slots):
+        """Sets the row of slot to dists to the other live slots, sorted"""
+        others = live_slots[live_slots != slot]
+        dists = dists[others]
+        order = numpy.argsort(dists, kind='mergesort')
+        num = len(others)
+        self.Ids[slot, :num] = slot_ids[others[order]]
+        self.Dists[slot, :num] = dists[order]
+        self.Ids[slot, num:] = 0
+        self.Dists[slot, num:] = numpy.inf
+
+
+def _best_join(rows, live_slots, r, id_r, id_slots, L, block_size=8):
+    """Returns (q, slot1, slot2) of the join minimising
+    q = (L-2)*d[i,j] - (r[i] + r[j]), scanning each sorted row only until its
+    bound (L-2)*d[i,j] - (r[i] + max(r)) can't beat the best q found so far.
+    
+    Of tied joins the one with the lowest (slot1, slot2) is returned, slot1
+    being the lower slot. q is computed the same way from either end of a
+    pair, so that ties are exact.
+    
+    id_r holds r of the nodes by id, -inf for dead ids so that their q is
+    infinite.
+    """
+    max_r = r[live_slots].max()
+    best = (numpy.inf, None, None)
+    slots = live_slots
+    start = 0
+    width = rows.Ids.shape[1]
+    while len(slots) and start < width:
+        end = min(start + block_size, width)
+        ids = rows.Ids[slots, start:end]
+        q = rows.Dists[slots, start:end] * (L - 2.0) - (
+                r[slots, numpy.newaxis] + id_r[ids])
+        least = q.min()
+        if least <= best[0] and least < numpy.inf:
+            (row, col) = numpy.nonzero(q == least)
+            pairs = [tuple(sorted((slots[i], id_slots[ids[i, j]])))
+                    for (i, j) in zip(row, col)]
+            if least < best[0]:
+                best = (least,) + min(pairs)
+            else:
+                best = (least,) + min(pairs + [best[1:]])
+        if end == width:
+            break
+        bounds = rows.Dists[slots, end] * (L - 2.0) - (r[slots] + max_r)
+        slots = slots[bounds <= best[0]]
+        start = end
+        block_size *= 2
+    return best
+
+def fast_nj(d, names):
+    """Returns the neighbour joining tree of the distance matrix d.
+
+    Arguments:
+        - d: square numpy array of distances between names, changed in place
+        - names: names of the tips, in the order of d
+
+    The neighbour joining tree that gnj(keep=1) finds, but each join is
+    found by searching the sorted rows of the distance matrix only as far
+    as the RapidNJ bounds require, and the matrix is updated in place
+    rather than copied, so typically O(n^2) work in total instead of
+    O(n^3). Negative branch lengths are set to 0.
+    
+    Where several joins are equally good, the one whose nodes come first
+    in names is taken, a joined node taking the place of its first member.
+    gnj orders tied joins differently, so with tied distances the two can
+    give different, equally good, trees.
+    """
+    num_tips = len(names)
+    assert num_tips >= 3, "nj needs at least 3 sequences"
+    d = numpy.asarray(d, float)
+    nodes = [LightweightTreeTip(name) for name in names]
+    slot_ids = numpy.arange(num_tips)
+    id_slots = numpy.concatenate([numpy.arange(num_tips),
+            -numpy.ones(num_tips, int)])
+    live = numpy.ones(num_tips, bool)
+    r = d.sum(axis=0)
+    live_slots = numpy.arange(num_tips)
+    rows = SortedRows(d, slot_ids, live_slots)
+    rebuild_at = num_tips // 2
+    next_id = num_tips
+    for L in range(num_tips, 3, -1):
+        id_r = numpy.empty(len(id_slots))
+        id_r.fill(-numpy.inf)
+        alive = id_slots >= 0
+        id_r[alive] = r[id_slots[alive]]
+        (q, i, j) = _best_join(rows, live_slots, r, id_r, id_slots, L)
+
+        # Branch lengths from i and j to new node
+        ij_dist_diff = (r[i]-r[j]) / (L-2.0)
+        left_length = max(0.0, 0.5 * (d[i,j] + ij_dist_diff))
+        right_length = max(0.0, 0.5 * (d[i,j] - ij_dist_diff))
+        new_node = LightweightTreeNode(
+                [(left_length, nodes[i]), (right_length, nodes[j])])
+
+        # Store new node at i, eliminate j
+        new_dists = 0.5 * (d[i] + d[j] - d[i,j])
+        live[j] = False
+        r -= d[i] + d[j]
+        r += new_dists
+        new_dists[i] = 0.0
+        d[:, i] = new_dists
+        d[i, :] = new_dists
+        live_slots = numpy.flatnonzero(live)
+        r[i] = new_dists[live_slots].sum()
+        nodes[i] = new_node
+        nodes[j] = None
+        id_slots[slot_ids[i]] = id_slots[slot_ids[j]] = -1
+        slot_ids[i] = next_id
+        id_slots[next_id] = i
+        next_id += 1
+        if L - 1 <= rebuild_at:
+            # drop stale entries once half the nodes are gone
+            rows = SortedRows(d, slot_ids, live_slots)
+            rebuild_at = (L - 1) // 2
+        else:
+            rows.setRow(i, new_dists, slot_ids, live_slots)
+
+    d = d[live_slots][:, live_slots]
+    lengths = numpy.sum(d, axis=0) - numpy.sum(d)/4
+    root = LightweightTreeNode(zip(lengths,
+            [nodes[slot] for slot in live_slots]))
+    tree = root.convert()
+    tree.Name = "root"
+    return tree
+
 def nj(dists, no_negatives=True):
     """Arguments:
         - dists: dict of (name1, name2): distance
         - no_negatives: negative branch lengths will be set to 0
     """
     assert no_negatives, "no_negatives=False is deprecated"
-    (result,) = gnj(dists, keep=1)
-    (score, tree) = result
-    return tree
+    (names, d) = distanceDictTo2D(dists)
+    return fast_nj(d, names)
 
@@ -5,10 +5,12 @@ from cogent.app.stride import Stride
 from cogent.parse.stride import stride_parser
 from cogent.struct.selection import einput
 from cogent.struct.annotation import xtradata
+from cogent.core.entity import AREAIMOL_VDW_RADII, DEFAULT_AREAIMOL_VDW_RADIUS
+from cogent.parse.pdb import PDBArrays
 from cogent.maths.geometry import sphere_points, coords_to_symmetry, \
                                   coords_to_crystal
 from _asa import asa_loop
-from numpy import array, r_
+from numpy import array, r_, empty, nan, isnan, in1d, ascontiguousarray
 
 
 __author__ = "Marcin Cieslik"
@@ -39,10 +41,19 @@ def _run_asa(atoms, lattice_coords, spoints, probe=1.4, bucket_size=5, \
         - bucket_size: see: ``KDTree``.
         - MAXSYM (int): maximum number of symmetry generated atoms.
     """
-    # get array of radii inflated by probe size of the selection of atoms.
-    atom_radii = array(atoms.getData('radius', forgiving=False)) + probe
+    # get array of radii of the selection of atoms.
+    atom_radii = array(atoms.getData('radius', forgiving=False))
     # get array of coordinates
     atom_coords = array(atoms.getData('coords', forgiving=False))
+    return _run_asa_arrays(atom_coords, atom_radii, lattice_coords, spoints, \
+                           probe, bucket_size, MAXSYM)
+
+def _run_asa_arrays(atom_coords, atom_radii, lattice_coords, spoints, \
+                    probe=1.4, bucket_size=5, MAXSYM=200000):
+    """Runs an ASA calculation for atoms given as an array of coordinates and
+    an array of radii. See: ``_run_asa``."""
+    # inflate radii by probe size
+    atom_radii = atom_radii + probe
     # calculate bounding box in a form of an array
     search_limit = 2 * (2.0 + probe)    # 2.0 is maximum atom radius
     atom_box = r_[atom_coords.min(axis=0) - search_limit, \
@@ -85,6 +96,91 @@ def _postpare_entities(entities):
     structures.setUnmasked(force=True)
 
 
+def _symmetry_lattice(coords, sh, symmetry_mode, crystal_mode=None):
+    """Expands coordinates to the unit-cell ('table' or 'uc' symmetry_mode)
+    and if crystal_mode is given to the crystal. Returns a 4D-array."""
+    # expand to unit-cell, real 3D
+    coords = coords_to_symmetry(coords, \
+                                sh[symmetry_mode + '_fmx'], \
+                                sh[symmetry_mode + '_omx'], \
+                                sh[symmetry_mode + '_mxs'], \
+                                symmetry_mode)
+    # expand to crystal, real 4D
+    if crystal_mode:
+        coords = coords_to_crystal(coords, \
+                                   sh[symmetry_mode + '_fmx'], \
+                                   sh[symmetry_mode + '_omx'], \
+                                   crystal_mode) # real 4D
+    else:
+        coords = array([coords]) # fake 4D
+    return coords
+
+def _atom_radii(atoms, radius_type=AREAIMOL_VDW_RADII, \
+                default_radius=DEFAULT_AREAIMOL_VDW_RADIUS):
+    """Returns the radii of an array of atom records, as ``Atom.setRadius``
+    sets them."""
+    get = radius_type.get
+    return array([get(key, default_radius) for key in \
+                  zip(atoms['res_name'].tolist(), atoms['at_name'].tolist())])
+
+def _prepare_asa_arrays(atoms, sh, symmetry_mode=None, crystal_mode=None, \
+                        points=960, **kwargs):
+    """Prepares the ASA calculation for an array of ``PDB_ATOM_DTYPE``
+    records and the header ``sh`` of their structure. Returns an array of ASA 
+    values, which are ``nan`` for atoms without a result. See: 
+    ``_prepare_asa``."""
+    spoints = sphere_points(points)
+    result = empty(len(atoms))
+    result.fill(nan)
+    coords = ascontiguousarray(atoms['coords'])
+    radii = _atom_radii(atoms)
+    if not symmetry_mode and not crystal_mode:
+        lattice_coords = array([[coords]]) # fake 3D and 4D
+        result[:] = _run_asa_arrays(coords, radii, lattice_coords, spoints, \
+                                    **kwargs)
+    elif symmetry_mode in ('table', 'uc'):
+        lattice_coords = _symmetry_lattice(coords, sh, symmetry_mode, \
+                                           crystal_mode)
+        result[:] = _run_asa_arrays(coords, radii, lattice_coords, spoints, \
+                                    **kwargs)
+    elif symmetry_mode == 'bio':
+        start = 0
+        for chain_ids, mx_num in sh['bio_cmx']:
+            selected = in1d(atoms['chain_id'], list(chain_ids))
+            stop = start + mx_num
+            lattice_coords = coords_to_symmetry(coords[selected], \
+                                                sh['uc_fmx'], \
+                                                sh['uc_omx'], \
+                                                sh['bio_mxs'][start:stop], \
+                                                symmetry_mode)
+            lattice_coords = array([lattice_coords])
+            start = stop
+            result[selected] = _run_asa_arrays(coords[selected], \
+                            radii[selected], lattice_coords, spoints, **kwargs)
+    return result
+
+def _asa_xtra_arrays(arrays, xtra_key, **asa_kwargs):
+    """Calculates ASA for the atoms of a ``PDBArrays`` instance. The values 
+    are stored as an array in its ``xtra`` dictionary and, if its structure 
+    has been built, in the xtra dictionaries of the atom entities."""
+    atoms = arrays.atoms
+    # water molecules are masked
+    unmasked = atoms['res_name'] != 'H_HOH'
+    if not unmasked.any():
+        raise ValueError('No unmasked atoms to build lattice.')
+    asas = empty(len(atoms))
+    asas.fill(nan)
+    asas[unmasked] = _prepare_asa_arrays(atoms[unmasked], arrays.header, \
+                                         **asa_kwargs)
+    arrays.xtra[xtra_key] = asas
+    found = ~isnan(asas)
+    result = dict([(id, {xtra_key:v}) for id, v in \
+                   zip(arrays.getFull_ids(atoms[found]), asas[found].tolist())])
+    if arrays.isBuilt():
+        xtradata(result, einput(arrays.getStructure(), 'S'))
+    return result
+
+
 def _prepare_asa(entities, symmetry_mode=None, crystal_mode=None, points=960, \
                 **kwargs):
     """Prepares the atomic solvent-accessible surface area (ASA) calculation.
@@ -130,20 +226,7 @@ def _prepare_asa(entities, symmetry_mode=None, crystal_mode=None, points=960, \
         coords = array(atoms.getData('coords', forgiving=False))
         idx_to_id = dict(enumerate(atoms.getData('getFull_id', \
                                                 forgiving=False, method=True)))
-        # expand to unit-cell, real 3D
-        coords = coords_to_symmetry(coords, \
-                                            sh[symmetry_mode + '_fmx'], \
-                                            sh[symmetry_mode + '_omx'], \
-                                            sh[symmetry_mode + '_mxs'], \
-                                            symmetry_mode)
-        # expand to crystal, real 4D
-        if crystal_mode:
-            coords = coords_to_crystal(coords, \
-                                               sh[symmetry_mode + '_fmx'], \
-                                               sh[symmetry_mode + '_omx'], \
-                                               crystal_mode) # real 4D
-        else:
-            coords = array([coords]) # fake 4D
+        coords = _symmetry_lattice(coords, sh, symmetry_mode, crystal_mode)
         asas = _run_asa(atoms, coords, spoints, **kwargs)
         for idx in xrange(asas.shape[0]):
             result[idx_to_id[idx]] = asas[idx]
@@ -180,7 +263,10 @@ def asa_xtra(entities, mode='internal', xtra_key=None, **asa_kwargs):
     
     Arguments:
     
-        - entities: an entity or sequence of entities
+        - entities: an entity or sequence of entities or a ``PDBArrays`` 
+          instance. For ``PDBArrays`` the 'internal' calculation works on the 
+          arrays and the ASA values of all atoms are also stored as an array 
+          in its ``xtra`` dictionary, other modes build the structure.
         - mode(str): 'internal' for calculations using the built-in cython code 
           or 'stride' if the stride binary should be called to do the job.
         - xtra_key(str): Key in the xtra dictionary to hold the result for each
@@ -190,6 +276,10 @@ def asa_xtra(entities, mode='internal', xtra_key=None, **asa_kwargs):
     ``_run_asa`` functions.
     """
     xtra_key = xtra_key or 'ASA'
+    if isinstance(entities, PDBArrays):
+        if mode == 'internal':
+            return _asa_xtra_arrays(entities, xtra_key, **asa_kwargs)
+        entities = entities.getStructure()
     structures = einput(entities, 'S')
     if len(structures.values()) > 1:
         raise ValueError('Entities from multiple structures are not supported.')
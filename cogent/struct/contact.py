@@ -3,11 +3,13 @@ surface areas (ASA)."""
 
 from cogent.struct.selection import einput
 from cogent.struct.annotation import xtradata
+from cogent.parse.pdb import PDBArrays
 from cogent.maths.geometry import coords_to_symmetry, \
                                   coords_to_crystal
 from _contact import cnt_loop
 from collections import defaultdict
-from numpy import array, r_, sqrt, int64
+from numpy import array, r_, sqrt, int64, unique, concatenate, \
+                  ascontiguousarray
 
 
 __author__ = "Marcin Cieslik"
@@ -54,10 +56,6 @@ def _prepare_contacts(query, model=None, level='A', search_limit=6.0, \
     Additional arguments are passed to the ``cnt_loop`` Cython function.
     """
 
-    contact_mode = {'diff_asu'  :0,
-                    'diff_sym' :1,
-                    'diff_chain':2 }[contact_mode]
-
     # determine unique structure
     structure = einput(query, 'S').values()[0]
     sh = structure.header
@@ -70,6 +68,70 @@ def _prepare_contacts(query, model=None, level='A', search_limit=6.0, \
     qents_ids = qents.getData('getFull_id', forgiving=False, method=True)
     qcoords = array(qents.getData('coords', forgiving=False))
 
+    lc = [] # lattice chain
+    qc = [] # query chain
+    lchains = [i[2] for i in lents_ids]
+    qchains = [i[2] for i in qents_ids]
+    allchains = set()
+    allchains.update(lchains)
+    allchains.update(qchains)
+    chain2id = dict(zip(allchains, range(len(allchains))))
+    for lent_id in lents_ids:
+        lc.append(chain2id[lent_id[2]])
+    for qent_id in qents_ids:
+        qc.append(chain2id[qent_id[2]])
+    lc = array(lc, dtype=int64)
+    qc = array(qc, dtype=int64)
+    return _contact_result(qents_ids, lents_ids, *_run_contacts(\
+                           qcoords, lcoords, qc, lc, sh, search_limit, \
+                           contact_mode, symmetry_mode, crystal_mode, **kwargs))
+
+def _prepare_contacts_arrays(arrays, search_limit=6.0, \
+                             contact_mode='diff_chain', symmetry_mode=None, \
+                             crystal_mode=None, **kwargs):
+    """Prepares distance contact calculations between the atoms of a 
+    ``PDBArrays`` instance (query) and the atoms of its first model (lattice).
+    See: ``_prepare_contacts``."""
+    qatoms = arrays.atoms
+    latoms = arrays.getModel(0)
+    qcoords = ascontiguousarray(qatoms['coords'])
+    lcoords = ascontiguousarray(latoms['coords'])
+    # chains are numbered in both the query and the lattice
+    chains = unique(concatenate((latoms['chain_id'], qatoms['chain_id'])), \
+                    return_inverse=True)[1].astype(int64)
+    lc = chains[:len(latoms)]
+    qc = chains[len(latoms):]
+    raw = _run_contacts(qcoords, lcoords, qc, lc, arrays.header, \
+                        search_limit, contact_mode, symmetry_mode, \
+                        crystal_mode, **kwargs)
+    (idxc, n_src, n_asu) = raw[:3]
+    # only the ids of atoms with contacts are needed
+    qidx = unique(n_src[:idxc])
+    lidx = unique(n_asu[:idxc])
+    qents_ids = dict(zip(qidx.tolist(), arrays.getFull_ids(qatoms[qidx])))
+    lents_ids = dict(zip(lidx.tolist(), arrays.getFull_ids(latoms[lidx])))
+    return _contact_result(qents_ids, lents_ids, *raw)
+
+def _contact_result(qents_ids, lents_ids, idxc, n_src, n_asu, n_sym, n_tra, \
+                    n_dst):
+    """Returns a dictionary of contacts from the output of ``cnt_loop``."""
+    result = defaultdict(dict)
+    for contact in xrange(idxc):
+        qent_id = qents_ids[n_src[contact]]
+        lent_id = lents_ids[n_asu[contact]]
+        result[qent_id][lent_id] = (sqrt(n_dst[contact]), n_tra[contact], n_sym[contact])
+    return result
+
+def _run_contacts(qcoords, lcoords, qc, lc, sh, search_limit, contact_mode, \
+                  symmetry_mode, crystal_mode, **kwargs):
+    """Runs a distance contact calculation between query coordinates and 
+    lattice coordinates, which are transformed according to symmetry_mode and
+    crystal_mode. The chain of each query and lattice entity is given as a 
+    number in qc and lc. Returns the output of ``cnt_loop``."""
+    contact_mode = {'diff_asu'  :0,
+                    'diff_sym' :1,
+                    'diff_chain':2 }[contact_mode]
+
     if symmetry_mode:
         if symmetry_mode == 'table':
             lcoords = coords_to_symmetry(lcoords, \
@@ -114,32 +176,9 @@ def _prepare_contacts(query, model=None, level='A', search_limit=6.0, \
     lcoords = lcoords.reshape((shape[0] * shape[1] * shape[2], shape[3]))
     box = r_[qcoords.min(axis=0) - search_limit, \
              qcoords.max(axis=0) + search_limit]
-    lc = [] # lattice chain
-    qc = [] # query chain
-    lchains = [i[2] for i in lents_ids]
-    qchains = [i[2] for i in qents_ids]
-    allchains = set()
-    allchains.update(lchains)
-    allchains.update(qchains)
-    chain2id = dict(zip(allchains, range(len(allchains))))
-    for lent_id in lents_ids:
-        lc.append(chain2id[lent_id[2]])
-    for qent_id in qents_ids:
-        qc.append(chain2id[qent_id[2]])
-    lc = array(lc, dtype=int64)
-    qc = array(qc, dtype=int64)
     # here we leave python
-    (idxc, n_src, n_asu, n_sym, n_tra, n_dst) = cnt_loop(\
-                            qcoords, lcoords, qc, lc, shape[1], shape[2], \
-                            zero_tra, contact_mode, search_limit, box, \
-                            **kwargs)
-
-    result = defaultdict(dict)
-    for contact in xrange(idxc):
-        qent_id = qents_ids[n_src[contact]]
-        lent_id = lents_ids[n_asu[contact]]
-        result[qent_id][lent_id] = (sqrt(n_dst[contact]), n_tra[contact], n_sym[contact])
-    return result
+    return cnt_loop(qcoords, lcoords, qc, lc, shape[1], shape[2], \
+                    zero_tra, contact_mode, search_limit, box, **kwargs)
 
 
 def contacts_xtra(query, xtra_key=None, **cnt_kwargs):
@@ -149,13 +188,27 @@ def contacts_xtra(query, xtra_key=None, **cnt_kwargs):
     
     Arguments:
         
-        - query (entitie[s]): query entity or sequence entities
+        - query (entitie[s]): query entity or sequence entities or a 
+          ``PDBArrays`` instance. Contacts between atoms are calculated from
+          the arrays, other levels or a custom lattice model build the 
+          structure.
         - xtra_key (str): name of the key
         
     Additional keyworded arguments are passed to the ``_prepare_contacts`` 
     functon.
     """
     xtra_key = xtra_key or 'CONTACTS'
+    if isinstance(query, PDBArrays):
+        if cnt_kwargs.get('level', 'A') == 'A' and \
+           cnt_kwargs.get('model') is None:
+            cnt_kwargs.pop('level', None)
+            cnt_kwargs.pop('model', None)
+            result = _prepare_contacts_arrays(query, **cnt_kwargs)
+            result = dict([(id, {xtra_key:v}) for id, v in result.iteritems()])
+            if query.isBuilt():
+                xtradata(result, einput(query.getStructure(), 'S'))
+            return result
+        query = query.getStructure()
     structures = einput(query, 'S')
     if len(structures.values()) > 1:
         raise ValueError('Entities from multiple structures are not supported.')
@@ -645,6 +645,15 @@ def minimize_error_rate(classifiers):
     return classifiers[argmin(\
         1.0*c[:,2]/(c[:,2]+c[:,5])+1.0*c[:,3]/(c[:,3]+c[:,4]))]
 
+def condensed_offsets(num_rows):
+    """Returns the offset of each row of a condensed distance matrix.
+
+    A condensed matrix holds the upper triangle of a symmetric matrix, row
+    by row: d(i,j) for i < j is at condensed_offsets(num_rows)[i] + j - i - 1.
+    """
+    rows = arange(num_rows)
+    return rows*num_rows - rows*(rows+1)//2
+
 def mutate_array(a, sd, mean=0):
     """Return mutated copy of the array (or vector), adding mean +/- sd."""
     return a + normal(mean, sd, a.shape)
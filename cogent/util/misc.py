@@ -14,6 +14,8 @@ from os.path import join, abspath, exists, isdir
 from numpy import logical_not, sum
 from cPickle import dumps, loads
 from gzip import GzipFile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import hashlib
 # import parse_command_line_parameters for backward compatibility
 from cogent.util.option_parsing import parse_command_line_parameters
@@ -1416,6 +1418,27 @@ def remove_files(list_of_filepaths, error_on_missing=True):
     if error_on_missing and missing:
         raise OSError, "Some filepaths were not accessible: %s" % '\t'.join(missing)
 
+def map_threads(f, tasks, num_threads=None):
+    """Applies f to each task, in a pool of num_threads threads if > 1.
+
+    numpy releases the GIL in dot products and large elementwise operations,
+    so blocks of an array computation can run concurrently in threads that
+    write into a shared result. num_threads defaults to the number of cpus.
+    """
+    if num_threads is None:
+        num_threads = cpu_count()
+    num_threads = min(num_threads, len(tasks))
+    if num_threads > 1:
+        pool = ThreadPool(num_threads)
+        try:
+            pool.map(f, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for task in tasks:
+            f(task)
+
 def get_random_directory_name(suppress_mkdir=False,\
     timestamp_pattern='%Y%m%d%H%M%S',\
     rand_length=20,\
@@ -27,8 +27,8 @@ except ImportError:
 
 numpy_version = re.split("[^\d]", numpy.__version__)
 numpy_version_info = tuple([int(i) for i in numpy_version if i.isdigit()])
-if numpy_version_info < (1, 3):
-    raise RuntimeError("Numpy-1.3 is required, %s found." % numpy_version)
+if numpy_version_info < (1, 6):
+    raise RuntimeError("Numpy-1.6 is required, %s found." % numpy_version)
 
 # Find arrayobject.h on any system
 numpy_include_dir = numpy.get_include()
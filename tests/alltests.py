@@ -128,6 +128,7 @@ def suite():
         'test_parse.test_cigar',
         'test_parse.test_clustal',
         'test_parse.test_column',
+        'test_parse.test_compressed',
         'test_parse.test_comrna',
         'test_parse.test_consan',
         'test_parse.test_cove',
@@ -136,6 +137,7 @@ def suite():
         'test_parse.test_cutg',
         'test_parse.test_dialign',
         'test_parse.test_ebi',
+        'test_parse.test_faidx',
         'test_parse.test_fasta',
         'test_parse.test_fastq',
         'test_parse.test_gbseq',
@@ -150,6 +152,7 @@ def suite():
         'test_parse.test_meme',
         'test_parse.test_msms',
         'test_parse.test_ncbi_taxonomy',
+        'test_parse.test_newick',
         'test_parse.test_nexus',
         'test_parse.test_nupack',
         'test_parse.test_pdb',
@@ -6,7 +6,8 @@ from numpy import array
 import numpy
 Float = numpy.core.numerictypes.sctype2char(float)
 from cogent.cluster.UPGMA import find_smallest_index, condense_matrix, \
-        condense_node_order, UPGMA_cluster, inputs_from_dict2D, upgma
+        condense_node_order, UPGMA_cluster, inputs_from_dict2D, upgma, \
+        row_minima, update_row_minima
 from cogent.util.dict2d import Dict2D
 
 __author__ = "Rob Knight"
@@ -85,6 +86,33 @@ class UPGMATests(TestCase):
         self.assertEqual(result[4, 4], 9999999)
         self.assertEqual(result[4, 0], 22.5)
 
+    def test_row_minima(self):
+        """row_minima returns the smallest value and column of each row"""
+        matrix = self.matrix
+        mins, columns = row_minima(matrix)
+        self.assertFloatEqual(mins, [1, 1, 4, 2, 2])
+        self.assertEqual(columns, [1, 0, 0, 4, 3])
+
+    def test_update_row_minima(self):
+        """update_row_minima matches row_minima of the condensed matrix"""
+        large_number = 9999999999
+        rand = numpy.random.RandomState(0)
+        for trial in range(20):
+            matrix = rand.randint(1, 6, (8, 8)).astype(Float)
+            matrix = matrix + matrix.T
+            numpy.fill_diagonal(matrix, large_number)
+            mins, columns = row_minima(matrix)
+            first = numpy.argmin(mins)
+            index = (first, columns[first])
+            matrix = condense_matrix(matrix, index, large_number)
+            matrix[first, first] = large_number
+            update_row_minima(matrix, mins, columns, index)
+            exp_mins, exp_columns = row_minima(matrix)
+            live = numpy.arange(8) != index[1]
+            self.assertFloatEqual(mins[live], exp_mins[live])
+            self.assertEqual(columns[live], exp_columns[live])
+            self.assertEqual(mins[index[1]], numpy.inf)
+
     def test_condense_node_order(self):
         """condense_node_order condenses nodes in list based on index info
         """
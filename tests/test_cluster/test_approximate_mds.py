@@ -9,8 +9,11 @@ from cogent.cluster.approximate_mds \
     import calc_matrix_a, calc_matrix_b, build_seed_matrix
 from cogent.cluster.approximate_mds import rowmeans, \
     affine_mapping, adjust_mds_to_ref, recenter, combine_mds, \
-    cmds_tzeng, CombineMds
-from numpy import array, matrix, random, argsort
+    cmds_tzeng, CombineMds, landmark_mds
+from cogent.util import parallel
+from numpy import array, matrix, random, argsort, memmap
+import os
+import tempfile
 
 __author__ = "Andreas Wilm"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -2009,6 +2012,55 @@ class FastMetricNystromScalingTests(TestCase):
         self.assertFloatEqual(matrix_b[0, 0], -272.711227)
         self.assertFloatEqual(matrix_b[-1, -1], -64.898372)
 
+    def test_landmark_mds(self):
+        """landmark_mds should give the nystrom coordinates in blocks"""
+        dim = 3
+        exp = nystrom(self.big_seed_matrix, dim)
+        calls = []
+        def dist_func(rows, cols):
+            calls.append(len(cols))
+            return FULL_SYM_MATRIX[rows][:, cols]
+        mds_coords = landmark_mds(100, 49, dim, dist_func, block_size=30,
+            permute_order=False)
+        self.assertFloatEqual(mds_coords, exp)
+        self.assertEqual(calls, [49, 30, 30, 30, 10])
+        mds_coords = landmark_mds(100, 49, dim, FULL_SYM_MATRIX,
+            block_size=7, permute_order=False)
+        self.assertFloatEqual(mds_coords, exp)
+
+    def test_landmark_mds_random_seeds(self):
+        """landmark_mds should keep objects in order with random seeds"""
+        mds_coords = landmark_mds(100, 49, 3, FULL_SYM_MATRIX,
+            block_size=16)
+        stress = goodness_of_fit.Stress(FULL_SYM_MATRIX, mds_coords)
+        self.assertTrue(stress.calcKruskalStress() < 0.1)
+        self.assertRaises(ValueError, landmark_mds, 100, 100, 3,
+            FULL_SYM_MATRIX)
+        self.assertRaises(ValueError, landmark_mds, 100, 2, 3,
+            FULL_SYM_MATRIX)
+
+    def test_landmark_mds_memmap(self):
+        """landmark_mds should read from and write to memory maps"""
+        exp = nystrom(self.big_seed_matrix, 3)
+        dirname = tempfile.mkdtemp()
+        try:
+            distances = memmap(os.path.join(dirname, 'dists'),
+                dtype=float, mode='w+', shape=FULL_SYM_MATRIX.shape)
+            distances[:] = FULL_SYM_MATRIX
+            coords = memmap(os.path.join(dirname, 'coords'),
+                dtype=float, mode='w+', shape=(100, 3))
+            with parallel.parallel_context(
+                    parallel.MultiprocessingParallelContext(2)):
+                result = landmark_mds(100, 49, 3, distances, block_size=25,
+                    out=coords, permute_order=False)
+            self.assertTrue(result is coords)
+            self.assertFloatEqual(coords, exp)
+            del distances, coords, result
+        finally:
+            for name in os.listdir(dirname):
+                os.remove(os.path.join(dirname, name))
+            os.rmdir(dirname)
+
 
 #run if called from the command line
 if __name__ == '__main__':
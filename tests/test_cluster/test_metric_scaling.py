@@ -3,9 +3,12 @@
 from cogent.util.unit_test import TestCase, main
 from cogent.cluster.metric_scaling import make_E_matrix, \
         make_F_matrix, run_eig, get_principal_coordinates, \
-        principal_coordinates_analysis, output_pca, PCoA
+        principal_coordinates_analysis, output_pca, PCoA, \
+        center_distance_matrix, randomized_eigh
 from numpy import array
 import numpy
+import os
+import tempfile
 Float = numpy.core.numerictypes.sctype2char(float)
 
 __author__ = "Catherine Lozupone"
@@ -78,6 +81,60 @@ class MetricScalingTests(TestCase):
         self.assertFloatEqual(abs(pcs[0,0]), 0.240788133045)
         self.assertFloatEqual(abs(pcs[1,0]), 0.233677162)
 
+    def test_principal_coordinate_analysis_num_axes(self):
+        """principal_coordinate_analysis should give the top num_axes axes"""
+        matrix = self.real_matrix
+        pcs, eigvals = principal_coordinates_analysis(matrix.copy())
+        order = eigvals.argsort()[::-1]
+        top_pcs, top_eigvals = principal_coordinates_analysis(matrix, 3,
+            seed=0)
+        self.assertEqual(top_pcs.shape, (3, 14))
+        self.assertFloatEqual(top_eigvals, eigvals[order[:3]])
+        self.assertFloatEqual(abs(top_pcs), abs(pcs[order[:3]]))
+        self.assertFloatEqual(abs(top_pcs[0,0]), 0.240788133045)
+
+    def test_principal_coordinate_analysis_memmap(self):
+        """principal_coordinate_analysis should centre a memmap in place"""
+        filename = tempfile.mktemp()
+        try:
+            matrix = numpy.memmap(filename, dtype=float, mode='w+',
+                shape=self.real_matrix.shape)
+            matrix[:] = self.real_matrix
+            pcs, eigvals = principal_coordinates_analysis(matrix, 2,
+                out=matrix, block_size=5, seed=0)
+            self.assertFloatEqual(abs(pcs[:,0]), [0.240788133045,
+                0.233677162])
+            self.assertFloatEqual(matrix,
+                make_F_matrix(make_E_matrix(self.real_matrix)))
+            del matrix
+        finally:
+            os.remove(filename)
+
+    def test_center_distance_matrix(self):
+        """center_distance_matrix should match make_F_matrix"""
+        exp = make_F_matrix(make_E_matrix(self.real_matrix))
+        for block_size in [1, 4, 14, 100]:
+            self.assertFloatEqual(center_distance_matrix(self.real_matrix,
+                block_size=block_size), exp)
+        matrix = self.real_matrix.copy()
+        result = center_distance_matrix(matrix, out=matrix)
+        self.assertTrue(result is matrix)
+        self.assertFloatEqual(matrix, exp)
+
+    def test_randomized_eigh(self):
+        """randomized_eigh should find the largest eigenvalues"""
+        points = numpy.random.RandomState(0).normal(size=(50, 4)) * \
+            [10, 5, 2, 1]
+        matrix = numpy.dot(points, points.T)
+        exp_vals, exp_vecs = numpy.linalg.eigh(matrix)
+        eigvals, eigvecs = randomized_eigh(matrix, 3, block_size=7, seed=1)
+        self.assertFloatEqual(eigvals, exp_vals[::-1][:3])
+        self.assertFloatEqual(abs(eigvecs), abs(exp_vecs[:, ::-1][:, :3]))
+        #run_eig returns the eigenvectors as rows
+        eigvals, eigvecs = run_eig(matrix, 2, seed=1)
+        self.assertEqual(eigvecs.shape, (2, 50))
+        self.assertFloatEqual(eigvals, exp_vals[::-1][:2])
+
     def test_PCoA(self):
         """PCoA returns a cogent Table result"""
         matrix = self.real_matrix
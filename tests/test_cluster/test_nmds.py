@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 
 from cogent.util.unit_test import TestCase, main
-from numpy import array, sqrt, size
+from numpy import array, sqrt, size, zeros, allclose
+from numpy.random import RandomState
 from cogent.cluster.nmds import NMDS, metaNMDS
 from cogent.maths.distance_transform import dist_euclidean
+from cogent.util import parallel
 
 __author__ = "Justin Kuczynski"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -43,6 +45,41 @@ class NMDSTests(TestCase):
         self.assertEqual(size(pts, 0), 4)
         self.assertEqual(size(pts, 1), 2)
 
+    def test_order(self):
+        """order, dists and dhats should follow the dissimilarities"""
+        self.assertEqual(self.nm.order,
+            [[1, 2], [0, 1], [2, 3], [0, 2], [0, 3], [1, 3]])
+        self.assertEqual(len(self.nm.dists), 6)
+        dhats = self.nm.dhats
+        self.assertEqual(dhats, sorted(dhats))
+
+    def test_monotone_regression(self):
+        """monotone regression should pool adjacent violators"""
+        nm = self.nm
+        self.assertFloatEqual(nm._do_monotone_regression([1, 3, 2, 4]),
+            [1, 2.5, 2.5, 4])
+        self.assertFloatEqual(nm._do_monotone_regression([3, 2, 1]),
+            [2, 2, 2])
+        #a chain of pools, with and without the one at a time finish
+        values = [1, 2, 3, 4, 5, 0]
+        for max_passes in [0, 2, 50]:
+            self.assertFloatEqual(nm._do_monotone_regression(values,
+                max_passes), [1, 2, 3, 3, 3, 3])
+
+    def test_stress_gradients(self):
+        """stress gradients should match finite differences"""
+        nm = self.nm
+        pts = nm.getPoints().ravel() + RandomState(0).normal(0, .1, 8)
+        stress = nm._recalc_stress_from_pts(pts.copy())
+        grad = nm._calc_stress_gradients(pts.copy())
+        epsilon = 1e-7
+        approx = zeros(len(pts))
+        for k in range(len(pts)):
+            nudged = pts.copy()
+            nudged[k] += epsilon
+            approx[k] = (nm._recalc_stress_from_pts(nudged) - stress)/epsilon
+        self.assertFloatEqual(grad, approx, eps=1e-4)
+
     def test_2(self):
         """l19 data should give stress below .13"""
         ptmtx = array(
@@ -122,5 +159,15 @@ class NMDSTests(TestCase):
         nm = metaNMDS(1, distmtx, verbosity=0)
         self.assertLessThan(nm.getStress(), .13)
 
+    def test_metaNMDS_parallel(self):
+        """metaNMDS random starts should not depend on the number of CPUs"""
+        distmtx = dist_euclidean(RandomState(0).random_sample((12, 4)))
+        nm = metaNMDS(3, distmtx, verbosity=0, rand_seed=1)
+        with parallel.parallel_context(
+                parallel.MultiprocessingParallelContext(2)):
+            nm2 = metaNMDS(3, distmtx, verbosity=0, rand_seed=1)
+        self.assertFloatEqual(nm.getStress(), nm2.getStress())
+        self.assertFloatEqual(nm.getPoints(), nm2.getPoints())
+
 if __name__ == '__main__':
        main()
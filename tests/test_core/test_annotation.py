@@ -183,6 +183,57 @@ class TestAnnotations(unittest.TestCase):
                 assert str(observed) == expected, ("-", annot_type, name, expected,
                                                     observed)
 
+    def test_annotations_overlapping(self):
+        """indexed overlap queries should match a linear scan"""
+        import random
+        random.seed(5)
+        seq = DNA.makeSequence('ACGT' * 250)
+        for i in range(300):
+            start = random.randrange(0, 990)
+            end = start + random.randrange(1, 10)
+            seq.addFeature(['gene', 'exon'][i % 2], 'f%s' % i, [(start, end)])
+        seq.addFeature('source', 'all', [(0, 1000)])
+        
+        def scan(start, end, within=False):
+            return [a for a in seq.annotations if a.map.Start < end
+                    and a.map.End > start and (not within or
+                    (a.map.Start >= start and a.map.End <= end))]
+        
+        for (start, end) in [(0, 1), (500, 520), (990, 1000), (0, 1000)]:
+            self.assertEqual(seq.getAnnotationsOverlapping(start, end),
+                    scan(start, end))
+            self.assertEqual(seq.getAnnotationsOverlapping(start, end,
+                    within=True), scan(start, end, True))
+        self.assertEqual(len(seq.getAnnotationsMatching('exon')), 150)
+        self.assertEqual(seq.getAnnotationsMatching('gene', 'f10')[0].Name,
+                'f10')
+        # index follows attach, detach and replacement of the list
+        new = seq.addFeature('exon', 'new', [(600, 601)])
+        self.assertEqual(seq.getAnnotationsOverlapping(600, 601),
+                scan(600, 601))
+        self.assertTrue(new in seq.getAnnotationsMatching('exon'))
+        seq.detachAnnotations([new])
+        self.assertEqual(seq.getAnnotationsOverlapping(600, 601),
+                scan(600, 601))
+        seq.annotations[0] = seq.annotations[1]
+        self.assertEqual(seq.getAnnotationsOverlapping(0, 1000),
+                scan(0, 1000))
+        # queries between attachments see every annotation so far
+        for i in range(40):
+            seq.addFeature('exon', 'more%s' % i, [(10 * i, 10 * i + 5)])
+            self.assertEqual(seq.getAnnotationsOverlapping(10 * i, 10 * i + 1),
+                    scan(10 * i, 10 * i + 1))
+        self.assertTrue(len(seq._annotation_index.pending) <= 8)
+        self.assertTrue(len(seq._annotation_index.trees) <= 5)
+        seq.annotations = seq.annotations[:100]
+        self.assertEqual(seq.getAnnotationsOverlapping(0, 1000),
+                seq.annotations)
+        # slicing uses the index
+        sub = seq[500:520]
+        self.assertEqual([a.Name for a in sub.annotations],
+                [a.Name for a in scan(500, 520)])
+    
+
 class TestMapSpans(unittest.TestCase):
     """Test attributes of Map & Spans classes critical to annotation
     manipulation."""
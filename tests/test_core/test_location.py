@@ -3,7 +3,8 @@
 """Unit tests for Range, Span and Point classes.
 """
 from cogent.util.unit_test import TestCase, main
-from cogent.core.location import Span, Range, Point, RangeFromString, Map
+from cogent.core.location import Span, Range, Point, RangeFromString, Map, \
+    LostSpan, ArrayMap
 
 __author__ = "Rob Knight"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -481,6 +482,60 @@ class MapTests(TestCase):
         self.assertEqual(coords, spans)
     
 
+def positions(map):
+    """parent position of each position of map, -1 for gaps"""
+    result = []
+    for span in map.spans:
+        if span.lost:
+            result.extend([-1] * span.length)
+        else:
+            result.extend(range(span.Start, span.End))
+    return result
+
+class ArrayMapTests(TestCase):
+    """tests of the ArrayMap class"""
+    def setUp(self):
+        self.map = Map(spans=[LostSpan(2), Span(0, 3), LostSpan(1),
+                Span(3, 5), Span(7, 9), LostSpan(2)], parent_length=10)
+        self.amap = ArrayMap.fromMap(self.map)
+    
+    def test_init(self):
+        """ArrayMap should merge adjacent gaps and contiguous spans"""
+        amap = ArrayMap([-1, -1, 0, 3, 6], [1, 2, 3, 2, 1], 7)
+        self.assertEqual(amap.starts, [-1, 0, 6])
+        self.assertEqual(amap.lengths, [3, 5, 1])
+        self.assertEqual(amap.offsets, [0, 3, 8])
+        self.assertEqual((len(amap), amap.Start, amap.End), (9, 0, 7))
+        self.assertEqual(repr(amap), '[-3-, 0:5, 6:7]/7')
+    
+    def test_fromMap_toMap(self):
+        """conversion to and from Map should keep all positions"""
+        self.assertEqual(positions(self.amap.toMap()), positions(self.map))
+        self.assertEqual(self.amap.getCoordinates(), [(0, 3), (3, 5), (7, 9)])
+        self.assertEqual(self.amap.gaps(), [[0, 2], [5, 6], [10, 12]])
+        reversed = Map([(5, 2)], parent_length=10)
+        self.assertRaises(ValueError, ArrayMap.fromMap, reversed)
+    
+    def test_getitem(self):
+        """slicing and composing should match Map"""
+        for (start, end) in [(0, 12), (1, 4), (5, 6), (3, 11), (4, 4)]:
+            self.assertEqual(positions(self.amap[start:end].toMap()),
+                    positions(self.map[start:end]))
+        index = Map(spans=[Span(1, 4), LostSpan(3), Span(6, 12)],
+                parent_length=12)
+        self.assertEqual(positions(self.amap[index].toMap()),
+                positions(self.map[index]))
+        self.assertRaises(ValueError, self.amap.__getitem__,
+                ArrayMap([0], [13], 13))
+    
+    def test_inverse(self):
+        """inverse should match Map and reject overlaps"""
+        self.assertEqual(positions(self.amap.inverse().toMap()),
+                positions(self.map.inverse()))
+        self.assertEqual(self.amap.inverse().parent_length, 12)
+        self.assertRaises(ValueError, ArrayMap([0, 2], [3, 3], 5).inverse)
+    
+
 #run the following if invoked from command-line
 if __name__ == "__main__":
     main()
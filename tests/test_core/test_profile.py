@@ -10,7 +10,8 @@ from numpy.random import random
 from cogent.util.unit_test import TestCase, main#, numpy_err 
 from cogent.core.moltype import DNA
 from cogent.core.sequence import ModelSequence
-from cogent.core.profile import Profile, ProfileError, CharMeaningProfile
+from cogent.core.profile import Profile, ProfileError, CharMeaningProfile,\
+    ProfileAccumulator
 from cogent.core.alignment import DenseAlignment as Alignment
 
 __author__ = "Sandra Smit"
@@ -518,6 +519,37 @@ class ProfileTests(TestCase):
         self.assertRaises(ProfileError,self.empty.score,p1)
         #raises error when character order doesn't match
         self.assertRaises(ProfileError,self.score2.score,p5) 
+
+    def test_scoreSequences(self):
+        """scoreSequences: should match score on each sequence
+        """
+        seqs = ["TCAAGT", "AGT", DNA.Sequence("GGTCAAGTCA")]
+        res = self.score2.scoreSequences(seqs)
+        self.assertEqual(len(res), 3)
+        for s, r in zip(seqs, res):
+            self.assertFloatEqual(r, self.score2.score(s))
+        res = self.score2.scoreSequences(seqs[:1]+seqs[2:], offset=2)
+        self.assertFloatEqual(res[0], [1.7,0.5])
+        self.assertFloatEqual(res[1], self.score2.score(seqs[2], offset=2))
+        self.assertEqual(self.score2.scoreSequences([]), [])
+        #same errors as score
+        self.assertRaises(ProfileError, self.score2.scoreSequences,\
+            ["TCAAGT", "AG"])
+        self.assertRaises(ProfileError, self.score2.scoreSequences,\
+            ["TCAAGT", "AGT"], offset=1)
+        self.assertRaises(ProfileError, self.score2.scoreSequences,\
+            ["TCAAGT", "ACBRT"])
+        self.assertRaises(ProfileError, self.empty.scoreSequences, ["ACGT"])
+
+    def test_score_long_sequence(self):
+        """score: should match a window by window calculation
+        """
+        p = Profile(random([7,4]), "TCAG")
+        seq = ''.join([ "TCAG"[i] for i in (random(500)*4).astype(int)])
+        idx = ["TCAG".index(c) for c in seq]
+        exp = [sum([p.Data[j,idx[i+j]] for j in range(7)])\
+            for i in range(len(seq)-6)]
+        self.assertFloatEqual(p.score(seq), exp)
  
     def test_rowUncertainty(self):
         """rowUncertainty: should handle full and empty profiles
@@ -746,5 +778,42 @@ class ModuleLevelFunctionsTest(TestCase):
         self.assertRaises(ValueError,CharMeaningProfile,self.alt_dna,\
             "AGNX",split_degenerates=True)
         
+class ProfileAccumulatorTests(TestCase):
+    """Tests for ProfileAccumulator"""
+
+    def test_add(self):
+        """ProfileAccumulator: should accumulate weighted counts in batches
+        """
+        acc = ProfileAccumulator(4, DNA, "TACG", split_degenerates=True)
+        acc.add(["TCAG"], [0.5])
+        acc.add(["TAR-", DNA.Sequence("yag-")], [.25, .25])
+        self.assertEqual(acc.NumSeqs, 3)
+        self.assertFloatEqual(acc.TotalWeight, 1)
+        exp = array([[0.875,0,0.125,0],
+            [0,0.5,0.5,0],
+            [0,0.625,0,0.375],
+            [0,0,0,1]])
+        self.assertFloatEqual(acc.toProfile().Data, exp)
+        p = acc.toProfile()
+        self.assertEqual(p.CharOrder, "TACG")
+        #unweighted, not normalized
+        acc = ProfileAccumulator(3, DNA, "TCAG")
+        acc.add(["TCA", "TCG", "N-A"])
+        self.assertEqual(acc.toProfile(normalize=False).Data.tolist(),\
+            [[2,0,0,0],[0,2,0,0],[0,0,2,1]])
+        #empty batches are fine
+        acc.add([])
+        self.assertEqual(acc.NumSeqs, 3)
+
+    def test_add_errors(self):
+        """ProfileAccumulator: should raise ProfileError on invalid input
+        """
+        acc = ProfileAccumulator(3, DNA, "TCAG")
+        self.assertRaises(ProfileError, acc.add, ["TCAG"])
+        self.assertRaises(ProfileError, acc.add, ["TCA", "TCA"], [1])
+        acc.add(["-CA"])
+        #first position only contains ignored characters
+        self.assertRaises(ProfileError, acc.toProfile)
+
 if __name__ == "__main__":
     main()
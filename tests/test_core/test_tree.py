@@ -1111,6 +1111,50 @@ class TreeNodeTests(TestCase):
         result = self.t.compareBySubsets(self.TreeRoot)
         self.assertEqual(result, 1)
 
+    def test_subsetMasks(self):
+        """subsetMasks should encode subsets as bitsets on the tip index"""
+        tip_index = {}
+        masks = self.t.subsetMasks(tip_index)
+        self.assertEqual(sorted(tip_index.values()), range(4))
+        expect = set()
+        for subset in self.t.subsets():
+            mask = 0
+            for name in subset:
+                mask |= 1 << tip_index[name]
+            expect.add(mask)
+        self.assertEqual(masks, frozenset(expect))
+        #a shared index is extended by the second tree
+        self.t4.subsetMasks(tip_index)
+        self.assertEqual(sorted(tip_index), sorted(self.t4.subset() |
+            self.t.subset()))
+
+    def test_postorderMasks(self):
+        """postorderMasks should give every node with its tip bitset"""
+        tip_index = {}
+        pairs = list(self.t.postorderMasks(tip_index))
+        self.assertEqual([n for n, m in pairs], list(self.t.postorder()))
+        self.assertEqual(pairs[-1][1], 15)
+        for node, mask in pairs:
+            names = [name for name, i in tip_index.items() if mask >> i & 1]
+            self.assertEqual(frozenset(names), frozenset(node.getTipNames(
+                includeself=True)))
+        pairs = list(self.t.postorderMasks(tip_index, include_self=False))
+        self.assertEqual(len(pairs), len(list(self.t.postorder())) - 1)
+
+    def test_splitMasks(self):
+        """splitMasks should be independent of rooting"""
+        t1 = DndParser("((a,b),(c,d),(e,f));", TreeNode)
+        t2 = DndParser("(((a,b),(e,f)),c,d);", TreeNode)
+        t3 = DndParser("(((a,c),(e,f)),b,d);", TreeNode)
+        tip_index = {}
+        s1 = t1.splitMasks(tip_index)
+        s2 = t2.splitMasks(tip_index)
+        s3 = t3.splitMasks(tip_index)
+        self.assertEqual(len(s1), 3)
+        self.assertEqual(s1, s2)
+        #Robinson-Foulds distance is the size of the symmetric difference
+        self.assertEqual(len(s1 ^ s3), 4)
+
 
 class PhyloNodeTests(TestCase):
     """Tests of phylogeny-specific methods."""
@@ -1700,6 +1744,27 @@ class TreeInterfaceForLikelihoodFunction(TestCase):
                          quoted_name_esc)
         self.assertEqual(tree.getNewick(escape_name=False),quoted_name)
    
+    def test_writeNewick(self):
+        """writeNewick should write the same string as getNewick"""
+        from StringIO import StringIO
+        orig = "((A:1.0,B:2.0)ab:3.0,((C:4.0,D:5.0)cd:6.0,E:7.0)cde:8.0)all;"
+        tree = self._maketree(orig)
+        out = StringIO()
+        tree.writeNewick(out, with_distances=True)
+        self.assertEqual(out.getvalue(), orig)
+        out = StringIO()
+        tree.writeNewick(out, semicolon=False)
+        self.assertEqual(out.getvalue(), tree.getNewick(semicolon=False))
+    
+    def test_getNewick_deep(self):
+        """getNewick should not recurse on deep caterpillar trees"""
+        from sys import getrecursionlimit
+        depth = getrecursionlimit() * 2
+        treestring = '(' * depth + 'a' + ''.join([',b%s)' % i
+                for i in range(depth)]) + ';'
+        tree = self._maketree(treestring)
+        self.assertTrue(tree.getNewick() == treestring)
+    
     def test_XML(self):
         # should add some non-length parameters
         orig = self.default_tree
@@ -1778,6 +1843,11 @@ class SmallTreeReshapeTestClass(TestCase):
         assert t1.sameTopology(t2), (t1, t2)
         assert not t1.sameTopology(t3), (t1, t3)
         assert not t2.sameTopology(t3), (t2, t3)
+        t4 = LoadTree(treestring="((s1,s5),(s2,s4),s6);")
+        t5 = LoadTree(treestring="((s1,s5),s2,s4);")
+        assert not t2.sameTopology(t4), (t2, t4)
+        assert not t2.sameTopology(t5), (t2, t5)
+        assert not t5.sameTopology(t2), (t5, t2)
 
 
 #=============================================================================
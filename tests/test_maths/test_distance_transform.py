@@ -531,6 +531,84 @@ class functionTests(TestCase):
                         [1-.4,1-4/11,0],
                         ]))
     
+    def test_pairwise_blocked(self):
+        """pairwise_blocked should give the same results for any tiling"""
+        data = numpy.random.RandomState(1).poisson(1, (23, 7))
+        data[4] = 0
+        data[9] = data[2]
+        exp = dist_bray_curtis(data)
+        for block_size in [1, 5, 23, 30]:
+            for num_threads in [1, 3]:
+                res = pairwise_blocked(data, BLOCK_KERNELS['bray_curtis'],
+                    block_size=block_size, num_threads=num_threads)
+                self.assertFloatEqual(res, exp)
+                res = pairwise_blocked(data, BLOCK_KERNELS['bray_curtis'],
+                    block_size=block_size, num_threads=num_threads,
+                    condensed=True)
+                self.assertFloatEqual(res, exp[numpy.triu_indices(23, 1)])
+        res = pairwise_blocked(data, BLOCK_KERNELS['bray_curtis'], dtype='f')
+        self.assertEqual(res.dtype, numpy.float32)
+        self.assertFloatEqual(res, exp, eps=1e-5)
+        out = numpy.zeros(253)
+        res = pairwise_blocked(data, BLOCK_KERNELS['bray_curtis'],
+            block_size=4, condensed=True, out=out)
+        self.assertTrue(res is out)
+        self.assertRaises(ValueError, pairwise_blocked, data,
+            BLOCK_KERNELS['bray_curtis'], out=numpy.zeros(10))
+        self.assertEqual(condensed_offsets(4).tolist(), [0, 3, 5, 6])
+
+    def test_pairwise_blocked_kernel(self):
+        """pairwise_blocked should compute any metric from its block kernel"""
+        def max_difference(x, y):
+            return abs(x[:, numpy.newaxis, :] - y[numpy.newaxis]).max(axis=2)
+        res = pairwise_blocked(self.dense1, max_difference, block_size=2)
+        self.assertFloatEqual(res, [[0, 4, 19], [4, 0, 20], [19, 20, 0]])
+
+    def test_dist_blocked(self):
+        """dist_blocked should match the dist_* functions for every metric"""
+        data = numpy.random.RandomState(2).poisson(0.8, (19, 9)) * 1.5
+        data[[3, 7]] = 0
+        data[12] = data[5]
+        data[:, 2] = 0
+        names = BLOCK_KERNELS.keys() + TABLE_KERNELS.keys()
+        for name in names:
+            if name.startswith('binary_'):
+                dist_f = eval('binary_dist_' + name[len('binary_'):])
+            else:
+                dist_f = eval('dist_' + name)
+            exp = dist_f(data)
+            self.assertFloatEqual(dist_blocked(data, name, block_size=4), exp)
+            self.assertFloatEqual(dist_blocked(data, name, block_size=6,
+                condensed=True), exp[numpy.triu_indices(19, 1)])
+        self.assertRaises(ValueError, dist_blocked, data, 'xyz')
+        self.assertRaises(ValueError, make_block_kernel, 'gower')
+
+    def test_dist_blocked_sparse(self):
+        """dist_blocked should accept sparse matrices with row slicing"""
+        class Dense(object):
+            def __init__(self, data):
+                self.data = data
+            def toarray(self):
+                return self.data
+        class RowSparse(object):
+            """stands in for a scipy.sparse matrix"""
+            def __init__(self, data):
+                self.data = data
+                self.shape = data.shape
+            def tocsr(self):
+                return self
+            def __getitem__(self, index):
+                return Dense(self.data[index])
+        data = numpy.random.RandomState(3).poisson(0.5, (13, 20))
+        for name in ['bray_curtis', 'gower', 'chisq', 'binary_jaccard']:
+            self.assertFloatEqual(dist_blocked(RowSparse(data), name,
+                block_size=5), dist_blocked(data, name))
+
+    def test_binary_dist_otu_gain_list(self):
+        """binary_dist_otu_gain should accept nested lists"""
+        self.assertEqual(binary_dist_otu_gain([[1, 0], [0, 2], [0, 0]]),
+            array([[0, 1, 1], [1, 0, 1], [0, 0, 0]]))
+
     #def test_no_dupes(self):
         #""" here we check all distance functions in distance_transform for 
         #duplicate
@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 #file test_parse.py
-from numpy import array
+from numpy import array, zeros, isnan, arange
+from numpy.random import RandomState
 from cogent.util.unit_test import TestCase, main
+from cogent.util import parallel
+from cogent.maths.stats.alpha_diversity import observed_species, shannon, \
+    chao1, equitability
 from cogent.maths.stats.rarefaction import (subsample,
                                             naive_histogram,
                                             wrap_numpy_histogram,
                                             rarefaction,
                                             subsample_freq_dist_nonzero,
                                             subsample_random,
-                                            subsample_multinomial)
+                                            subsample_multinomial,
+                                            subsample_table,
+                                            batch_rarefaction,
+                                            _table_metrics)
 
 __author__ = "Rob Knight"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -110,6 +117,62 @@ class TopLevelTests(TestCase):
             actual[tuple(e)] = None
         self.assertTrue(len(actual) > 1)
 
+    def test_subsample_table(self):
+        """subsample_table should subsample each row of a table"""
+        table = array([[5,0,3,10,1,7], [0,2,0,0,0,1], [1,1,1,1,1,1]])
+        random = RandomState(0)
+        for replace in [False, True]:
+            result = subsample_table(table, 4, replace, random)
+            self.assertEqual(result.sum(axis=1), [4,3,4])
+            self.assertEqual(result[1], [0,2,0,0,0,1])
+            self.assertEqual(result[:, 1][[0]], [0])
+            if not replace:
+                self.assertTrue((result <= table).all())
+        self.assertEqual(subsample_table(table, 30), table)
+        #rows picks (repeated) rows to subsample
+        result = subsample_table(table, 2, random_state=random,
+            rows=[2,2,0])
+        self.assertEqual(result.shape, (3,6))
+        self.assertEqual(result.sum(axis=1), [2,2,2])
+        #the draws have hypergeometric means
+        result = subsample_table(table, 13, random_state=random,
+            rows=zeros(5000, int))
+        self.assertFloatEqual(result.mean(axis=0), table[0]/2.,
+            eps=0.05)
+
+    def test_batch_rarefaction(self):
+        """batch_rarefaction should give alpha diversity of rarefied tables"""
+        table = RandomState(0).randint(0, 4, (6, 20))
+        table[0] = 0
+        table[0, :3] = 1
+        result = batch_rarefaction(table, [2, 10, 1000], num_iters=5,
+            metrics=[observed_species, shannon, equitability],
+            batch_size=2, seed=0)
+        self.assertEqual(sorted(result),
+            ['equitability', 'observed_species', 'shannon'])
+        observed = result['observed_species']
+        self.assertEqual(observed.shape, (3,5,6))
+        self.assertEqual(observed[0, :, 0], [2]*5)
+        self.assertTrue(isnan(observed[1:, :, 0]).all())
+        self.assertTrue(isnan(observed[2]).all())
+        self.assertFalse(isnan(observed[1, :, 1:]).any())
+        with parallel.parallel_context(
+                parallel.MultiprocessingParallelContext(2)):
+            result2 = batch_rarefaction(table, [2, 10, 1000], num_iters=5,
+                metrics=[observed_species, shannon, equitability],
+                batch_size=2, seed=0)
+        for name in result:
+            self.assertEqual(isnan(result[name]), isnan(result2[name]))
+            self.assertFloatEqual(result[name][:2, :, 1:],
+                result2[name][:2, :, 1:])
+
+    def test_table_metrics(self):
+        """row by row metrics should match the alpha diversity functions"""
+        table = RandomState(1).randint(0, 4, (10, 30))
+        for metric, table_metric in _table_metrics().items():
+            self.assertFloatEqual(table_metric(table),
+                [metric(row) for row in table])
+
     def test_naive_histogram(self):
         """naive_histogram should produce expected result"""
         vals = array([1,0,0,3])
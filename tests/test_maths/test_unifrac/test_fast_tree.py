@@ -12,10 +12,15 @@ from cogent.maths.unifrac.fast_tree import (count_envs, sum_env_dict,
     jackknife_int, unifrac, unnormalized_unifrac, PD, G, unnormalized_G, 
     unifrac_matrix, unifrac_vector, PD_vector, weighted_unifrac, 
     weighted_unifrac_matrix, weighted_unifrac_vector, jackknife_array, 
-    env_unique_fraction, unifrac_one_sample, weighted_one_sample)
+    env_unique_fraction, unifrac_one_sample, weighted_one_sample,
+    unifrac_matrix_blocked, weighted_unifrac_matrix_blocked, SparseColumns,
+    SparseEnvCounts, index_envs_sparse, parent_indices, 
+    bool_descendants_sparse, sum_descendants_sparse, unifrac_vector_sparse,
+    weighted_unifrac_vector_sparse, permute_selected_rows_batch,
+    fitch_descendants_batch, env_unique_fraction_batch)
 from numpy import (arange, reshape, zeros, logical_or, array, sum, nonzero, 
     flatnonzero, newaxis)
-from numpy.random import permutation    
+from numpy.random import permutation, RandomState
 
 __author__ = "Rob Knight and Micah Hamady"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -370,6 +375,47 @@ f   D"""
         #make sure we didn't change orig
         self.assertEqual(orig, reshape(arange(8), (4,2)))
 
+    def test_permute_selected_rows_batch(self):
+        """permute_selected_rows_batch should give one copy per permutation"""
+        orig = reshape(arange(8),(4,2))
+        perms = [[1,0], [0,1], [1,0]]
+        result = permute_selected_rows_batch([0,2], orig, perms)
+        self.assertEqual(result.shape, (4,6))
+        for k, perm in enumerate(perms):
+            exp = zeros((4,2), int)
+            permute_selected_rows([0,2], orig, exp, lambda n: array(perm))
+            self.assertEqual(result[:,2*k:2*k+2], exp)
+        self.assertEqual(permute_selected_rows_batch([0,2], orig, []).shape,
+            (4,0))
+
+    def test_fitch_descendants_batch(self):
+        """fitch_descendants_batch should match fitch_descendants per copy"""
+        t = DndParser('(((a:1,b:2):4,(c:3,d:1):2):1,(e:2,f:1,g:1):3);', 
+            UniFracTreeNode)
+        node_index, nodes = index_tree(t)
+        tips = [n._leaf_index for n in t.tips()]
+        rand = RandomState(2)
+        orig = zeros((len(node_index), 3), int)
+        orig[tips] = rand.randint(0, 2, (len(tips), 3))
+        perms = [rand.permutation(len(tips)) for i in range(20)]
+        batch = permute_selected_rows_batch(tips, orig, perms)
+        changes = fitch_descendants_batch(bind_to_array(nodes, batch), 20)
+        for k in range(20):
+            one = permute_selected_rows_batch(tips, orig, perms[k:k+1])
+            self.assertEqual(changes[k], 
+                fitch_descendants(bind_to_array(nodes, one)))
+        #env_unique_fraction_batch after bool_descendants on the batch
+        bl = get_branch_lengths(node_index)
+        batch = permute_selected_rows_batch(tips, orig, perms)
+        bool_descendants(bind_to_array(nodes, batch))
+        sums, fracs = env_unique_fraction_batch(bl, batch, 20)
+        for k in range(20):
+            one = permute_selected_rows_batch(tips, orig, perms[k:k+1])
+            bool_descendants(bind_to_array(nodes, one))
+            exp_sums, exp_fracs = env_unique_fraction(bl, one)
+            self.assertFloatEqual(sums[k], exp_sums)
+            self.assertFloatEqual(fracs[k], exp_fracs)
+
     def test_prep_items_for_jackknife(self):
         """prep_items_for_jackknife should expand indices of repeated counts"""
         a = array([0,1,0,1,2,0,3])
@@ -625,6 +671,139 @@ f   D"""
             abs(2./3-3./7)*4,
             abs(1./3-4./7)*3]))
 
+    def test_unifrac_matrix_blocked(self):
+        """unifrac_matrix_blocked should match unifrac_matrix"""
+        m = array([[1,0,1],[1,1,0],[0,1,0],[0,0,1],[0,1,0],[0,1,1],[1,1,1],\
+            [0,1,1],[1,1,1]])
+        bl = self.branch_lengths
+        for metric, is_symmetric in [(unifrac, True), (unifrac, False),
+            (unnormalized_unifrac, True), (G, False), (unnormalized_G, False)]:
+            exp = unifrac_matrix(bl, m, metric, is_symmetric)
+            for block_size in [1, 2, 256]:
+                for num_threads in [1, 3]:
+                    result = unifrac_matrix_blocked(bl, m, metric,
+                        is_symmetric, block_size, num_threads)
+                    self.assertFloatEqual(result, exp)
+        #random states with some empty rows and zero branch lengths
+        rand = RandomState(7)
+        m = rand.randint(0, 3, (40, 11)) * (rand.rand(40, 1) > 0.3)
+        bl = rand.rand(40) * (rand.rand(40) > 0.2)
+        exp = unifrac_matrix(bl, m)
+        self.assertFloatEqual(unifrac_matrix_blocked(bl, m, block_size=4,
+            num_threads=2), exp)
+        self.assertRaises(ValueError, unifrac_matrix_blocked, bl, m, PD)
+        #asymmetric metrics treated as symmetric keep metric(i,j) for i > j
+        m = rand.randint(0, 2, (50, 11))
+        bl = rand.rand(50)
+        for metric in [G, unnormalized_G]:
+            exp = unifrac_matrix(bl, m, metric, True)
+            for block_size in [1, 4, 256]:
+                self.assertFloatEqual(unifrac_matrix_blocked(bl, m, metric,
+                    True, block_size), exp)
+
+    def test_weighted_unifrac_matrix_blocked(self):
+        """weighted_unifrac_matrix_blocked should match pairwise result"""
+        envs = self.count_array
+        bound_indices = bind_to_array(self.nodes, envs)
+        sum_descendants(bound_indices)
+        bl = self.branch_lengths
+        tip_indices = [n._leaf_index for n in self.t.tips()]
+        td = bl.copy()[:,newaxis]
+        tip_bindings = bind_to_parent_array(self.t, td)
+        tip_distances(td, tip_bindings, tip_indices)
+        for bl_correct in [False, True]:
+            exp = weighted_unifrac_matrix(bl, envs, tip_indices,
+                bl_correct=bl_correct, tip_distances=td)
+            for block_size in [1, 2, 64]:
+                for max_cells in [1, 5, 2**22]:
+                    result = weighted_unifrac_matrix_blocked(bl, envs,
+                        tip_indices, bl_correct=bl_correct, tip_distances=td,
+                        block_size=block_size, num_threads=2,
+                        max_cells=max_cells)
+                    self.assertFloatEqual(result, exp)
+
+    def test_SparseColumns(self):
+        """SparseColumns should hold the nonzero entries by column"""
+        a = array([[0,2,0,1],[3,0,0,0],[0,4,0,5]])
+        m = SparseColumns.fromMatrix(a)
+        self.assertEqual(m.shape, (3,4))
+        self.assertEqual(m.IndPtr, [0,1,3,3,5])
+        self.assertEqual(m.Indices, [1,0,2,0,2])
+        self.assertEqual(m.Data, [3,2,4,1,5])
+        self.assertEqual(m.toarray(), a)
+        self.assertEqual(m.toarray(1, 4, array([0,2])), a[[0,2],1:])
+        self.assertEqual(m.rowsUsed(2, 4), [0,2])
+        self.assertEqual(m.columnSums(array([1,10,100])), [30,402,0,501])
+        self.assertEqual(m.columnSums(array([1,10,100]), as_bool=True),
+            [10,101,0,101])
+        self.assertEqual(m.take([3,0]).toarray(), a[:,[3,0]])
+        self.assertEqual(m.take([]).shape, (3,0))
+
+    def test_SparseEnvCounts(self):
+        """SparseEnvCounts should look like the count_envs dict"""
+        envs = SparseEnvCounts(array([[1,0],[0,0],[2,3]]), ['a','b','c'],
+            ['X','Y'])
+        self.assertEqual(envs.keys(), ['a','c'])
+        self.assertEqual(len(envs), 2)
+        self.assertTrue('c' in envs)
+        self.assertFalse('b' in envs)
+        self.assertEqual(envs['c'], {'X':2, 'Y':3})
+        self.assertEqual(envs['a'], {'X':1})
+        self.assertRaises(KeyError, envs.__getitem__, 'b')
+        self.assertRaises(KeyError, envs.__getitem__, 'd')
+        self.assertFalse('d' in envs)
+        self.assertRaises(ValueError, SparseEnvCounts, array([[1,0]]),
+            ['a','b'], ['X','Y'])
+
+    def test_sparse_descendants(self):
+        """sparse propagation should match dense propagation"""
+        matrix = array([[1,0,2,0],[0,0,1,0],[0,0,0,1],[3,0,1,0],[0,0,0,2],
+            [0,0,0,0]])
+        taxa = ['a','b','c','d','e','f']
+        envs = SparseEnvCounts(matrix, taxa, ['D','C','B','A'])
+        env_dict = dict([(t, dict([(e, c) for e, c in \
+            zip(['D','C','B','A'], row) if c])) for t, row in \
+            zip(taxa, matrix) if row.any()])
+        m, unique_envs, env_to_index, node_to_index = \
+            index_envs_sparse(envs, self.node_index)
+        exp, exp_envs, exp_env_to_index, exp_node_to_index = \
+            index_envs(env_dict, self.node_index)
+        self.assertEqual(unique_envs, exp_envs)
+        self.assertEqual(m.toarray(), exp)
+        self.assertEqual(index_envs_sparse(env_dict, self.node_index)[0].toarray(),
+            exp)
+        parents = parent_indices(self.t)
+        self.assertEqual(parents[self.t._leaf_index], -1)
+        for propagate, dense_propagate in [
+            (bool_descendants_sparse, bool_descendants),
+            (sum_descendants_sparse, sum_descendants)]:
+            dense = exp.copy()
+            dense_propagate(bind_to_array(self.nodes, dense))
+            sparse = propagate(m, parents)
+            self.assertEqual(sparse.toarray() != 0, dense != 0)
+            if propagate is sum_descendants_sparse:
+                self.assertEqual(sparse.toarray(), dense)
+        bools = bool_descendants_sparse(m, parents)
+        dense = bools.toarray()
+        bl = self.branch_lengths
+        self.assertFloatEqual(unifrac_vector_sparse(bl, bools),
+            unifrac_vector(bl, dense))
+        self.assertFloatEqual(unifrac_matrix_blocked(bl, bools, G, False, 2),
+            unifrac_matrix(bl, dense, G, False))
+        sums = sum_descendants_sparse(m, parents)
+        dense = sums.toarray()
+        tip_indices = [n._leaf_index for n in self.t.tips()]
+        td = bl.copy()[:,newaxis]
+        tip_distances(td, bind_to_parent_array(self.t, td), tip_indices)
+        for bl_correct in [False, True]:
+            self.assertFloatEqual(weighted_unifrac_vector_sparse(bl, sums,
+                tip_indices, bl_correct, td), weighted_unifrac_vector(bl, 
+                dense, tip_indices, bl_correct, td))
+            self.assertFloatEqual(weighted_unifrac_matrix_blocked(bl, sums,
+                tip_indices, bl_correct, td, block_size=3), 
+                weighted_unifrac_matrix(bl, dense, tip_indices, bl_correct,
+                td))
+
 
 if __name__ == '__main__':    #run if called from command-line
     main()
@@ -2,11 +2,13 @@
 """Unit tests for fast unifrac."""
 from __future__ import division
 
-from numpy import array, logical_not, argsort
+import os
+import tempfile
+from numpy import array, logical_not, argsort, arange, zeros, memmap
 from cogent.util.unit_test import TestCase, main
 from cogent.parse.tree import DndParser
 from cogent.maths.unifrac.fast_tree import (count_envs, index_tree, index_envs,
-    get_branch_lengths)
+    get_branch_lengths, SparseEnvCounts, G, unnormalized_unifrac, PD)
 from cogent.maths.unifrac.fast_unifrac import (reshape_by_name,
     meta_unifrac, shuffle_tipnames, weight_equally, weight_by_num_tips, 
     weight_by_branch_length, weight_by_num_seqs, get_all_env_names,
@@ -15,8 +17,23 @@ from cogent.maths.unifrac.fast_unifrac import (reshape_by_name,
     UniFracTreeNode, mcarlo_sig, num_comps, fast_unifrac, 
     fast_unifrac_whole_tree, PD_whole_tree, PD_generic_whole_tree,
     TEST_ON_TREE, TEST_ON_ENVS, TEST_ON_PAIRWISE, shared_branch_length,
-    shared_branch_length_to_root, fast_unifrac_one_sample)
-from numpy.random import permutation 
+    shared_branch_length_to_root, fast_unifrac_one_sample,
+    fast_unifrac_permutations, UNIFRAC_DIST_MATRIX, UNIFRAC_DIST_VECTOR,
+    condensed_offsets, condensed_to_matrix, unifrac_stripes, 
+    fast_unifrac_striped, fast_p_test)
+from numpy.random import permutation, RandomState
+
+def sparse_envs(envs):
+    """Returns SparseEnvCounts with the counts of the count_envs dict envs"""
+    taxa = sorted(envs)
+    env_names = sorted(set([e for counts in envs.values() for e in counts]))
+    matrix = array([[envs[taxon].get(e, 0) for e in env_names] \
+        for taxon in taxa])
+    #an extra empty env and an unknown taxon should be ignored
+    matrix = array([list(row) + [0] for row in matrix] + \
+        [[1]*(len(env_names)+1)])
+    return SparseEnvCounts(matrix, taxa + ['not_in_tree'], 
+        env_names + ['empty'])
 
 __author__ = "Rob Knight and Micah Hamady"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -152,6 +169,119 @@ f B 1
         self.assertRaises(ValueError,  fast_unifrac, self.t, \
             self.wrong_tip_counts)
             
+    def test_fast_unifrac_sparse(self):
+        """fast_unifrac should give the same results for SparseEnvCounts"""
+        modes = [UNIFRAC_DIST_MATRIX, UNIFRAC_DIST_VECTOR]
+        for envs in [self.env_counts, self.missing_env_counts, 
+            self.extra_tip_counts]:
+            for weighted in [False, True, 'correct']:
+                for metric, is_symmetric in [(G, False), 
+                    (unnormalized_unifrac, True), (lambda bl,i,j: 0, True)]:
+                    exp = fast_unifrac(self.t, envs, weighted, metric, 
+                        is_symmetric, modes)
+                    obs = fast_unifrac(self.t, sparse_envs(envs), weighted,
+                        metric, is_symmetric, modes)
+                    for mode in modes:
+                        self.assertFloatEqual(obs[mode][0], exp[mode][0])
+                        self.assertEqual(obs[mode][1], exp[mode][1])
+        self.assertRaises(ValueError,  fast_unifrac, self.t, \
+            sparse_envs(self.wrong_tip_counts))
+
+    def test_fast_unifrac_permutations_sparse(self):
+        """fast_unifrac_permutations should accept SparseEnvCounts"""
+        for weighted in [False, True]:
+            exp = fast_unifrac_permutations(self.t, self.env_counts, weighted,
+                10, 'A', 'C', permutation_f=RandomState(1).permutation)
+            obs = fast_unifrac_permutations(self.t, 
+                sparse_envs(self.env_counts), weighted, 10, 'A', 'C', 
+                permutation_f=RandomState(1).permutation)
+            self.assertFloatEqual(obs, exp)
+
+    def test_batched_permutations(self):
+        """permutation tests should not depend on the batch size"""
+        for weighted in [False, True, 'correct']:
+            exp = fast_unifrac_permutations(self.t, self.env_counts, weighted,
+                25, 'A', 'C', permutation_f=RandomState(1).permutation,
+                batch_size=1)
+            self.assertEqual(len(exp), 25)
+            obs = fast_unifrac_permutations(self.t, self.env_counts, weighted,
+                25, 'A', 'C', permutation_f=RandomState(1).permutation,
+                batch_size=7)
+            self.assertFloatEqual(obs, exp)
+        exp = fast_p_test(self.t, self.env_counts, 25, 
+            permutation_f=RandomState(2).permutation, batch_size=1)
+        obs = fast_p_test(self.t, self.env_counts, 25, 
+            permutation_f=RandomState(2).permutation, batch_size=10)
+        self.assertEqual(obs, exp)
+        exp = fast_unifrac_whole_tree(self.t, self.env_counts, 25, 
+            permutation_f=RandomState(3).permutation, batch_size=1)
+        obs = fast_unifrac_whole_tree(self.t, self.env_counts, 25, 
+            permutation_f=RandomState(3).permutation, batch_size=4)
+        self.assertFloatEqual(obs[0], exp[0])
+        self.assertFloatEqual(obs[1], exp[1])
+        #real value from the identity permutation
+        self.assertEqual(fast_p_test(self.t, self.env_counts, 1, 
+            permutation_f=lambda n: arange(n)), [2])
+
+    def test_seeded_permutations(self):
+        """seeded permutation tests should be reproducible"""
+        first = fast_unifrac_permutations(self.t, self.env_counts, False, 30,
+            'A', 'B', seed=5, batch_size=8)
+        second = fast_unifrac_permutations(self.t, self.env_counts, False, 
+            30, 'A', 'B', seed=5, batch_size=8)
+        self.assertEqual(len(first), 30)
+        self.assertEqual(first, second)
+        self.assertEqual(fast_p_test(self.t, self.env_counts, 30, seed=1),
+            fast_p_test(self.t, self.env_counts, 30, seed=1))
+        self.assertNotEqual(fast_p_test(self.t, self.env_counts, 30, seed=1),
+            fast_p_test(self.t, self.env_counts, 30, seed=2))
+
+    def test_condensed(self):
+        """condensed matrices should hold the upper triangle by row"""
+        self.assertEqual(condensed_offsets(4), [0,3,5,6])
+        m = condensed_to_matrix(arange(1,7), 4)
+        self.assertEqual(m, array([[0,1,2,3],[1,0,4,5],[2,4,0,6],
+            [3,5,6,0]]))
+        self.assertEqual(unifrac_stripes(4, 3), [(0,1),(1,3)])
+        self.assertEqual(unifrac_stripes(4, 1), [(0,1),(1,2),(2,3)])
+        self.assertEqual(unifrac_stripes(5, 100), [(0,4)])
+        self.assertEqual(unifrac_stripes(1, 100), [])
+
+    def test_fast_unifrac_striped(self):
+        """fast_unifrac_striped should write the matrix and resume"""
+        dirname = tempfile.mkdtemp()
+        filename = os.path.join(dirname, 'dists')
+        try:
+            for envs in [self.env_counts, sparse_envs(self.env_counts)]:
+                for weighted in [False, True, 'correct']:
+                    exp = fast_unifrac(self.t, envs, weighted, 
+                        modes=[UNIFRAC_DIST_MATRIX])[UNIFRAC_DIST_MATRIX]
+                    obs, env_names = fast_unifrac_striped(self.t, envs, 
+                        filename, weighted, stripe_size=1, block_size=1)
+                    self.assertEqual(env_names, exp[1])
+                    self.assertFloatEqual(condensed_to_matrix(obs, 3), exp[0])
+            #only stripes missing from the log are computed again
+            log = open(filename + '.stripes').read().splitlines()
+            self.assertEqual(log[1:], ['0', '1'])
+            open(filename + '.stripes', 'w').write('\n'.join(log[:2])+'\n')
+            memmap(filename, float, 'r+', shape=(3,))[:] = 0
+            obs, env_names = fast_unifrac_striped(self.t, self.env_counts,
+                filename, 'correct', stripe_size=1)
+            self.assertEqual(obs[:2], [0, 0])
+            self.assertFloatEqual(obs[2], exp[0][1,2])
+            #a different computation starts again
+            obs, env_names = fast_unifrac_striped(self.t, self.env_counts,
+                filename, stripe_size=1)
+            exp = fast_unifrac(self.t, self.env_counts, 
+                modes=[UNIFRAC_DIST_MATRIX])[UNIFRAC_DIST_MATRIX]
+            self.assertFloatEqual(condensed_to_matrix(obs, 3), exp[0])
+            self.assertRaises(ValueError, fast_unifrac_striped, self.t, 
+                {'a':{'A':1}}, filename)
+        finally:
+            for name in os.listdir(dirname):
+                os.remove(os.path.join(dirname, name))
+            os.rmdir(dirname)
+
     def test_fast_unifrac_one_sample(self):
         """ fu one sample should match whole unifrac result, for env 'B'"""
         # first get full unifrac matrix
@@ -344,6 +474,8 @@ f B 1
         env_counts = count_envs(env_str.splitlines())
         self.assertEqual(PD_whole_tree(t1,env_counts), \
             (['A','B','C'], array([7.,15.,11.])))
+        self.assertEqual(PD_whole_tree(t1,sparse_envs(env_counts)), \
+            (['A','B','C'], array([7.,15.,11.])))
 
     def test_PD_generic_whole_tree(self):
         """PD_generic_whole_tree should correctly compute PD for test tree."""
@@ -3,8 +3,11 @@
 import copy
 import os
 import tempfile
+from StringIO import StringIO
 from unittest import TestCase, main
 
+import numpy
+
 from cogent.parse.binary_sff import (
     seek_pad, parse_common_header, parse_read_header, parse_read_data,
     validate_common_header, parse_read, parse_binary_sff, UnsupportedSffError,
@@ -12,6 +15,8 @@ from cogent.parse.binary_sff import (
     write_read, write_binary_sff, format_common_header, format_read_header,
     format_read_data, format_binary_sff, base36_encode, base36_decode,
     decode_location, decode_timestamp, decode_accession, decode_sff_filename,
+    parse_read_arrays, parse_binary_sff_arrays, read_from_arrays,
+    parse_sff_index, parse_read_by_name,
     )
 
 __author__ = "Kyle Bittinger"
@@ -194,6 +199,74 @@ class ParsingFunctionTests(TestCase):
         self.assertEqual(counter, 20)
 
 
+class ArrayParsingFunctionTests(TestCase):
+    def setUp(self):
+        self.sff_file = open(SFF_FP, 'rb')
+
+    def assertReadsEqual(self, observed, expected):
+        self.assertEqual(sorted(observed.keys()), sorted(expected.keys()))
+        for key, value in expected.items():
+            if key in ('Name', 'Bases'):
+                self.assertEqual(observed[key], value)
+            else:
+                self.assertTrue(numpy.allclose(observed[key], value))
+
+    def test_parse_read_arrays(self):
+        self.sff_file.seek(440)
+        observed = parse_read_arrays(self.sff_file, 400)
+        expected = dict(READ_HEADER.items() + READ_DATA.items())
+        self.assertReadsEqual(observed, expected)
+        self.assertEqual(observed['flowgram_values'].dtype, numpy.uint16)
+        self.assertEqual(self.sff_file.tell() % 8, 0)
+
+    def test_parse_binary_sff_arrays(self):
+        header, reads = parse_binary_sff(self.sff_file)
+        reads = list(reads)
+        for native in [False, True]:
+            observed_header, arrays = parse_binary_sff_arrays(
+                open(SFF_FP, 'rb'), native_flowgram_values=native)
+            self.assertEqual(observed_header, COMMON_HEADER)
+            self.assertEqual(arrays['flowgram_values'].shape, (20, 400))
+            self.assertEqual(arrays['base_offsets'][-1],
+                sum([r['number_of_bases'] for r in reads]))
+            for i, read in enumerate(reads):
+                if native:
+                    read = dict(read)
+                    read['flowgram_values'] = numpy.round(
+                        numpy.array(read['flowgram_values']) * 100)
+                self.assertReadsEqual(read_from_arrays(arrays, i), read)
+        self.assertEqual(arrays['read_offset'][0], 440)
+
+    def test_parse_binary_sff_arrays_no_fileno(self):
+        """Files that can't be memory mapped should be read"""
+        data = open(SFF_FP, 'rb').read()
+        header, arrays = parse_binary_sff_arrays(StringIO(data))
+        self.assertEqual(arrays['Name'], parse_binary_sff_arrays(
+            self.sff_file)[1]['Name'])
+
+    def test_parse_sff_index(self):
+        header, arrays = parse_binary_sff_arrays(self.sff_file)
+        index = parse_sff_index(self.sff_file, header)
+        expected = dict(zip(arrays['Name'], arrays['read_offset']))
+        self.assertEqual(index, expected)
+        # Without an index section the reads are scanned
+        header['index_length'] = 0
+        self.assertEqual(parse_sff_index(self.sff_file, header), expected)
+
+    def test_parse_read_by_name(self):
+        header, arrays = parse_binary_sff_arrays(self.sff_file)
+        index = parse_sff_index(self.sff_file, header)
+        for i in [19, 0, 7]:
+            observed = parse_read_by_name(
+                self.sff_file, header, index, arrays['Name'][i])
+            expected = read_from_arrays(arrays, i)
+            expected['flowgram_values'] = numpy.round(
+                expected['flowgram_values'] * 100)
+            self.assertReadsEqual(observed, expected)
+        self.assertRaises(
+            KeyError, parse_read_by_name, self.sff_file, header, index, 'x')
+
+
 class FormattingFunctionTests(TestCase):
     def setUp(self):
         self.output_file = tempfile.TemporaryFile()
@@ -3,12 +3,14 @@
 """
 from string import split, strip
 from cogent.util.unit_test import TestCase, main
+from cogent.parse.record import RecordError
 from cogent.parse.blast import iter_finder, query_finder, iteration_set_finder,\
     is_blast_junk, is_blat_junk, make_label, PsiBlastQueryFinder, \
     TableToValues, \
     PsiBlastTableParser, PsiBlastFinder, GenericBlastParser9, \
     PsiBlastParser9, LastProteinIds9, QMEBlast9, QMEPsiBlast9, \
-    fastacmd_taxonomy_splitter, FastacmdTaxonomyParser
+    fastacmd_taxonomy_splitter, FastacmdTaxonomyParser, \
+    ColumnarBlastParser, BlastHitColumns, BLAST_TABULAR_FIELDS
 
 __author__ = "Micah Hamady"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -280,6 +282,114 @@ Scientific name: cf. Acremonium sp. KR21-2
         self.assertEqual(r1['tax_id'], '228610')
 
         
+
+class ColumnarBlastTests(TestCase):
+    """Tests of ColumnarBlastParser and BlastHitColumns"""
+
+    def setUp(self):
+        """Define some standard data"""
+        BlastTests.setUp.im_func(self)
+
+    def test_ColumnarBlastParser(self):
+        """ColumnarBlastParser should give typed columns of all hits"""
+        hits = ColumnarBlastParser(self.rec2)
+        self.assertEqual(len(hits), 13)
+        self.assertEqual(hits.Fields, ['ITERATION'] + BLAST_TABULAR_FIELDS)
+        self.assertEqual(hits['ITERATION'], [1,1,1,2,2,2,2,2,2,2,1,1,1])
+        self.assertEqual(hits['QUERY ID'], ['ece:Z4181']*10 + ['ece:Z4182']*3)
+        self.assertEqual(hits['SUBJECT ID'][:3],
+            ['ece:Z4181', 'ecs:ECs3717', 'cvi:CV2421'])
+        self.assertEqual(hits.Labels['QUERY ID'], ['ece:Z4181', 'ece:Z4182'])
+        self.assertEqual(hits['% identity'][2], 41.67)
+        self.assertEqual(hits['MISMATCHES'][:3], [0, 0, 42])
+        self.assertEqual(hits['E-VALUE'][-1], 2e-06)
+        self.assertEqual(hits['BIT SCORE'][:3], [187, 187, 52.8])
+        self.assertRaises(KeyError, hits.getColumn, 'xxx')
+        #the result shouldn't depend on the chunk size
+        for chunk_size in [1, 4, 7]:
+            chunked = ColumnarBlastParser(self.rec2, chunk_size=chunk_size)
+            for field in hits.Fields:
+                self.assertEqual(chunked[field], hits[field])
+            self.assertEqual(chunked.Labels['SUBJECT ID'],
+                hits.Labels['SUBJECT ID'])
+
+    def test_ColumnarBlastParser_fields(self):
+        """ColumnarBlastParser should handle -outfmt 6 and 7 output"""
+        outfmt6 = [l for l in self.rec2 if not l.startswith('#')]
+        hits = ColumnarBlastParser(outfmt6)
+        self.assertEqual(hits.Fields, BLAST_TABULAR_FIELDS)
+        self.assertEqual(len(hits), 13)
+        outfmt7 = ['# BLASTP 2.2.28+', '# Query: a',
+            '# Fields: query id, subject id, evalue, bit score',
+            'a\tb\t1e-10\t50.1', 'a\tc\t1e-5\t20']
+        hits = ColumnarBlastParser(outfmt7)
+        self.assertEqual(hits.Fields, ['QUERY ID', 'SUBJECT ID', 'E-VALUE',
+            'BIT SCORE'])
+        self.assertEqual(hits['E-VALUE'], [1e-10, 1e-5])
+        self.assertRaises(RecordError, ColumnarBlastParser, outfmt6 + ['a\tb'])
+        empty = ColumnarBlastParser([])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(len(empty.bestHitsByQuery()), 0)
+        #PSI-BLAST output for a query without hits
+        no_hits = ColumnarBlastParser(['# BLASTP 2.2.10 [Oct-19-2004]',
+            '# Iteration: 1', '# Query: a', '# Database: db'])
+        self.assertEqual(len(no_hits), 0)
+        self.assertEqual(no_hits.Fields, ['ITERATION'] + BLAST_TABULAR_FIELDS)
+        self.assertEqual(len(no_hits['ITERATION']), 0)
+
+    def test_filterByField(self):
+        """filterByField should keep hits better than threshold"""
+        hits = ColumnarBlastParser(self.rec2)
+        good = hits.filterByField('E-value', 1e-6)
+        self.assertEqual(len(good), 7)
+        self.assertTrue((good['E-VALUE'] < 1e-6).all())
+        long_hits = hits.filterByField('ALIGNMENT LENGTH', 100)
+        self.assertEqual(long_hits['SUBJECT ID'][-1], 'ecs:ECs3718')
+        self.assertEqual(len(long_hits), 7)
+        self.assertRaises(ValueError, hits.filterByField, 'Q. START', 3)
+
+    def test_filterByIteration(self):
+        """filterByIteration should keep hits of one iteration per query"""
+        hits = ColumnarBlastParser(self.rec2)
+        last = hits.filterByIteration()
+        self.assertEqual(last['ITERATION'], [2]*7 + [1]*3)
+        self.assertEqual(len(hits.filterByIteration(1)), 6)
+        self.assertEqual(len(hits.filterByIteration(-2)), 3)
+        outfmt6 = ColumnarBlastParser([l for l in self.rec2
+            if not l.startswith('#')])
+        self.assertEqual(len(outfmt6.filterByIteration()), 13)
+        self.assertEqual(len(outfmt6.filterByIteration(2)), 0)
+
+    def test_bestHitsByQuery(self):
+        """bestHitsByQuery should give the n best hits of each query"""
+        hits = ColumnarBlastParser(self.rec3).filterByIteration()
+        best = hits.bestHitsByQuery()
+        self.assertEqual(best['QUERY ID'], ['ece:Z4181', 'ece:Z4182'])
+        self.assertEqual(best['SUBJECT ID'], ['ecs:ECs3717', 'cvi:CV2422'])
+        best = hits.bestHitsByQuery(n=2, return_self=True)
+        self.assertEqual(best['SUBJECT ID'], ['ecs:ECs3717', 'cvi:CV2421',
+            'ece:Z4182', 'cvi:CV2422'])
+        best = hits.bestHitsByQuery(field='E-VALUE', return_self=True)
+        self.assertEqual(best['SUBJECT ID'], ['ecs:ECs3717', 'ece:Z4182'])
+        self.assertRaises(ValueError, hits.bestHitsByQuery, field='S. END')
+
+    def test_iterHitsByQuery(self):
+        """iterHitsByQuery should give the hits of each query in order"""
+        hits = ColumnarBlastParser(self.rec3)
+        groups = list(hits.iterHitsByQuery())
+        self.assertEqual([q for q, h in groups], ['ece:Z4181', 'ece:Z4182'])
+        self.assertEqual(map(len, [h for q, h in groups]), [5, 2])
+        self.assertEqual(groups[1][1]['SUBJECT ID'],
+            ['ece:Z4182', 'cvi:CV2422'])
+
+    def test_toTable(self):
+        """toTable should give a Table with a row per hit"""
+        hits = ColumnarBlastParser(self.rec)
+        table = hits.toTable()
+        self.assertEqual(table.Shape, (10, 13))
+        self.assertEqual(table.Header, hits.Fields)
+        self.assertEqual(table.getRawData('SUBJECT ID')[2], 'cvi:CV2421')
+
                             
 if __name__ == "__main__":
     main()
@@ -17,7 +17,7 @@ __status__ = "Prototype"
 from cogent.util.unit_test import main, TestCase
 from cogent.parse.blast_xml import BlastXMLResult, MinimalBlastParser7,\
      get_tag, parse_hsp, parse_hit, parse_header, parse_parameters,\
-     HSP_XML_FIELDNAMES, HIT_XML_FIELDNAMES
+     HSP_XML_FIELDNAMES, HIT_XML_FIELDNAMES, ColumnarBlastXmlParser
 
 import xml.dom.minidom
 
@@ -190,6 +190,46 @@ class BlastXmlResultTests(TestCase):
             self.assertEqual(gap_hsp['GAP_OPENINGS'],'33')
 
 
+
+class ColumnarBlastXmlParserTests(TestCase):
+    """Tests of parsing XML output into columns."""
+
+    def test_columns(self):
+        """ColumnarBlastXmlParser should give a row per hsp."""
+        hits = ColumnarBlastXmlParser(COMPLETE_XML.splitlines(True))
+        self.assertEqual(len(hits), 3)
+        self.assertEqual(hits['QUERY ID'], ['1', '1', '1'])
+        self.assertEqual(hits['SUBJECT ID'][0], 'gi|148670104|gb|EDL02051.1|')
+        self.assertEqual(hits['HIT_LENGTH'], [707, 707, 707])
+        self.assertEqual(hits['Q. START'], [4, 4, 6])
+        self.assertEqual(hits['GAP OPENINGS'], [0, 33, 0])
+        self.assertEqual(hits['ALIGNMENT LENGTH'], [14, 14, 18])
+        self.assertEqual(hits['MISMATCHES'], [14-55, 14-55-33, 18-55])
+        self.assertFloatEqual(hits['% IDENTITY'][2], 5500.0 / 18)
+        self.assertEqual(hits['E-VALUE'], [0.333]*3)
+        self.assertEqual(hits['BIT SCORE'], [1023.46]*3)
+        chunked = ColumnarBlastXmlParser(COMPLETE_XML, chunk_size=2)
+        for field in hits.Fields:
+            self.assertEqual(chunked[field], hits[field])
+
+    def test_query_ids(self):
+        """ColumnarBlastXmlParser should take query ids from definitions."""
+        xml = COMPLETE_XML.replace('<Iteration>', '<Iteration>'
+            '<Iteration_query-def>q1 a protein</Iteration_query-def>')
+        hits = ColumnarBlastXmlParser(xml)
+        self.assertEqual(hits['QUERY ID'], ['q1', 'q1', 'q1'])
+        self.assertEqual(len(hits.bestHitsByQuery(return_self=True)), 1)
+
+    def test_missing_tags(self):
+        """ColumnarBlastXmlParser shouldn't reuse values of earlier HSPs."""
+        hits = ColumnarBlastXmlParser(COMPLETE_XML)
+        self.assertEqual(hits['POSITIVE'], [555, 555, 555])
+        last = COMPLETE_XML.rindex('<Hsp_positive>')
+        xml = COMPLETE_XML[:last] + COMPLETE_XML[last:].replace(
+            '<Hsp_positive>555</Hsp_positive>', '', 1)
+        hits = ColumnarBlastXmlParser(xml)
+        self.assertEqual(hits['POSITIVE'], [555, 555, 0])
+
                 
 HSP_XML = """
         <Hsp>
@@ -2,7 +2,7 @@
 import unittest, sys, os
 from cogent import DNA, LoadSeqs
 from cogent.parse.cigar import map_to_cigar, cigar_to_map, aligned_from_cigar, \
-                                slice_cigar, CigarParser
+                                slice_cigar, CigarParser, cigar_to_array_map
 
 __author__ = "Hua Ying"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -34,6 +34,13 @@ class TestCigar(unittest.TestCase):
         map = cigar_to_map(self.cigar_text)
         assert str(map) == str(self.map)
     
+    def test_cigar_to_array_map(self):
+        """test generating an ArrayMap from cigar"""
+        map = cigar_to_array_map(self.cigar_text)
+        self.assertEqual(map.toMap().getCoordinates(),
+                         self.map.getCoordinates())
+        self.assertEqual((len(map), map.parent_length), (22, 12))
+    
     def test_aligned_from_cigar(self):
         """test generating aligned seq from cigar"""
         aligned_seq = aligned_from_cigar(self.cigar_text, self.seq)
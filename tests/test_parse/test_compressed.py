@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+import os
+import bz2
+import zlib
+import struct
+import tempfile
+from gzip import GzipFile
+
+from cogent import LoadSeqs, LoadTree, LoadTable
+from cogent.util.unit_test import TestCase, main
+from cogent.parse.compressed import compression_type, open_compressed,\
+    strip_compressed_suffix, BgzfReader
+from cogent.parse.fastq import MinimalFastqParser
+from cogent.parse.faidx import IndexedFasta
+
+__author__ = "Gavin Huttley"
+__copyright__ = "Copyright 2007-2012, The Cogent Project"
+__credits__ = ["Gavin Huttley"]
+__license__ = "GPL"
+__version__ = "1.5.3-dev"
+__maintainer__ = "Gavin Huttley"
+__email__ = "gavin.huttley@anu.edu.au"
+__status__ = "Production"
+
+def bgzf_blocks(data, block_size):
+    """Returns data BGZF compressed, block_size bytes per block"""
+    blocks = []
+    for start in range(0, len(data), block_size) + [len(data)]:
+        chunk = data[start:start+block_size]
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressor.compress(chunk) + compressor.flush()
+        block_size_field = 12 + 6 + len(deflated) + 8 - 1
+        header = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' + \
+                struct.pack('<H', 6) + 'BC' + struct.pack('<HH', 2,
+                block_size_field)
+        footer = struct.pack('<II', zlib.crc32(chunk) & 0xffffffff,
+                len(chunk))
+        blocks.append(header + deflated + footer)
+    #the last, empty, block is the BGZF end of file marker
+    return ''.join(blocks)
+
+fasta_data = '>a\nACGTACGTAC\nGTAC\n>b\nTTTTGGGG\nCC\n'
+
+class CompressedTests(TestCase):
+    """Tests of compressed file detection and reading"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def _write(self, name, data, kind=None):
+        """writes data to name in the temp dir, compressed as kind"""
+        filename = os.path.join(self.dir, name)
+        if kind == 'gzip':
+            f = GzipFile(filename, 'wb')
+            f.write(data)
+            f.close()
+        elif kind == 'bz2':
+            open(filename, 'wb').write(bz2.compress(data))
+        elif kind == 'bgzf':
+            open(filename, 'wb').write(bgzf_blocks(data, 7))
+        else:
+            open(filename, 'wb').write(data)
+        return filename
+
+    def test_compression_type(self):
+        """compression_type should detect compression from magic bytes"""
+        for kind in [None, 'gzip', 'bz2', 'bgzf']:
+            filename = self._write('seqs.txt', fasta_data, kind)
+            self.assertEqual(compression_type(filename), kind)
+            f = open_compressed(filename)
+            self.assertEqual(f.read(), fasta_data)
+            f.close()
+        filename = self._write('empty', '')
+        self.assertEqual(compression_type(filename), None)
+
+    def test_strip_compressed_suffix(self):
+        """strip_compressed_suffix should remove compression suffixes"""
+        self.assertEqual(strip_compressed_suffix('a.fasta.gz'), 'a.fasta')
+        self.assertEqual(strip_compressed_suffix('a.fasta.bz2'), 'a.fasta')
+        self.assertEqual(strip_compressed_suffix('a.fasta'), 'a.fasta')
+
+    def test_BgzfReader(self):
+        """BgzfReader should read, seek and iterate by uncompressed offset"""
+        filename = self._write('seqs.fasta.gz', fasta_data, 'bgzf')
+        f = BgzfReader(filename)
+        self.assertEqual(f.Size, len(fasta_data))
+        self.assertEqual(f.read(), fasta_data)
+        self.assertEqual(f.read(), '')
+        for start in range(len(fasta_data)):
+            for size in [0, 1, 6, 7, 8, 20, 100]:
+                self.assertEqual(f.readAt(start, size),
+                        fasta_data[start:start+size])
+        f.seek(3)
+        self.assertEqual(f.tell(), 3)
+        self.assertEqual(f.read(9), fasta_data[3:12])
+        f.seek(-3, 2)
+        self.assertEqual(f.read(), 'CC\n')
+        f.seek(0)
+        self.assertEqual(list(f), fasta_data.splitlines(True))
+        f.close()
+
+    def test_BgzfReader_virtual(self):
+        """BgzfReader should convert to and from virtual offsets"""
+        filename = self._write('seqs.fasta.gz', fasta_data, 'bgzf')
+        f = BgzfReader(filename)
+        f.seek(9)
+        virtual = f.tellVirtual()
+        #9 is the third byte of the second 7 byte block
+        self.assertEqual(virtual & 0xFFFF, 2)
+        f.seek(0)
+        f.seekVirtual(virtual)
+        self.assertEqual(f.tell(), 9)
+        self.assertRaises(ValueError, f.seekVirtual, (3 << 16) | 1)
+        f.close()
+
+    def test_loaders(self):
+        """LoadSeqs, LoadTree, LoadTable and parsers read compressed files"""
+        for kind in ['gzip', 'bz2', 'bgzf']:
+            filename = self._write('seqs.fasta.gz', fasta_data, kind)
+            seqs = LoadSeqs(filename, aligned=False)
+            self.assertEqual(seqs.todict(),
+                    {'a': 'ACGTACGTACGTAC', 'b': 'TTTTGGGGCC'})
+            filename = self._write('tree.nwk.bz2', '((a,b),c);', kind)
+            self.assertEqual(LoadTree(filename).getNewick(), '((a,b),c);')
+            filename = self._write('table.csv.gz', 'x,y\n1,2\n3,4\n', kind)
+            self.assertEqual(LoadTable(filename).getColumns(['x', 'y']
+                    ).Shape, (2, 2))
+            filename = self._write('reads.fastq.gz',
+                    '@r1\nACG\n+r1\nIII\n', kind)
+            self.assertEqual(list(MinimalFastqParser(filename)),
+                    [('r1', 'ACG', 'III')])
+
+    def test_IndexedFasta(self):
+        """IndexedFasta should work on BGZF but not gzip files"""
+        filename = self._write('seqs.fasta.gz', fasta_data, 'bgzf')
+        f = IndexedFasta(filename)
+        self.assertEqual(f.getSeq('a'), 'ACGTACGTACGTAC')
+        self.assertEqual(f.getSeq('a', 8, 12), 'ACGT')
+        self.assertEqual(f.getSeq('b', 5), 'GGGCC')
+        f.close()
+        lines = open(filename + '.fai').read().splitlines()
+        self.assertEqual(lines, ['a\t14\t3\t10\t11', 'b\t10\t22\t8\t9'])
+        filename = self._write('plain.fasta.gz', fasta_data, 'gzip')
+        self.assertRaises(ValueError, IndexedFasta, filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+import os
+import tempfile
+from StringIO import StringIO
+
+from cogent.util.unit_test import TestCase, main
+from cogent.core.moltype import DNA
+from cogent.parse.record import RecordError
+from cogent.parse.fasta import MinimalFastaParser
+from cogent.parse.fastq import MinimalFastqParser
+from cogent.parse.faidx import fasta_index_records, fastq_index_records,\
+    parse_fai, write_fai, IndexedFasta, IndexedFastq
+
+__author__ = "Gavin Huttley"
+__copyright__ = "Copyright 2007-2012, The Cogent Project"
+__credits__ = ["Gavin Huttley"]
+__license__ = "GPL"
+__version__ = "1.5.3-dev"
+__maintainer__ = "Gavin Huttley"
+__email__ = "gavin.huttley@anu.edu.au"
+__status__ = "Production"
+
+fasta_data = """>one first sequence
+ACGTACGTAC
+GTACGTACGT
+ACG
+>two
+TTTT
+>three
+>four description
+AAAAACCCCC
+GGGGGTTTTT
+"""
+
+fastq_data = """@r1 first
+ACGTACGT
++r1
+IIIIHHHH
+@r2
+TTGCA
++
+!!"#$
+"""
+
+class IndexRecordTests(TestCase):
+    """Tests of building and reading .fai records"""
+
+    def test_fasta_index_records(self):
+        """fasta_index_records should give samtools faidx records"""
+        records = list(fasta_index_records(StringIO(fasta_data)))
+        self.assertEqual(records, [('one', 23, 20, 10, 11),
+            ('two', 4, 51, 4, 5),
+            ('three', 0, 63, 0, 0),
+            ('four', 20, 81, 10, 11)])
+
+    def test_fasta_index_records_crlf(self):
+        """fasta_index_records should count line terminators as bytes"""
+        data = fasta_data.replace('\n', '\r\n')
+        records = list(fasta_index_records(StringIO(data)))
+        self.assertEqual(records[0], ('one', 23, 21, 10, 12))
+
+    def test_fasta_index_records_errors(self):
+        """fasta_index_records should raise RecordError on bad files"""
+        for data in ['ACGT\n>a\nAC\n', '>a\nAC\nACGT\n', '>a\nACG\nA\nAC\n',
+                '>a\nAC\n\nAC\n', '>\nAC\n']:
+            self.assertRaises(RecordError, list,
+                    fasta_index_records(StringIO(data)))
+
+    def test_fastq_index_records(self):
+        """fastq_index_records should give samtools fqidx records"""
+        records = list(fastq_index_records(StringIO(fastq_data)))
+        self.assertEqual(records, [('r1', 8, 10, 8, 9, 23),
+            ('r2', 5, 36, 5, 6, 44)])
+        for data in ['r1\nAC\n+\nII\n', '@r1\nAC\n+\nI\n', '@r1\nAC\n-\nII\n',
+                '@r1\nAC\n+\n']:
+            self.assertRaises(RecordError, list,
+                    fastq_index_records(StringIO(data)))
+
+    def test_parse_write_fai(self):
+        """write_fai output should be read back by parse_fai"""
+        records = list(fastq_index_records(StringIO(fastq_data)))
+        out = StringIO()
+        write_fai(records, out)
+        self.assertEqual(out.getvalue().splitlines()[0],
+                'r1\t8\t10\t8\t9\t23')
+        self.assertEqual(list(parse_fai(out.getvalue().splitlines())),
+                records)
+        self.assertRaises(RecordError, list, parse_fai(['a\t1\t2\n']))
+
+
+class IndexedFileTests(TestCase):
+    """Tests of IndexedFasta and IndexedFastq"""
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fasta = os.path.join(self.dir, 'seqs.fasta')
+        self.fastq = os.path.join(self.dir, 'seqs.fastq')
+        open(self.fasta, 'w').write(fasta_data)
+        open(self.fastq, 'w').write(fastq_data)
+
+    def tearDown(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def test_index_written(self):
+        """IndexedFasta should write the index and reuse it"""
+        f = IndexedFasta(self.fasta)
+        f.close()
+        self.assertTrue(os.path.exists(self.fasta + '.fai'))
+        lines = open(self.fasta + '.fai').read().splitlines()
+        self.assertEqual(lines[0], 'one\t23\t20\t10\t11')
+        #the saved index is used when present
+        open(self.fasta + '.fai', 'w').write('one\t3\t20\t10\t11\n')
+        f = IndexedFasta(self.fasta)
+        self.assertEqual(f.keys(), ['one'])
+        self.assertEqual(f.getSeq('one'), 'ACG')
+        f.close()
+
+    def test_no_index_written(self):
+        """IndexedFasta should not write the index if write_index is False"""
+        f = IndexedFasta(self.fasta, write_index=False)
+        self.assertFalse(os.path.exists(self.fasta + '.fai'))
+        self.assertEqual(len(f), 4)
+        f.close()
+
+    def test_getSeq(self):
+        """IndexedFasta.getSeq should return whole sequences and regions"""
+        f = IndexedFasta(self.fasta)
+        exp = dict([(label.split()[0], seq) for label, seq in
+                MinimalFastaParser(open(self.fasta), strict=False)])
+        exp['three'] = ''
+        self.assertEqual(f.Names, ['one', 'two', 'three', 'four'])
+        for name in f:
+            full = exp[name]
+            self.assertEqual(f.getSeq(name), full)
+            for start in range(-3, len(full) + 2):
+                for end in [None, -1, 0, 5, 9, 10, 11, 21, 30]:
+                    self.assertEqual(f.getSeq(name, start, end),
+                            full[start:end])
+        self.assertRaises(KeyError, f.getSeq, 'five')
+        f.close()
+
+    def test_items(self):
+        """IndexedFasta items should be sliceable like strings"""
+        f = IndexedFasta(self.fasta, MolType=DNA)
+        seq = f['one']
+        self.assertEqual(len(seq), 23)
+        self.assertEqual(seq[8:13], 'ACGTA')
+        self.assertEqual(seq[-1], 'G')
+        self.assertEqual(seq[::5], 'ACGTA')
+        self.assertEqual(str(seq), 'ACGTACGTACGTACGTACGTACG')
+        self.assertRaises(IndexError, seq.__getitem__, 23)
+        self.assertRaises(KeyError, f.__getitem__, 'five')
+        self.assertTrue('two' in f)
+        s = f.getSeq('two', 1, 3)
+        self.assertEqual(str(s), 'TT')
+        self.assertEqual(s.Name, 'two')
+        self.assertEqual(s.MolType, DNA)
+        f.close()
+
+    def test_toSequenceCollection(self):
+        """IndexedFasta.toSequenceCollection should load the named seqs"""
+        f = IndexedFasta(self.fasta)
+        coll = f.toSequenceCollection(['two', 'four'], MolType=DNA)
+        self.assertEqual(coll.Names, ['two', 'four'])
+        self.assertEqual(str(coll.getSeq('four')), 'AAAAACCCCCGGGGGTTTTT')
+        f.close()
+
+    def test_fastq(self):
+        """IndexedFastq should give sequences and qualities"""
+        f = IndexedFastq(self.fastq)
+        exp = list(MinimalFastqParser(self.fastq, strict=False))
+        self.assertEqual(f.Names, ['r1', 'r2'])
+        for (label, seq, qual), name in zip(exp, f.Names):
+            self.assertEqual(f.getSeq(name), seq)
+            self.assertEqual(f.getQual(name), qual)
+        self.assertEqual(f.getQual('r2', 1, 3), '!"')
+        self.assertEqual(f['r1'][2:4], 'GT')
+        f.close()
+        lines = open(self.fastq + '.fai').read().splitlines()
+        self.assertEqual(lines[1], 'r2\t5\t36\t5\t6\t44')
+
+    def test_empty_file(self):
+        """IndexedFasta should work on empty files"""
+        open(self.fasta, 'w').close()
+        f = IndexedFasta(self.fasta)
+        self.assertEqual(len(f), 0)
+        self.assertEqual(f.Names, [])
+        f.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 """Unit tests for FASTA and related parsers.
 """
+from StringIO import StringIO
 from cogent.parse.fasta import FastaParser, MinimalFastaParser, \
-    NcbiFastaLabelParser, NcbiFastaParser, RichLabel, LabelParser, GroupFastaParser
+    NcbiFastaLabelParser, NcbiFastaParser, RichLabel, LabelParser, \
+    GroupFastaParser, FastaFinder, FastaBlockFinder
 from cogent.core.sequence import DnaSequence, Sequence, ProteinSequence as Protein
 from cogent.core.info import Info
 from cogent.parse.record import RecordError
@@ -107,6 +109,46 @@ class MinimalFastaParserTests(GenericFastaTest):
         self.assertEqual(a, ('abc', 'caggac'))
         self.assertEqual(b, ('456', 'cg'))
 
+    def test_file_input(self):
+        """MinimalFastaParser should give the same results for file objects"""
+        for lines in [self.oneseq, self.multiline, self.threeseq, self.oneX]:
+            f = StringIO('\n'.join(lines))
+            self.assertEqual(list(MinimalFastaParser(f)),
+                list(MinimalFastaParser(lines)))
+        for lines in [self.labels, self.twogood, self.nolabels]:
+            f = StringIO('\n'.join(lines))
+            self.assertRaises(RecordError, list, MinimalFastaParser(f))
+            f = StringIO('\n'.join(lines))
+            self.assertEqual(list(MinimalFastaParser(f, strict=False)),
+                list(MinimalFastaParser(lines, strict=False)))
+        self.assertEqual(list(MinimalFastaParser(StringIO(''))), [])
+
+class FastaBlockFinderTests(TestCase):
+    """Tests of FastaBlockFinder"""
+
+    def _joined(self, recs):
+        return [(r[0], ''.join(r[1:])) for r in recs]
+
+    def test_blocks(self):
+        """FastaBlockFinder should find the records FastaFinder finds"""
+        texts = ['>a\nACGT\nAC\n>b\nGG\n\n>c\n',
+            'junk\n#comment\n>a\nAC\n',
+            '#comment\n\n>a x y \nAC\n  >b\n AC GT \n#c\nTT\n>c\nA',
+            '>a\r\nAC\r\nGT\r\n>b\r\nT\r\n',
+            '>a\nAC>GT\n>\nT\n>b\n\n\n',
+            '\n\n>a\nACGTACGTACGTAC\nACGTAC\n\n>b\nA\n']
+        for text in texts:
+            exp = self._joined(FastaFinder(text.split('\n')))
+            for block_size in [1, 2, 3, 5, 7, 1000]:
+                obs = FastaBlockFinder(StringIO(text), block_size=block_size)
+                self.assertEqual(self._joined(obs), exp)
+
+    def test_sequence_is_joined(self):
+        """FastaBlockFinder should give plain records as [label, seq]"""
+        text = '>a\nAC\nGT\n>b\n\n'
+        self.assertEqual(list(FastaBlockFinder(StringIO(text), 4)),
+            [['>a', 'ACGT'], ['>b']])
+
 class FastaParserTests(GenericFastaTest):
     """Tests of FastaParser: returns sequence objects."""
        
@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 from cogent.util.unit_test import TestCase, main
 
-from cogent.parse.fastq import MinimalFastqParser
+from StringIO import StringIO
+import numpy
+
+from cogent.parse.record import RecordError
+from cogent.parse.fastq import MinimalFastqParser, FastqParser,\
+    FastqBatchParser
 
 __author__ = "Gavin Huttley"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -51,6 +56,46 @@ class ParseFastq(TestCase):
             self.assertTrue(label in data)
             self.assertEqual(seq, data[label]["seq"])
             self.assertEqual(qual, data[label]["qual"])
+
+    def test_FastqParser(self):
+        """FastqParser should give qualities as Phred score arrays"""
+        for batch_size in [1, 3, 10000]:
+            count = 0
+            for label, seq, qual in FastqParser('data/fastq.txt',
+                    batch_size=batch_size):
+                count += 1
+                self.assertEqual(seq, data[label]["seq"])
+                self.assertEqual(qual.dtype, numpy.uint8)
+                self.assertEqual(qual.tolist(),
+                        [ord(c) - 33 for c in data[label]["qual"]])
+            self.assertEqual(count, len(data))
+        qual = list(FastqParser('data/fastq.txt', phred_offset=64))[0][2]
+        self.assertEqual(qual.tolist(),
+                [ord(c) - 64 for c in r'````Y^T]`]c^cabcacc`^Lb^ccYT\T\Y\WF'])
+
+    def test_FastqBatchParser(self):
+        """FastqBatchParser should give padded quality arrays per batch"""
+        text = '@a\nACGT\n+\nIIII\n@b\nAC\n+b\n#5\n@c\nA\n+\n!\n\n'
+        batches = list(FastqBatchParser(StringIO(text), batch_size=2))
+        self.assertEqual(len(batches), 2)
+        labels, seqs, quals, lengths = batches[0]
+        self.assertEqual(labels, ['a', 'b'])
+        self.assertEqual(seqs, ['ACGT', 'AC'])
+        self.assertEqual(quals.tolist(), [[40,40,40,40],[2,20,0,0]])
+        self.assertEqual(lengths.tolist(), [4, 2])
+        labels, seqs, quals, lengths = batches[1]
+        self.assertEqual((labels, seqs, quals.tolist(), lengths.tolist()),
+                (['c'], ['A'], [[0]], [1]))
+
+    def test_FastqBatchParser_errors(self):
+        """FastqBatchParser should raise RecordError on invalid records"""
+        for text in ['@a\nAC\n+\nII\n@b\nAC\n', '@a\nAC\n+\nI\n',
+                '@a\nAC\n+b\nII\n', 'a\nAC\n+\nII\n', '@a\nAC\n+\n  \n']:
+            self.assertRaises(RecordError, list,
+                    FastqBatchParser(StringIO(text)))
+        #the quality label is only checked if strict
+        self.assertEqual(len(list(FastqParser(StringIO('@a\nAC\n+b\nII\n'),
+            strict=False))), 1)
     
 
 if __name__ == "__main__":
@@ -16,12 +16,17 @@ from cogent.core.sequence import Sequence
 from cogent.parse.flowgram_collection import FlowgramCollection, flows_from_array,\
      flows_from_generic,flows_from_kv_pairs,flows_from_empty,flows_from_dict,\
      flows_from_sff,assign_sequential_names,flows_from_flowCollection,\
-     pick_from_prob_density, seqs_to_flows
+     pick_from_prob_density, seqs_to_flows, flows_from_binary_sff,\
+     binary_sff_header_info
+from cogent.parse.binary_sff import parse_binary_sff_arrays
 
 from cogent.parse.flowgram import Flowgram
 from cogent.core.alignment import SequenceCollection
 from tempfile import mktemp
 from os import remove
+from os.path import dirname, join, realpath
+
+SFF_FP = join(dirname(dirname(realpath(__file__))), 'data', 'F6AVWTA01.sff')
 
 class flowgram_tests(TestCase):
     """Tests of top-level functions."""
@@ -61,6 +66,21 @@ class flowgram_tests(TestCase):
         self.assertEqual(obs_labels, ['a','b'])
         self.assertEqual(obs_info, [None,None])
 
+    def test_flows_from_binary_sff(self):
+        """flows_from_binary_sff should format flows and info on demand"""
+        header, reads = parse_binary_sff_arrays(open(SFF_FP, 'rb'))
+        obs_a, obs_labels, obs_info = flows_from_binary_sff(reads)
+        self.assertEqual(len(obs_a), 20)
+        self.assertEqual(obs_labels, reads['Name'])
+        self.assertEqual(obs_a[0].split()[:5], ['1.01','0.00','0.98','0.03',
+                                                '0.00'])
+        self.assertEqual(len(list(obs_a)), 20)
+        info = obs_info[0]
+        self.assertEqual(info['Name'], 'GA202I001ER3QL')
+        self.assertEqual(info['Bases'].upper(), reads['Bases'][0])
+        self.assertEqual(info['Clip Qual Left'], '5')
+        self.assertEqual(binary_sff_header_info(header)['# of Reads'], '20')
+
     def test_flows_from_kv_pairs(self):
         """seqs_from_kv_pairs should initialize from key-value pairs"""
         c = [['a','0.0 1.1 3.0 1.0'],['b','0.5 1.0 4.0 0.0']]
@@ -151,6 +171,26 @@ class FlowgramCollectionTests(TestCase):
         self.assertEqual(git('Common Header'), 'sff')
 
 
+    def test_init_binary_sff(self):
+        """FlowgramCollection init from binary SFF arrays should be lazy"""
+        header, reads = parse_binary_sff_arrays(open(SFF_FP, 'rb'))
+        self.assertEqual(self.Class._guess_input_type.im_func(None, reads),
+                         'binary_sff')
+        f = self.Class(reads, header_info=binary_sff_header_info(header))
+        self.assertEqual(len(f), 20)
+        self.assertEqual(f._flows, None)
+        self.assertEqual(f.Names, reads['Name'])
+        flow = f.NamedFlows[reads['Name'][3]]
+        self.assertEqual(flow.Bases.upper(), reads['Bases'][3])
+        self.assertFloatEqual(flow.flowgram, reads['flowgram_values'][3])
+        #the text format gives the same collection
+        text = self.Class(str(f))
+        self.assertEqual(text.Names, f.Names)
+        for n in f.Names:
+            self.assertEqual(text.NamedFlows[n].flowgram,
+                             f.NamedFlows[n].flowgram)
+            self.assertEqual(text.NamedFlows[n].Bases, f.NamedFlows[n].Bases)
+
     def test_init_pairs(self):
         """FlowgramCollection init from list of (key,val) should work"""
         Flows = [['a','0.0 1.1 3.0 1.0'],['b','0.5 1.0 4.0 0.0']]
@@ -5,7 +5,8 @@ from cogent.parse.genbank import parse_locus, parse_single_line, \
     indent_splitter, parse_sequence, block_consolidator, parse_organism, \
     parse_feature, location_line_tokenizer, parse_simple_location_segment, \
     parse_location_line, parse_reference, parse_source, \
-    Location, LocationList, RichGenbankParser
+    Location, LocationList, RichGenbankParser, MinimalGenbankParser, \
+    parse_feature_table, GenbankRecord
 from cogent.util.unit_test import TestCase, main
 
 __author__ = "Rob Knight"
@@ -17,6 +18,15 @@ __maintainer__ = "Rob Knight"
 __email__ = "rob@spot.colorado.edu"
 __status__ = "Production"
 
+def comparable(features):
+    """Returns features with locations as strings, for comparisons"""
+    result = []
+    for f in features:
+        f = f.copy()
+        f['location'] = str(f['location'])
+        result.append(f)
+    return result
+
 class GenBankTests(TestCase):
     """Tests of the GenBank main functions."""
     
@@ -370,6 +380,86 @@ ORIGIN
             self.assertEqual(str(got), expects[locus])
     
 
+    def test_parse_feature_table(self):
+        """parse_feature_table should only parse the wanted feature types"""
+        lines = open('data/annotated_seq.gb').read().splitlines()
+        start = [i for i, l in enumerate(lines) if l.startswith('FEATURES')]
+        end = [i for i, l in enumerate(lines) if l.startswith('ORIGIN')]
+        table = lines[start[0]:end[0]]
+        features = parse_feature_table(table)
+        self.assertEqual(len(features), 10)
+        cds = parse_feature_table(table, feature_types=['CDS'])
+        self.assertEqual(comparable(cds),
+            comparable([f for f in features if f['type'] == 'CDS']))
+        self.assertEqual(len(cds), 2)
+        self.assertEqual(comparable(parse_feature_table(table,
+            ['gene', 'mRNA'])), comparable([f for f in features
+            if f['type'] in ['gene', 'mRNA']]))
+    
+    def test_lazy_minimal_parser(self):
+        """MinimalGenbankParser lazy records should match eager ones"""
+        lines = open('data/annotated_seq.gb').read().splitlines()
+        eager = list(MinimalGenbankParser(lines))[0]
+        lazy = list(MinimalGenbankParser(lines, lazy=True))[0]
+        self.assertTrue(isinstance(lazy, GenbankRecord))
+        self.assertEqual(lazy['locus'], 'AE017341')
+        #only the locus line has been parsed
+        self.assertEqual(lazy._data.keys().count('sequence'), 0)
+        self.assertEqual(lazy._data.keys().count('features'), 0)
+        self.assertEqual(comparable(lazy['features']),
+            comparable(eager['features']))
+        self.assertEqual(lazy._data.keys().count('sequence'), 0)
+        self.assertEqual(lazy['sequence'], eager['sequence'])
+        self.assertEqual(lazy['species'], eager['species'])
+        self.assertEqual(sorted(lazy.keys()), sorted(eager.keys()))
+        self.assertEqual(len(lazy), len(eager))
+        self.assertFalse('contig' in lazy)
+        self.assertEqual(lazy.get('contig', 'x'), 'x')
+        self.assertRaises(KeyError, lazy.__getitem__, 'contig')
+        cds = list(MinimalGenbankParser(lines, feature_types=['CDS']))[0]
+        self.assertEqual(comparable(cds['features']), comparable(
+            [f for f in eager['features'] if f['type'] == 'CDS']))
+    
+    def test_rich_parser_feature_types(self):
+        """RichGenbankParser should only annotate the wanted feature types"""
+        seq = list(RichGenbankParser(open('data/annotated_seq.gb')))[0][1]
+        self.assertEqual(len(seq.annotations), 9)
+        seq = list(RichGenbankParser(open('data/annotated_seq.gb'),
+            feature_types=['CDS']))[0][1]
+        self.assertEqual([a.type for a in seq.annotations], ['CDS', 'CDS'])
+    
+    def test_rich_parser_lazy(self):
+        """RichGenbankParser lazy records should make the same sequences"""
+        name, seq = list(RichGenbankParser(open('data/annotated_seq.gb')))[0]
+        recs = list(RichGenbankParser(open('data/annotated_seq.gb'),
+            lazy=True))
+        self.assertEqual(len(recs), 1)
+        self.assertEqual(recs[0][0], name)
+        lazy_seq = recs[0][1].toSequence()
+        self.assertEqual(str(lazy_seq), str(seq))
+        self.assertEqual(map(str, lazy_seq.annotations),
+            map(str, seq.annotations))
+        #the other arguments apply to the lazy records too
+        lines = open('data/annotated_seq.gb').readlines()
+        contig = [l for l in lines[:[l[:6] for l in lines].index('ORIGIN')]]
+        contig += ['//\n']
+        features = []
+        def add_annotation(seq, feature, spans):
+            features.append(feature['type'])
+        recs = list(RichGenbankParser(contig + lines, lazy=True,
+            skip_contigs=True, info_excludes=['species'],
+            add_annotation=add_annotation))
+        self.assertEqual(len(recs), 1)
+        lazy_seq = recs[0][1].toSequence()
+        self.assertFalse('species' in lazy_seq.Info)
+        self.assertEqual(len(features), 9)
+        self.assertEqual(len(lazy_seq.annotations), 0)
+        recs = list(RichGenbankParser(contig + lines, lazy=True))
+        self.assertEqual(len(recs), 2)
+        self.assertFalse(recs[0][1].hasSequence())
+        self.assertEqual(recs[0][1].toSequence(), None)
+    
+
 class LocationTests(TestCase):
     """Tests of the Location class."""
     def test_init(self):
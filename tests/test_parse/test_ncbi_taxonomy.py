@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 """Tests of parsers for dealing with NCBI Taxonomy files.
 """
-
+import os
+import tempfile
 from cogent.parse.ncbi_taxonomy import MissingParentError, NcbiTaxon, \
     NcbiTaxonParser, NcbiTaxonLookup, NcbiName, NcbiNameParser, \
     NcbiNameLookup, \
-    NcbiTaxonomy, NcbiTaxonNode, NcbiTaxonomyFromFiles
+    NcbiTaxonomy, NcbiTaxonNode, NcbiTaxonomyFromFiles, \
+    compile_ncbi_taxonomy, NcbiTaxonomyFromCache, MappedNcbiTaxonomy
 from cogent.util.unit_test import TestCase, main
 
 __author__ = "Jason Carnes"
@@ -329,6 +331,96 @@ class NcbiTaxonNodeTests(TestCase):
         gr = tx[3].getRankedDescendants('group')
         self.assertEqual(gr, [tx[123]])
         assert tx[3] is tx['a']
-       
+
+class MappedNcbiTaxonomyTests(TestCase):
+    """Tests of the binary taxonomy cache."""
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        compile_ncbi_taxonomy(good_nodes, good_names, self.filename)
+        self.tx = NcbiTaxonomyFromCache(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def test_init(self):
+        """NcbiTaxonomyFromCache should give the taxa of the dump files"""
+        assert isinstance(self.tx, MappedNcbiTaxonomy)
+        self.assertEqual(len(self.tx), 6)
+        self.assertEqual(self.tx.TaxonIds.tolist(), [1, 2, 6, 7, 9, 10])
+        self.assertEqual(self.tx.Depths.tolist(), [0, 1, 2, 3, 4, 3])
+        self.assertEqual(self.tx[10].Name, 'Fakus namus')
+        self.assertEqual(self.tx['1'].Name, 'root')
+        self.assertEqual(self.tx['root'].Parent, None)
+        self.assertEqual(self.tx[7].Rank, 'species')
+        self.assertEqual(self.tx[7].RankId, 4)
+        self.assertEqual(self.tx[7].ParentId, 6)
+        self.assertEqual(self.tx[1].ParentId, 1)
+        self.assertEqual(self.tx.getName(2), 'Bacteria')
+        self.assertEqual(self.tx.getRank(2), 'superkingdom')
+        assert 9 in self.tx
+        assert 8 not in self.tx
+        self.assertRaises(KeyError, self.tx.__getitem__, 8)
+        self.assertRaises(KeyError, self.tx.__getitem__, 'Bacterium')
+
+    def test_matches_tree(self):
+        """MappedNcbiTaxonomy nodes should match NcbiTaxonomy nodes"""
+        tree = NcbiTaxonomyFromFiles(good_nodes, good_names)
+        for t_id in self.tx.TaxonIds:
+            node, exp = self.tx[t_id], tree[t_id]
+            self.assertEqual(node.Name, exp.Name)
+            self.assertEqual(node.Rank, exp.Rank)
+            self.assertEqual([n.TaxonId for n in node.ancestors()],
+                [n.TaxonId for n in exp.ancestors()])
+            self.assertEqual(sorted([n.TaxonId for n in node.Children]),
+                sorted([n.TaxonId for n in exp.Children]))
+            assert self.tx[node.Name] is node
+
+    def test_navigation(self):
+        """MappedNcbiTaxonNode should support tree navigation"""
+        tx = self.tx
+        assert tx[7].Parent is tx[6]
+        assert tx[1].Parent is None
+        self.assertEqual(tx[7].siblings(), [tx[10]])
+        self.assertEqual(tx[6].Children, [tx[7], tx[10]])
+        self.assertEqual(len(tx['root']), 1)
+        assert tx['root'][0] is tx[2]
+        assert tx[9].lastCommonAncestor(tx[10]) is tx[6]
+        assert tx[9].lastCommonAncestor(tx[1]) is tx[1]
+        self.assertEqual(tx[1].getRankedDescendants('species'),
+            [tx[7], tx[10]])
+
+    def test_lineage(self):
+        """MappedNcbiTaxonomy should give lineages and common ancestors"""
+        self.assertEqual(self.tx.getLineage(9).tolist(), [9, 7, 6, 2, 1])
+        self.assertEqual(self.tx.getLineage(1).tolist(), [1])
+        self.assertEqual(self.tx.lastCommonAncestor([9, 10, 7]), 6)
+        self.assertEqual(self.tx.lastCommonAncestor([9]), 9)
+        self.assertEqual(self.tx.lastCommonAncestor([9, 2]), 2)
+        self.assertEqual(self.tx.lastCommonAncestors([9, 9, 10, 1],
+            [9, 7, 9, 10]).tolist(), [9, 7, 6, 1])
+        self.assertEqual(self.tx.getRankedAncestors([9, 10, 2, 6],
+            'genus').tolist(), [6, 6, -1, 6])
+        self.assertEqual(self.tx.getRankedAncestors([9], 'order').tolist(),
+            [-1])
+        self.assertRaises(KeyError, self.tx.getLineage, 8)
+        self.assertRaises(KeyError, self.tx.lastCommonAncestors, [9], [8])
+
+    def test_deadbeats(self):
+        """compile_ncbi_taxonomy should store deadbeats as roots"""
+        self.assertRaises(MissingParentError, compile_ncbi_taxonomy,
+            bad_nodes, good_names, self.filename, strict=True)
+        compile_ncbi_taxonomy(bad_nodes, good_names, self.filename)
+        tx = NcbiTaxonomyFromCache(self.filename)
+        self.assertEqual(tx[9].Parent, None)
+        self.assertEqual(tx.lastCommonAncestor([9, 10]), None)
+        self.assertEqual(tx.lastCommonAncestors([9, 7], [10, 2]).tolist(),
+            [-1, 2])
+
+    def test_bad_file(self):
+        """NcbiTaxonomyFromCache should refuse other files"""
+        open(self.filename, 'wb').write('x' * 40)
+        self.assertRaises(ValueError, NcbiTaxonomyFromCache, self.filename)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""Unit tests for the Newick format parser.
+"""
+from StringIO import StringIO
+from cogent.parse.newick import parse_string, parse_trees, TreeParseError
+from cogent.core.tree import PhyloNode
+from cogent.util.unit_test import TestCase, main
+
+__author__ = "Peter Maxwell"
+__copyright__ = "Copyright 2007-2012, The Cogent Project"
+__credits__ = ["Peter Maxwell"]
+__license__ = "GPL"
+__version__ = "1.5.3-dev"
+__maintainer__ = "Peter Maxwell"
+__email__ = "pm67nz@gmail.com"
+__status__ = "Production"
+
+class NewickParserTests(TestCase):
+    """Tests of the Newick string and stream parsers"""
+
+    def setUp(self):
+        def constructor(children, name, params):
+            return PhyloNode(Children=list(children or []), Name=name,
+                    Params=params)
+        self.constructor = constructor
+
+    def test_parse_string(self):
+        """parse_string should build a tree from a string"""
+        tree = parse_string("((a:1,b:2)x,(c,d));", self.constructor)
+        self.assertEqual(tree.getNewick(with_distances=True),
+            "((a:1.0,b:2.0)x,(c,d));")
+
+    def test_parse_string_error(self):
+        """parse_string should report the line of a parse error"""
+        try:
+            parse_string("((a,b),\n(c d)));", self.constructor,
+                strict_labels=True)
+        except TreeParseError, e:
+            self.assertTrue('line 2' in str(e), str(e))
+        else:
+            self.fail("no TreeParseError raised")
+
+    def test_parse_trees(self):
+        """parse_trees should yield each tree in a stream in turn"""
+        data = StringIO("((a,b),c);\n(a,(b,c));\n\n((a,\nc),b);  \n")
+        trees = [t.getNewick() for t in parse_trees(data, self.constructor)]
+        self.assertEqual(trees, ["((a,b),c);", "(a,(b,c));", "((a,c),b);"])
+        #several trees on one line, last unterminated
+        trees = parse_trees(["(a,b);(c,d);", "(e,f)"], self.constructor)
+        self.assertEqual([t.getNewick() for t in trees],
+            ["(a,b);", "(c,d);", "(e,f);"])
+        self.assertEqual(list(parse_trees([], self.constructor)), [])
+
+    def test_parse_trees_error(self):
+        """parse_trees should report errors with their line number"""
+        trees = parse_trees(["(a,b);\n", "(c,d));\n"], self.constructor,
+            strict_labels=True)
+        self.assertEqual(trees.next().getNewick(), "(a,b);")
+        try:
+            trees.next()
+        except TreeParseError, e:
+            self.assertTrue('line 2' in str(e), str(e))
+        else:
+            self.fail("no TreeParseError raised")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,9 @@ from cogent.util.unit_test import TestCase, main
 from cogent.parse.pdb import dict2pdb, dict2ter, pdb2dict, get_symmetry, \
                              get_coords_offset, get_trailer_offset, \
                              parse_header, parse_coords, parse_trailer, \
-                             PDBParser
+                             PDBParser, parse_coords_array, build_structure, \
+                             PDBArrayParser, PDBArrays, PDB_ATOM_DTYPE
+from cogent.struct.selection import einput
 from cogent.core.entity import Structure
 from cogent.core.entity import StructureBuilder
 from numpy import array, allclose
@@ -557,5 +559,70 @@ class pdbTests(TestCase):
         d = {'ser_num': 1, 'chain_id': 'A', 'res_name': 'MET', 'res_ic': ' ', \
               'res_id': 1,}
         assert dict2ter(d) == 'TER       2      MET A   1 \n'
+
+    def test_parse_coords_array(self):
+        """testing coords parsing into an array."""
+        atom = 'ATOM     10  CA  PRO A   2      51.588  38.262  31.417  1.00  6.58           C  \n'
+        hetatm = 'HETATM 1633  O   HOH B 164    -117.979-135.529  38.171  0.50 91.02\n'
+        mse = 'HETATM 1634  SE  MSE B 165      17.979  35.529  38.171  1.00  1.02          SE  \n'
+        lines = ['MODEL ', atom, hetatm, 'ENDMDL', 'MODEL ', mse]
+        atoms = parse_coords_array(lines)
+        assert atoms.dtype == PDB_ATOM_DTYPE
+        self.assertEqual(atoms['model'].tolist(), [0, 0, 1])
+        for i, line in enumerate([atom, hetatm, mse]):
+            d = pdb2dict(line)
+            for name in ('at_type', 'ser_num', 'at_name', 'at_id', 'alt_loc',
+                         'res_name', 'chain_id', 'res_id', 'res_ic', 'h_flag',
+                         'occupancy', 'bfactor', 'seg_id', 'element'):
+                self.assertEqual(atoms[i][name], d[name])
+            self.assertFloatEqual(atoms[i]['coords'], d['coords'])
+        self.assertEqual(len(parse_coords_array(['MODEL ', 'ENDMDL'])), 0)
+        bad = atom[:56] + '   x ' + atom[61:]
+        self.assertRaises(ValueError, parse_coords_array, [atom, bad])
+
+    def test_build_structure(self):
+        """build_structure should build the structure parse_coords builds."""
+        lines = open('data/1LJO.pdb').readlines()
+        builder = StructureBuilder()
+        builder.initStructure('JUNK')
+        exp = parse_coords(builder, lines)
+        builder = StructureBuilder()
+        builder.initStructure('JUNK')
+        obs = build_structure(builder, parse_coords_array(lines))
+        exp_atoms = einput(exp, 'A')
+        obs_atoms = einput(obs, 'A')
+        self.assertEqual(sorted(obs_atoms.keys()), sorted(exp_atoms.keys()))
+        for key, atom in exp_atoms.items():
+            self.assertEqual(obs_atoms[key].coords, atom.coords)
+            self.assertEqual(obs_atoms[key].bfactor, atom.bfactor)
+            self.assertEqual(obs_atoms[key].parent.name, atom.parent.name)
+
+    def test_PDBArrayParser(self):
+        """tests parsing into arrays with a lazily built structure."""
+        arrays = PDBArrayParser(open('data/2E12.pdb'), 'JUNK')
+        assert isinstance(arrays, PDBArrays)
+        structure = PDBParser(open('data/2E12.pdb'), 'JUNK')
+        self.assertEqual(arrays.header['space_group'], 'P 21 21 21')
+        self.assertEqual(sorted(arrays.header), sorted(structure.header))
+        assert arrays.raw_trailer == structure.raw_trailer
+        atoms = einput(structure, 'A')
+        self.assertEqual(len(arrays), len(atoms))
+        self.assertEqual(arrays.coords.shape, (len(atoms), 3))
+        self.assertEqual(arrays.getModelIds(), [0])
+        self.assertEqual(len(arrays.getModel(0)), len(arrays))
+        full_ids = arrays.getFull_ids()
+        self.assertEqual(sorted(full_ids), sorted(atoms.keys()))
+        for full_id, bfactor in zip(full_ids, arrays.bfactors):
+            self.assertEqual(atoms[full_id].bfactor, bfactor)
+        assert not arrays.isBuilt()
+        built = arrays.getStructure()
+        assert arrays.isBuilt()
+        assert built is arrays.getStructure()
+        assert type(built) is Structure
+        assert built.getId() == ('JUNK', )
+        assert built.header is arrays.header
+        self.assertEqual(sorted(einput(built, 'A').keys()),
+                         sorted(atoms.keys()))
+
 if __name__ == '__main__':
     main()
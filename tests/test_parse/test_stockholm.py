@@ -6,13 +6,13 @@ Provides tests for StockholmParser and related classes and functions.
 from cogent.parse.stockholm import is_gf_line, is_gc_line, is_gs_line, \
     is_gr_line, is_seq_line, is_structure_line, GfToInfo, GcToInfo, GsToInfo, \
     GrToInfo, MinimalStockholmParser, StockholmFinder, \
-    StockholmParser, Sequence, is_empty_or_html
+    StockholmParser, Sequence, is_empty_or_html, StreamingStockholmParser
 from cogent.util.unit_test import TestCase, main
 from cogent.parse.record import RecordError
 from cogent.core.info import Info
 from cogent.struct.rna2d import WussStructure
-from cogent.core.alignment import Alignment
-from cogent.core.moltype import BYTES
+from cogent.core.alignment import Alignment, DenseAlignment
+from cogent.core.moltype import BYTES, RNA
 
 __author__ = "Jeremy Widmann"
 __copyright__ = "Copyright 2007-2012, The Cogent Project"
@@ -426,6 +426,82 @@ class StockholmParserTests(TestCase):
         self.assertEqual(a,exp_aln)
         self.assertEqual(s,exp_struct)
         
+
+    def test_StreamingStockholmParser(self):
+        """StreamingStockholmParser: same alignments as StockholmParser"""
+        for lines in [self._fake_record, self._fake_two_records,
+                self.single_family, self._fake_record_bad_header_1,
+                self._fake_record_bad_structure_2]:
+            exp = [(a.todict(), dict(a.Info)) for a in
+                StockholmParser(lines, strict=False)]
+            obs = [(a.todict(), dict(a.Info)) for a in
+                StreamingStockholmParser(lines, strict=False)]
+            self.assertEqual(obs, exp)
+        aln = list(StreamingStockholmParser(self._fake_record))[0]
+        assert isinstance(aln, Alignment)
+        self.assertEqual(aln.Info['GF']['AccessionNumber'], 'RF00014')
+        self.assertEqual(aln.Info['GC']['ReferenceAnnotation'], 'x' * 87)
+        assert isinstance(aln.Info['Struct'], WussStructure)
+        self.assertEqual(aln.Names,
+            ['U17136.1/898-984', 'M15749.1/155-239', 'AF090431.1/222-139'])
+
+    def test_StreamingStockholmParser_annotations(self):
+        """StreamingStockholmParser: should keep only chosen annotation"""
+        lines = self._fake_record[:-1] + self._fake_gs_annotation + \
+            self._fake_gr_annotation + ['//']
+        aln = list(StreamingStockholmParser(lines))[0]
+        self.assertEqual(aln.Info['GR'], GrToInfo(self._fake_gr_annotation))
+        self.assertEqual(aln.Info['GS'], GsToInfo(self._fake_gs_annotation))
+        aln = list(StreamingStockholmParser(lines, annotations=['GF']))[0]
+        assert 'GR' not in aln.Info
+        assert 'GS' not in aln.Info
+        assert 'GC' not in aln.Info
+        self.assertEqual(aln.Info['GF']['Author'], 'Mifsud W')
+        self.assertEqual(len(aln.Info['Struct']), 87)
+
+    def test_StreamingStockholmParser_dense(self):
+        """StreamingStockholmParser: should build DenseAlignment objects"""
+        exp = list(StreamingStockholmParser(self._fake_two_records,
+            strict=False))[0]
+        lower = [line.lower() if line[:1].isalpha() else line for line in
+            self._fake_record]
+        for MolType in [BYTES, RNA]:
+            obs = list(StreamingStockholmParser(self._fake_record,
+                MolType=MolType, dense=True))[0]
+            assert isinstance(obs, DenseAlignment)
+            self.assertEqual(obs.todict(), exp.todict())
+            self.assertEqual(obs.Names, exp.Names)
+            self.assertEqual(obs.Info['Struct'], exp.Info['Struct'])
+        #lower case letters are converted except for BYTES
+        obs = list(StreamingStockholmParser(lower, MolType=RNA, dense=True))
+        self.assertEqual(obs[0].todict()['u17136.1/898-984'],
+            exp.todict()['U17136.1/898-984'])
+        obs = list(StreamingStockholmParser(lower, dense=True))
+        self.assertEqual(obs[0].todict()['u17136.1/898-984'],
+            exp.todict()['U17136.1/898-984'].lower())
+        bad = [line.replace('AAC', 'AXC') for line in self._fake_record]
+        self.assertRaises(RecordError, list, StreamingStockholmParser(bad,
+            MolType=RNA, dense=True))
+
+    def test_StreamingStockholmParser_strict(self):
+        """StreamingStockholmParser: toggle strict on bad records"""
+        for lines in [self._fake_record_no_headers,
+                self._fake_record_no_sequences,
+                self._fake_record_bad_header_2,
+                self._fake_record_bad_sequence_1,
+                self._fake_record_bad_structure_1,
+                self._fake_record_bad_structure_2,
+                self._fake_two_records,
+                self._fake_record[:-1]]:
+            self.assertRaises(RecordError, list,
+                StreamingStockholmParser(lines))
+        self.assertEqual(list(StreamingStockholmParser(
+            self._fake_record_bad_structure_2, strict=False)), [])
+        self.assertEqual(len(list(StreamingStockholmParser(
+            self._fake_two_records, strict=False))), 1)
+        #a last record without '//' is kept if not strict
+        self.assertEqual(len(list(StreamingStockholmParser(
+            self._fake_record[:-1], strict=False))), 1)
         
 
 # This is an altered version of some header info from Rfam.seed modified to
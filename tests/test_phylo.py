@@ -5,7 +5,7 @@ from numpy import log, exp
 warnings.filterwarnings('ignore', 'Not using MPI as mpi4py not found')
 
 from cogent.phylo.distance import EstimateDistances
-from cogent.phylo.nj import nj, gnj
+from cogent.phylo.nj import nj, gnj, fast_nj
 from cogent.phylo.least_squares import wls
 from cogent import LoadSeqs, LoadTree
 from cogent.phylo.tree_collection import LogLikelihoodScoredTreeCollection,\
@@ -107,6 +107,63 @@ class TreeReconstructionTests(unittest.TestCase):
         reconstructed = nj(self.dists)
         self.assertTreeDistancesEqual(self.tree, reconstructed)
         
+    def test_fast_nj(self):
+        """fast_nj should give the same trees as gnj with keep=1"""
+        import numpy
+        rand = numpy.random.RandomState(1)
+        for num_tips in [3, 4, 7, 40]:
+            points = rand.random_sample((num_tips, 3))
+            d = numpy.sqrt(((points[:, numpy.newaxis] - points) ** 2
+                    ).sum(axis=-1))
+            names = ['s%s' % i for i in range(num_tips)]
+            dists = dict(((names[i], names[j]), d[i, j])
+                    for i in range(num_tips) for j in range(num_tips)
+                    if i != j)
+            (score, expected) = gnj(dists, keep=1)[0]
+            reconstructed = fast_nj(d.copy(), names)
+            self.assertTrue(expected.sameTopology(reconstructed))
+            self.assertTreeDistancesEqual(expected, reconstructed)
+    
+    def test_fast_nj_ties(self):
+        """fast_nj should take the first of tied joins"""
+        import numpy
+        from cogent.phylo.nj import LightweightTreeTip, LightweightTreeNode
+        def slow_nj(d, names):
+            d = numpy.array(d, float)
+            nodes = [LightweightTreeTip(name) for name in names]
+            live = range(len(names))
+            while len(live) > 3:
+                L = len(live)
+                r = d[live][:, live].sum(axis=0)
+                r = dict(zip(live, r))
+                pairs = [((L-2.0)*d[i,j] - (r[i]+r[j]), i, j)
+                        for i in live for j in live if i < j]
+                (q, i, j) = min(pairs)
+                diff = (r[i]-r[j]) / (L-2.0)
+                nodes[i] = LightweightTreeNode([
+                        (max(0.0, 0.5*(d[i,j]+diff)), nodes[i]),
+                        (max(0.0, 0.5*(d[i,j]-diff)), nodes[j])])
+                new_dists = 0.5 * (d[i] + d[j] - d[i,j])
+                new_dists[i] = 0.0
+                d[i, :] = d[:, i] = new_dists
+                live.remove(j)
+            d = d[live][:, live]
+            lengths = numpy.sum(d, axis=0) - numpy.sum(d)/4
+            return LightweightTreeNode(zip(lengths,
+                    [nodes[i] for i in live])).convert()
+        
+        rand = numpy.random.RandomState(3)
+        for num_tips in [4, 5, 8, 12, 30]:
+            for k in range(6):
+                d = rand.randint(1, 6, (num_tips, num_tips))
+                d = d + d.T
+                numpy.fill_diagonal(d, 0)
+                names = ['s%s' % i for i in range(num_tips)]
+                expected = slow_nj(d, names)
+                reconstructed = fast_nj(d.copy(), names)
+                self.assertTrue(expected.sameTopology(reconstructed))
+                self.assertTreeDistancesEqual(expected, reconstructed)
+
     def test_gnj(self):
         """testing gnj"""
         results = gnj(self.dists, keep=1)
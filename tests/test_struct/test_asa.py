@@ -5,7 +5,7 @@ import numpy as np
 from numpy import sum
 from cogent.util.unit_test import TestCase, main
 from cogent.app.util import ApplicationNotFoundError
-from cogent.parse.pdb import PDBParser
+from cogent.parse.pdb import PDBParser, PDBArrayParser
 from cogent.struct.selection import einput
 from cogent.maths.stats.test import correlation
 
@@ -101,6 +101,32 @@ class asaTest(TestCase):
             for a in residue:
                 a.xtra['ASA'] == a.xtra['SASA']
 
+    def test_asa_xtra_arrays(self):
+        """test internal asa on atom arrays"""
+        self.input_file = os.path.join('data', '2E12.pdb')
+        self.input_structure = PDBParser(open(self.input_file))
+        self.input_arrays = PDBArrayParser(open(self.input_file))
+        for kwargs in ({}, {'symmetry_mode':'uc', 'crystal_mode':1}):
+            exp = asa.asa_xtra(self.input_structure, **kwargs)
+            obs = asa.asa_xtra(self.input_arrays, **kwargs)
+            self.assertEqual(sorted(obs.keys()), sorted(exp.keys()))
+            for key in exp:
+                self.assertFloatEqual(obs[key]['ASA'], exp[key]['ASA'])
+        assert not self.input_arrays.isBuilt()
+        asas = self.input_arrays.xtra['ASA']
+        self.assertEqual(len(asas), len(self.input_arrays))
+        waters = self.input_arrays.atoms['res_name'] == 'H_HOH'
+        assert np.isnan(asas[waters]).all()
+        assert not np.isnan(asas[~waters]).any()
+        # results are added to the structure once it is built
+        structure = self.input_arrays.getStructure()
+        result = asa.asa_xtra(self.input_arrays, xtra_key='SASA')
+        a = einput(structure, 'A')
+        for key, value in result.items():
+            self.assertEqual(a[key].xtra['SASA'], value['SASA'])
+        self.assertRaises(ValueError, asa.asa_xtra,
+                          PDBArrayParser(dummy_water))
+
     def test_asa_xtra_stride(self):
         """test asa via stride"""
         self.input_file = os.path.join('data', '2E12.pdb')
@@ -4,11 +4,11 @@ import os
 import numpy as np
 try:
     from cogent.util.unit_test import TestCase, main
-    from cogent.parse.pdb import PDBParser
+    from cogent.parse.pdb import PDBParser, PDBArrayParser
     from cogent.struct.selection import einput
 except ImportError:
     from zenpdb.cogent.util.unit_test import TestCase, main
-    from zenpdb.cogent.parse.pdb import PDBParser
+    from zenpdb.cogent.parse.pdb import PDBParser, PDBArrayParser
     from zenpdb.cogent.struct.selection import einput
 
 
@@ -70,6 +70,27 @@ class asaTest(TestCase):
            [('2E12', 0, 'B', ('GLU', 57, ' '), ('OE2', ' '))][0], \
            5.2156557833123873)
 
+    def test_arrays(self):
+        """compares contacts from atom arrays"""
+        self.input_file = os.path.join('data', '2E12.pdb')
+        self.input_structure = PDBParser(open(self.input_file))
+        self.input_arrays = PDBArrayParser(open(self.input_file))
+        for kwargs in ({}, {'symmetry_mode':'uc', 'contact_mode':'diff_sym'}):
+            exp = contact.contacts_xtra(self.input_structure, **kwargs)
+            obs = contact.contacts_xtra(self.input_arrays, **kwargs)
+            self.assertEqual(sorted(obs.keys()), sorted(exp.keys()))
+            for key in exp:
+                exp_cnt = exp[key]['CONTACTS']
+                obs_cnt = obs[key]['CONTACTS']
+                self.assertEqual(sorted(obs_cnt.keys()), sorted(exp_cnt.keys()))
+                for lkey in exp_cnt:
+                    self.assertFloatEqual(obs_cnt[lkey][0], exp_cnt[lkey][0])
+        assert not self.input_arrays.isBuilt()
+        # other levels need the structure
+        res = contact.contacts_xtra(self.input_arrays, level='R')
+        assert self.input_arrays.isBuilt()
+        self.assertTrue(res)
+
     def test_crystal(self):
         """"compares contacts diff unit-cell-mates"""
         pass
@@ -19,7 +19,8 @@ from cogent.util.array import gapped_to_ungapped, unmasked_to_masked, \
     only_nonzero, combine_dimensions, split_dimension, \
     non_diag, perturb_one_off_diag, perturb_off_diag, \
     merge_samples, sort_merged_samples_by_value, classifiers, \
-    minimize_error_count, minimize_error_rate, mutate_array
+    minimize_error_count, minimize_error_rate, mutate_array, \
+    condensed_offsets
 
 import numpy
 Float = numpy.core.numerictypes.sctype2char(float)
@@ -703,6 +704,11 @@ class ArrayMathTests(TestCase):
         residuals = m - a
         assert min(residuals) > -6
         assert max(residuals) < 6
+    
+    def test_condensed_offsets(self):
+        """condensed_offsets should give the start of each condensed row"""
+        self.assertEqual(condensed_offsets(4), [0,3,5,6])
+        self.assertEqual(condensed_offsets(1), [0])
         
 
 if __name__ == '__main__':
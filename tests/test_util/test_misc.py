@@ -26,7 +26,7 @@ from cogent.util.misc import (iterable, max_index, min_index,
     create_dir, handle_error_codes, identity, if_, deep_list, deep_tuple,
     combinate,gzip_dump,gzip_load,recursive_flatten_old,getNewId,toString,
     timeLimitReached, get_independent_coords, get_merged_by_value_coords,
-    get_merged_overlapping_coords, get_run_start_indices)
+    get_merged_overlapping_coords, get_run_start_indices, map_threads)
 from numpy import array
 from time import clock, sleep
 
@@ -718,6 +718,16 @@ class UtilsTests(TestCase):
         
         self.assertRaises(AssertionError, wrap_gen())
     
+    def test_map_threads(self):
+        """map_threads should apply f to every task, with or without threads"""
+        for num_threads in [None, 1, 3]:
+            result = [0] * 10
+            def f(i):
+                result[i] = i * i
+            map_threads(f, range(10), num_threads)
+            self.assertEqual(result, [i * i for i in range(10)])
+        map_threads(f, [], 2)
+    
     def test_merged_by_value_spans(self):
         """correctly merge adjacent spans with the same value"""
         # initial values same